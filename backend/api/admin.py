@@ -3,7 +3,7 @@ API endpoint dla administracji systemu
 Zarządzanie użytkownikami, ustawienia systemowe, logi
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
 from utils.database import execute_query, execute_insert, success_response, error_response, not_found_response
 from datetime import datetime, date
 import json
@@ -614,98 +614,286 @@ def delete_vat_rate(rate_id):
 @admin_bp.route('/admin/backup', methods=['POST'])
 def backup_database():
     """
-    Tworzenie kopii zapasowej bazy danych
+    Tworzenie kopii zapasowej bazy danych (online, API backupu SQLite)
+    Parametry JSON: compression (none|gzip|zstd), incremental (bool)
     """
     try:
-        import shutil
         import os
-        from datetime import datetime
+        from flask import current_app
+        from utils.backup_engine import backup_engine
+        
+        params = request.get_json(silent=True) or {}
         
         # Ścieżka do głównej bazy danych
-        db_path = os.path.join(os.path.dirname(__file__), '..', '..', 'kupony.db')
-        db_path = os.path.abspath(db_path)
+        db_path = current_app.config.get('DATABASE_PATH')
         
-        if not os.path.exists(db_path):
+        if not db_path or not os.path.exists(db_path):
             return error_response("Plik bazy danych nie został znaleziony", 404)
         
-        # Nazwa pliku backup z timestampem
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'kupony_backup_{timestamp}.db'
-        backup_path = os.path.join(os.path.dirname(db_path), backup_filename)
+        result = backup_engine.create_backup(
+            db_path,
+            os.path.join(os.path.dirname(db_path), 'backup'),
+            prefix='kupony_backup',
+            compression=params.get('compression', current_app.config.get('BACKUP_COMPRESSION', 'gzip')),
+            incremental=bool(params.get('incremental', False))
+        )
+        result['created_at'] = datetime.now().isoformat()
         
-        # Kopiuj bazę danych
-        shutil.copy2(db_path, backup_path)
-        
-        # Sprawdź czy kopia została utworzona
-        if os.path.exists(backup_path):
-            file_size = os.path.getsize(backup_path)
-            return success_response({
-                'backup_filename': backup_filename,
-                'backup_path': backup_path,
-                'file_size': file_size,
-                'created_at': datetime.now().isoformat()
-            }, f"Kopia zapasowa utworzona: {backup_filename}")
-        else:
-            return error_response("Nie udało się utworzyć kopii zapasowej", 500)
+        return success_response(result, f"Kopia zapasowa utworzona: {result['backup_filename']}")
         
+    except ValueError as e:
+        return error_response(str(e), 400)
     except Exception as e:
         print(f"Błąd tworzenia kopii zapasowej: {e}")
         return error_response(f"Błąd tworzenia kopii zapasowej: {str(e)}", 500)
 
-@admin_bp.route('/admin/export', methods=['POST'])
+@admin_bp.route('/admin/backup/verify', methods=['POST'])
+def verify_backup():
+    """
+    Weryfikacja kopii zapasowej: odtworzenie do pliku tymczasowego i PRAGMA integrity_check
+    """
+    try:
+        import os
+        from flask import current_app
+        from utils.backup_engine import backup_engine
+        
+        filename = (request.get_json(silent=True) or {}).get('filename')
+        if not filename:
+            return error_response("Brak nazwy kopii (filename)", 400)
+        
+        backup_dir = os.path.join(os.path.dirname(current_app.config.get('DATABASE_PATH')), 'backup')
+        result = backup_engine.verify_backup(backup_dir, filename)
+        
+        if result['integrity_ok']:
+            return success_response(result, "Kopia zapasowa jest poprawna")
+        return error_response(f"Kopia uszkodzona: {'; '.join(result['messages'][:3])}", 422)
+        
+    except FileNotFoundError:
+        return not_found_response("Nie znaleziono kopii zapasowej")
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        print(f"Błąd weryfikacji kopii zapasowej: {e}")
+        return error_response(f"Błąd weryfikacji kopii zapasowej: {str(e)}", 500)
+
+def _reset_caches_after_restore():
+    """
+    Czyści pamięć podręczną procesu zbudowaną na bazie sprzed odtworzenia: plan cen i promocji,
+    kopce partii FIFO, kupony, definicje i liczniki limitów rabatów, schemat indeksu klientów.
+    Pozostałe workery serwera mają własną pamięć - po odtworzeniu bazy trzeba je zrestartować.
+    """
+    from utils.pricing_engine import pricing_engine
+    from utils.coupon_cache import coupon_cache
+    from utils.discount_limits import discount_limits
+    from utils.customer_search import customer_search_index
+    from api.fifo_service import fifo_service
+    
+    pricing_engine.invalidate()
+    fifo_service.invalidate()
+    coupon_cache.invalidate()
+    customer_search_index.invalidate()
+    discount_limits.invalidate_rabat()
+    if discount_limits.status().get('loaded'):
+        discount_limits.rebuild()
+
+@admin_bp.route('/admin/backup/restore', methods=['POST'])
+def restore_backup():
+    """
+    Odtworzenie kopii zapasowej do pliku backup/restored_*.db (z weryfikacją integralności).
+    Z apply=true zweryfikowana kopia zastępuje bazę roboczą (wcześniej tworzona jest kopia bieżącego stanu),
+    a pamięć podręczna tego procesu jest czyszczona; pozostałe workery serwera wymagają restartu.
+    """
+    try:
+        import os
+        from flask import current_app
+        from utils.backup_engine import backup_engine
+        
+        params = request.get_json(silent=True) or {}
+        filename = params.get('filename')
+        if not filename:
+            return error_response("Brak nazwy kopii (filename)", 400)
+        
+        db_path = current_app.config.get('DATABASE_PATH')
+        backup_dir = os.path.join(os.path.dirname(db_path), 'backup')
+        result = backup_engine.restore_backup(backup_dir, filename, db_path, apply=bool(params.get('apply', False)))
+        if result['applied']:
+            _reset_caches_after_restore()
+            result['restart_required'] = True  # pozostałe workery mają pamięć podręczną sprzed odtworzenia
+        
+        message = "Baza odtworzona z kopii zapasowej" if result['applied'] else "Kopia odtworzona i zweryfikowana"
+        return success_response(result, message)
+        
+    except FileNotFoundError:
+        return not_found_response("Nie znaleziono kopii zapasowej")
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        print(f"Błąd odtwarzania kopii zapasowej: {e}")
+        return error_response(f"Błąd odtwarzania kopii zapasowej: {str(e)}", 500)
+
+@admin_bp.route('/admin/backup/retention', methods=['POST'])
+def apply_backup_retention():
+    """
+    Zastosowanie polityki retencji (domyślnie BACKUP_RETENTION) do kopii z danym prefiksem
+    """
+    try:
+        import os
+        from flask import current_app
+        from utils.backup_engine import backup_engine
+        
+        params = request.get_json(silent=True) or {}
+        policy = dict(current_app.config.get('BACKUP_RETENTION') or {})
+        for key in ('keep_last', 'keep_daily', 'keep_weekly', 'keep_monthly', 'max_age_days'):
+            if key in params:
+                policy[key] = int(params[key]) if params[key] is not None else None
+        
+        backup_dir = os.path.join(os.path.dirname(current_app.config.get('DATABASE_PATH')), 'backup')
+        result = backup_engine.apply_retention(backup_dir, prefix=params.get('prefix', 'kupony_auto_backup'), **policy)
+        result['policy'] = policy
+        
+        return success_response(result, f"Usunięto {len(result['removed'])} kopii zapasowych")
+        
+    except Exception as e:
+        print(f"Błąd retencji kopii zapasowych: {e}")
+        return error_response(f"Błąd retencji kopii zapasowych: {str(e)}", 500)
+
+@admin_bp.route('/admin/export', methods=['GET', 'POST'])
 def export_data():
     """
-    Eksport danych systemu w formacie JSON
+    Strumieniowy eksport danych systemu
+    Parametry (query lub JSON): tables (lista lub po przecinku, domyślnie wszystkie),
+    format (ndjson|csv), date_from, date_to, destination (response|disk), chunk_rows
     """
     try:
-        export_data = {}
-        
-        # Eksportuj główne tabele
-        tables_to_export = [
-            'produkty',
-            'pos_transakcje', 
-            'pos_pozycje',
-            'users',
-            'kategorie',
-            'klienci',
-            'rabaty'
-        ]
-        
-        for table in tables_to_export:
-            try:
-                # Sprawdź czy tabela istnieje
-                check_sql = f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'"
-                table_exists = execute_query(check_sql)
-                
-                if table_exists:
-                    # Eksportuj dane z tabeli
-                    data_sql = f"SELECT * FROM {table} LIMIT 1000"  # Limit dla bezpieczeństwa
-                    table_data = execute_query(data_sql)
-                    export_data[table] = table_data or []
-                else:
-                    export_data[table] = []
-                    
-            except Exception as table_error:
-                print(f"Błąd eksportu tabeli {table}: {table_error}")
-                export_data[table] = []
-        
-        # Dodaj metadane eksportu
-        export_data['_metadata'] = {
-            'export_date': datetime.now().isoformat(),
-            'system_version': '3.0.0',
-            'exported_tables': list(export_data.keys())
-        }
+        from utils.data_export import data_exporter
+        from utils.database import get_db_connection
         
-        return success_response({
-            'export_data': export_data,
-            'tables_exported': len([t for t in tables_to_export if export_data.get(t)]),
-            'total_records': sum(len(export_data.get(t, [])) for t in tables_to_export)
-        }, "Dane zostały wyeksportowane pomyślnie")
+        params = request.get_json(silent=True) or {}
+        params = {**request.args.to_dict(), **params}
+        
+        export_format = params.get('format', 'ndjson')
+        destination = params.get('destination', 'response')
+        date_from = params.get('date_from') or None
+        date_to = params.get('date_to') or None
+        
+        if export_format not in ('ndjson', 'csv'):
+            return error_response("Nieobsługiwany format eksportu (ndjson, csv)", 400)
+        
+        conn = get_db_connection()
+        if not conn:
+            return error_response("Błąd połączenia z bazą danych", 500)
+        try:
+            tables, missing = data_exporter.resolve_tables(conn.cursor(), params.get('tables'))
+        finally:
+            conn.close()
+            
+        if missing:
+            return error_response(f"Nieznane tabele: {', '.join(missing)}", 400)
+        if not tables:
+            return error_response("Brak tabel do eksportu", 400)
+        
+        if destination == 'disk':
+            manifest = data_exporter.export_to_directory(
+                tables, date_from, date_to,
+                chunk_rows=int(params['chunk_rows']) if params.get('chunk_rows') else None,
+                name=params.get('name')
+            )
+            return success_response({
+                'export': manifest,
+                'tables_exported': len(manifest['tables']),
+                'total_records': sum(t['rows'] for t in manifest['tables'].values())
+            }, f"Dane wyeksportowane do katalogu {manifest['name']}")
+        
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if export_format == 'csv':
+            if len(tables) != 1:
+                return error_response("Eksport CSV obsługuje jedną tabelę (parametr tables)", 400)
+            stream = data_exporter.stream_csv(tables[0], date_from, date_to)
+            mimetype = 'text/csv'
+            filename = f'{tables[0]}_{timestamp}.csv'
+        else:
+            stream = data_exporter.stream_ndjson(tables, date_from, date_to)
+            mimetype = 'application/x-ndjson'
+            filename = f'pos_system_export_{timestamp}.ndjson'
+        
+        return Response(
+            stream_with_context(stream),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
         
     except Exception as e:
         print(f"Błąd eksportu danych: {e}")
         return error_response(f"Błąd eksportu danych: {str(e)}", 500)
 
+@admin_bp.route('/admin/export/tables', methods=['GET'])
+def get_export_tables():
+    """
+    Lista tabel dostępnych do eksportu (liczba wierszy, kolumna daty) i zapisanych eksportów
+    """
+    try:
+        from utils.data_export import data_exporter
+        
+        tables = data_exporter.describe_tables()
+        if tables is None:
+            return error_response("Błąd połączenia z bazą danych", 500)
+        
+        return success_response({
+            'tables': tables,
+            'exports': data_exporter.list_exports()
+        }, "Lista tabel pobrana pomyślnie")
+        
+    except Exception as e:
+        print(f"Błąd pobierania listy tabel: {e}")
+        return error_response(f"Błąd pobierania listy tabel: {str(e)}", 500)
+
+@admin_bp.route('/admin/import', methods=['POST'])
+def import_data():
+    """
+    Import danych zapisywany paczkami (executemany) w jednej transakcji
+    Źródło: plik (multipart 'file': .ndjson, .ndjson.gz, .csv z parametrem table)
+    albo eksport z dysku (parametr export_name). Tryb: insert|ignore|replace
+    """
+    try:
+        from utils.data_export import data_exporter
+        import gzip
+        
+        params = request.get_json(silent=True) or {}
+        params = {**request.args.to_dict(), **request.form.to_dict(), **params}
+        
+        mode = params.get('mode', 'insert')
+        tables = params.get('tables')
+        if isinstance(tables, str):
+            tables = [t.strip() for t in tables.split(',') if t.strip()]
+        
+        started = datetime.now()
+        upload = request.files.get('file')
+        
+        if upload:
+            filename = upload.filename or ''
+            stream = gzip.GzipFile(fileobj=upload.stream) if filename.endswith('.gz') else upload.stream
+            if filename.endswith('.csv') or filename.endswith('.csv.gz'):
+                if not params.get('table'):
+                    return error_response("Import CSV wymaga parametru table", 400)
+                result = data_exporter.import_csv(stream, params['table'], mode=mode)
+            else:
+                result = data_exporter.import_ndjson(stream, mode=mode, tables=tables)
+        elif params.get('export_name'):
+            result = data_exporter.import_directory(params['export_name'], mode=mode, tables=tables)
+        else:
+            return error_response("Brak pliku (file) lub nazwy eksportu (export_name)", 400)
+        
+        result['duration_ms'] = round((datetime.now() - started).total_seconds() * 1000, 1)
+        return success_response(result, f"Zaimportowano {result['total_imported']} rekordów")
+        
+    except FileNotFoundError:
+        return not_found_response("Nie znaleziono eksportu")
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        print(f"Błąd importu danych: {e}")
+        return error_response(f"Błąd importu danych: {str(e)}", 500)
+
 @admin_bp.route('/admin/backup/scheduler/status', methods=['GET'])
 def get_backup_scheduler_status():
     """
@@ -730,7 +918,16 @@ def start_backup_scheduler():
     try:
         from utils.scheduler import auto_backup_scheduler
         
-        auto_backup_scheduler.start_scheduler()
+        if auto_backup_scheduler.app is None:
+            auto_backup_scheduler.init_app(current_app._get_current_object())
+        
+        if not auto_backup_scheduler.start_scheduler():
+            status = auto_backup_scheduler.get_scheduler_status()
+            return success_response({
+                'status': 'standby',
+                'owner_pid': status['owner_pid'],
+                'message': 'Scheduler działa w innym procesie - ten proces czeka w rezerwie'
+            }, "Scheduler działa w innym procesie")
         
         return success_response({
             'status': 'started',
@@ -760,6 +957,59 @@ def stop_backup_scheduler():
         print(f"Błąd zatrzymywania schedulera: {e}")
         return error_response(f"Błąd zatrzymywania schedulera: {str(e)}", 500)
 
+@admin_bp.route('/admin/singletons', methods=['GET'])
+def get_singleton_roles():
+    """
+    Role jednoinstancyjne (scheduler, właściciel drukarki fiskalnej) - który proces je trzyma
+    """
+    try:
+        from utils.process_lock import singleton_election
+        
+        return success_response(singleton_election.status(['scheduler', 'fiscal_printer']), "Status ról pobrany pomyślnie")
+        
+    except Exception as e:
+        print(f"Błąd pobierania statusu ról: {e}")
+        return error_response(f"Błąd pobierania statusu ról: {str(e)}", 500)
+
+@admin_bp.route('/admin/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Metryki procesu w formacie tekstowym Prometheus: czasy żądań, liczba i czas
+    zapytań SQL na żądanie, czasy znormalizowanych zapytań
+    """
+    from utils.metrics import metrics
+    
+    return Response(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@admin_bp.route('/admin/metrics/summary', methods=['GET'])
+def get_metrics_summary():
+    """
+    Najbardziej kosztowne endpointy i zapytania oraz próbki wolnych zapytań (JSON)
+    """
+    try:
+        from utils.metrics import metrics
+        
+        limit = request.args.get('limit', 20, type=int)
+        summary = metrics.summary(limit=limit)
+        summary['slow_queries'] = metrics.slow_query_samples()
+        summary['slow_query_threshold_ms'] = round(metrics.slow_query_seconds * 1000, 1)
+        
+        return success_response(summary, "Metryki pobrane pomyślnie")
+        
+    except Exception as e:
+        print(f"Błąd pobierania metryk: {e}")
+        return error_response(f"Błąd pobierania metryk: {str(e)}", 500)
+
+@admin_bp.route('/admin/metrics/reset', methods=['POST'])
+def reset_metrics():
+    """
+    Wyzerowanie metryk procesu (np. przed pomiarem)
+    """
+    from utils.metrics import metrics
+    
+    metrics.reset()
+    return success_response({'reset': True}, "Metryki wyzerowane")
+
 @admin_bp.route('/admin/backup/manual', methods=['POST'])
 def trigger_manual_backup():
     """
@@ -782,34 +1032,19 @@ def trigger_manual_backup():
 @admin_bp.route('/admin/backup/list', methods=['GET'])
 def list_backups():
     """
-    Lista dostępnych kopii zapasowych
+    Lista dostępnych kopii zapasowych (pełnych i przyrostowych)
     """
     try:
         import os
         from flask import current_app
+        from utils.backup_engine import backup_engine
         
         # Ścieżka do folderu backup
         db_path = current_app.config.get('DATABASE_PATH')
         backup_dir = os.path.join(os.path.dirname(db_path), 'backup')
         
-        backups = []
-        
-        if os.path.exists(backup_dir):
-            for filename in os.listdir(backup_dir):
-                if filename.endswith('.db'):
-                    file_path = os.path.join(backup_dir, filename)
-                    file_stat = os.stat(file_path)
-                    
-                    backups.append({
-                        'filename': filename,
-                        'size': file_stat.st_size,
-                        'created': datetime.fromtimestamp(file_stat.st_ctime).isoformat(),
-                        'modified': datetime.fromtimestamp(file_stat.st_mtime).isoformat(),
-                        'is_automatic': 'auto_backup' in filename
-                    })
-        
-        # Sortuj po dacie utworzenia (najnowsze pierwsze)
-        backups.sort(key=lambda x: x['created'], reverse=True)
+        # Posortowane po dacie utworzenia (najnowsze pierwsze)
+        backups = backup_engine.list_backups(backup_dir)
         
         return success_response({
             'backups': backups,
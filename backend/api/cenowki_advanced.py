@@ -6,6 +6,7 @@ Zarządzanie cenowkami z dedykowanymi uproszczonymi nazwami
 from flask import Blueprint, request, jsonify
 from datetime import datetime, date
 import sqlite3
+import logging
 import os
 import sys
 
@@ -15,6 +16,8 @@ from utils.database import execute_query, execute_insert, get_db_connection
 from utils.response_helpers import success_response, error_response
 from api.warehouse_pricing import warehouse_pricing_manager
 
+logger = logging.getLogger(__name__)
+
 cenowki_api_bp = Blueprint('cenowki_api', __name__)
 
 class CenowkiManager:
@@ -53,7 +56,7 @@ class CenowkiManager:
             return [dict(row) for row in result] if result else []
             
         except Exception as e:
-            print(f"Błąd pobierania cenowek: {e}")
+            logger.error("Błąd pobierania cenowek: %s", e)
             return []
         finally:
             conn.close()
@@ -113,11 +116,11 @@ class CenowkiManager:
             
             warehouse_result = cursor.fetchone()
             if not warehouse_result:
-                print(f"❌ Nie znaleziono magazynu dla location_id: {location_id}")
+                logger.warning("Nie znaleziono magazynu dla location_id: %s", location_id)
                 return False
                 
             warehouse_id = warehouse_result['id']
-            print(f"🔍 Mapowanie: location_id={location_id} -> warehouse_id={warehouse_id}")
+            logger.debug("Mapowanie: location_id=%s -> warehouse_id=%s", location_id, warehouse_id)
             
             # Użyj warehouse_pricing_manager do ustawienia ceny (z synchronizacją)
             vat_rate = 1.23
@@ -132,14 +135,14 @@ class CenowkiManager:
             )
             
             if not success:
-                print(f"❌ Błąd ustawienia ceny magazynowej")
+                logger.error("Błąd ustawienia ceny magazynowej")
                 return False
                 
-            print(f"✅ Cena ustawiona i zsynchronizowana dla wszystkich magazynów lokalizacji {location_id}")
+            logger.info("Cena ustawiona i zsynchronizowana dla wszystkich magazynów lokalizacji %s", location_id)
             return True
             
         except Exception as e:
-            print(f"Błąd tworzenia/aktualizacji cenowki: {e}")
+            logger.error("Błąd tworzenia/aktualizacji cenowki: %s", e)
             conn.rollback()
             return False
         finally:
@@ -191,7 +194,7 @@ class CenowkiManager:
             return True, "Aktualizacja zakończona pomyślnie"
             
         except Exception as e:
-            print(f"Błąd aktualizacji cenowki: {e}")
+            logger.error("Błąd aktualizacji cenowki: %s", e)
             conn.rollback()
             return False, str(e)
         finally:
@@ -246,11 +249,11 @@ class CenowkiManager:
                         cenowka_dict['cena_netto'] = warehouse_price['cena_sprzedazy_netto']
                         cenowka_dict['location_id'] = location_id
                         cenowka_dict['warehouse_id'] = warehouse_id
-                        print(f"🔍 DEBUG - Zwracam cenę z warehouse_product_prices: {warehouse_price['cena_sprzedazy_brutto']} dla produktu {product_id}, warehouse {warehouse_id}")
+                        logger.debug("Zwracam cenę z warehouse_product_prices: %s dla produktu %s, warehouse %s", warehouse_price['cena_sprzedazy_brutto'], product_id, warehouse_id)
                     else:
-                        print(f"🔍 DEBUG - Brak ceny w warehouse_product_prices dla produktu {product_id}, warehouse {warehouse_id}")
+                        logger.debug("Brak ceny w warehouse_product_prices dla produktu %s, warehouse %s", product_id, warehouse_id)
                 else:
-                    print(f"🔍 DEBUG - Nie znaleziono warehouse dla location_id: {location_id}")
+                    logger.debug("Nie znaleziono warehouse dla location_id: %s", location_id)
             
             # Dodaj cenę zakupu produktu do obliczeń marży
             cursor.execute("""
@@ -277,7 +280,7 @@ class CenowkiManager:
             return cenowka_dict
             
         except Exception as e:
-            print(f"Błąd pobierania cenówki dla produktu {product_id}: {e}")
+            logger.error("Błąd pobierania cenówki dla produktu %s: %s", product_id, e)
             return None
         finally:
             conn.close()
@@ -327,11 +330,11 @@ class CenowkiManager:
                     
                     warehouse_result = cursor.fetchone()
                     if not warehouse_result:
-                        print(f"❌ Nie znaleziono magazynu dla location_id: {location_id}")
+                        logger.warning("Nie znaleziono magazynu dla location_id: %s", location_id)
                         return False, "Nie znaleziono magazynu dla tej lokalizacji"
                         
                     warehouse_id = warehouse_result['id']
-                    print(f"🔍 Mapowanie: location_id={location_id} -> warehouse_id={warehouse_id}")
+                    logger.debug("Mapowanie: location_id=%s -> warehouse_id=%s", location_id, warehouse_id)
                     
                     # Użyj warehouse_pricing_manager do ustawienia ceny (z synchronizacją)
                     created_by = kwargs.get('created_by', 'cenowka')
@@ -349,12 +352,12 @@ class CenowkiManager:
                     if not success:
                         return False, "Błąd aktualizacji ceny magazynowej"
                     
-                    print(f"✅ Cena zaktualizowana i zsynchronizowana dla wszystkich magazynów lokalizacji {location_id}")
+                    logger.info("Cena zaktualizowana i zsynchronizowana dla wszystkich magazynów lokalizacji %s", location_id)
             
             return True, "Aktualizacja zakończona pomyślnie"
             
         except Exception as e:
-            print(f"Błąd aktualizacji cenówki: {e}")
+            logger.error("Błąd aktualizacji cenówki: %s", e)
             conn.rollback()
             return False, str(e)
         finally:
@@ -376,7 +379,7 @@ class CenowkiManager:
             return True
             
         except Exception as e:
-            print(f"Błąd usuwania cenowki: {e}")
+            logger.error("Błąd usuwania cenowki: %s", e)
             conn.rollback()
             return False
         finally:
@@ -413,12 +416,12 @@ def create_cenowka():
     """Utwórz nową pozycję cenowki z ceną lokalizacyjną"""
     try:
         data = request.get_json()
-        print(f"🔍 DEBUG - Otrzymane dane cenowki: {data}")
+        logger.debug("Otrzymane dane cenowki: %s", data)
         
         required_fields = ['product_id', 'nazwa_uproszczona', 'cena_cenowkowa', 'location_id']
         for field in required_fields:
             if field not in data:
-                print(f"❌ DEBUG - Brak wymaganego pola: {field}")
+                logger.debug("Brak wymaganego pola: %s", field)
                 return error_response(f"Brak wymaganego pola: {field}", 400)
         
         success = cenowki_manager.create_cenowka_with_location_price(
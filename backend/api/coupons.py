@@ -5,13 +5,24 @@ Tworzenie, walidacja, wykorzystywanie kuponów, statystyki
 
 from flask import Blueprint, request, jsonify, session
 from utils.database import execute_query, execute_insert, success_response, error_response, not_found_response
+from utils.database import get_db_connection, retry_on_locked
+from utils.coupon_cache import coupon_cache
 from datetime import datetime, timedelta
+import logging
 import random
+import sqlite3
 import string
+import time
 from api.auth import require_auth
 
+logger = logging.getLogger(__name__)
+
 coupons_bp = Blueprint('coupons', __name__)
 
+BULK_MAX_COUPONS = 10000
+BULK_CHUNK = 500  # Limit parametrów w jednym zapytaniu IN (...)
+COUPON_CODE_ALPHABET = string.ascii_uppercase + string.digits
+
 def generate_coupon_code(length=8):
     """Generuj unikalny kod kuponu"""
     max_attempts = 10
@@ -292,6 +303,246 @@ def create_coupon():
     except Exception as e:
         return error_response(f"Błąd tworzenia kuponu: {str(e)}", 500)
 
+def generate_coupon_codes(cursor, count, length=8, prefix=''):
+    """
+    Generuj N unikalnych kodów kuponów naraz - losowanie w pamięci, a kolizje z istniejącymi
+    kodami sprawdzane jednym zapytaniem na paczkę zamiast zapytania na każdy kod
+    """
+    codes = set()
+    for _ in range(10):
+        missing = count - len(codes)
+        if missing <= 0:
+            break
+        
+        candidates = set()
+        while len(candidates) < missing:
+            code = prefix + ''.join(random.choices(COUPON_CODE_ALPHABET, k=length))
+            if code not in codes:
+                candidates.add(code)
+        
+        candidate_list = list(candidates)
+        for start in range(0, len(candidate_list), BULK_CHUNK):
+            chunk = candidate_list[start:start + BULK_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"SELECT kod FROM kupony WHERE kod IN ({placeholders})", chunk)
+            candidates.difference_update(row[0] for row in cursor.fetchall())
+        codes.update(candidates)
+    
+    if len(codes) < count:
+        raise Exception(f"Nie można wygenerować {count} unikalnych kodów po 10 próbach")
+    return sorted(codes)
+
+@retry_on_locked
+def _issue_coupon_batch(conn, count, value, expiry_date, phone_number, payment_method,
+                        shop, location_id, customer_name, code_length, prefix, register_payment):
+    """
+    Cała emisja w jednej transakcji: kody, kupony, dokumenty zakupu i (opcjonalnie) jeden KP.
+    Blokada zapisu jest brana na początku (BEGIN IMMEDIATE), więc numeracja dokumentów
+    i unikalność kodów nie kolidują z równoległym tworzeniem kuponów.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        codes = generate_coupon_codes(cursor, count, code_length, prefix)
+        
+        cursor.executemany("""
+            INSERT INTO kupony (
+                kod, wartosc, data_waznosci, numer_telefonu, 
+                sposob_platnosci, sklep, data_utworzenia, status, location_id
+            ) VALUES (?, ?, ?, ?, ?, ?, datetime('now'), 'aktywny', ?)
+        """, [(code, value, expiry_date, phone_number, payment_method, shop, location_id) for code in codes])
+        
+        coupon_ids = {}
+        for start in range(0, len(codes), BULK_CHUNK):
+            chunk = codes[start:start + BULK_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"SELECT id, kod FROM kupony WHERE kod IN ({placeholders})", chunk)
+            coupon_ids.update((row[1], row[0]) for row in cursor.fetchall())
+        
+        # Numeracja KP-YYYYMMDD-NNNN kontynuowana od ostatniego dokumentu z dzisiaj
+        today = datetime.now().strftime('%Y%m%d')
+        cursor.execute("""
+            SELECT document_number FROM coupon_purchase_documents 
+            WHERE document_number LIKE ? 
+            ORDER BY id DESC LIMIT 1
+        """, (f'KP-{today}-%',))
+        last = cursor.fetchone()
+        try:
+            next_seq = int(last[0].split('-')[-1]) + 1 if last else 1
+        except ValueError:
+            next_seq = 1
+        
+        location_name = None
+        if location_id:
+            cursor.execute("SELECT nazwa FROM locations WHERE id = ?", (location_id,))
+            row = cursor.fetchone()
+            location_name = row[0] if row else None
+        
+        issued = []
+        documents = []
+        for offset, code in enumerate(codes):
+            document_number = f"KP-{today}-{next_seq + offset:04d}"
+            issued.append({'coupon_id': coupon_ids[code], 'code': code, 'document_number': document_number})
+            documents.append((
+                document_number, coupon_ids[code], code, value,
+                payment_method, phone_number, customer_name,
+                location_id, location_name, shop, expiry_date
+            ))
+        
+        cursor.executemany("""
+            INSERT INTO coupon_purchase_documents (
+                document_number, coupon_id, coupon_code, coupon_value,
+                payment_method, customer_phone, customer_name,
+                location_id, location_name, seller_name, expiry_date
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, documents)
+        
+        # Jedna wpłata KP na całą partię zamiast osobnego wpisu kasowego na każdy kupon
+        if register_payment:
+            first_document, last_document = documents[0][0], documents[-1][0]
+            opis = f"Sprzedaż {count} kuponów po {value:.2f} zł"
+            if customer_name:
+                opis += f" - {customer_name}"
+            cursor.execute("""
+                INSERT INTO kasa_operacje 
+                (typ_operacji, typ_platnosci, kwota, opis, kategoria, 
+                 numer_dokumentu, kontrahent, data_operacji, utworzyl, uwagi, location_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, date('now'), ?, ?, ?)
+            """, (
+                'KP',
+                payment_method if payment_method in ('gotowka', 'karta', 'blik', 'przelew') else 'gotowka',
+                round(value * count, 2),
+                opis,
+                'kupony',
+                first_document,
+                customer_name or '',
+                shop or 'system',
+                f'Automatyczny wpis z emisji kuponów {first_document} - {last_document}',
+                location_id
+            ))
+        
+        conn.commit()
+        return issued
+    except Exception:
+        conn.rollback()
+        raise
+
+@coupons_bp.route('/coupons/bulk-create', methods=['POST'])
+# @require_auth  # Wyłączono dla testów
+def bulk_create_coupons():
+    """
+    Emisja wielu kuponów naraz (kampanie sezonowe)
+    POST /api/coupons/bulk-create
+    Body: {
+        "count": 500,
+        "value": 50.00,
+        "expiry_date": "2025-12-31",
+        "payment_method": "gotowka",   # opcjonalnie - z metodą płatności powstaje jeden KP na partię
+        "register_payment": true,
+        "code_length": 8,
+        "prefix": "XMAS",
+        "location_id": 1,
+        "customer_name": "Firma ABC"
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return error_response("Brak danych JSON", 400)
+        
+        value = data.get('wartosc') or data.get('value')
+        expiry_date = data.get('data_waznosci') or data.get('expiry_date')
+        phone_number = data.get('numer_telefonu') or data.get('phone_number', '')
+        payment_method = data.get('sposob_platnosci') or data.get('payment_method', '')
+        customer_name = data.get('customer_name') or data.get('nazwa_klienta', '')
+        location_id = data.get('location_id', 1)
+        prefix = str(data.get('prefix', '')).strip().upper()
+        
+        try:
+            count = int(data.get('count') or data.get('ilosc') or 0)
+            code_length = int(data.get('code_length', 8))
+        except (TypeError, ValueError):
+            return error_response("Pola 'count' i 'code_length' muszą być liczbami", 400)
+        
+        if count < 1 or count > BULK_MAX_COUPONS:
+            return error_response(f"Liczba kuponów musi być z zakresu 1-{BULK_MAX_COUPONS}", 400)
+        if code_length < 6 or code_length > 16:
+            return error_response("Długość kodu musi być z zakresu 6-16", 400)
+        if prefix and (not prefix.isalnum() or len(prefix) > 8):
+            return error_response("Prefiks może mieć do 8 liter lub cyfr", 400)
+        
+        if not value or not expiry_date:
+            return error_response("Wartość i data ważności są wymagane", 400)
+        
+        try:
+            value = float(value)
+            if value <= 0:
+                return error_response("Wartość musi być większa od 0", 400)
+            if value > 10000:
+                return error_response("Wartość nie może przekraczać 10000", 400)
+        except ValueError:
+            return error_response("Nieprawidłowa wartość", 400)
+        
+        try:
+            expiry_datetime = datetime.strptime(expiry_date, '%Y-%m-%d')
+            if expiry_datetime.date() <= datetime.now().date():
+                return error_response("Data ważności musi być w przyszłości", 400)
+        except ValueError:
+            return error_response("Nieprawidłowy format daty (YYYY-MM-DD)", 400)
+        
+        register_payment = bool(data.get('register_payment', True)) and bool(payment_method)
+        shop = session.get('login', 'admin')
+        
+        conn = get_db_connection()
+        if not conn:
+            return error_response("Błąd połączenia z bazą danych", 500)
+        
+        started = time.perf_counter()
+        try:
+            # Transakcję otwieramy ręcznie (BEGIN IMMEDIATE)
+            conn.isolation_level = None
+            issued = _issue_coupon_batch(
+                conn, count, value, expiry_date, phone_number, payment_method,
+                shop, location_id, customer_name, code_length, prefix, register_payment
+            )
+        except sqlite3.IntegrityError as e:
+            return error_response(f"Konflikt kodów lub numerów dokumentów, spróbuj ponownie: {str(e)}", 409)
+        finally:
+            conn.close()
+        
+        took_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("Wyemitowano %s kuponów po %s zł w %s ms", count, value, took_ms)
+        
+        return success_response({
+            'count': len(issued),
+            'value': value,
+            'total_value': round(value * len(issued), 2),
+            'expiry_date': expiry_date,
+            'payment_registered': register_payment,
+            'coupons': issued,
+            'took_ms': took_ms
+        }, f"Utworzono {len(issued)} kuponów")
+        
+    except Exception as e:
+        return error_response(f"Błąd emisji kuponów: {str(e)}", 500)
+
+@coupons_bp.route('/coupons/cache', methods=['GET'])
+def get_coupon_cache_stats():
+    """
+    Statystyki cache walidacji kuponów
+    GET /api/coupons/cache
+    """
+    return success_response(coupon_cache.stats(), "Statystyki cache kuponów")
+
+@coupons_bp.route('/coupons/cache', methods=['DELETE'])
+def clear_coupon_cache():
+    """
+    Wyczyść cache walidacji kuponów (np. po ręcznej zmianie kuponów w bazie)
+    DELETE /api/coupons/cache
+    """
+    coupon_cache.invalidate()
+    return success_response(coupon_cache.stats(), "Cache kuponów wyczyszczony")
+
 @coupons_bp.route('/coupons/documents', methods=['GET'])
 def get_coupon_documents():
     """
@@ -435,6 +686,19 @@ def get_document_by_coupon(coupon_id):
     except Exception as e:
         return error_response(f"Błąd pobierania dokumentu: {str(e)}", 500)
 
+def load_coupon_for_validation(code):
+    """Wiersz kuponu do walidacji (źródło dla coupon_cache)"""
+    query = """
+    SELECT 
+        id, kod, wartosc, data_waznosci, 
+        status, data_wykorzystania,
+        sklep, kwota_wykorzystana
+    FROM kupony 
+    WHERE kod = ?
+    """
+    result = execute_query(query, (code.upper(),))
+    return result[0] if result else None
+
 @coupons_bp.route('/coupons/validate/<code>', methods=['GET'])
 def validate_coupon(code):
     """
@@ -442,23 +706,12 @@ def validate_coupon(code):
     GET /api/coupons/validate/ABC12345
     """
     try:
-        # Sprawdź kupon w bazie
-        query = """
-        SELECT 
-            id, kod, wartosc, data_waznosci, 
-            status, data_wykorzystania,
-            sklep, kwota_wykorzystana
-        FROM kupony 
-        WHERE kod = ?
-        """
+        # Powtórne skanowanie tego samego kodu obsługuje cache (status liczony niżej przy każdym odczycie)
+        coupon = coupon_cache.get(code, load_coupon_for_validation)
         
-        result = execute_query(query, (code.upper(),))
-        
-        if not result:
+        if not coupon:
             return not_found_response(f"Kupon {code} nie został znaleziony")
         
-        coupon = result[0]
-        
         # Sprawdź status kuponu
         validation_result = {
             'code': coupon['kod'],
@@ -561,6 +814,7 @@ def use_coupon_internal(code, amount_used, transaction_id=None):
         """
         
         success = execute_insert(update_query, (new_value, new_status, used_amount, code.upper()))
+        coupon_cache.invalidate(code)
         
         if success:
             print(f"✅ Kupon {code.upper()} wykorzystany: -{used_amount} zł, pozostało: {new_value} zł, status: {new_status}")
@@ -646,6 +900,7 @@ def use_coupon(code):
         """
         
         success = execute_insert(update_query, (new_value, new_status, used_amount, code.upper()))
+        coupon_cache.invalidate(code)
         
         if success:
             return success_response({
@@ -775,15 +1030,14 @@ def get_coupon_history(coupon_id):
     Pobierz historię kuponu
     GET /api/coupons/123/history
     """
-    import sys
-    print(f"🔥 [ENTRY] get_coupon_history wywołane! coupon_id: {coupon_id}", file=sys.stderr, flush=True)
+    logger.debug("get_coupon_history wywołane, coupon_id: %s", coupon_id)
     
     try:
-        print(f"[DEBUG] get_coupon_history - coupon_id: {coupon_id} (type: {type(coupon_id)})", file=sys.stderr, flush=True)
+        logger.debug("get_coupon_history - coupon_id: %s (type: %s)", coupon_id, type(coupon_id))
         
         # Sprawdź czy coupon_id jest poprawne
         if not coupon_id or coupon_id <= 0:
-            print(f"[DEBUG] Niepoprawne coupon_id: {coupon_id}", file=sys.stderr)
+            logger.debug("Niepoprawne coupon_id: %s", coupon_id)
             return error_response("Niepoprawne ID kuponu", 400)
         
         # Pobierz szczegóły kuponu
@@ -796,16 +1050,16 @@ def get_coupon_history(coupon_id):
         FROM kupony 
         WHERE id = ?
         """
-        print(f"[DEBUG] Wykonuję zapytanie dla coupon_id: {coupon_id}", file=sys.stderr, flush=True)
+        logger.debug("Wykonuję zapytanie dla coupon_id: %s", coupon_id)
         coupon_result = execute_query(coupon_query, (coupon_id,))
-        print(f"[DEBUG] Wynik zapytania: {len(coupon_result) if coupon_result else 0} rekordów", file=sys.stderr, flush=True)
+        logger.debug("Wynik zapytania: %s rekordów", len(coupon_result) if coupon_result else 0)
         
         if not coupon_result:
-            print(f"[DEBUG] Kupon ID {coupon_id} nie znaleziony w bazie", file=sys.stderr, flush=True)
+            logger.debug("Kupon ID %s nie znaleziony w bazie", coupon_id)
             return not_found_response("Kupon nie został znaleziony")
         
         coupon = coupon_result[0]
-        print(f"[DEBUG] Znaleziono kupon: {coupon['kod']}", file=sys.stderr, flush=True)
+        logger.debug("Znaleziono kupon: %s", coupon['kod'])
         
         # Przygotuj historię wydarzeń
         history_events = []
@@ -855,11 +1109,11 @@ def get_coupon_history(coupon_id):
             }
         }
         
-        print(f"[DEBUG] Zwracam odpowiedź: {len(history_events)} wydarzeń", file=sys.stderr, flush=True)
+        logger.debug("Zwracam odpowiedź: %s wydarzeń", len(history_events))
         return success_response(response_data, "Historia kuponu pobrana pomyślnie")
         
     except Exception as e:
-        print(f"[ERROR] Błąd w get_coupon_history: {str(e)}", file=sys.stderr, flush=True)
+        logger.error("Błąd w get_coupon_history: %s", e)
         return error_response(f"Błąd pobierania historii kuponu: {str(e)}", 500)
 
 @coupons_bp.route('/coupons/<int:coupon_id>/use', methods=['POST'])
@@ -910,6 +1164,7 @@ def use_coupon_by_id(coupon_id):
             receipt_number,
             coupon_id
         ))
+        coupon_cache.invalidate(coupon['kod'])
         
         if success:
             return success_response({
@@ -6,6 +6,7 @@ Pozwala na tworzenie, edycję i zarządzanie szablonami przez interfejs graficzn
 from flask import Blueprint, request, jsonify, Response
 from datetime import datetime
 import sqlite3
+import logging
 import json
 import os
 from io import BytesIO
@@ -20,6 +21,8 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase.pdfmetrics import registerFontFamily
 
+logger = logging.getLogger(__name__)
+
 custom_templates_bp = Blueprint('custom_templates', __name__)
 
 # Rejestracja czcionek UTF-8 do obsługi polskich znaków
@@ -56,20 +59,20 @@ def register_utf8_fonts():
                 try:
                     pdfmetrics.registerFont(TTFont('DejaVuSans', path))
                     font_registered = True
-                    print(f"✅ Zarejestrowano czcionkę DejaVuSans: {path}")
+                    logger.debug("Zarejestrowano czcionkę DejaVuSans: %s", path)
                     break
                 except Exception as e:
-                    print(f"⚠️ Nie udało się zarejestrować {path}: {e}")
+                    logger.warning("Nie udało się zarejestrować %s: %s", path, e)
                     
         for path in bold_font_paths:
             if os.path.exists(path):
                 try:
                     pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', path))
                     bold_font_registered = True
-                    print(f"✅ Zarejestrowano czcionkę DejaVuSans-Bold: {path}")
+                    logger.debug("Zarejestrowano czcionkę DejaVuSans-Bold: %s", path)
                     break
                 except Exception as e:
-                    print(f"⚠️ Nie udało się zarejestrować bold {path}: {e}")
+                    logger.warning("Nie udało się zarejestrować bold %s: %s", path, e)
         
         # Jeśli nie ma DejaVu, spróbuj innych czcionek systemowych obsługujących UTF-8
         if not font_registered:
@@ -84,27 +87,27 @@ def register_utf8_fonts():
                     try:
                         pdfmetrics.registerFont(TTFont('SystemUTF8', path))
                         font_registered = True
-                        print(f"✅ Zarejestrowano systemową czcionkę UTF-8: {path}")
+                        logger.debug("Zarejestrowano systemową czcionkę UTF-8: %s", path)
                         break
                     except Exception as e:
-                        print(f"⚠️ Nie udało się zarejestrować systemowej czcionki {path}: {e}")
+                        logger.warning("Nie udało się zarejestrować systemowej czcionki %s: %s", path, e)
         
         if not font_registered:
-            print("⚠️ Nie znaleziono żadnej czcionki UTF-8 - polskie znaki mogą się nie wyświetlać poprawnie")
+            logger.warning("Nie znaleziono żadnej czcionki UTF-8 - polskie znaki mogą się nie wyświetlać poprawnie")
             
         # Zawsze spróbuj zarejestrować rodzinę czcionek Helvetica (domyślnie dostępna)
         try:
             registerFontFamily('Helvetica', normal='Helvetica', bold='Helvetica-Bold', italic='Helvetica-Oblique', boldItalic='Helvetica-BoldOblique')
-            print("✅ Zarejestrowano rodzinę czcionek Helvetica")
+            logger.debug("Zarejestrowano rodzinę czcionek Helvetica")
         except Exception as e:
-            print(f"⚠️ Błąd rejestracji rodziny Helvetica: {e}")
+            logger.error("Błąd rejestracji rodziny Helvetica: %s", e)
             
         # Wyświetl dostępne czcionki
         available_fonts = pdfmetrics.getRegisteredFontNames()
-        print(f"🔤 Dostępne czcionki: {available_fonts}")
+        logger.debug("Dostępne czcionki: %s", available_fonts)
             
     except Exception as e:
-        print(f"❌ Błąd podczas rejestracji czcionek UTF-8: {e}")
+        logger.error("Błąd podczas rejestracji czcionek UTF-8: %s", e)
 
 # Zarejestruj czcionki przy imporcie modułu
 register_utf8_fonts()
@@ -144,13 +147,13 @@ class CustomTemplateManager:
             
             if 'anchored' not in columns:
                 cursor.execute("ALTER TABLE custom_invoice_templates ADD COLUMN anchored BOOLEAN DEFAULT 0")
-                print("✅ Dodano kolumnę 'anchored' do tabeli custom_invoice_templates")
+                logger.debug("Dodano kolumnę 'anchored' do tabeli custom_invoice_templates")
             
             conn.commit()
-            print("✅ Tabela custom_invoice_templates utworzona/sprawdzona")
+            logger.debug("Tabela custom_invoice_templates utworzona/sprawdzona")
             
         except Exception as e:
-            print(f"❌ Błąd inicjalizacji bazy danych dla customowych szablonów: {e}")
+            logger.error("Błąd inicjalizacji bazy danych dla customowych szablonów: %s", e)
         finally:
             conn.close()
     
@@ -172,13 +175,13 @@ class CustomTemplateManager:
             template_id = cursor.lastrowid
             conn.commit()
             
-            print(f"✅ Customowy szablon '{template_data['name']}' zapisany z ID: {template_id}")
+            logger.info("Customowy szablon '%s' zapisany z ID: %s", template_data['name'], template_id)
             return template_id
             
         except sqlite3.IntegrityError:
             raise Exception("Szablon o tej nazwie już istnieje")
         except Exception as e:
-            print(f"❌ Błąd zapisywania szablonu: {e}")
+            logger.error("Błąd zapisywania szablonu: %s", e)
             raise e
         finally:
             conn.close()
@@ -208,7 +211,7 @@ class CustomTemplateManager:
             return templates
             
         except Exception as e:
-            print(f"❌ Błąd pobierania customowych szablonów: {e}")
+            logger.error("Błąd pobierania customowych szablonów: %s", e)
             return []
         finally:
             conn.close()
@@ -257,10 +260,10 @@ class CustomTemplateManager:
                 raise Exception("Szablon nie został znaleziony")
             
             conn.commit()
-            print(f"✅ Szablon ID {template_id} zaktualizowany")
+            logger.info("Szablon ID %s zaktualizowany", template_id)
             
         except Exception as e:
-            print(f"❌ Błąd aktualizacji szablonu: {e}")
+            logger.error("Błąd aktualizacji szablonu: %s", e)
             raise e
         finally:
             conn.close()
@@ -294,10 +297,10 @@ class CustomTemplateManager:
                 raise Exception("Szablon nie został znaleziony")
             
             conn.commit()
-            print(f"✅ Szablon ID {template_id} usunięty")
+            logger.info("Szablon ID %s usunięty", template_id)
             
         except Exception as e:
-            print(f"❌ Błąd usuwania szablonu: {e}")
+            logger.error("Błąd usuwania szablonu: %s", e)
             raise e
         finally:
             conn.close()
@@ -334,11 +337,11 @@ class CustomTemplateManager:
             new_template_id = cursor.lastrowid
             conn.commit()
             
-            print(f"✅ Szablon zduplikowany - nowy ID: {new_template_id}")
+            logger.info("Szablon zduplikowany - nowy ID: %s", new_template_id)
             return new_template_id
             
         except Exception as e:
-            print(f"❌ Błąd duplikowania szablonu: {e}")
+            logger.error("Błąd duplikowania szablonu: %s", e)
             raise e
         finally:
             conn.close()
@@ -369,7 +372,7 @@ class CustomTemplateManager:
                 return self._generate_pdf_with_flowables(invoice_data, positions, template_config, buffer)
                 
         except Exception as e:
-            print(f"❌ Błąd generowania PDF z polami szablonu: {e}")
+            logger.error("Błąd generowania PDF z polami szablonu: %s", e)
             raise e
             
     def _generate_pdf_with_canvas(self, invoice_data, positions, template_config, buffer):
@@ -425,8 +428,8 @@ class CustomTemplateManager:
             content_lines = field.get('contentLines', [])
             line_styles = field.get('lineStyles', [])
             
-            print(f"🔍 DEBUG STYLED TEXT: contentLines={content_lines}")
-            print(f"🔍 DEBUG STYLED TEXT: lineStyles={line_styles}")
+            logger.debug("STYLED TEXT: contentLines=%s", content_lines)
+            logger.debug("STYLED TEXT: lineStyles=%s", line_styles)
             
             # Fallback do zwykłego content jeśli brak contentLines
             if not content_lines:
@@ -444,7 +447,7 @@ class CustomTemplateManager:
                 line_style = line_styles[i] if i < len(line_styles) else {}
                 is_bold = line_style.get('bold', False)
                 
-                print(f"🔍 DEBUG LINIA {i}: content='{line_content}', style={line_style}, is_bold={is_bold}")
+                logger.debug("LINIA %s: content='%s', style=%s, is_bold=%s", i, line_content, line_style, is_bold)
                 
                 # Ustaw czcionkę dla tej linii
                 current_font = font_name
@@ -453,7 +456,7 @@ class CustomTemplateManager:
                 if is_bold:
                     # Sprawdź czy istnieje pogrubiona wersja czcionki
                     registered_fonts = pdfmetrics.getRegisteredFontNames()
-                    print(f"🔍 DEBUG: Dostępne czcionki: {registered_fonts}")
+                    logger.debug("Dostępne czcionki: %s", registered_fonts)
                     
                     if font_name == 'SystemUTF8':
                         bold_font = 'SystemUTF8-Bold'  # Jeśli jest dostępna
@@ -468,12 +471,12 @@ class CustomTemplateManager:
                     if bold_font in registered_fonts:
                         current_font = bold_font
                         canvas_obj.setFont(bold_font, font_size)
-                        print(f"🔍 DEBUG: Używam bold czcionki {bold_font} dla linii {i}")
+                        logger.debug("Używam bold czcionki %s dla linii %s", bold_font, i)
                     else:
                         # Fallback do zwykłej czcionki z większym rozmiarem
                         current_size = font_size + 1
                         canvas_obj.setFont(font_name, font_size + 1)
-                        print(f"🔍 DEBUG: Fallback - bold czcionka {bold_font} nie dostępna, używam {font_name} z rozmiarem {font_size + 1} dla linii {i}")
+                        logger.debug("Fallback - bold czcionka %s nie dostępna, używam %s z rozmiarem %s dla linii %s", bold_font, font_name, font_size + 1, i)
                 else:
                     canvas_obj.setFont(font_name, font_size)
                 
@@ -539,7 +542,7 @@ class CustomTemplateManager:
                     current_y_offset += table_info['height']
             
             if field_type == 'text':
-                print(f"🔍 DEBUG CANVAS TEXT: id={field.get('id')}, textAlign={field.get('style', {}).get('textAlign', 'left')}")
+                logger.debug("CANVAS TEXT: id=%s, textAlign=%s", field.get('id'), field.get('style', {}).get('textAlign', 'left'))
                 
                 # Zastąp placeholdery w content
                 content = self._replace_placeholders(content, invoice_data)
@@ -686,13 +689,13 @@ class CustomTemplateManager:
                     # Sprawdź czy pole ma contentLines lub lineStyles
                     has_content_lines = bool(field.get('contentLines'))
                     has_line_styles = bool(field.get('lineStyles'))
-                    print(f"🔍 DEBUG FIELD: id={field.get('id')}, has_contentLines={has_content_lines}, has_lineStyles={has_line_styles}")
+                    logger.debug("FIELD: id=%s, has_contentLines=%s, has_lineStyles=%s", field.get('id'), has_content_lines, has_line_styles)
                     
                     if has_content_lines or has_line_styles:
-                        print(f"🔍 DEBUG: Używam draw_styled_multiline_text dla pola {field.get('id')}")
+                        logger.debug("Używam draw_styled_multiline_text dla pola %s", field.get('id'))
                         draw_styled_multiline_text(c, field, x, y, font_name, font_size, max_width, None, content)
                     else:
-                        print(f"🔍 DEBUG: Używam draw_multiline_text dla pola {field.get('id')}")
+                        logger.debug("Używam draw_multiline_text dla pola %s", field.get('id'))
                         # Użyj standardowej funkcji dla prostego tekstu
                         draw_multiline_text(c, content, x, y, font_name, font_size, max_width)
                 
@@ -706,21 +709,21 @@ class CustomTemplateManager:
                 
                 if is_vat_table and invoice_data.get('vat_summary'):
                     # Renderuj tabelę VAT
-                    print(f"Rendering VAT summary table in Canvas. VAT data: {invoice_data.get('vat_summary')}")
-                    print(f"🔍 DEBUG: Przed renderowaniem tabeli VAT, cumulative_y_offset = {cumulative_y_offset}")
+                    logger.debug("Rendering VAT summary table in Canvas. VAT data: %s", invoice_data.get('vat_summary'))
+                    logger.debug("Przed renderowaniem tabeli VAT, cumulative_y_offset = %s", cumulative_y_offset)
                     table_height = self._render_vat_table_canvas(c, field, invoice_data['vat_summary'], table_config, margins, height, cumulative_y_offset, settings)
                     # Aktualizuj globalny offset o wysokość tabeli + odstęp
                     cumulative_y_offset += table_height + 5  # 5 punktów odstępu między tabelami
-                    print(f"🔍 DEBUG: Po renderowaniu tabeli VAT, cumulative_y_offset = {cumulative_y_offset}")
+                    logger.debug("Po renderowaniu tabeli VAT, cumulative_y_offset = %s", cumulative_y_offset)
                 elif positions and columns:
                     # Renderuj standardową tabelę produktów
-                    print(f"🔍 DEBUG: Przed renderowaniem tabeli produktów, cumulative_y_offset = {cumulative_y_offset}")
+                    logger.debug("Przed renderowaniem tabeli produktów, cumulative_y_offset = %s", cumulative_y_offset)
                     table_height = self._render_products_table_canvas(c, field, positions, invoice_data, table_config, margins, height, cumulative_y_offset, settings)
                     # Aktualizuj globalny offset o wysokość tabeli + odstęp
                     cumulative_y_offset += table_height + 5  # 5 punktów odstępu między tabelami
-                    print(f"🔍 DEBUG: Po renderowaniu tabeli produktów, cumulative_y_offset = {cumulative_y_offset}")
+                    logger.debug("Po renderowaniu tabeli produktów, cumulative_y_offset = %s", cumulative_y_offset)
                 else:
-                    print(f"No data to render table: positions={len(positions) if positions else 0}, columns={len(columns)}")
+                    logger.debug("No data to render table: positions=%s, columns=%s", len(positions) if positions else 0, len(columns))
         
         c.save()
         buffer.seek(0)
@@ -798,7 +801,7 @@ class CustomTemplateManager:
                 
                 if table_type == 'vat_summary':
                     # Tabela podsumowania VAT
-                    print(f"Rendering VAT summary table. Invoice data VAT summary: {invoice_data.get('vat_summary')}")
+                    logger.debug("Rendering VAT summary table. Invoice data VAT summary: %s", invoice_data.get('vat_summary'))
                     if invoice_data.get('vat_summary'):
                         vat_data = [['Stawka VAT', 'Podstawa netto', 'Kwota VAT', 'Wartość brutto']]
                         for vat_row in invoice_data['vat_summary']:
@@ -809,7 +812,7 @@ class CustomTemplateManager:
                                 f"{vat_row.get('wartosc_brutto', 0):.2f} zł"
                             ]
                             vat_data.append(row)
-                            print(f"Added VAT row: {row}")
+                            logger.debug("Added VAT row: %s", row)
                         
                         # Twórz tabelę VAT z szerszymi kolumnami
                         vat_table = Table(vat_data, colWidths=[80, 120, 120, 120])
@@ -825,9 +828,9 @@ class CustomTemplateManager:
                         ]))
                         elements.append(vat_table)
                         elements.append(Spacer(1, 20))
-                        print(f"VAT table added with {len(vat_data)-1} data rows")
+                        logger.debug("VAT table added with %s data rows", len(vat_data)-1)
                     else:
-                        print("No VAT summary data found in invoice data")
+                        logger.debug("No VAT summary data found in invoice data")
                 elif table_type == 'products':
                     # Tabela produktów (istniejący kod)
                     if positions:
@@ -1151,7 +1154,7 @@ class CustomTemplateManager:
             return buffer.getvalue()
             
         except Exception as e:
-            print(f"❌ Błąd generowania PDF z customowym szablonem: {e}")
+            logger.error("Błąd generowania PDF z customowym szablonem: %s", e)
             raise e
     
     def _create_custom_styles(self, config):
@@ -1444,7 +1447,7 @@ class CustomTemplateManager:
         scale_factor = total_width / total_configured_width if total_configured_width > 0 else 1
         col_widths = [width * scale_factor for width in col_widths]
         
-        print(f"🔍 DEBUG COLUMN WIDTHS VAT: total_width={total_width}, configured_widths={[col.get('width', 100) for col in columns]}, final_widths={col_widths}")
+        logger.debug("COLUMN WIDTHS VAT: total_width=%s, configured_widths=%s, final_widths=%s", total_width, [col.get('width', 100) for col in columns], col_widths)
         
         # Ustawienia czcionki - użyj globalnych ustawień lub domyślnych
         global_font_family = settings.get('font_family', settings.get('globalFontFamily', 'SystemUTF8'))
@@ -1463,8 +1466,8 @@ class CustomTemplateManager:
             else:
                 font_name = "Helvetica"
         
-        print(f"🔍 DEBUG VAT TABLE: Używana czcionka: {font_name}, dostępne czcionki: {registered_fonts}")
-        print(f"🔍 DEBUG: Przed renderowaniem tabeli VAT, cumulative_y_offset = {current_y_offset}")
+        logger.debug("VAT TABLE: Używana czcionka: %s, dostępne czcionki: %s", font_name, registered_fonts)
+        logger.debug("Przed renderowaniem tabeli VAT, cumulative_y_offset = %s", current_y_offset)
         
         # Użyj globalnego rozmiaru czcionki
         header_font_size = max(global_font_size - 1, 8)  # Nieco mniejszy dla nagłówka
@@ -1544,11 +1547,11 @@ class CustomTemplateManager:
             
             current_y -= row_height
         
-        print(f"🔍 DEBUG: Renderowana tabela VAT na pozycji ({x_start}, {table_y}) z {len(vat_data)} wierszami")
+        logger.debug("Renderowana tabela VAT na pozycji (%s, %s) z %s wierszami", x_start, table_y, len(vat_data))
         
         # Zwróć wysokość tabeli (od pozycji początkowej do końcowej)
         table_height = table_y - current_y + row_height  # +row_height bo current_y jest na dole ostatniego wiersza
-        print(f"🔍 DEBUG: Tabela VAT ma wysokość {table_height} (od {table_y} do {current_y})")
+        logger.debug("Tabela VAT ma wysokość %s (od %s do %s)", table_height, table_y, current_y)
         return table_height
     
     def _render_products_table_canvas(self, c, field, positions, invoice_data, table_config, margins, height, current_y_offset, settings=None):
@@ -1581,7 +1584,7 @@ class CustomTemplateManager:
         scale_factor = total_width / total_configured_width if total_configured_width > 0 else 1
         col_widths = [width * scale_factor for width in col_widths]
         
-        print(f"🔍 DEBUG COLUMN WIDTHS PRODUCTS: total_width={total_width}, configured_widths={[col.get('width', 100) for col in columns]}, final_widths={col_widths}")
+        logger.debug("COLUMN WIDTHS PRODUCTS: total_width=%s, configured_widths=%s, final_widths=%s", total_width, [col.get('width', 100) for col in columns], col_widths)
         
         # Ustawienia czcionki - użyj globalnych ustawień lub domyślnych
         global_font_family = settings.get('font_family', settings.get('globalFontFamily', 'SystemUTF8'))
@@ -1600,8 +1603,8 @@ class CustomTemplateManager:
             else:
                 font_name = "Helvetica"
         
-        print(f"🔍 DEBUG PRODUCTS TABLE: Używana czcionka: {font_name}, dostępne czcionki: {registered_fonts}")
-        print(f"🔍 DEBUG: Przed renderowaniem tabeli produktów, cumulative_y_offset = {current_y_offset}")
+        logger.debug("PRODUCTS TABLE: Używana czcionka: %s, dostępne czcionki: %s", font_name, registered_fonts)
+        logger.debug("Przed renderowaniem tabeli produktów, cumulative_y_offset = %s", current_y_offset)
         
         # Użyj globalnego rozmiaru czcionki
         header_font_size = max(global_font_size - 1, 8)  # Nieco mniejszy dla nagłówka
@@ -1686,11 +1689,11 @@ class CustomTemplateManager:
             
             current_y -= row_height
         
-        print(f"🔍 DEBUG: Renderowana tabela produktów na pozycji ({x_start}, {table_y}) z {len(positions)} pozycjami")
+        logger.debug("Renderowana tabela produktów na pozycji (%s, %s) z %s pozycjami", x_start, table_y, len(positions))
         
         # Zwróć wysokość tabeli (od pozycji początkowej do końcowej)
         table_height = table_y - current_y + row_height  # +row_height bo current_y jest na dole ostatniego wiersza
-        print(f"🔍 DEBUG: Tabela produktów ma wysokość {table_height} (od {table_y} do {current_y})")
+        logger.debug("Tabela produktów ma wysokość %s (od %s do %s)", table_height, table_y, current_y)
         return table_height
 
 # Inicjalizuj manager
@@ -1818,7 +1821,7 @@ def get_company_data_for_template():
         current_dir = os.path.dirname(os.path.abspath(__file__))
         db_path = os.path.join(current_dir, '..', '..', 'kupony.db')
         
-        print(f"🔍 TEMPLATE COMPANY: Ścieżka do bazy: {db_path}")
+        logger.debug("TEMPLATE COMPANY: Ścieżka do bazy: %s", db_path)
         
         conn = sqlite3.connect(db_path)
         conn.row_factory = sqlite3.Row
@@ -1829,14 +1832,14 @@ def get_company_data_for_template():
         
         if result:
             company_data = dict(result)
-            print(f"🔍 TEMPLATE COMPANY: Pobrano dane: {company_data}")
+            logger.debug("TEMPLATE COMPANY: Pobrano dane: %s", company_data)
             return company_data
         else:
-            print(f"🔍 TEMPLATE COMPANY: Brak danych w tabeli firma")
+            logger.debug("TEMPLATE COMPANY: Brak danych w tabeli firma")
             return {}
             
     except Exception as e:
-        print(f"❌ TEMPLATE COMPANY: Błąd pobierania danych firmy: {e}")
+        logger.error("TEMPLATE COMPANY: Błąd pobierania danych firmy: %s", e)
         return {}
     finally:
         if 'conn' in locals():
@@ -1866,9 +1869,9 @@ def generate_custom_template_preview():
             }), 400
         
         # Użyj danych z żądania lub pobierz rzeczywiste dane firmy
-        print(f"🔍 TEMPLATE DEBUG: invoice_data = {invoice_data}")
-        print(f"🔍 TEMPLATE DEBUG: bool(invoice_data) = {bool(invoice_data)}")
-        print(f"🔍 TEMPLATE DEBUG: not invoice_data = {not invoice_data}")
+        logger.debug("TEMPLATE: invoice_data = %s", invoice_data)
+        logger.debug("TEMPLATE: bool(invoice_data) = %s", bool(invoice_data))
+        logger.debug("TEMPLATE: not invoice_data = %s", not invoice_data)
         
         # Zapisz debug do pliku
         with open('/Users/robson/Downloads/pos-system-v3/backend/template_debug.log', 'a') as f:
@@ -1876,7 +1879,7 @@ def generate_custom_template_preview():
             f.write(f"DEBUG: bool(invoice_data) = {bool(invoice_data)}\n")
         
         if not invoice_data:
-            print("🔍 TEMPLATE DEBUG: Używam domyślnych danych")
+            logger.debug("TEMPLATE: Używam domyślnych danych")
             # Pobierz dane firmy z bazy danych
             company_data = get_company_data_for_template()
             
@@ -1954,9 +1957,9 @@ def generate_custom_template_preview():
         
         # Konwertuj dane z frontendu na format backendu
         # Pobierz dane firmy jeśli nie ma danych sprzedawcy w invoice_data
-        print(f"🔍 TEMPLATE DEBUG: Konwersja danych, invoice_data = {invoice_data}")
+        logger.debug("TEMPLATE: Konwersja danych, invoice_data = %s", invoice_data)
         company_data = get_company_data_for_template()
-        print(f"🔍 TEMPLATE DEBUG: company_data dla konwersji = {company_data}")
+        logger.debug("TEMPLATE: company_data dla konwersji = %s", company_data)
         
         converted_invoice = {
             'numer_faktury': invoice_data.get('invoice_number', invoice_data.get('numer_faktury', 'FV/001/2025')),
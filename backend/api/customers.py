@@ -3,10 +3,14 @@ API endpoint dla zarządzania klientami
 Kompatybilne z React frontend - wyszukiwarka klientów, szczegóły, statystyki
 """
 
+import logging
+
 from flask import Blueprint, request, jsonify
 from utils.database import execute_query, success_response, error_response, not_found_response
+from utils.customer_search import customer_search_index
 
 customers_bp = Blueprint('customers', __name__)
+logger = logging.getLogger(__name__)
 
 @customers_bp.route('/customers/search', methods=['GET'])
 def search_customers():
@@ -24,30 +28,8 @@ def search_customers():
         if len(query) < 2:
             return error_response("Zapytanie musi mieć co najmniej 2 znaki", 400)
         
-        # Wyszukiwanie w tabelach pos_klienci (rzeczywista tabela)
-        sql_query = """
-        SELECT 
-            id,
-            (imie || ' ' || nazwisko) as name,
-            telefon as phone,
-            email,
-            (ulica || ' ' || miasto) as address,
-            data_rejestracji as created_at,
-            data_ostatniej_edycji as updated_at
-        FROM pos_klienci 
-        WHERE 
-            (imie LIKE ? OR nazwisko LIKE ?) OR 
-            telefon LIKE ? OR 
-            email LIKE ? OR
-            miasto LIKE ?
-        ORDER BY nazwisko ASC
-        LIMIT ?
-        """
-        
-        search_pattern = f"%{query}%"
-        params = [search_pattern, search_pattern, search_pattern, search_pattern, search_pattern, limit]
-        
-        results = execute_query(sql_query, params)
+        # Indeks klientów: telefon/NIP/e-mail po znormalizowanych kluczach, nazwy po prefiksach słów
+        results, match_type, took_ms = customer_search_index.search(query, limit)
         
         if results is None:
             return error_response("Błąd połączenia z bazą danych", 500)
@@ -56,15 +38,69 @@ def search_customers():
             'customers': results,
             'total': len(results),
             'query': query,
-            'limit': limit
+            'limit': limit,
+            'match': match_type,
+            'took_ms': took_ms
         }, f"Znaleziono {len(results)} klientów")
         
     except ValueError:
         return error_response("Parametr 'limit' musi być liczbą", 400)
     except Exception as e:
-        print(f"Błąd wyszukiwania klientów: {e}")
+        logger.error("Błąd wyszukiwania klientów: %s", e)
         return error_response("Wystąpił błąd podczas wyszukiwania", 500)
 
+@customers_bp.route('/customers/resolve', methods=['POST'])
+def resolve_customers():
+    """
+    Wsadowe dopasowanie rekordów importu do istniejących klientów
+    POST /api/customers/resolve  {"records": [{"nip": ..., "telefon": ..., "email": ...}, ...]}
+    Dopasowanie po NIP, potem telefonie, potem e-mailu (klucze znormalizowane).
+    """
+    try:
+        data = request.get_json() or {}
+        records = data.get('records')
+        
+        if not isinstance(records, list):
+            return error_response("Pole 'records' musi być listą", 400)
+        
+        if len(records) > 10000:
+            return error_response("Maksymalnie 10000 rekordów w jednym żądaniu", 400)
+        
+        results = customer_search_index.resolve(records)
+        
+        if results is None:
+            return error_response("Błąd połączenia z bazą danych", 500)
+        
+        matched = sum(1 for result in results if result['customer_id'] is not None)
+        return success_response({
+            'results': results,
+            'total': len(results),
+            'matched': matched,
+            'unmatched': len(results) - matched
+        }, f"Dopasowano {matched} z {len(results)} rekordów")
+        
+    except Exception as e:
+        logger.error("Błąd dopasowania klientów: %s", e)
+        return error_response("Wystąpił błąd podczas dopasowania klientów", 500)
+
+@customers_bp.route('/customers/search-index', methods=['GET'])
+def get_customer_search_index_status():
+    """
+    Stan indeksu wyszukiwania klientów: liczba wpisów, kolejka, czasy odpowiedzi vs cel
+    """
+    return success_response(customer_search_index.status(), "Stan indeksu klientów")
+
+@customers_bp.route('/customers/search-index/rebuild', methods=['POST'])
+def rebuild_customer_search_index():
+    """
+    Pełna przebudowa indeksu wyszukiwania klientów
+    """
+    try:
+        indexed = customer_search_index.rebuild()
+        return success_response({'indexed': indexed}, f"Przebudowano indeks klientów ({indexed} wpisów)")
+    except Exception as e:
+        return error_response(f"Błąd przebudowy indeksu klientów: {str(e)}", 500)
+
 @customers_bp.route('/customers/<int:customer_id>', methods=['GET'])
 def get_customer(customer_id):
     """
@@ -11,6 +11,7 @@ Endpointy do:
 
 from flask import Blueprint, request, jsonify
 from api.fifo_service import fifo_service, ProductBatch, AllocationRequest
+from utils.expiry_monitor import expiry_monitor
 from utils.response_helpers import success_response, error_response
 from datetime import datetime, date
 import traceback
@@ -325,28 +326,17 @@ def expiry_alert_report():
     """Raport alertów o datach ważności"""
     try:
         warehouse_id = request.args.get('warehouse_id', type=int)
-        
-        # Pobierz partie wygasające w różnych przedziałach
-        alerts = {
-            "expired": fifo_service.get_expiring_batches(warehouse_id, -1),  # Już przeterminowane
-            "expiring_7_days": fifo_service.get_expiring_batches(warehouse_id, 7),
-            "expiring_30_days": fifo_service.get_expiring_batches(warehouse_id, 30),
-            "expiring_90_days": fifo_service.get_expiring_batches(warehouse_id, 90)
-        }
-        
-        # Statystyki
-        stats = {
-            "total_expired": len(alerts["expired"]),
-            "total_expiring_7_days": len(alerts["expiring_7_days"]),
-            "total_expiring_30_days": len(alerts["expiring_30_days"]),
-            "total_expiring_90_days": len(alerts["expiring_90_days"])
-        }
-        
+        limit = request.args.get('limit', 200, type=int)
+
+        # Przedziały przeliczane codziennie przez scheduler (utils/expiry_monitor.py)
+        report = expiry_monitor.alerts(warehouse_id, limit)
+
         response_data = {
             "warehouse_id": warehouse_id,
-            "alerts": alerts,
-            "statistics": stats,
-            "generated_at": datetime.now().isoformat()
+            "alerts": report['alerts'],
+            "statistics": report['statistics'],
+            "computed_for": report['computed_for'],
+            "generated_at": report['computed_at']
         }
         
         return success_response(response_data, "Raport alertów wygenerowany")
@@ -354,3 +344,30 @@ def expiry_alert_report():
     except Exception as e:
         logging.error(f"Błąd raportu alertów: {str(e)}")
         return error_response(f"Błąd serwera: {str(e)}", 500)
+
+@fifo_bp.route('/fifo/reports/expiry-summary', methods=['GET'])
+def expiry_summary_report():
+    """Przedziały ważności i wartość zagrożona per magazyn (pulpit) - gotowe wiersze z przeliczenia dziennego"""
+    try:
+        warehouse_id = request.args.get('warehouse_id', type=int)
+        summary = expiry_monitor.summary(warehouse_id)
+        return success_response(summary, "Podsumowanie dat ważności")
+        
+    except Exception as e:
+        logging.error(f"Błąd podsumowania dat ważności: {str(e)}")
+        return error_response(f"Błąd serwera: {str(e)}", 500)
+
+@fifo_bp.route('/fifo/reports/expiry-alert/recalculate', methods=['POST'])
+def recalculate_expiry_alerts():
+    """Ręczne przeliczenie przedziałów ważności (domyślnie robi to scheduler)"""
+    try:
+        result = expiry_monitor.run()
+        
+        if not result.get('success'):
+            return error_response(f"Błąd przeliczania dat ważności: {result.get('error')}", 500)
+            
+        return success_response(result, f"Przeliczono daty ważności ({result['batches']} partii)")
+        
+    except Exception as e:
+        logging.error(f"Błąd przeliczania dat ważności: {str(e)}")
+        return error_response(f"Błąd serwera: {str(e)}", 500)
@@ -0,0 +1,960 @@
+"""
+Silnik partii FIFO/FEFO
+=======================
+
+Partie (product_batches) każdej pary (produkt, magazyn) trzymane są w pamięci jako dwa kopce:
+FIFO po dacie przyjęcia i FEFO po dacie ważności. Alokacja zdejmuje ilość z wierzchołka
+kopca - koszt O(k log n) dla k partii, z których faktycznie pobrano towar, zamiast
+sortowania wszystkich partii przy każdej sprzedaży. Partie wyczerpane i przeterminowane
+wypadają z kopca leniwie.
+
+Spójność z bazą: triggery na product_batches podbijają wersję pary w fifo_batch_versions
+przy każdej zmianie (także spoza serwisu, np. korekta z /fifo/batch/<id>/adjust albo inny
+worker). Każda operacja w transakcji BEGIN IMMEDIATE porównuje wersje swoich par z pamięcią
+i przeładowuje tylko te, które się zmieniły.
+
+Zapis zbiorczy: nagłówki alokacji, pozycje (fifo_allocation_details), stany partii i ruchy
+(batch_movements) jednej partii żądań trafiają do bazy w jednej transakcji poleceniami
+executemany. Koszt wydania (COGS) liczony jest z cen zakupu faktycznie pobranych partii.
+
+Benchmark (na kopii katalogu backend - baza produkcyjna nie jest modyfikowana):
+
+    cd backend && python -m api.fifo_service --products 2000 --batches 20 --sales 50000
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from utils.database import get_db_connection, retry_on_locked
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('fifo', 'fefo')
+
+# Tolerancja porównań ilości ułamkowych
+EPSILON = 1e-9
+
+# Partie bez daty ważności w FEFO idą na koniec
+NO_EXPIRY = '9999-12-31'
+
+# Pary (produkt, magazyn) na jedno zapytanie - limit parametrów SQLite
+LOOKUP_CHUNK = 400
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS product_batches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        batch_number TEXT UNIQUE NOT NULL,
+        product_id INTEGER NOT NULL,
+        warehouse_id INTEGER NOT NULL,
+        received_date TEXT NOT NULL,
+        expiry_date TEXT,
+        supplier_id INTEGER,
+        purchase_invoice_id INTEGER,
+        initial_quantity REAL NOT NULL DEFAULT 0,
+        current_quantity REAL NOT NULL DEFAULT 0,
+        reserved_quantity REAL NOT NULL DEFAULT 0,
+        purchase_price_net REAL NOT NULL DEFAULT 0,
+        purchase_price_gross REAL NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'active',
+        location_in_warehouse TEXT,
+        notes TEXT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        updated_at TEXT DEFAULT (datetime('now')),
+        created_by TEXT DEFAULT 'system',
+        FOREIGN KEY (product_id) REFERENCES produkty(id) ON DELETE CASCADE,
+        FOREIGN KEY (warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE,
+        FOREIGN KEY (supplier_id) REFERENCES dostawcy(id),
+        FOREIGN KEY (purchase_invoice_id) REFERENCES faktury_zakupowe(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS batch_movements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        batch_id INTEGER NOT NULL,
+        movement_type TEXT NOT NULL,
+        quantity REAL NOT NULL,
+        quantity_before REAL NOT NULL DEFAULT 0,
+        quantity_after REAL NOT NULL DEFAULT 0,
+        document_type TEXT,
+        document_number TEXT,
+        reference_id INTEGER,
+        reason TEXT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        created_by TEXT NOT NULL DEFAULT 'system',
+        FOREIGN KEY (batch_id) REFERENCES product_batches(id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fifo_allocations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        warehouse_id INTEGER NOT NULL,
+        requested_quantity REAL NOT NULL,
+        allocated_quantity REAL NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        allocation_strategy TEXT NOT NULL DEFAULT 'fifo',
+        document_type TEXT NOT NULL,
+        document_id INTEGER,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        completed_at TEXT,
+        created_by TEXT NOT NULL DEFAULT 'system',
+        FOREIGN KEY (product_id) REFERENCES produkty(id) ON DELETE CASCADE,
+        FOREIGN KEY (warehouse_id) REFERENCES warehouses(id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fifo_allocation_details (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        allocation_id INTEGER NOT NULL,
+        batch_id INTEGER NOT NULL,
+        allocated_quantity REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'allocated',
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        used_at TEXT,
+        FOREIGN KEY (allocation_id) REFERENCES fifo_allocations(id) ON DELETE CASCADE,
+        FOREIGN KEY (batch_id) REFERENCES product_batches(id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fifo_batch_versions (
+        product_id INTEGER NOT NULL,
+        warehouse_id INTEGER NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (product_id, warehouse_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_product_batches_queue ON product_batches(product_id, warehouse_id, status)",
+    "CREATE INDEX IF NOT EXISTS idx_product_batches_expiry_date ON product_batches(expiry_date)",
+    # Indeks ważności per magazyn - tylko partie, które mogą się przeterminować na stanie
+    """
+    CREATE INDEX IF NOT EXISTS idx_product_batches_expiry_active ON product_batches(warehouse_id, expiry_date)
+    WHERE status = 'active' AND current_quantity > 0 AND expiry_date IS NOT NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_batch_movements_batch ON batch_movements(batch_id)",
+    "CREATE INDEX IF NOT EXISTS idx_batch_movements_document ON batch_movements(document_type, document_number)",
+    "CREATE INDEX IF NOT EXISTS idx_fifo_allocations_product_warehouse ON fifo_allocations(product_id, warehouse_id)",
+    "CREATE INDEX IF NOT EXISTS idx_fifo_allocations_document ON fifo_allocations(document_type, document_id)",
+    "CREATE INDEX IF NOT EXISTS idx_fifo_allocation_details_allocation ON fifo_allocation_details(allocation_id)",
+    "CREATE INDEX IF NOT EXISTS idx_fifo_allocation_details_batch ON fifo_allocation_details(batch_id)",
+] + [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fifo_batch_version_{event.lower()}
+    AFTER {event} ON product_batches
+    BEGIN
+        INSERT INTO fifo_batch_versions (product_id, warehouse_id, version)
+        VALUES ({row}.product_id, {row}.warehouse_id, 1)
+        ON CONFLICT(product_id, warehouse_id) DO UPDATE SET version = version + 1;
+    END
+    """
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+]
+
+
+@dataclass
+class ProductBatch:
+    """Partia towaru do przyjęcia (POST /fifo/batches)"""
+    product_id: int
+    warehouse_id: int
+    initial_quantity: float
+    purchase_price_net: float
+    received_date: Optional[str] = None
+    expiry_date: Optional[str] = None
+    supplier_id: Optional[int] = None
+    purchase_invoice_id: Optional[int] = None
+    current_quantity: Optional[float] = None
+    reserved_quantity: float = 0.0
+    purchase_price_gross: Optional[float] = None
+    location_in_warehouse: Optional[str] = None
+    notes: Optional[str] = None
+    created_by: str = 'system'
+    batch_number: Optional[str] = None
+
+
+@dataclass
+class AllocationRequest:
+    """Żądanie wydania ilości produktu z magazynu według strategii 'fifo' albo 'fefo'"""
+    product_id: int
+    warehouse_id: int
+    requested_quantity: float
+    strategy: str = 'fifo'
+    document_type: str = 'sale'
+    document_id: Optional[int] = None
+    created_by: str = 'system'
+
+
+@dataclass
+class AllocationResult:
+    allocation_id: Optional[int]
+    requested_quantity: float
+    allocated_quantity: float
+    success: bool
+    message: str
+    allocations: List[dict] = field(default_factory=list)
+    cost_net: float = 0.0
+    cost_gross: float = 0.0
+
+
+class _Batch:
+    """Stan partii w pamięci"""
+    __slots__ = ('id', 'batch_number', 'received_date', 'expiry_date', 'current', 'reserved',
+                 'price_net', 'price_gross', 'status')
+
+    def __init__(self, row):
+        (self.id, self.batch_number, self.received_date, self.expiry_date, self.current,
+         self.reserved, self.price_net, self.price_gross, self.status) = row
+
+    @property
+    def available(self):
+        return self.current - self.reserved
+
+    def usable(self, today):
+        return (self.status == 'active' and self.available > EPSILON
+                and (not self.expiry_date or self.expiry_date[:10] >= today))
+
+
+class _BatchQueue:
+    """Partie jednej pary (produkt, magazyn): stan w słowniku, kolejność w kopcach FIFO i FEFO"""
+    __slots__ = ('version', 'batches', 'heaps', 'queued')
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.batches = {}
+        self.heaps = {strategy: [] for strategy in STRATEGIES}
+        self.queued = {strategy: set() for strategy in STRATEGIES}
+        for row in rows:
+            batch = _Batch(row)
+            self.batches[batch.id] = batch
+            for strategy in STRATEGIES:
+                self.heaps[strategy].append((self._key(strategy, batch), batch.id))
+                self.queued[strategy].add(batch.id)
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+
+    @staticmethod
+    def _key(strategy, batch):
+        if strategy == 'fefo':
+            return (batch.expiry_date or NO_EXPIRY, batch.received_date, batch.id)
+        return (batch.received_date, batch.id)
+
+    def requeue(self, batch):
+        """Partia z odzyskaną dostępnością (anulowanie, częściowe wydanie) wraca do kopców"""
+        for strategy in STRATEGIES:
+            if batch.id not in self.queued[strategy]:
+                heapq.heappush(self.heaps[strategy], (self._key(strategy, batch), batch.id))
+                self.queued[strategy].add(batch.id)
+
+    def take(self, strategy, quantity, today):
+        """[(partia, ilość)] z wierzchołka kopca; rezerwuje pobraną ilość w pamięci"""
+        heap, queued = self.heaps[strategy], self.queued[strategy]
+        taken = []
+        while quantity > EPSILON and heap:
+            batch = self.batches.get(heap[0][1])
+            if batch is None or not batch.usable(today):
+                queued.discard(heapq.heappop(heap)[1])
+                continue
+            quantity_taken = min(batch.available, quantity)
+            batch.reserved += quantity_taken
+            quantity -= quantity_taken
+            taken.append((batch, quantity_taken))
+            if batch.available <= EPSILON:
+                queued.discard(heapq.heappop(heap)[1])
+        return taken
+
+    def available(self, today):
+        return sum(b.available for b in self.batches.values() if b.usable(today))
+
+
+class FifoService:
+
+    def __init__(self):
+        self._schema_ready = False
+        self._lock = threading.RLock()
+        self._queues = {}
+
+    def _connect(self):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        # Transakcje otwierane ręcznie (BEGIN IMMEDIATE)
+        conn.isolation_level = None
+        return conn
+
+    def ensure_schema(self):
+        if self._schema_ready:
+            return
+        conn = get_db_connection()
+        try:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._schema_ready = True
+        finally:
+            conn.close()
+
+    def _transaction(self, work):
+        """work(cursor) w BEGIN IMMEDIATE; przy błędzie pamięć par jest odrzucana (przeładuje się z bazy)"""
+        self.ensure_schema()
+        conn = self._connect()
+        try:
+            with self._lock:
+                return self._run(conn, work)
+        finally:
+            conn.close()
+
+    @retry_on_locked
+    def _run(self, conn, work):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            result = work(cursor)
+            cursor.execute("COMMIT")
+            return result
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            self._queues.clear()
+            raise
+
+    # ------------------------------------------------------------------ kolejki w pamięci
+
+    @staticmethod
+    def _versions(cursor, keys):
+        versions = {}
+        keys = list(keys)
+        for start in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[start:start + LOOKUP_CHUNK]
+            cursor.execute(f"""
+                WITH keys (product_id, warehouse_id) AS (VALUES {','.join(['(?, ?)'] * len(chunk))})
+                SELECT v.product_id, v.warehouse_id, v.version
+                FROM keys JOIN fifo_batch_versions v
+                  ON v.product_id = keys.product_id AND v.warehouse_id = keys.warehouse_id
+            """, [value for key in chunk for value in key])
+            versions.update(((row[0], row[1]), row[2]) for row in cursor.fetchall())
+        return versions
+
+    def _queues_for(self, cursor, keys):
+        """Kolejki par - przeładowane tylko te, których wersja w bazie różni się od pamięci"""
+        keys = set(keys)
+        versions = self._versions(cursor, keys)
+        stale = [key for key in keys
+                 if key not in self._queues or self._queues[key].version != versions.get(key, 0)]
+        rows = {key: [] for key in stale}
+        for start in range(0, len(stale), LOOKUP_CHUNK):
+            chunk = stale[start:start + LOOKUP_CHUNK]
+            cursor.execute(f"""
+                WITH keys (product_id, warehouse_id) AS (VALUES {','.join(['(?, ?)'] * len(chunk))})
+                SELECT b.product_id, b.warehouse_id, b.id, b.batch_number, b.received_date, b.expiry_date,
+                       b.current_quantity, b.reserved_quantity, b.purchase_price_net, b.purchase_price_gross, b.status
+                FROM keys JOIN product_batches b
+                  ON b.product_id = keys.product_id AND b.warehouse_id = keys.warehouse_id AND b.status = 'active'
+                WHERE b.current_quantity > 0
+            """, [value for key in chunk for value in key])
+            for row in cursor.fetchall():
+                rows[(row[0], row[1])].append(tuple(row[2:]))
+        for key in stale:
+            self._queues[key] = _BatchQueue(versions.get(key, 0), rows[key])
+        return {key: self._queues[key] for key in keys}
+
+    def _sync_versions(self, cursor, keys):
+        """Po własnym zapisie - pamięć jest aktualna, przyjmuje nowe wersje z triggerów"""
+        for key, version in self._versions(cursor, keys).items():
+            if key in self._queues:
+                self._queues[key].version = version
+
+    def invalidate(self, product_id=None, warehouse_id=None):
+        """Odrzuca kolejki z pamięci (wszystkie albo jednej pary)"""
+        with self._lock:
+            if product_id is None:
+                self._queues.clear()
+            else:
+                self._queues.pop((int(product_id), int(warehouse_id)), None)
+
+    # ------------------------------------------------------------------ partie
+
+    @staticmethod
+    def _next_batch_numbers(cursor, count):
+        prefix = f"BATCH-{datetime.now().strftime('%Y-%m')}-"
+        cursor.execute("""
+            SELECT COALESCE(MAX(CAST(substr(batch_number, ?) AS INTEGER)), 0)
+            FROM product_batches WHERE batch_number LIKE ?
+        """, (len(prefix) + 1, prefix + '%'))
+        last = cursor.fetchone()[0]
+        return [f"{prefix}{last + n:06d}" for n in range(1, count + 1)]
+
+    def create_batches(self, batches):
+        """Przyjęcie wielu partii w jednej transakcji; zwraca listę numerów partii"""
+        batches = [b for b in batches if float(b.initial_quantity) > 0]
+        if not batches:
+            return []
+
+        def work(cursor):
+            numbers = self._next_batch_numbers(cursor, len(batches))
+            now = datetime.now().isoformat()
+            rows = []
+            for batch, generated in zip(batches, numbers):
+                batch.batch_number = batch.batch_number or generated
+                current = batch.initial_quantity if batch.current_quantity is None else batch.current_quantity
+                gross = (batch.purchase_price_gross if batch.purchase_price_gross is not None
+                         else round(batch.purchase_price_net * 1.23, 4))
+                rows.append((batch.batch_number, int(batch.product_id), int(batch.warehouse_id),
+                             batch.received_date or now, batch.expiry_date, batch.supplier_id,
+                             batch.purchase_invoice_id, float(batch.initial_quantity), float(current),
+                             float(batch.reserved_quantity or 0), float(batch.purchase_price_net), float(gross),
+                             batch.location_in_warehouse, batch.notes, batch.created_by))
+            cursor.executemany("""
+                INSERT INTO product_batches
+                (batch_number, product_id, warehouse_id, received_date, expiry_date, supplier_id,
+                 purchase_invoice_id, initial_quantity, current_quantity, reserved_quantity,
+                 purchase_price_net, purchase_price_gross, location_in_warehouse, notes, created_by)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            cursor.executemany("""
+                INSERT INTO batch_movements
+                (batch_id, movement_type, quantity, quantity_before, quantity_after, document_type,
+                 reference_id, reason, created_by)
+                SELECT id, 'in', current_quantity, 0, current_quantity, 'receipt', purchase_invoice_id,
+                       'Przyjęcie partii', created_by
+                FROM product_batches WHERE batch_number = ?
+            """, [(row[0],) for row in rows])
+            # Nowe partie wejdą do kopców przy następnym odczycie pary (wersja podbita triggerem)
+            return [row[0] for row in rows]
+
+        return self._transaction(work)
+
+    def create_batch(self, batch):
+        """(sukces, komunikat) - kontrakt używany przez api.fifo_api"""
+        if float(batch.initial_quantity) <= 0:
+            return False, "Ilość partii musi być większa od zera"
+        number = self.create_batches([batch])[0]
+        return True, f"Utworzono partię {number}"
+
+    def get_product_batches(self, product_id, warehouse_id, active_only=True):
+        self.ensure_schema()
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(f"""
+                SELECT pb.*, pb.current_quantity - pb.reserved_quantity AS available_quantity,
+                       CASE WHEN pb.expiry_date IS NULL THEN NULL
+                            ELSE CAST(julianday(pb.expiry_date) - julianday('now') AS INTEGER) END AS days_to_expiry
+                FROM product_batches pb
+                WHERE pb.product_id = ? AND pb.warehouse_id = ?
+                {"AND pb.status = 'active' AND pb.current_quantity > 0" if active_only else ''}
+                ORDER BY pb.received_date, pb.id
+            """, (product_id, warehouse_id)).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    # ------------------------------------------------------------------ alokacja
+
+    def _take(self, cursor, requests, today):
+        """Pobiera partie dla żądań; zwraca [(żądanie, [(partia, ilość)])] i zmienia tylko pamięć"""
+        for request in requests:
+            if request.strategy not in STRATEGIES:
+                raise ValueError(f"Nieznana strategia alokacji: {request.strategy}")
+        queues = self._queues_for(cursor, {(int(r.product_id), int(r.warehouse_id)) for r in requests})
+        return [(request, queues[(int(request.product_id), int(request.warehouse_id))].take(
+                    request.strategy, float(request.requested_quantity), today))
+                for request in requests]
+
+    def _persist(self, cursor, taken, consume):
+        """
+        Zapis jednej partii żądań: nagłówki, pozycje, stany partii i ruchy (executemany)
+        consume=True - wydanie od razu (sprzedaż), inaczej rezerwacja do późniejszego consume()
+        """
+        now = datetime.now().isoformat()
+        status, detail_status = ('completed', 'used') if consume else ('allocated', 'allocated')
+        results, details, movements, batch_changes = [], [], [], {}
+
+        for request, parts in taken:
+            allocated = sum(q for _, q in parts)
+            cursor.execute("""
+                INSERT INTO fifo_allocations
+                (product_id, warehouse_id, requested_quantity, allocated_quantity, status,
+                 allocation_strategy, document_type, document_id, completed_at, created_by)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (request.product_id, request.warehouse_id, request.requested_quantity, allocated,
+                  status if parts else 'cancelled', request.strategy, request.document_type,
+                  request.document_id, now if consume else None, request.created_by))
+            allocation_id = cursor.lastrowid
+
+            lines = []
+            for batch, quantity in parts:
+                details.append((allocation_id, batch.id, quantity, detail_status, now if consume else None))
+                change = batch_changes.setdefault(batch.id, [batch, 0.0])
+                change[1] += quantity
+                movements.append((batch.id, 'out' if consume else 'reserve', quantity,
+                                  request.document_type, allocation_id, request.created_by))
+                lines.append({
+                    'batch_id': batch.id,
+                    'batch_number': batch.batch_number,
+                    'quantity': quantity,
+                    'received_date': batch.received_date,
+                    'expiry_date': batch.expiry_date,
+                    'purchase_price_net': batch.price_net,
+                    'cost_net': round(quantity * batch.price_net, 4)
+                })
+            if consume:
+                for batch, quantity in parts:
+                    batch.current -= quantity
+                    batch.reserved -= quantity
+
+            requested = float(request.requested_quantity)
+            complete = allocated >= requested - EPSILON
+            results.append(AllocationResult(
+                allocation_id=allocation_id,
+                requested_quantity=requested,
+                allocated_quantity=allocated,
+                success=complete,
+                message=("Alokacja zakończona pomyślnie" if complete
+                         else f"Niewystarczający stan partii - alokowano {allocated} z {requested}"),
+                allocations=lines,
+                cost_net=round(sum(q * b.price_net for b, q in parts), 4),
+                cost_gross=round(sum(q * b.price_gross for b, q in parts), 4)
+            ))
+
+        cursor.executemany("""
+            INSERT INTO fifo_allocation_details (allocation_id, batch_id, allocated_quantity, status, used_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, details)
+        if consume:
+            cursor.executemany("""
+                UPDATE product_batches
+                SET current_quantity = current_quantity - ?,
+                    status = CASE WHEN current_quantity - ? <= ? THEN 'sold_out' ELSE status END,
+                    updated_at = datetime('now')
+                WHERE id = ?
+            """, [(q, q, EPSILON, batch_id) for batch_id, (_, q) in batch_changes.items()])
+            for batch, _ in batch_changes.values():
+                if batch.current <= EPSILON:
+                    batch.status = 'sold_out'
+        else:
+            cursor.executemany("""
+                UPDATE product_batches SET reserved_quantity = reserved_quantity + ?, updated_at = datetime('now')
+                WHERE id = ?
+            """, [(q, batch_id) for batch_id, (_, q) in batch_changes.items()])
+        cursor.executemany("""
+            INSERT INTO batch_movements
+            (batch_id, movement_type, quantity, quantity_before, quantity_after, document_type, reference_id, created_by)
+            SELECT ?, ?, ?, current_quantity + CASE WHEN ? = 'out' THEN ? ELSE 0 END, current_quantity, ?, ?, ?
+            FROM product_batches WHERE id = ?
+        """, [(batch_id, kind, q, kind, q, doc, ref, user, batch_id)
+              for batch_id, kind, q, doc, ref, user in movements])
+        self._sync_versions(cursor, {(int(r.product_id), int(r.warehouse_id)) for r, _ in taken})
+        return results
+
+    def allocate_many(self, requests, consume=False, then=None):
+        """
+        Alokacja wielu żądań w jednej transakcji (np. wszystkie pozycje paragonu)
+        consume=True wydaje towar od razu - koszt w AllocationResult.cost_net
+        requests - lista albo requests(cursor) wołane już w transakcji (żądania z odczytu,
+        którego nie może wyprzedzić równoległy zapis)
+        then(cursor, wyniki) - dalszy zapis w tej samej transakcji (np. koszt pozycji paragonu)
+        """
+        today = date.today().isoformat()
+
+        def positive(items):
+            return [r for r in items if float(r.requested_quantity) > 0]
+
+        def work(cursor):
+            pending = positive(requests(cursor)) if callable(requests) else requests
+            results = self._persist(cursor, self._take(cursor, pending, today), consume) if pending else []
+            if then:
+                then(cursor, results)
+            return results
+
+        if not callable(requests):
+            requests = positive(requests)
+            if not requests and not then:
+                return []
+        return self._transaction(work)
+
+    def allocate_fifo(self, allocation_request):
+        """Rezerwacja partii dla jednego żądania (POST /fifo/allocate)"""
+        if float(allocation_request.requested_quantity) <= 0:
+            return AllocationResult(None, float(allocation_request.requested_quantity), 0.0, False,
+                                    "Ilość musi być większa od zera")
+        return self.allocate_many([allocation_request])[0]
+
+    def sell(self, warehouse_id, lines, strategy='fifo', document_type='sale', document_id=None,
+             created_by='system', then=None):
+        """
+        Wydanie sprzedaży bez rezerwacji: lines [(product_id, ilość)] albo lines(cursor) - odczyt
+        pozycji w transakcji wydania. Zwraca listę AllocationResult w kolejności pozycji (ilości > 0)
+        """
+        def requests(items):
+            return [AllocationRequest(product_id, warehouse_id, quantity, strategy,
+                                      document_type, document_id, created_by)
+                    for product_id, quantity in items]
+
+        if callable(lines):
+            return self.allocate_many(lambda cursor: requests(lines(cursor)), consume=True, then=then)
+        return self.allocate_many(requests(lines), consume=True, then=then)
+
+    # ------------------------------------------------------------------ wydanie / anulowanie
+
+    @staticmethod
+    def _allocation(cursor, allocation_id):
+        cursor.execute("SELECT * FROM fifo_allocations WHERE id = ?", (allocation_id,))
+        allocation = cursor.fetchone()
+        if not allocation:
+            raise ValueError("Alokacja nie istnieje")
+        if allocation['status'] != 'allocated':
+            raise ValueError(f"Alokacja ma status '{allocation['status']}'")
+        cursor.execute("""
+            SELECT d.id, d.batch_id, d.allocated_quantity, b.purchase_price_net, b.purchase_price_gross
+            FROM fifo_allocation_details d JOIN product_batches b ON b.id = d.batch_id
+            WHERE d.allocation_id = ? AND d.status = 'allocated'
+            ORDER BY d.id
+        """, (allocation_id,))
+        return dict(allocation), [dict(row) for row in cursor.fetchall()]
+
+    def _release(self, cursor, allocation, used):
+        """Zwalnia rezerwacje alokacji; used {detail_id: ilość wydana} - wydane ilości schodzą ze stanu"""
+        key = (allocation['product_id'], allocation['warehouse_id'])
+        queue = self._queues_for(cursor, [key])[key]
+        now = datetime.now().isoformat()
+        updates, movements = [], []
+        for detail in allocation['details']:
+            quantity_used = used.get(detail['id'], 0.0)
+            updates.append((quantity_used, detail['allocated_quantity'], quantity_used, EPSILON, detail['batch_id']))
+            if quantity_used > 0:
+                movements.append((detail['batch_id'], 'out', quantity_used))
+            if detail['allocated_quantity'] - quantity_used > EPSILON:
+                movements.append((detail['batch_id'], 'unreserve', detail['allocated_quantity'] - quantity_used))
+            batch = queue.batches.get(detail['batch_id'])
+            if batch:
+                batch.current -= quantity_used
+                batch.reserved -= detail['allocated_quantity']
+                if batch.current <= EPSILON:
+                    batch.status = 'sold_out'
+                elif batch.available > EPSILON:
+                    queue.requeue(batch)
+
+        cursor.executemany("""
+            UPDATE product_batches
+            SET current_quantity = current_quantity - ?,
+                reserved_quantity = MAX(reserved_quantity - ?, 0),
+                status = CASE WHEN current_quantity - ? <= ? THEN 'sold_out' ELSE status END,
+                updated_at = datetime('now')
+            WHERE id = ?
+        """, updates)
+        cursor.executemany("""
+            INSERT INTO batch_movements
+            (batch_id, movement_type, quantity, quantity_before, quantity_after, document_type, reference_id, created_by)
+            SELECT ?, ?, ?, current_quantity + CASE WHEN ? = 'out' THEN ? ELSE 0 END, current_quantity, ?, ?, ?
+            FROM product_batches WHERE id = ?
+        """, [(batch_id, kind, q, kind, q, allocation['document_type'], allocation['id'], allocation['user'], batch_id)
+              for batch_id, kind, q in movements])
+        self._sync_versions(cursor, [key])
+        return now
+
+    def consume(self, allocation_id, consumed_quantity=None, created_by='system'):
+        """
+        Wydanie zarezerwowanej alokacji (w kolejności partii z alokacji); nadwyżka rezerwacji wraca
+        do partii. Zwraca {'consumed_quantity', 'cost_net', 'cost_gross', 'batches'}
+        """
+        def work(cursor):
+            allocation, details = self._allocation(cursor, allocation_id)
+            remaining = (float(allocation['allocated_quantity']) if consumed_quantity is None
+                         else float(consumed_quantity))
+            if remaining > allocation['allocated_quantity'] + EPSILON:
+                raise ValueError("Ilość wydana większa niż alokowana")
+            used, batches, cost_net, cost_gross = {}, [], 0.0, 0.0
+            for detail in details:
+                quantity = min(detail['allocated_quantity'], remaining)
+                remaining -= quantity
+                used[detail['id']] = quantity
+                if quantity > 0:
+                    cost_net += quantity * detail['purchase_price_net']
+                    cost_gross += quantity * detail['purchase_price_gross']
+                    batches.append({'batch_id': detail['batch_id'], 'quantity': quantity,
+                                    'purchase_price_net': detail['purchase_price_net']})
+            allocation.update(details=details, user=created_by)
+            now = self._release(cursor, allocation, used)
+            cursor.executemany("""
+                UPDATE fifo_allocation_details
+                SET allocated_quantity = ?, status = CASE WHEN ? > 0 THEN 'used' ELSE 'cancelled' END, used_at = ?
+                WHERE id = ?
+            """, [(q, q, now, detail_id) for detail_id, q in used.items()])
+            consumed = sum(used.values())
+            cursor.execute("""
+                UPDATE fifo_allocations SET status = 'completed', allocated_quantity = ?, completed_at = ?
+                WHERE id = ?
+            """, (consumed, now, allocation_id))
+            return {'allocation_id': allocation_id, 'consumed_quantity': consumed,
+                    'cost_net': round(cost_net, 4), 'cost_gross': round(cost_gross, 4), 'batches': batches}
+
+        return self._transaction(work)
+
+    def consume_allocation(self, allocation_id, consumed_quantity=None, created_by='system'):
+        """(sukces, komunikat) - kontrakt używany przez api.fifo_api"""
+        try:
+            result = self.consume(allocation_id, consumed_quantity, created_by)
+        except ValueError as e:
+            return False, str(e)
+        return True, (f"Wydano {result['consumed_quantity']} szt., "
+                      f"koszt zakupu netto {result['cost_net']:.2f}")
+
+    def cancel_allocation(self, allocation_id, reason='Anulowane'):
+        def work(cursor):
+            allocation, details = self._allocation(cursor, allocation_id)
+            allocation.update(details=details, user='system')
+            now = self._release(cursor, allocation, {})
+            cursor.execute("""
+                UPDATE fifo_allocation_details SET status = 'cancelled' WHERE allocation_id = ? AND status = 'allocated'
+            """, (allocation_id,))
+            cursor.execute("""
+                UPDATE fifo_allocations SET status = 'cancelled', completed_at = ? WHERE id = ?
+            """, (now, allocation_id))
+            return len(details)
+
+        try:
+            released = self._transaction(work)
+        except ValueError as e:
+            return False, str(e)
+        logger.info("FIFO: anulowano alokację %s (%s partii) - %s", allocation_id, released, reason)
+        return True, f"Anulowano alokację {allocation_id}, zwolniono {released} partii"
+
+    # ------------------------------------------------------------------ raporty
+
+    def available_quantity(self, product_id, warehouse_id):
+        """Dostępna ilość z pamięci (po sprawdzeniu wersji pary)"""
+        key = (int(product_id), int(warehouse_id))
+        today = date.today().isoformat()
+        return self._transaction(lambda cursor: self._queues_for(cursor, [key])[key].available(today))
+
+    def get_expiring_batches(self, warehouse_id=None, days_ahead=30):
+        """
+        Partie z datą ważności w ciągu days_ahead dni; days_ahead < 0 - już przeterminowane
+        Zakres po indeksie idx_product_batches_expiry_active (bez skanowania wszystkich partii)
+        """
+        self.ensure_schema()
+        today = date.today()
+        if days_ahead < 0:
+            condition, params = "pb.expiry_date < ?", [today.isoformat()]
+        else:
+            condition, params = "pb.expiry_date >= ? AND pb.expiry_date <= ?", [
+                today.isoformat(), (today + timedelta(days=days_ahead)).isoformat() + 'T23:59:59']
+        if warehouse_id:
+            condition += " AND pb.warehouse_id = ?"
+            params.append(warehouse_id)
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(f"""
+                SELECT pb.id, pb.batch_number, pb.product_id, p.nazwa AS product_name, pb.warehouse_id,
+                       pb.expiry_date, pb.current_quantity, pb.reserved_quantity,
+                       pb.current_quantity * pb.purchase_price_net AS value_net,
+                       CAST(julianday(substr(pb.expiry_date, 1, 10)) - julianday(date('now')) AS INTEGER) AS days_to_expiry
+                FROM product_batches pb
+                LEFT JOIN produkty p ON p.id = pb.product_id
+                WHERE pb.status = 'active' AND pb.current_quantity > 0 AND pb.expiry_date IS NOT NULL
+                  AND {condition}
+                ORDER BY pb.expiry_date, pb.id
+            """, params).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def get_stock_summary(self, warehouse_id=None):
+        self.ensure_schema()
+        where, params = '', []
+        if warehouse_id:
+            where, params = 'AND pb.warehouse_id = ?', [warehouse_id]
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(f"""
+                SELECT pb.product_id, p.nazwa AS product_name, pb.warehouse_id,
+                       SUM(pb.current_quantity) AS total_quantity,
+                       SUM(pb.reserved_quantity) AS total_reserved,
+                       SUM(pb.current_quantity - pb.reserved_quantity) AS available_quantity,
+                       ROUND(SUM(pb.current_quantity * pb.purchase_price_net), 2) AS value_net,
+                       MIN(pb.received_date) AS oldest_batch_date,
+                       MAX(pb.received_date) AS newest_batch_date,
+                       MIN(pb.expiry_date) AS earliest_expiry,
+                       COUNT(*) AS active_batches_count
+                FROM product_batches pb
+                LEFT JOIN produkty p ON p.id = pb.product_id
+                WHERE pb.status = 'active' AND pb.current_quantity > 0 {where}
+                GROUP BY pb.product_id, pb.warehouse_id
+                ORDER BY p.nazwa
+            """, params).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+
+# ---------------------------------------------------------------------- benchmark
+
+def seed_batches(products, batches_per_product, warehouse_id, seed=42):
+    """Syntetyczne produkty z partiami o losowych datach przyjęcia, ważności i cenach"""
+    rnd = random.Random(seed)
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM produkty")
+        first = cursor.fetchone()[0] + 1
+        cursor.executemany("INSERT INTO produkty (id, nazwa, cena) VALUES (?, ?, 1)",
+                           [(first + n, f"Benchmark FIFO {n}") for n in range(products)])
+        conn.commit()
+    finally:
+        conn.close()
+
+    start = date.today() - timedelta(days=365)
+    batches = []
+    for n in range(products):
+        for _ in range(batches_per_product):
+            received = start + timedelta(days=rnd.randrange(300))
+            batches.append(ProductBatch(
+                product_id=first + n, warehouse_id=warehouse_id,
+                initial_quantity=rnd.randint(5, 50), purchase_price_net=round(rnd.uniform(1, 100), 2),
+                received_date=received.isoformat(),
+                expiry_date=(received + timedelta(days=rnd.randint(120, 720))).isoformat(),
+                created_by='benchmark'))
+    fifo_service.create_batches(batches)
+    return list(range(first, first + products))
+
+
+def run_benchmark(products=2000, batches=20, sales=50000, lines_per_sale=5, seed=42, warehouse_id=5):
+    product_ids = seed_batches(products, batches, warehouse_id, seed)
+    rnd = random.Random(seed)
+    receipts = [[(rnd.choice(product_ids), rnd.randint(1, 3)) for _ in range(lines_per_sale)]
+                for _ in range(max(sales // lines_per_sale, 1))]
+
+    # Połączenie otwarte przez cały pomiar - jak na działającym serwerze zamknięcie ostatniego
+    # połączenia nie wymusza checkpointu WAL po każdej transakcji
+    keeper = get_db_connection()
+    try:
+        fifo_service.invalidate()
+        results = []
+
+        # Paragon = jedna transakcja (ścieżka POS)
+        half = len(receipts) // 2
+        started = time.perf_counter()
+        for n, receipt in enumerate(receipts[:half]):
+            results.extend(fifo_service.sell(warehouse_id, receipt, 'fefo' if n % 2 else 'fifo',
+                                             document_id=n, created_by='benchmark'))
+        took_receipts = time.perf_counter() - started
+        receipt_lines = len(results)
+
+        # Wiele paragonów w jednej transakcji (zapis zbiorczy, np. import sprzedaży)
+        started = time.perf_counter()
+        rest = receipts[half:]
+        for start in range(0, len(rest), 200):
+            results.extend(fifo_service.allocate_many(
+                [AllocationRequest(product_id, warehouse_id, quantity, 'fifo', 'sale', half + start + n, 'benchmark')
+                 for n, receipt in enumerate(rest[start:start + 200]) for product_id, quantity in receipt],
+                consume=True))
+        took_bulk = time.perf_counter() - started
+        bulk_lines = len(results) - receipt_lines
+
+        # Rezerwacja + wydanie (ścieżka API /fifo/allocate + consume) na próbce
+        sample = min(2000, len(product_ids))
+        reserved_cost = 0.0
+        started = time.perf_counter()
+        for product_id in product_ids[:sample]:
+            result = fifo_service.allocate_fifo(AllocationRequest(product_id, warehouse_id, 1, 'fifo',
+                                                                  created_by='benchmark'))
+            if result.allocation_id and result.allocated_quantity:
+                reserved_cost += fifo_service.consume(result.allocation_id)['cost_net']
+        took_reserved = time.perf_counter() - started
+
+        # Kontrola: koszt z silnika = koszt z pozycji alokacji w bazie, stany partii nieujemne
+        db_cost = keeper.execute("""
+            SELECT COALESCE(SUM(d.allocated_quantity * b.purchase_price_net), 0)
+            FROM fifo_allocation_details d
+            JOIN fifo_allocations a ON a.id = d.allocation_id
+            JOIN product_batches b ON b.id = d.batch_id
+            WHERE a.created_by = 'benchmark' AND d.status = 'used'
+        """).fetchone()[0]
+        negative = keeper.execute("""
+            SELECT COUNT(*) FROM product_batches WHERE current_quantity < -1e-9 OR reserved_quantity < -1e-9
+        """).fetchone()[0]
+    finally:
+        keeper.close()
+
+    engine_cost = sum(r.cost_net for r in results) + reserved_cost
+    return {
+        'products': products,
+        'batches': products * batches,
+        'sale_lines': len(results),
+        'short_lines': sum(1 for r in results if not r.success),
+        'receipt_per_second': round(receipt_lines / took_receipts) if took_receipts else None,
+        'bulk_per_second': round(bulk_lines / took_bulk) if took_bulk else None,
+        'reserve_consume_per_second': round(sample / took_reserved) if took_reserved else None,
+        'cost_net': round(engine_cost, 2),
+        'cost_matches_db': abs(db_cost - engine_cost) < 0.01,
+        'negative_batches': negative
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark alokacji partii FIFO/FEFO')
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--batches', type=int, default=20, help='partie na produkt')
+    parser.add_argument('--sales', type=int, default=50000, help='pozycje sprzedaży')
+    parser.add_argument('--lines-per-sale', type=int, default=5, help='pozycje na paragon (jedna transakcja)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help='wynik jako JSON')
+    parser.add_argument('--in-sandbox', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.in_sandbox:
+        result = run_benchmark(args.products, args.batches, args.sales, args.lines_per_sale, args.seed)
+        with open(args.in_sandbox, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return 0
+
+    from utils.benchmark import BACKEND_DIR, SANDBOX_IGNORE
+
+    temp_dir = tempfile.mkdtemp(prefix='fifo_benchmark_')
+    try:
+        sandbox = os.path.join(temp_dir, 'backend')
+        shutil.copytree(BACKEND_DIR, sandbox, ignore=SANDBOX_IGNORE)
+        result_file = os.path.join(temp_dir, 'result.json')
+        forwarded = [arg for arg in (argv if argv is not None else sys.argv[1:])]
+        completed = subprocess.run(
+            [sys.executable, '-m', 'api.fifo_service', *forwarded, '--in-sandbox', result_file],
+            cwd=sandbox
+        )
+        if completed.returncode != 0 or not os.path.exists(result_file):
+            print(f"❌ Benchmark zakończony błędem (kod {completed.returncode})")
+            return completed.returncode or 1
+        with open(result_file, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"FIFO/FEFO: {result['products']} produktów, {result['batches']} partii")
+        print(f"Sprzedaż: {result['sale_lines']} pozycji, niepełne: {result['short_lines']}")
+        print(f"Alokacje/s: paragon na transakcję {result['receipt_per_second']}, "
+              f"200 paragonów na transakcję {result['bulk_per_second']}, "
+              f"rezerwacja + wydanie {result['reserve_consume_per_second']}")
+        print(f"Koszt zakupu netto: {result['cost_net']} (zgodny z bazą: {result['cost_matches_db']}), "
+              f"ujemne partie: {result['negative_batches']}")
+    return 0
+
+
+# Globalna instancja
+fifo_service = FifoService()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
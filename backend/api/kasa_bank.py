@@ -13,6 +13,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
 # Import funkcji bazy danych
 from utils.database import get_db_connection, execute_query, execute_insert, success_response, error_response, not_found_response
+from utils.pagination import ensure_list_schema, decode_cursor, keyset_condition, page_result, count_cache
 
 kasa_bank_bp = Blueprint('kasa_bank', __name__)
 
@@ -97,11 +98,45 @@ class KasaBankManager:
         finally:
             conn.close()
     
-    def get_operacje(self, limit=50, offset=0, date_from=None, date_to=None, typ_platnosci=None, location_id=None):
-        """Pobierz operacje finansowe z filtrowaniem według lokalizacji"""
+    def get_operacje(self, limit=50, offset=0, date_from=None, date_to=None, typ_platnosci=None, location_id=None, cursor_token=None):
+        """
+        Pobierz operacje finansowe z filtrowaniem według lokalizacji
+        Z cursor_token stronicowanie kursorowe po (data_operacji, id); offset tylko dla zgodności wstecz.
+        Zwraca (operacje, next_cursor, total).
+        """
+        ensure_list_schema()
         conn = self.get_connection()
         try:
-            query = """
+            where = ""
+            params = []
+            
+            # Porównania bez date() na kolumnie - pozwalają użyć indeksu (data_operacji, id)
+            if date_from:
+                where += " AND data_operacji >= ?"
+                params.append(date_from)
+                
+            if date_to:
+                where += " AND data_operacji < date(?, '+1 day')"
+                params.append(date_to)
+                
+            if typ_platnosci:
+                where += " AND typ_platnosci = ?"
+                params.append(typ_platnosci)
+                
+            if location_id:
+                where += " AND location_id = ?"
+                params.append(location_id)
+            
+            page_where = where
+            page_params = list(params)
+            cursor_values = decode_cursor(cursor_token)
+            if cursor_values:
+                condition, values = keyset_condition(['data_operacji', 'id'], cursor_values)
+                page_where += f" AND {condition}"
+                page_params.extend(values)
+                offset = 0
+            
+            query = f"""
                 SELECT 
                     id,
                     data_operacji,
@@ -117,35 +152,23 @@ class KasaBankManager:
                     uwagi,
                     location_id
                 FROM kasa_operacje
-                WHERE 1=1
+                WHERE 1=1 {page_where}
+                ORDER BY data_operacji DESC, id DESC LIMIT ? OFFSET ?
             """
+            page_params.extend([limit + 1, offset])
             
-            params = []
-            
-            if date_from:
-                query += " AND date(data_operacji) >= ?"
-                params.append(date_from)
-                
-            if date_to:
-                query += " AND date(data_operacji) <= ?"
-                params.append(date_to)
-                
-            if typ_platnosci:
-                query += " AND typ_platnosci = ?"
-                params.append(typ_platnosci)
-                
-            if location_id:
-                query += " AND location_id = ?"
-                params.append(location_id)
+            cursor = conn.cursor()
+            cursor.execute(query, page_params)
+            rows = [dict(row) for row in cursor.fetchall()]
+            operacje, next_cursor, _ = page_result(rows, limit, lambda row: (row['data_operacji'], row['id']))
             
-            query += " ORDER BY data_operacji DESC, id DESC LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
+            def count_operacje():
+                cursor.execute(f"SELECT COUNT(*) FROM kasa_operacje WHERE 1=1 {where}", params)
+                return cursor.fetchone()[0]
             
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            operacje = cursor.fetchall()
+            total = count_cache.get(('kasa_operacje', where, tuple(params)), count_operacje)
             
-            return [dict(row) for row in operacje]
+            return operacje, next_cursor, total
             
         finally:
             conn.close()
@@ -177,6 +200,7 @@ class KasaBankManager:
             
             operacja_id = cursor.lastrowid
             conn.commit()
+            count_cache.invalidate('kasa_operacje')
             
             return operacja_id
             
@@ -596,19 +620,24 @@ def get_operacje():
         date_to = request.args.get('date_to')
         typ_platnosci = request.args.get('typ_platnosci')
         location_id = request.args.get('location_id', type=int)
+        cursor_token = request.args.get('cursor')
         
-        operacje = kasa_bank_manager.get_operacje(
+        operacje, next_cursor, total = kasa_bank_manager.get_operacje(
             limit=limit,
             offset=offset,
             date_from=date_from,
             date_to=date_to,
             typ_platnosci=typ_platnosci,
-            location_id=location_id
+            location_id=location_id,
+            cursor_token=cursor_token
         )
         
         return success_response({
             'operacje': operacje,
-            'count': len(operacje)
+            'count': len(operacje),
+            'total': total,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
         }, "Operacje pobrane pomyślnie")
         
     except Exception as e:
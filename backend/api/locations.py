@@ -1,10 +1,10 @@
-print("🔥 LOCATIONS MODULE LOADED")
 """
 API modułu Locations - zarządzanie lokalizacjami i sklepami
 """
 
 from flask import Blueprint, request, jsonify
 from datetime import datetime
+import logging
 import sqlite3
 import os
 import sys
@@ -12,6 +12,8 @@ import sys
 # Dodaj ścieżki do modułów
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
+logger = logging.getLogger(__name__)
+
 locations_bp = Blueprint('locations', __name__)
 print(f"🔥 LOCATIONS BLUEPRINT CREATED: {locations_bp}")
 
@@ -137,7 +139,7 @@ class LocationsManager:
     
     def update_location(self, location_id, data):
         """Aktualizuj lokalizację"""
-        print(f"🔍 DEBUG LocationsManager.update_location: location_id={location_id}, data={data}")
+        logger.debug("LocationsManager.update_location: location_id=%s, data=%s", location_id, data)
         conn = self.get_connection()
         try:
             cursor = conn.cursor()
@@ -163,7 +165,7 @@ class LocationsManager:
                 'updated_at': datetime.now().isoformat()
             }
             
-            print(f"🔍 DEBUG: Mapped update_data={update_data}")
+            logger.debug("Mapped update_data=%s", update_data)
             
             # Aktualizuj dane
             cursor.execute("""
@@ -189,7 +191,7 @@ class LocationsManager:
             ))
             
             conn.commit()
-            print(f"✅ DEBUG: Location {location_id} updated successfully")
+            logger.debug("Location %s updated successfully", location_id)
             return True, "Lokalizacja została zaktualizowana"
             
         except Exception as e:
@@ -536,7 +538,7 @@ def update_location(location_id):
     """Aktualizuj lokalizację"""
     try:
         data = request.get_json()
-        print(f"🔍 DEBUG: Received data for location {location_id}: {data}")
+        logger.debug("Received data for location %s: %s", location_id, data)
         
         # Walidacja danych
         if not data.get('nazwa'):
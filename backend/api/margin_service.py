@@ -15,6 +15,8 @@ from typing import Dict, Any, Optional, Tuple, List
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from utils.database import get_db_connection
+from utils.moving_average import moving_average, DEFAULT_WAREHOUSE_ID
+from utils.sale_costs import sale_costs
 import logging
 
 @dataclass
@@ -176,36 +178,17 @@ class MarginService:
     def _get_weighted_average_purchase_price(self, cursor, product_id: int, 
                                            warehouse_id: Optional[int],
                                            strategy: PurchasePriceStrategy) -> Tuple[float, str]:
-        """Pobiera średnią ważoną cenę zakupu z ostatnich transakcji"""
-        
-        cutoff_date = (datetime.now() - timedelta(days=strategy.timeframe_days)).strftime('%Y-%m-%d')
-        
-        query = """
-            SELECT fzp.cena_netto, fzp.ilosc, fz.data_faktury
-            FROM faktury_zakupowe_pozycje fzp
-            JOIN faktury_zakupowe fz ON fzp.faktura_id = fz.id
-            WHERE fzp.produkt_id = ?
-            AND fz.data_faktury >= ?
-            AND fzp.cena_netto > 0
-            AND fzp.ilosc > 0
-            ORDER BY fz.data_faktury DESC
+        """
+        Pobiera ruchomą średnią ważoną ceny zakupu magazynu (utils.moving_average)
+        Średnia jest utrzymywana przyrostowo przy PZ i aktualizacji cen z faktury - odczyt po kluczu
         """
         
-        cursor.execute(query, (product_id, cutoff_date))
-        transactions = cursor.fetchall()
+        warehouse_id = warehouse_id or DEFAULT_WAREHOUSE_ID
+        moving_average.ensure_schema(cursor)
+        average = moving_average.cost(product_id, warehouse_id, cursor=cursor)
         
-        if len(transactions) >= strategy.min_transactions:
-            # Oblicz średnią ważoną
-            total_value = 0.0
-            total_quantity = 0.0
-            
-            for price_net, quantity, _ in transactions:
-                total_value += float(price_net) * float(quantity)
-                total_quantity += float(quantity)
-            
-            if total_quantity > 0:
-                weighted_avg = total_value / total_quantity
-                return weighted_avg, f"Średnia ważona z {len(transactions)} transakcji ({strategy.timeframe_days} dni)"
+        if average and average > 0:
+            return average, f"Średnia ruchoma (magazyn {warehouse_id})"
         
         # Fallback na najnowszą cenę
         return self._get_latest_purchase_price(cursor, product_id, warehouse_id)
@@ -344,6 +327,56 @@ class MarginService:
         
         return results
 
+    def get_realized_margins_for_products(self,
+                                          products: List[Dict[str, Any]],
+                                          warehouse_id: Optional[int] = None,
+                                          days: int = 90) -> List[Dict[str, Any]]:
+        """
+        Jak get_margin_for_products_list, ale koszt to średni zrealizowany koszt jednostkowy
+        z pozycji sprzedaży (pos_pozycje.koszt_netto) - jedno zapytanie dla całej listy;
+        produkty bez sprzedaży w okresie - cena zakupu z kartoteki
+        """
+        location_id = None
+        if warehouse_id:
+            conn = self.get_connection()
+            try:
+                row = conn.execute("SELECT location_id FROM warehouses WHERE id = ?", (warehouse_id,)).fetchone()
+                location_id = row[0] if row else None
+            finally:
+                conn.close()
+
+        product_ids = [product.get('id') or product.get('product_id') for product in products]
+        costs = sale_costs.unit_costs(product_ids, days=days, location_id=location_id)
+
+        results = []
+        for product, product_id in zip(products, product_ids):
+            sell_price_net = float(product.get('cena_sprzedazy_netto', 0) or product.get('price_net', 0) or 0)
+            buy_price_net, method = costs.get(int(product_id), (0.0, 'none')) if product_id else (0.0, 'none')
+            enhanced_product = product.copy()
+            if sell_price_net > 0:
+                margin_calc = self.calculate_margin(sell_price_net, buy_price_net, method)
+                enhanced_product.update({
+                    'margin_percent': margin_calc.margin_percent,
+                    'margin_amount': margin_calc.margin_amount,
+                    'markup_percent': margin_calc.markup_percent,
+                    'profit_amount': margin_calc.profit_amount,
+                    'calculated_buy_price_net': round(buy_price_net, 4),
+                    'margin_calculation_method': method
+                })
+            else:
+                # Produkt bez ceny sprzedaży
+                enhanced_product.update({
+                    'margin_percent': 0.0,
+                    'margin_amount': 0.0,
+                    'markup_percent': 0.0,
+                    'profit_amount': 0.0,
+                    'calculated_buy_price_net': round(buy_price_net, 4),
+                    'margin_calculation_method': 'Brak ceny sprzedaży'
+                })
+            results.append(enhanced_product)
+
+        return results
+
     def set_target_margin(self, 
                          product_id: int,
                          target_margin_percent: float,
@@ -209,8 +209,12 @@ def calculate_margins_batch():
                 "price_net": 150.00
             }
         ],
-        "warehouse_id": 1 (opcjonalnie)
+        "warehouse_id": 1 (opcjonalnie),
+        "days": 90 (opcjonalnie - okres kosztów zrealizowanych)
     }
+    
+    Koszt: średni zrealizowany koszt jednostkowy z pozycji sprzedaży (wyliczany przy finalizacji
+    paragonu), dla produktów bez sprzedaży w okresie - cena zakupu z kartoteki
     """
     try:
         data = request.get_json()
@@ -220,10 +224,17 @@ def calculate_margins_batch():
         
         products = data.get('products', [])
         warehouse_id = data.get('warehouse_id')
-        
-        results = margin_service.get_margin_for_products_list(
+        try:
+            days = int(data.get('days', 90))
+        except (TypeError, ValueError):
+            days = 0
+        if days < 1:
+            return jsonify({"error": "Pole days musi być liczbą dni >= 1"}), 400
+        
+        results = margin_service.get_realized_margins_for_products(
             products=products,
-            warehouse_id=int(warehouse_id) if warehouse_id else None
+            warehouse_id=int(warehouse_id) if warehouse_id else None,
+            days=days
         )
         
         return jsonify({
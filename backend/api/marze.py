@@ -11,9 +11,23 @@ import sys
 # Dodaj ścieżki do modułów
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from utils.database import get_db_connection, execute_query, execute_insert, success_response, error_response
+from utils.sale_costs import sale_costs, NET_REVENUE_SQL
 
 marze_bp = Blueprint('marze', __name__)
 
+def _days_param(default=30):
+    """Parametr days analiz (liczba dni >= 1) -> (days, None) albo (None, odpowiedź 400)"""
+    value = request.args.get('days')
+    if value is None:
+        return default, None
+    try:
+        days = int(value)
+    except ValueError:
+        days = 0
+    if days < 1:
+        return None, (jsonify({'success': False, 'error': 'Parametr days musi być liczbą dni >= 1'}), 400)
+    return days, None
+
 class MarzeManager:
     def __init__(self):
         pass
@@ -68,163 +82,152 @@ class MarzeManager:
         finally:
             conn.close()
     
-    def get_margin_analysis(self):
-        """Analiza marż - podstawowe statystyki"""
+    def _sold_products(self, cursor, days, location_id=None):
+        """
+        Sprzedaż per produkt z gotowych kosztów pozycji (pos_pozycje.koszt_netto wyliczany przy
+        finalizacji paragonu) - bez wyliczania cen zakupu w chwili raportu
+        """
+        location_filter, params = '', [f'-{int(days)} days']
+        if location_id:
+            location_filter = 'AND t.location_id = ?'
+            params.append(int(location_id))
+        cursor.execute(f"""
+            SELECT
+                pp.produkt_id as product_id,
+                COALESCE(p.nazwa, MAX(pp.nazwa_produktu)) as product_name,
+                p.kategoria as category,
+                SUM(pp.ilosc) as total_sold,
+                SUM(pp.koszt_netto) as total_cost,
+                SUM({NET_REVENUE_SQL}) as total_revenue
+            FROM pos_transakcje t
+            JOIN pos_pozycje pp ON pp.transakcja_id = t.id
+            LEFT JOIN produkty p ON p.id = pp.produkt_id
+            WHERE t.status = 'zakonczony'
+            AND t.data_transakcji >= date('now', ?)
+            AND pp.koszt_netto IS NOT NULL
+            {location_filter}
+            GROUP BY pp.produkt_id
+            HAVING total_sold > 0
+        """, params)
+        products = []
+        for row in cursor.fetchall():
+            product = dict(row)
+            cost, revenue = product['total_cost'] or 0, product['total_revenue'] or 0
+            product.update({
+                'cena_zakupu': round(cost / product['total_sold'], 4),
+                'cena_sprzedazy': round(revenue / product['total_sold'], 4),
+                'total_cost': round(cost, 2),
+                'total_revenue': round(revenue, 2),
+                'total_profit': round(revenue - cost, 2),
+                'realized_margin': round((revenue - cost) / cost * 100, 2) if cost > 0 else 0
+            })
+            products.append(product)
+
+        cursor.execute(f"""
+            SELECT COUNT(*)
+            FROM pos_transakcje t
+            JOIN pos_pozycje pp ON pp.transakcja_id = t.id
+            WHERE t.status = 'zakonczony'
+            AND t.data_transakcji >= date('now', ?)
+            AND pp.koszt_netto IS NULL
+            {location_filter}
+        """, params)
+        return products, cursor.fetchone()[0]
+
+    def get_margin_analysis(self, days=30, location_id=None):
+        """Analiza marż zrealizowanych - podstawowe statystyki z kosztów pozycji sprzedaży"""
         conn = self.get_connection()
         try:
             cursor = conn.cursor()
-            
-            # Statystyki ogólne
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_products,
-                    AVG(CASE 
-                        WHEN cena_zakupu > 0 THEN 
-                            ((cena - cena_zakupu) / cena_zakupu) * 100
-                        ELSE 0 
-                    END) as avg_margin,
-                    MIN(CASE 
-                        WHEN cena_zakupu > 0 THEN 
-                            ((cena - cena_zakupu) / cena_zakupu) * 100
-                        ELSE 0 
-                    END) as min_margin,
-                    MAX(CASE 
-                        WHEN cena_zakupu > 0 THEN 
-                            ((cena - cena_zakupu) / cena_zakupu) * 100
-                        ELSE 0 
-                    END) as max_margin,
-                    SUM(cena - cena_zakupu) as total_potential_profit
-                FROM produkty 
-                WHERE cena_zakupu > 0 AND cena > 0 AND aktywny = 1
-            """)
-            
-            general_stats = dict(cursor.fetchone())
-            
-            # Produkty z najwyższymi i najniższymi marżami
-            cursor.execute("""
-                SELECT 
-                    nazwa,
-                    cena_zakupu,
-                    cena as cena_sprzedazy,
-                    ROUND(((cena - cena_zakupu) / cena_zakupu) * 100, 2) as margin
-                FROM produkty 
-                WHERE cena_zakupu > 0 AND cena > 0 AND aktywny = 1
-                ORDER BY margin DESC
-                LIMIT 10
-            """)
-            
-            highest_margins = [dict(row) for row in cursor.fetchall()]
-            
-            cursor.execute("""
-                SELECT 
-                    nazwa,
-                    cena_zakupu,
-                    cena as cena_sprzedazy,
-                    ROUND(((cena - cena_zakupu) / cena_zakupu) * 100, 2) as margin
-                FROM produkty 
-                WHERE cena_zakupu > 0 AND cena > 0 AND aktywny = 1
-                ORDER BY margin ASC
-                LIMIT 10
-            """)
-            
-            lowest_margins = [dict(row) for row in cursor.fetchall()]
-            
-            # Analiza kategorii
-            cursor.execute("""
-                SELECT 
-                    kategoria as category,
-                    COUNT(id) as product_count,
-                    AVG(CASE 
-                        WHEN cena_zakupu > 0 THEN 
-                            ((cena - cena_zakupu) / cena_zakupu) * 100
-                        ELSE 0 
-                    END) as avg_margin,
-                    SUM(cena - cena_zakupu) as total_potential_profit
-                FROM produkty
-                WHERE cena_zakupu > 0 AND cena > 0 AND aktywny = 1 AND kategoria IS NOT NULL
-                GROUP BY kategoria
-                ORDER BY avg_margin DESC
-            """)
-            
-            category_analysis = [dict(row) for row in cursor.fetchall()]
-            
-            return {
-                'general_stats': general_stats,
-                'highest_margins': highest_margins,
-                'lowest_margins': lowest_margins,
-                'category_analysis': category_analysis
-            }
-            
+            sale_costs.ensure_schema(cursor)
+            products, uncosted_lines = self._sold_products(cursor, days, location_id)
         finally:
             conn.close()
-    
-    def get_sales_margin_analysis(self, days=30):
-        """Analiza marż ze sprzedaży"""
+
+        costed = [p for p in products if p['total_cost'] > 0]
+        margins = [p['realized_margin'] for p in costed]
+
+        # Statystyki ogólne
+        general_stats = {
+            'total_products': len(costed),
+            'avg_margin': round(sum(margins) / len(margins), 2) if margins else None,
+            'min_margin': min(margins) if margins else None,
+            'max_margin': max(margins) if margins else None,
+            'total_profit': round(sum(p['total_profit'] for p in products), 2),
+            'uncosted_lines': uncosted_lines
+        }
+
+        # Produkty z najwyższymi i najniższymi marżami
+        ranking = [{
+            'nazwa': p['product_name'],
+            'cena_zakupu': p['cena_zakupu'],
+            'cena_sprzedazy': p['cena_sprzedazy'],
+            'margin': p['realized_margin']
+        } for p in sorted(costed, key=lambda p: p['realized_margin'], reverse=True)]
+
+        # Analiza kategorii
+        categories = {}
+        for p in costed:
+            if p['category'] is None:
+                continue
+            entry = categories.setdefault(p['category'], {'category': p['category'], 'product_count': 0,
+                                                          'margins': [], 'total_profit': 0.0})
+            entry['product_count'] += 1
+            entry['margins'].append(p['realized_margin'])
+            entry['total_profit'] += p['total_profit']
+        category_analysis = sorted(({
+            'category': entry['category'],
+            'product_count': entry['product_count'],
+            'avg_margin': round(sum(entry['margins']) / len(entry['margins']), 2),
+            'total_profit': round(entry['total_profit'], 2)
+        } for entry in categories.values()), key=lambda c: c['avg_margin'], reverse=True)
+
+        return {
+            'period_days': days,
+            'general_stats': general_stats,
+            'highest_margins': ranking[:10],
+            'lowest_margins': ranking[::-1][:10],
+            'category_analysis': category_analysis
+        }
+
+    def get_sales_margin_analysis(self, days=30, location_id=None):
+        """Analiza marż ze sprzedaży - sumy gotowych kosztów pozycji"""
         conn = self.get_connection()
         try:
             cursor = conn.cursor()
-            
-            # Analiza sprzedaży z marżami
-            cursor.execute("""
-                SELECT 
-                    p.nazwa as product_name,
-                    p.cena_zakupu,
-                    p.cena_sprzedazy,
-                    SUM(ti.quantity) as total_sold,
-                    SUM(ti.quantity * p.cena_zakupu) as total_cost,
-                    SUM(ti.quantity * p.cena_sprzedazy) as total_revenue,
-                    SUM(ti.quantity * (p.cena_sprzedazy - p.cena_zakupu)) as total_profit,
-                    CASE 
-                        WHEN SUM(ti.quantity * p.cena_zakupu) > 0 THEN
-                            ROUND((SUM(ti.quantity * (p.cena_sprzedazy - p.cena_zakupu)) / 
-                                  SUM(ti.quantity * p.cena_zakupu)) * 100, 2)
-                        ELSE 0
-                    END as realized_margin
-                FROM transaction_items ti
-                JOIN transactions t ON ti.transaction_id = t.id
-                JOIN produkty p ON ti.product_id = p.id
-                WHERE t.status = 'completed' 
-                AND t.created_at >= date('now', '-{} days')
-                AND p.cena_zakupu > 0
-                GROUP BY p.id, p.nazwa, p.cena_zakupu, p.cena_sprzedazy
-                HAVING total_sold > 0
-                ORDER BY total_profit DESC
-            """.format(days))
-            
-            sales_analysis = [dict(row) for row in cursor.fetchall()]
-            
-            # Podsumowanie całkowite
-            cursor.execute("""
-                SELECT 
-                    SUM(ti.quantity * p.cena_zakupu) as total_cost,
-                    SUM(ti.quantity * p.cena_sprzedazy) as total_revenue,
-                    SUM(ti.quantity * (p.cena_sprzedazy - p.cena_zakupu)) as total_profit,
-                    COUNT(DISTINCT p.id) as products_sold,
-                    SUM(ti.quantity) as total_items_sold
-                FROM transaction_items ti
-                JOIN transactions t ON ti.transaction_id = t.id
-                JOIN produkty p ON ti.product_id = p.id
-                WHERE t.status = 'completed' 
-                AND t.created_at >= date('now', '-{} days')
-                AND p.cena_zakupu > 0
-            """.format(days))
-            
-            summary = dict(cursor.fetchone())
-            
-            if summary['total_cost'] and summary['total_cost'] > 0:
-                summary['overall_margin'] = round((summary['total_profit'] / summary['total_cost']) * 100, 2)
-            else:
-                summary['overall_margin'] = 0
-            
-            return {
-                'period_days': days,
-                'summary': summary,
-                'products': sales_analysis
-            }
-            
+            sale_costs.ensure_schema(cursor)
+            products, uncosted_lines = self._sold_products(cursor, days, location_id)
         finally:
             conn.close()
-    
+
+        sales_analysis = sorted(
+            ({key: p[key] for key in ('product_id', 'product_name', 'cena_zakupu', 'cena_sprzedazy', 'total_sold',
+                                      'total_cost', 'total_revenue', 'total_profit', 'realized_margin')}
+             for p in products),
+            key=lambda p: p['total_profit'], reverse=True
+        )
+
+        # Podsumowanie całkowite
+        summary = {
+            'total_cost': round(sum(p['total_cost'] for p in products), 2),
+            'total_revenue': round(sum(p['total_revenue'] for p in products), 2),
+            'total_profit': round(sum(p['total_profit'] for p in products), 2),
+            'products_sold': len(products),
+            'total_items_sold': sum(p['total_sold'] for p in products),
+            'uncosted_lines': uncosted_lines
+        }
+
+        if summary['total_cost'] > 0:
+            summary['overall_margin'] = round((summary['total_profit'] / summary['total_cost']) * 100, 2)
+        else:
+            summary['overall_margin'] = 0
+
+        return {
+            'period_days': days,
+            'summary': summary,
+            'products': sales_analysis
+        }
+
     def update_product_margins(self, updates):
         """Masowa aktualizacja marż produktów"""
         conn = self.get_connection()
@@ -353,7 +356,11 @@ def get_product_margins():
 def get_margin_analysis():
     """Analiza marż"""
     try:
-        analysis = marze_manager.get_margin_analysis()
+        days, invalid = _days_param()
+        if invalid:
+            return invalid
+        location_id = request.args.get('location_id', type=int)
+        analysis = marze_manager.get_margin_analysis(days, location_id)
         
         return jsonify({
             'success': True,
@@ -370,8 +377,11 @@ def get_margin_analysis():
 def get_sales_margin_analysis():
     """Analiza marż ze sprzedaży"""
     try:
-        days = request.args.get('days', 30, type=int)
-        analysis = marze_manager.get_sales_margin_analysis(days)
+        days, invalid = _days_param()
+        if invalid:
+            return invalid
+        location_id = request.args.get('location_id', type=int)
+        analysis = marze_manager.get_sales_margin_analysis(days, location_id)
         
         return jsonify({
             'success': True,
@@ -3,10 +3,14 @@ API dla zarządzania zamówieniami od klientów
 """
 from flask import Blueprint, request, jsonify, session
 import sqlite3
+import logging
 from datetime import datetime
 import uuid
 from utils.database import execute_query, execute_insert
 from utils.response_helpers import success_response, error_response, not_found_response
+from utils.customer_search import customer_search_index
+
+logger = logging.getLogger(__name__)
 
 orders_bp = Blueprint('orders', __name__)
 
@@ -74,15 +78,20 @@ def get_orders():
             params.append(location_id)
             
         if search:
-            conditions.append("""
+            # Klienci z indeksu wyszukiwania zamiast LIKE po kolumnach pos_klienci
+            customer_search_index.refresh()
+            match_sql, match_params, match_type = customer_search_index.match_clause(search)
+            if match_type == 'prefix':
+                substring = customer_search_index.substring_clause(search)
+                if substring:
+                    match_sql = f"{match_sql} UNION {substring[0]}"
+                    match_params = match_params + substring[1]
+            conditions.append(f"""
                 (z.numer_zamowienia LIKE ? OR 
-                 k.imie LIKE ? OR 
-                 k.nazwisko LIKE ? OR 
-                 k.nazwa_firmy LIKE ? OR
-                 k.email LIKE ?)
+                 z.klient_id IN (SELECT id FROM pos_klienci WHERE rowid IN ({match_sql})))
             """)
-            search_param = f"%{search}%"
-            params.extend([search_param] * 5)
+            params.append(f"%{search}%")
+            params.extend(match_params)
         
         # Składanie zapytania
         if conditions:
@@ -129,7 +138,7 @@ def get_orders():
     except ValueError:
         return error_response("Nieprawidłowe parametry page lub limit", 400)
     except Exception as e:
-        print(f"Błąd pobierania zamówień: {e}")
+        logger.error("Błąd pobierania zamówień: %s", e)
         return error_response("Wystąpił błąd podczas pobierania zamówień", 500)
 
 @orders_bp.route('/orders/<int:order_id>', methods=['GET'])
@@ -190,7 +199,7 @@ def get_order(order_id):
         return success_response(order, "Szczegóły zamówienia")
         
     except Exception as e:
-        print(f"Błąd pobierania zamówienia {order_id}: {e}")
+        logger.error("Błąd pobierania zamówienia %s: %s", order_id, e)
         return error_response("Wystąpił błąd podczas pobierania zamówienia", 500)
 
 @orders_bp.route('/orders', methods=['POST'])
@@ -340,7 +349,7 @@ def create_order():
             'wartosc_netto': round(wartosc_netto, 2)
         }, "Zamówienie zostało utworzone pomyślnie")
     except Exception as e:
-        print(f"Błąd tworzenia zamówienia: {e}")
+        logger.error("Błąd tworzenia zamówienia: %s", e)
         return error_response("Wystąpił błąd podczas tworzenia zamówienia", 500)
 
 @orders_bp.route('/orders/<int:order_id>', methods=['PUT'])
@@ -403,7 +412,7 @@ def update_order(order_id):
         else:
             return error_response("Nie udało się zaktualizować zamówienia", 500)
     except Exception as e:
-        print(f"Błąd aktualizacji zamówienia {order_id}: {e}")
+        logger.error("Błąd aktualizacji zamówienia %s: %s", order_id, e)
         return error_response("Wystąpił błąd podczas aktualizacji zamówienia", 500)
 
 @orders_bp.route('/orders/<int:order_id>', methods=['DELETE'])
@@ -438,7 +447,7 @@ def delete_order(order_id):
             return error_response("Nie udało się usunąć zamówienia", 500)
         
     except Exception as e:
-        print(f"Błąd usuwania zamówienia {order_id}: {e}")
+        logger.error("Błąd usuwania zamówienia %s: %s", order_id, e)
         return error_response("Wystąpił błąd podczas usuwania zamówienia", 500)
 
 @orders_bp.route('/orders/<int:order_id>/receipt', methods=['GET'])
@@ -527,7 +536,7 @@ def generate_order_receipt(order_id):
         return success_response(receipt_data, "Paragon wygenerowany")
         
     except Exception as e:
-        print(f"Błąd generowania paragonu dla zamówienia {order_id}: {e}")
+        logger.error("Błąd generowania paragonu dla zamówienia %s: %s", order_id, e)
         return error_response("Wystąpił błąd podczas generowania paragonu", 500)
 
 @orders_bp.route('/orders/stats', methods=['GET'])
@@ -565,7 +574,7 @@ def get_orders_stats():
         return success_response(stats, "Statystyki zamówień")
         
     except Exception as e:
-        print(f"Błąd pobierania statystyk zamówień: {e}")
+        logger.error("Błąd pobierania statystyk zamówień: %s", e)
         return error_response("Wystąpił błąd podczas pobierania statystyk", 500)
 
 
@@ -576,22 +585,22 @@ def convert_order_to_pos(order_id):
     POST /api/orders/123/convert-to-pos
     Body: { "warehouse_id": 5, "kasjer_login": "kasjer1" }
     """
-    print(f"🔄 DEBUG: Wywołano convert_order_to_pos dla order_id={order_id}")
+    logger.debug("Wywołano convert_order_to_pos dla order_id=%s", order_id)
     
     try:
         # Parsuj JSON request
         try:
             data = request.get_json() or {}
-            print(f"🔄 DEBUG: Request Content-Type: {request.content_type}")
-            print(f"🔄 DEBUG: Request data: {request.data}")
-            print(f"🔄 DEBUG: Request method: {request.method}")
-            print(f"🔄 DEBUG: Otrzymane dane JSON: {data}")
+            logger.debug("Request Content-Type: %s", request.content_type)
+            logger.debug("Request data: %s", request.data)
+            logger.debug("Request method: %s", request.method)
+            logger.debug("Otrzymane dane JSON: %s", data)
         except Exception as e:
-            print(f"🔄 DEBUG: Błąd parsowania JSON: {e}")
+            logger.warning("Błąd parsowania JSON: %s", e)
             data = {}
         
         # 1. Pobierz zamówienie z danymi klienta
-        print(f"🔄 DEBUG: Pobieranie zamówienia {order_id}")
+        logger.debug("Pobieranie zamówienia %s", order_id)
         
         order_query = """
             SELECT 
@@ -601,9 +610,9 @@ def convert_order_to_pos(order_id):
             LEFT JOIN pos_klienci k ON z.klient_id = k.id
             WHERE z.id = ?
         """
-        print(f"🔄 DEBUG: Wykonuję zapytanie order_query")
+        logger.debug("Wykonuję zapytanie order_query")
         order_result = execute_query(order_query, (order_id,))
-        print(f"🔄 DEBUG: Wynik order_result: {order_result}")
+        logger.debug("Wynik order_result: %s", order_result)
         
         if not order_result:
             return not_found_response("Zamówienie nie zostało znalezione")
@@ -632,7 +641,7 @@ def convert_order_to_pos(order_id):
             if not warehouse_result:
                 return error_response(f"Brak aktywnego magazynu dla lokalizacji {order['location_id']}", 400)
             warehouse_id = warehouse_result[0]['id']
-            print(f"🔄 DEBUG: Auto-wybrano magazyn {warehouse_id} dla lokalizacji {order['location_id']}")
+            logger.debug("Auto-wybrano magazyn %s dla lokalizacji %s", warehouse_id, order['location_id'])
         
         # 3. Pobierz pozycje zamówienia z danymi produktów
         items_query = """
@@ -766,6 +775,6 @@ def convert_order_to_pos(order_id):
         }, "Zamówienie zostało przekształcone w transakcję POS")
         
     except Exception as e:
-        print(f"Błąd konwersji zamówienia na POS: {e}")
+        logger.error("Błąd konwersji zamówienia na POS: %s", e)
         return error_response("Wystąpił błąd podczas konwersji zamówienia", 500)
 
@@ -4,10 +4,18 @@ Transakcje, koszyk, płatności, statystyki sprzedaży, rabaty
 """
 
 from flask import Blueprint, request, jsonify, session
-from utils.database import execute_query, execute_insert, success_response, error_response, not_found_response
+from utils.database import (execute_query, execute_insert, success_response, error_response, not_found_response,
+                            get_db_connection, retry_on_locked)
+from utils.discount_limits import discount_limits
+from utils.stock_ledger import stock_ledger, movement as ledger_movement, DEFAULT_LOCATION_ID
+from utils.stock_shortages import stock_shortages
+from utils.sale_costs import sale_costs
 from datetime import datetime
+import logging
 import uuid
 
+logger = logging.getLogger(__name__)
+
 # Importuj system prefixów dokumentów
 try:
     from api.document_prefixes import prefix_manager
@@ -24,12 +32,12 @@ def get_pos_stats():
     """
     try:
         location_id = request.args.get('location_id')
-        print(f"🔍 DEBUG: Starting POS stats for location_id: {location_id}")
+        logger.debug("Starting POS stats for location_id: %s", location_id)
         
         # Użyj lokalnej daty zamiast UTC
         from datetime import datetime
         today = datetime.now().strftime('%Y-%m-%d')
-        print(f"🔍 DEBUG: Using local today date: {today}")
+        logger.debug("Using local today date: %s", today)
         
         # Buduj warunki WHERE
         base_conditions = "WHERE status = 'zakonczony'"
@@ -56,12 +64,12 @@ def get_pos_stats():
         {base_conditions}
         """
         
-        print("🔍 DEBUG: Executing query...")
+        logger.debug("Executing query...")
         results = execute_query(stats_query)
-        print(f"🔍 DEBUG: Query results: {results}")
+        logger.debug("Query results: %s", results)
         
         if results is None:
-            print("❌ DEBUG: results is None")
+            logger.debug("results is None")
             return error_response("Błąd połączenia z bazą danych", 500)
             
         stats = results[0] if results else {
@@ -79,7 +87,7 @@ def get_pos_stats():
             'month_average_transaction': 0
         }
         
-        print(f"✅ DEBUG: Final stats: {stats}")
+        logger.debug("Final stats: %s", stats)
         return success_response(stats, "Statystyki POS pobrane pomyślnie")
         
     except Exception as e:
@@ -475,12 +483,12 @@ def complete_transaction(transaction_id):
         items_query = """
         SELECT 
             ti.id,
-            ti.product_id as product_id,
+            ti.produkt_id as product_id,
             ti.ilosc as quantity,
             ti.cena_jednostkowa as unit_price,
             p.nazwa as product_name
         FROM pos_pozycje ti
-        LEFT JOIN produkty p ON ti.product_id = p.id
+        LEFT JOIN produkty p ON ti.produkt_id = p.id
         WHERE ti.transakcja_id = ?
         """
         
@@ -489,31 +497,25 @@ def complete_transaction(transaction_id):
         if not items:
             return error_response("Nie znaleziono pozycji dla tej transakcji", 400)
         
-        # Sprawdź stany magazynowe przed sprzedażą
+        location_id = transaction.get('location_id') or DEFAULT_LOCATION_ID
+        
+        # Sprawdź stany magazynowe przed sprzedażą - jeden odczyt stock_on_hand dla wszystkich pozycji
+        required = {}
+        for item in items:
+            required[item['product_id']] = required.get(item['product_id'], 0) + item['quantity']
+        stocks = stock_ledger.on_hand_many(required.keys(), location_id)
+        
         stock_check_errors = []
         for item in items:
             product_id = item['product_id']
-            required_quantity = item['quantity']
-            
-            # Sprawdź aktualny stan z pos_magazyn
-            stock_query = "SELECT stan_aktualny as stock FROM pos_magazyn WHERE produkt_id = ?"
-            
-            current_stock = 0
-            try:
-                stock_result = execute_query(stock_query, [product_id])
-                if stock_result and stock_result[0]['stock'] is not None:
-                    current_stock = stock_result[0]['stock']
-            except:
-                # Jeśli nie ma wpisu w stanach, przyjmij że jest 0
-                current_stock = 0
-            
-            if current_stock < required_quantity:
+            current_stock = stocks.get(product_id, 0)
+            if current_stock < required[product_id]:
                 stock_check_errors.append({
                     'product_id': product_id,
                     'product_name': item['product_name'],
-                    'required': required_quantity,
+                    'required': required[product_id],
                     'available': current_stock,
-                    'shortfall': required_quantity - current_stock
+                    'shortfall': required[product_id] - current_stock
                 })
         
         # Jeśli są błędy stanów, zwróć błąd
@@ -523,54 +525,19 @@ def complete_transaction(transaction_id):
                 'stock_errors': stock_check_errors
             }, 400)
         
-        # Aktualizuj stany magazynowe
-        stock_updates = []
-        for item in items:
-            product_id = item['product_id']
-            sold_quantity = item['quantity']
-            
-            # Zaktualizuj stan w tabeli pos_magazyn
-            update_query = """
-            UPDATE pos_magazyn 
-            SET stan_aktualny = COALESCE(stan_aktualny, 0) - ?,
-                ostatnia_aktualizacja = datetime('now')
-            WHERE produkt_id = ?
-            """
-            
-            try:
-                result = execute_insert(update_query, [sold_quantity, product_id])
-                if result:
-                    stock_updates.append({
-                        'product_id': product_id,
-                        'product_name': item['product_name'],
-                        'quantity_sold': sold_quantity
-                    })
-            except Exception as e:
-                print(f"Błąd aktualizacji stanu dla produktu {product_id}: {e}")
-                
-            # Zapisz ruch magazynowy (jeśli tabela istnieje)
-            try:
-                # Pobierz stan przed zmianą
-                current_stock_before = execute_query("SELECT stan_aktualny FROM pos_magazyn WHERE produkt_id = ?", [product_id])
-                stan_przed = current_stock_before[0]['stan_aktualny'] if current_stock_before else 0
-                stan_po = stan_przed - sold_quantity
-                
-                movement_sql = """
-                INSERT INTO pos_ruchy_magazynowe 
-                (product_id, typ_ruchu, ilosc, stan_przed, stan_po, data_ruchu, czas_ruchu, user_login, uwagi)
-                VALUES (?, 'wydanie', ?, ?, ?, date('now'), time('now'), ?, ?)
-                """
-                execute_insert(movement_sql, [
-                    product_id, 
-                    sold_quantity,
-                    stan_przed,
-                    stan_po,
-                    data.get('user', 'system'),
-                    f"Sprzedaż - transakcja #{transaction_id}"
-                ])
-            except Exception as e:
-                print(f"Błąd zapisu ruchu magazynowego: {e}")
-                pass
+        # Aktualizuj stany magazynowe - wszystkie pozycje jednym zapisem do księgi ruchów
+        user = data.get('user', 'system')
+        stock_ledger.post([
+            ledger_movement(item['product_id'], location_id, -item['quantity'], 'sale',
+                            'pos_transakcja', transaction_id, f"TRANS-{transaction_id}",
+                            f"Sprzedaż - transakcja #{transaction_id}", user)
+            for item in items
+        ])
+        stock_updates = [{
+            'product_id': item['product_id'],
+            'product_name': item['product_name'],
+            'quantity_sold': item['quantity']
+        } for item in items]
         
         # Aktualizuj status transakcji na 'zakonczony'
         payment_method = data.get('payment_method', 'gotowka')
@@ -619,7 +586,7 @@ def complete_transaction(transaction_id):
             # Użyj kwoty otrzymanej jako kwotę końcową (po rabacie)
             final_amount = amount_paid
             
-            print(f"DEBUG kasa_operacje: payment_method={payment_method}, typ_platnosci={typ_platnosci}, final_amount={final_amount}")
+            logger.debug("kasa_operacje: payment_method=%s, typ_platnosci=%s, final_amount=%s", payment_method, typ_platnosci, final_amount)
             
             execute_insert(kasa_operacja_sql, (
                 'KP',  # Kasa Przyjmie
@@ -656,7 +623,8 @@ def complete_transaction(transaction_id):
 def update_inventory_after_sale():
     """
     Endpoint specjalnie do odejmowania stanów po sprzedaży
-    Body: {"items": [{"product_id": 1, "quantity": 2}]}
+    Body: {"items": [{"product_id": 1, "quantity": 2}], "location_id": 5}
+    Stany czytane są jednym zapytaniem do stock_on_hand, a zmiany zapisywane jedną partią ruchów
     """
     try:
         data = request.get_json()
@@ -667,100 +635,65 @@ def update_inventory_after_sale():
         if not isinstance(items, list):
             return error_response("Items musi być listą", 400)
         
+        location_id = data.get('location_id') or DEFAULT_LOCATION_ID
+        
         updates = []
         errors = []
-        
+        valid = []
         for item in items:
-            try:
-                product_id = item.get('product_id')
-                quantity = item.get('quantity', 0)
-                
-                if not product_id or quantity <= 0:
-                    errors.append({
-                        'error': 'Nieprawidłowe dane produktu',
-                        'item': item
-                    })
-                    continue
-                
-                # Sprawdź aktualny stan
-                stock_queries = [
-                    "SELECT stan_magazynowy as stock, nazwa as name FROM produkty WHERE id = ?",
-                    "SELECT stan_magazynowy as stock, nazwa as name FROM produkty WHERE id = ?"
-                ]
-                
-                product_info = None
-                for query in stock_queries:
-                    try:
-                        result = execute_query(query, [product_id])
-                        if result:
-                            product_info = result[0]
-                            break
-                    except:
-                        continue
-                
-                if not product_info:
-                    errors.append({
-                        'error': f'Produkt {product_id} nie został znaleziony',
-                        'item': item
-                    })
-                    continue
-                
-                current_stock = product_info['stock'] or 0
-                
-                if current_stock < quantity:
-                    errors.append({
-                        'error': f'Niewystarczający stan dla produktu {product_info["name"]}',
-                        'item': item,
-                        'available': current_stock,
-                        'required': quantity
-                    })
-                    continue
-                
-                # Odejmij stan
-                update_queries = [
-                    """
-                    UPDATE produkty 
-                    SET stan_magazynowy = stan_magazynowy - ?,
-                        data_modyfikacji = datetime('now')
-                    WHERE id = ?
-                    """,
-                    """
-                    UPDATE produkty 
-                    SET stan_magazynowy = stan_magazynowy - ?,
-                        data_modyfikacji = datetime('now')
-                    WHERE id = ?
-                    """
-                ]
-                
-                updated = False
-                for update_query in update_queries:
-                    try:
-                        result = execute_insert(update_query, [quantity, product_id])
-                        if result:
-                            updated = True
-                            break
-                    except:
-                        continue
-                
-                if updated:
-                    updates.append({
-                        'product_id': product_id,
-                        'product_name': product_info['name'],
-                        'old_stock': current_stock,
-                        'new_stock': current_stock - quantity,
-                        'quantity_sold': quantity
-                    })
-                else:
-                    errors.append({
-                        'error': f'Błąd aktualizacji stanu dla produktu {product_id}',
-                        'item': item
-                    })
-                    
-            except Exception as e:
+            product_id = item.get('product_id')
+            quantity = item.get('quantity', 0)
+            if not product_id or quantity <= 0:
+                errors.append({
+                    'error': 'Nieprawidłowe dane produktu',
+                    'item': item
+                })
+                continue
+            valid.append(item)
+        
+        names = {}
+        if valid:
+            product_ids = list({int(item['product_id']) for item in valid})
+            placeholders = ','.join('?' * len(product_ids))
+            names = {row['id']: row['nazwa'] for row in execute_query(
+                f"SELECT id, nazwa FROM produkty WHERE id IN ({placeholders})", product_ids
+            ) or []}
+        stocks = stock_ledger.on_hand_many(names.keys(), location_id) if names else {}
+        
+        movements = []
+        for item in valid:
+            product_id = int(item['product_id'])
+            quantity = item['quantity']
+            if product_id not in names:
                 errors.append({
-                    'error': str(e),
+                    'error': f'Produkt {product_id} nie został znaleziony',
                     'item': item
                 })
+                continue
+            
+            current_stock = stocks[product_id]
+            if current_stock < quantity:
+                errors.append({
+                    'error': f'Niewystarczający stan dla produktu {names[product_id]}',
+                    'item': item,
+                    'available': current_stock,
+                    'required': quantity
+                })
+                continue
+            
+            stocks[product_id] = current_stock - quantity
+            movements.append(ledger_movement(product_id, location_id, -quantity, 'sale',
+                                             note='Odjęcie stanu po sprzedaży'))
+            updates.append({
+                'product_id': product_id,
+                'product_name': names[product_id],
+                'old_stock': current_stock,
+                'new_stock': current_stock - quantity,
+                'quantity_sold': quantity
+            })
+        
+        if movements:
+            stock_ledger.post(movements)
         
         response_data = {
             'successful_updates': len(updates),
@@ -842,106 +775,71 @@ def add_item_to_cart(transakcja_id):
         product_id = data['product_id']
         ilosc = float(data.get('ilosc', 1))
         
-        # Sprawdź czy transakcja istnieje i jest w trakcie
-        transakcja = execute_query("SELECT status FROM pos_transakcje WHERE id = ?", (transakcja_id,))
-        if not transakcja:
-            return error_response("Transakcja nie została znaleziona", 404)
-            
-        if transakcja[0]['status'] != 'w_trakcie':
-            return error_response("Można dodawać produkty tylko do transakcji w trakcie", 400)
-        
-        # Pobierz informacje o produkcie
-        product = execute_query("""
-            SELECT *, cena_sprzedazy_brutto as aktualna_cena
-            FROM produkty
-            WHERE id = ?
-        """, (product_id,))
-        
-        if not product:
-            return error_response("Produkt nie został znaleziony", 404)
-            
-        product = product[0]
-        
-        # Sprawdź czy pozycja już istnieje w koszyku
-        existing_item = execute_query("""
-            SELECT id, ilosc FROM pos_pozycje 
-            WHERE transakcja_id = ? AND produkt_id = ?
-        """, (transakcja_id, product_id))
-        
-        cena_jednostkowa_brutto = float(product['aktualna_cena'])
-        stawka_vat = float(product.get('stawka_vat', 23))
-        cena_jednostkowa_netto = cena_jednostkowa_brutto / (1 + stawka_vat / 100)
-        
-        if existing_item:
-            # Aktualizuj istniejącą pozycję
-            nowa_ilosc = existing_item[0]['ilosc'] + ilosc
-            wartosc_brutto = nowa_ilosc * cena_jednostkowa_brutto
-            wartosc_netto = nowa_ilosc * cena_jednostkowa_netto
-            wartosc_vat = wartosc_brutto - wartosc_netto
-            
-            query = """
-            UPDATE pos_pozycje 
-            SET ilosc = ?, wartosc_netto = ?, kwota_vat = ?, wartosc_brutto = ?
-            WHERE id = ?
-            """
+        def dodaj_pozycje(cursor):
+            # Sprawdź czy transakcja istnieje i jest w trakcie
+            transakcja = cursor.execute("SELECT status FROM pos_transakcje WHERE id = ?", (transakcja_id,)).fetchone()
+            if not transakcja:
+                raise CartError("Transakcja nie została znaleziona", 404)
+            if transakcja['status'] != 'w_trakcie':
+                raise CartError("Można dodawać produkty tylko do transakcji w trakcie", 400)
+            
+            # Pobierz informacje o produkcie
+            product = cursor.execute("""
+                SELECT *, cena_sprzedazy_brutto as aktualna_cena
+                FROM produkty
+                WHERE id = ?
+            """, (product_id,)).fetchone()
+            if not product:
+                raise CartError("Produkt nie został znaleziony", 404)
+            product = dict(product)
+            
+            # Sprawdź czy pozycja już istnieje w koszyku
+            existing_item = cursor.execute("""
+                SELECT id, ilosc FROM pos_pozycje 
+                WHERE transakcja_id = ? AND produkt_id = ?
+            """, (transakcja_id, product_id)).fetchone()
+            
+            # Cena z karty produktu jest tylko wstępna - pozycję przelicza plan cen w tej samej transakcji
+            cena_jednostkowa_brutto = float(product['aktualna_cena'])
+            stawka_vat = float(product.get('stawka_vat', 23))
+            cena_jednostkowa_netto = cena_jednostkowa_brutto / (1 + stawka_vat / 100)
+            
+            if existing_item:
+                # Aktualizuj istniejącą pozycję
+                nowa_ilosc = existing_item['ilosc'] + ilosc
+                wartosc_brutto = nowa_ilosc * cena_jednostkowa_brutto
+                wartosc_netto = nowa_ilosc * cena_jednostkowa_netto
+                cursor.execute("""
+                    UPDATE pos_pozycje 
+                    SET ilosc = ?, wartosc_netto = ?, kwota_vat = ?, wartosc_brutto = ?
+                    WHERE id = ?
+                """, (nowa_ilosc, wartosc_netto, wartosc_brutto - wartosc_netto, wartosc_brutto, existing_item['id']))
+                return existing_item['id']
             
-            result = execute_query(query, (nowa_ilosc, wartosc_netto, wartosc_vat, wartosc_brutto, existing_item[0]['id']))
-            pozycja_id = existing_item[0]['id']
-        else:
-            # Dodaj nową pozycję - tylko do pos_pozycje
+            # Dodaj nową pozycję - tylko do pos_pozycje, lp jako kolejny numer w transakcji
             wartosc_brutto = ilosc * cena_jednostkowa_brutto
             wartosc_netto = ilosc * cena_jednostkowa_netto
-            wartosc_vat = wartosc_brutto - wartosc_netto
-            
-            # Pobierz numer pozycji (lp)
-            lp_query = execute_query("""
-                SELECT COALESCE(MAX(lp), 0) + 1 as lp 
-                FROM pos_pozycje WHERE transakcja_id = ?
-            """, (transakcja_id,))
-            lp = lp_query[0]['lp'] if lp_query else 1
-            
-            query = """
-            INSERT INTO pos_pozycje (
-                transakcja_id, produkt_id, nazwa_produktu, kod_produktu,
-                cena_jednostkowa, ilosc, jednostka, rabat_procent, rabat_kwota,
-                cena_po_rabacie, wartosc_netto, stawka_vat, kwota_vat, 
-                wartosc_brutto, lp
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
-            
-            pozycja_id = execute_insert(query, (
+            cursor.execute("""
+                INSERT INTO pos_pozycje (
+                    transakcja_id, produkt_id, nazwa_produktu, kod_produktu,
+                    cena_jednostkowa, ilosc, jednostka, rabat_procent, rabat_kwota,
+                    cena_po_rabacie, wartosc_netto, stawka_vat, kwota_vat, 
+                    wartosc_brutto, lp
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                          (SELECT COALESCE(MAX(lp), 0) + 1 FROM pos_pozycje WHERE transakcja_id = ?))
+            """, (
                 transakcja_id, product_id, product['nazwa'], product.get('kod_produktu', ''),
                 cena_jednostkowa_brutto, ilosc, product.get('jednostka', 'szt'), 0, 0,
-                cena_jednostkowa_brutto, wartosc_netto, stawka_vat, wartosc_vat,
-                wartosc_brutto, lp
+                cena_jednostkowa_brutto, wartosc_netto, stawka_vat, wartosc_brutto - wartosc_netto,
+                wartosc_brutto, transakcja_id
             ))
+            return cursor.lastrowid
         
-        # **NAPRAWKA**: Aktualizuj sumy w transakcji po dodaniu/aktualizacji pozycji
-        update_sums_query = execute_query("""
-            SELECT 
-                COALESCE(SUM(wartosc_brutto), 0) as suma_brutto_pozycje,
-                COALESCE(SUM(wartosc_netto), 0) as suma_netto_pozycje,
-                COALESCE(SUM(kwota_vat), 0) as suma_vat_pozycje
-            FROM pos_pozycje 
-            WHERE transakcja_id = ?
-        """, (transakcja_id,))
+        try:
+            pozycja_id = przelicz_i_zapisz_koszyk(transakcja_id, zmiana=dodaj_pozycje)
+        except CartError as e:
+            return error_response(str(e), e.status)
         
-        if update_sums_query:
-            sums = update_sums_query[0]
-            update_transaction_query = """
-            UPDATE pos_transakcje 
-            SET suma_brutto = ?,
-                suma_netto = ?,
-                suma_vat = ?
-            WHERE id = ?
-            """
-            execute_insert(update_transaction_query, (
-                sums['suma_brutto_pozycje'],
-                sums['suma_netto_pozycje'], 
-                sums['suma_vat_pozycje'],
-                transakcja_id
-            ))
-            
         if pozycja_id:
             return success_response("Produkt dodany do koszyka", {"pozycja_id": pozycja_id})
         else:
@@ -1018,6 +916,181 @@ def get_cart(transakcja_id):
         print(f"Błąd get_cart: {e}")
         return error_response(f"Błąd serwera: {e}", 500)
 
+class CartError(Exception):
+    """Odrzucona zmiana koszyka - komunikat i kod odpowiedzi HTTP"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def _pozycje_do_przeliczenia(conn, transakcja_id, ceny_z_koszyka=False):
+    """
+    Pozycje koszyka jako linie silnika cen. Produkty spoza planu (np. nieaktywne)
+    i ceny z koszyka (ceny_z_koszyka) zachowują zapisaną cenę jednostkową.
+    """
+    from utils.pricing_engine import pricing_engine
+    
+    produkty = pricing_engine.plan(conn).products
+    pozycje = [dict(row) for row in conn.execute("""
+        SELECT id, produkt_id, ilosc, cena_jednostkowa, stawka_vat FROM pos_pozycje
+        WHERE transakcja_id = ? ORDER BY lp, id
+    """, (transakcja_id,))]
+    lines = [{
+        'product_id': p['produkt_id'],
+        'quantity': p['ilosc'],
+        'unit_price': p['cena_jednostkowa'] if ceny_z_koszyka or p['produkt_id'] not in produkty else None
+    } for p in pozycje]
+    return pozycje, lines
+
+def _rabaty_transakcji(conn, transakcja_id):
+    return [row[0] for row in conn.execute("""
+        SELECT DISTINCT rabat_id FROM rabaty_uzycie WHERE transakcja_id = ?
+    """, (transakcja_id,))]
+
+def _przelicz(conn, transakcja_id, rabat_ids=(), user_id=''):
+    from api.rabaty import przelicz_koszyk
+    
+    transakcja = conn.execute("""
+        SELECT id, location_id FROM pos_transakcje WHERE id = ? AND status = 'w_trakcie'
+    """, (transakcja_id,)).fetchone()
+    if not transakcja:
+        return None
+    
+    pozycje, lines = _pozycje_do_przeliczenia(conn, transakcja_id)
+    zastosowane = _rabaty_transakcji(conn, transakcja_id)
+    wynik = przelicz_koszyk(lines, transakcja['location_id'], {
+        'rabat_ids': zastosowane + [r for r in rabat_ids if r not in zastosowane],
+        'user_id': user_id
+    }, zastosowane=zastosowane)
+    return pozycje, wynik
+
+def przelicz_transakcje(transakcja_id, rabat_ids=(), user_id='', conn=None):
+    """
+    Przelicz koszyk w trakcie skompilowanym planem cen i promocji (api.rabaty.przelicz_koszyk)
+    z rabatami zastosowanymi do transakcji (rabaty_uzycie) oraz rabat_ids - bez zapisu.
+    Zwraca (pozycje, wynik) albo None, gdy nie ma takiego koszyka w trakcie.
+    """
+    if conn is not None:
+        return _przelicz(conn, transakcja_id, rabat_ids, user_id)
+    conn = get_db_connection()
+    try:
+        return _przelicz(conn, transakcja_id, rabat_ids, user_id)
+    finally:
+        conn.close()
+
+def _zapisz_przeliczenie(cursor, transakcja_id, pozycje, wynik):
+    updates = []
+    for pozycja, line in zip(pozycje, wynik['lines']):
+        stawka_vat = float(pozycja['stawka_vat'] or 23)
+        ilosc = float(line['quantity'] or 0)
+        wartosc_brutto = line['total']
+        wartosc_netto = round(wartosc_brutto / (1 + stawka_vat / 100), 2)
+        updates.append((
+            line['unit_price'],
+            round(line['discount'] / line['gross'] * 100, 2) if line['gross'] else 0,
+            line['discount'],
+            round(wartosc_brutto / ilosc, 2) if ilosc else line['unit_price'],
+            wartosc_netto,
+            round(wartosc_brutto - wartosc_netto, 2),
+            wartosc_brutto,
+            pozycja['id']
+        ))
+    
+    basket = wynik['basket_rabat']
+    cursor.executemany("""
+        UPDATE pos_pozycje
+        SET cena_jednostkowa = ?, rabat_procent = ?, rabat_kwota = ?, cena_po_rabacie = ?,
+            wartosc_netto = ?, kwota_vat = ?, wartosc_brutto = ?
+        WHERE id = ?
+    """, updates)
+    cursor.execute("""
+        UPDATE pos_transakcje
+        SET suma_brutto = (SELECT ROUND(COALESCE(SUM(wartosc_brutto), 0), 2) FROM pos_pozycje WHERE transakcja_id = :id),
+            suma_netto = (SELECT ROUND(COALESCE(SUM(wartosc_netto), 0), 2) FROM pos_pozycje WHERE transakcja_id = :id),
+            suma_vat = (SELECT ROUND(COALESCE(SUM(kwota_vat), 0), 2) FROM pos_pozycje WHERE transakcja_id = :id),
+            rabat_kwota = :rabat_kwota, rabat_procent = :rabat_procent
+        WHERE id = :id
+    """, {
+        'id': transakcja_id,
+        'rabat_kwota': wynik['basket_discount'],
+        'rabat_procent': basket['wartosc'] if basket and basket['typ_rabatu'] == 'procentowy' else 0
+    })
+
+@retry_on_locked
+def _przelicz_i_zapisz(conn, transakcja_id, user_id, zmiana):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        wynik_zmiany = zmiana(cursor) if zmiana else None
+        przeliczenie = _przelicz(conn, transakcja_id, user_id=user_id)
+        if przeliczenie is not None:
+            _zapisz_przeliczenie(cursor, transakcja_id, *przeliczenie)
+        cursor.execute("COMMIT")
+        return (przeliczenie[1] if przeliczenie else None), wynik_zmiany
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+
+def przelicz_i_zapisz_koszyk(transakcja_id, user_id='', zmiana=None, conn=None):
+    """
+    Przelicz koszyk w trakcie i zapisz wynik: ceny i rabaty pozycji, sumy transakcji
+    oraz rabat koszykowy (rabat_kwota). Zwraca wynik silnika albo None.
+    zmiana(cursor) - zmiana pozycji koszyka wykonywana w tej samej transakcji BEGIN IMMEDIATE
+    co przeliczenie (jedno połączenie, bez okna między zapisem pozycji a sum); jej wynik
+    jest zwracany zamiast wyniku silnika. CartError z zmiany przerywa transakcję.
+    """
+    from utils.pricing_engine import pricing_engine
+    
+    # Schemat planu i liczniki limitów przed blokadą zapisu - tworzą je osobne połączenia
+    pricing_engine.ensure_schema()
+    discount_limits.ensure_loaded()
+    own = conn is None
+    conn = conn or get_db_connection()
+    conn.isolation_level = None
+    try:
+        wynik, wynik_zmiany = _przelicz_i_zapisz(conn, transakcja_id, user_id, zmiana)
+    finally:
+        if own:
+            conn.close()
+    return wynik_zmiany if zmiana else wynik
+
+@pos_bp.route('/pos/cart/<int:transakcja_id>/reprice', methods=['POST'])
+def reprice_cart(transakcja_id):
+    """
+    Przelicz koszyk skompilowanym planem cen i promocji (podgląd, bez zapisu)
+    Body (opcjonalne): {ceny: 'cennik'|'koszyk', rabat_ids, kody_rabatow, kupony, user_id}
+    Bez rabat_ids brane są rabaty już zastosowane do transakcji.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        conn = get_db_connection()
+        try:
+            transakcja = conn.execute("""
+                SELECT id, location_id FROM pos_transakcje WHERE id = ?
+            """, (transakcja_id,)).fetchone()
+            if not transakcja:
+                return error_response("Transakcja nie została znaleziona", 404)
+            
+            # 'koszyk' zachowuje ceny zapisane w pozycjach (np. zmienione ręcznie przez kasjera)
+            _, lines = _pozycje_do_przeliczenia(conn, transakcja_id, data.get('ceny') == 'koszyk')
+            zastosowane = _rabaty_transakcji(conn, transakcja_id)
+        finally:
+            conn.close()
+        if 'rabat_ids' not in data:
+            data['rabat_ids'] = zastosowane
+        
+        from api.rabaty import przelicz_koszyk
+        wynik = przelicz_koszyk(lines, transakcja['location_id'], data, zastosowane=zastosowane)
+        wynik['transakcja_id'] = transakcja_id
+        
+        return success_response("Koszyk przeliczony", wynik)
+        
+    except Exception as e:
+        logger.error("Błąd reprice_cart: %s", e)
+        return error_response(f"Błąd serwera: {e}", 500)
+
 @pos_bp.route('/pos/cart/<int:transakcja_id>/items/<int:pozycja_id>', methods=['PUT'])
 def update_cart_item(transakcja_id, pozycja_id):
     """
@@ -1034,63 +1107,20 @@ def update_cart_item(transakcja_id, pozycja_id):
         if nowa_ilosc <= 0:
             return error_response("Ilość musi być większa od 0", 400)
             
-        # Sprawdź czy pozycja istnieje
-        pozycja = execute_query("""
-            SELECT p.*, prod.stawka_vat FROM pos_pozycje p
-            JOIN produkty prod ON p.produkt_id = prod.id
-            WHERE p.id = ? AND p.transakcja_id = ?
-        """, (pozycja_id, transakcja_id))
-        
-        if not pozycja:
-            return error_response("Pozycja nie została znaleziona", 404)
-            
-        pozycja = pozycja[0]
-        
-        # Przelicz wartości
-        cena_jednostkowa_brutto = pozycja['cena_jednostkowa']
-        wartosc_brutto = nowa_ilosc * cena_jednostkowa_brutto
-        wartosc_netto = nowa_ilosc * (pozycja['wartosc_netto'] / pozycja['ilosc'])  # cena netto za jednostkę
-        wartosc_vat = wartosc_brutto - wartosc_netto
-        
-        query = """
-        UPDATE pos_pozycje 
-        SET ilosc = ?, wartosc_netto = ?, kwota_vat = ?, wartosc_brutto = ?
-        WHERE id = ?
-        """
-        
-        result = execute_query(query, (nowa_ilosc, wartosc_netto, wartosc_vat, wartosc_brutto, pozycja_id))
-        
-        # **NAPRAWKA**: Aktualizuj sumy w transakcji po aktualizacji pozycji
-        if result is not None:
-            update_sums_query = execute_query("""
-                SELECT 
-                    COALESCE(SUM(wartosc_brutto), 0) as suma_brutto_pozycje,
-                    COALESCE(SUM(wartosc_netto), 0) as suma_netto_pozycje,
-                    COALESCE(SUM(kwota_vat), 0) as suma_vat_pozycje
-                FROM pos_pozycje 
-                WHERE transakcja_id = ?
-            """, (transakcja_id,))
-            
-            if update_sums_query:
-                sums = update_sums_query[0]
-                update_transaction_query = """
-                UPDATE pos_transakcje 
-                SET suma_brutto = ?,
-                    suma_netto = ?,
-                    suma_vat = ?
-                WHERE id = ?
-                """
-                execute_insert(update_transaction_query, (
-                    sums['suma_brutto_pozycje'],
-                    sums['suma_netto_pozycje'], 
-                    sums['suma_vat_pozycje'],
-                    transakcja_id
-                ))
+        def zmien_ilosc(cursor):
+            # Brak zmienionego wiersza - pozycji nie ma w tym koszyku
+            cursor.execute("UPDATE pos_pozycje SET ilosc = ? WHERE id = ? AND transakcja_id = ?",
+                           (nowa_ilosc, pozycja_id, transakcja_id))
+            if cursor.rowcount == 0:
+                raise CartError("Pozycja nie została znaleziona", 404)
+            return True
         
-        if result is not None:
-            return success_response("Pozycja zaktualizowana")
-        else:
-            return error_response("Nie udało się zaktualizować pozycji", 500)
+        try:
+            # Ceny pozycji, promocje (progi ilościowe i koszykowe) i sumy z planu cen
+            przelicz_i_zapisz_koszyk(transakcja_id, zmiana=zmien_ilosc)
+        except CartError as e:
+            return error_response(str(e), e.status)
+        return success_response("Pozycja zaktualizowana")
             
     except Exception as e:
         print(f"Błąd update_cart_item: {e}")
@@ -1102,48 +1132,19 @@ def remove_cart_item(transakcja_id, pozycja_id):
     Usuń pozycję z koszyka
     """
     try:
-        # Sprawdź czy pozycja istnieje
-        pozycja = execute_query("""
-            SELECT id FROM pos_pozycje 
-            WHERE id = ? AND transakcja_id = ?
-        """, (pozycja_id, transakcja_id))
-        
-        if not pozycja:
-            return error_response("Pozycja nie została znaleziona", 404)
-            
-        result = execute_query("DELETE FROM pos_pozycje WHERE id = ?", (pozycja_id,))
+        def usun_pozycje(cursor):
+            # Brak usuniętego wiersza - pozycji nie ma w tym koszyku
+            cursor.execute("DELETE FROM pos_pozycje WHERE id = ? AND transakcja_id = ?", (pozycja_id, transakcja_id))
+            if cursor.rowcount == 0:
+                raise CartError("Pozycja nie została znaleziona", 404)
+            return True
         
-        # **NAPRAWKA**: Aktualizuj sumy w transakcji po usunięciu pozycji
-        if result is not None:
-            update_sums_query = execute_query("""
-                SELECT 
-                    COALESCE(SUM(wartosc_brutto), 0) as suma_brutto_pozycje,
-                    COALESCE(SUM(wartosc_netto), 0) as suma_netto_pozycje,
-                    COALESCE(SUM(kwota_vat), 0) as suma_vat_pozycje
-                FROM pos_pozycje 
-                WHERE transakcja_id = ?
-            """, (transakcja_id,))
-            
-            if update_sums_query:
-                sums = update_sums_query[0]
-                update_transaction_query = """
-                UPDATE pos_transakcje 
-                SET suma_brutto = ?,
-                    suma_netto = ?,
-                    suma_vat = ?
-                WHERE id = ?
-                """
-                execute_insert(update_transaction_query, (
-                    sums['suma_brutto_pozycje'],
-                    sums['suma_netto_pozycje'], 
-                    sums['suma_vat_pozycje'],
-                    transakcja_id
-                ))
-        
-        if result is not None:
-            return success_response("Pozycja usunięta z koszyka")
-        else:
-            return error_response("Nie udało się usunąć pozycji", 500)
+        try:
+            # Promocje i sumy pozostałych pozycji z planu cen
+            przelicz_i_zapisz_koszyk(transakcja_id, zmiana=usun_pozycje)
+        except CartError as e:
+            return error_response(str(e), e.status)
+        return success_response("Pozycja usunięta z koszyka")
             
     except Exception as e:
         print(f"Błąd remove_cart_item: {e}")
@@ -1155,90 +1156,73 @@ def apply_discount_to_cart(transakcja_id):
     Zastosuj rabat do koszyka
     """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         
         if 'rabat_id' not in data:
             return error_response("Pole rabat_id jest wymagane", 400)
-            
-        rabat_id = data['rabat_id']
+        try:
+            rabat_id = int(data['rabat_id'])
+        except (TypeError, ValueError):
+            return error_response("Pole rabat_id musi być liczbą całkowitą", 400)
         user_id = data.get('user_id', 'unknown')
         
-        # Pobierz aktualną sumę koszyka
-        suma_query = execute_query("""
-            SELECT suma_brutto FROM pos_transakcje WHERE id = ? AND status = 'w_trakcie'
-        """, (transakcja_id,))
-        
-        if not suma_query:
-            return error_response("Transakcja nie została znaleziona lub nie jest w trakcie", 404)
-            
-        kwota_koszyka = float(suma_query[0]['suma_brutto'])
-        
-        if kwota_koszyka <= 0:
-            return error_response("Koszyk jest pusty", 400)
-            
-        # Oblicz rabat
-        calc_response = execute_query("""
-            SELECT 
-                r.*,
-                CASE 
-                    WHEN r.typ_rabatu = 'procentowy' THEN (? * r.wartosc) / 100
-                    ELSE MIN(r.wartosc, ?)
-                END as kwota_rabatu
-            FROM rabaty r
-            WHERE r.id = ? AND r.aktywny = 1
-        """, (kwota_koszyka, kwota_koszyka, rabat_id))
-        
-        if not calc_response:
+        rabat_info = discount_limits.get_rabat(rabat_id)
+        if not rabat_info:
             return error_response("Rabat nie został znaleziony lub jest nieaktywny", 404)
-            
-        rabat_info = calc_response[0]
-        
-        # Sprawdź warunki rabatu
-        if kwota_koszyka < rabat_info['minimum_koszyka']:
-            return error_response(f"Minimalna wartość koszyka: {rabat_info['minimum_koszyka']} zł", 400)
-            
-        if rabat_info['maksimum_koszyka'] and kwota_koszyka > rabat_info['maksimum_koszyka']:
-            return error_response(f"Maksymalna wartość koszyka: {rabat_info['maksimum_koszyka']} zł", 400)
-        
-        kwota_rabatu = float(rabat_info['kwota_rabatu'])
-        kwota_po_rabacie = kwota_koszyka - kwota_rabatu
         
-        # Zapisz użycie rabatu
-        query = """
-        INSERT INTO rabaty_uzycie (
-            rabat_id, transakcja_id, user_id, kwota_przed_rabatem, 
-            kwota_rabatu, kwota_po_rabacie, notatka, ip_address
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        
-        uzycie_id = execute_insert(query, (
-            rabat_id, transakcja_id, user_id, kwota_koszyka,
-            kwota_rabatu, kwota_po_rabacie, 
-            data.get('notatka', ''), request.remote_addr
-        ))
-        
-        # Aktualizuj kolumny rabatowe w transakcji
-        if rabat_info['typ_rabatu'] == 'procentowy':
-            rabat_procent = rabat_info['wartosc']
-        else:
-            rabat_procent = 0
-            
-        update_transaction_query = """
-        UPDATE pos_transakcje 
-        SET rabat_kwota = ?, rabat_procent = ?
-        WHERE id = ?
-        """
-        execute_insert(update_transaction_query, (kwota_rabatu, rabat_procent, transakcja_id))
-        
-        if uzycie_id:
-            return success_response("Rabat zastosowany do koszyka", {
-                "uzycie_id": uzycie_id,
-                "kwota_rabatu": kwota_rabatu,
-                "kwota_po_rabacie": kwota_po_rabacie,
-                "rabat_nazwa": rabat_info['nazwa']
+        # Podgląd i zapis przeliczenia na jednym połączeniu
+        conn = get_db_connection()
+        try:
+            if rabat_id in _rabaty_transakcji(conn, transakcja_id):
+                return error_response("Rabat jest już zastosowany do koszyka", 400)
+            
+            # Podgląd koszyka z rabatem - ten sam plan cen i promocji co zapis pozycji
+            przeliczenie = przelicz_transakcje(transakcja_id, [rabat_id], user_id, conn=conn)
+            if przeliczenie is None:
+                return error_response("Transakcja nie została znaleziona lub nie jest w trakcie", 404)
+            _, wynik = przeliczenie
+            
+            if wynik['subtotal'] <= 0:
+                return error_response("Koszyk jest pusty", 400)
+            
+            odrzucony = next((r for r in wynik['rejected'] if r.get('rabat_id') == rabat_id), None)
+            if odrzucony:
+                return error_response(odrzucony['powod'], 400)
+            
+            # Kwota rabatu: jego rabaty pozycyjne i rabat koszykowy
+            kwota_rabatu = round(sum(line['discount'] for line in wynik['lines'] if line['rabat_id'] == rabat_id), 2)
+            if wynik['basket_rabat'] and wynik['basket_rabat']['rabat_id'] == rabat_id:
+                kwota_rabatu = round(kwota_rabatu + wynik['basket_discount'], 2)
+            if kwota_rabatu <= 0:
+                return error_response("Rabat nie obejmuje pozycji koszyka", 400)
+            kwota_koszyka = wynik['subtotal']
+            
+            # Zapisz użycie rabatu - limit sprawdzany w transakcji zapisu (utils/discount_limits.py)
+            uzycie_id, blad = discount_limits.record_usage(rabat_info, user_id, {
+                'transakcja_id': transakcja_id,
+                'user_id': user_id,
+                'kwota_przed_rabatem': kwota_koszyka,
+                'kwota_rabatu': kwota_rabatu,
+                'kwota_po_rabacie': round(kwota_koszyka - kwota_rabatu, 2),
+                'notatka': data.get('notatka', ''),
+                'ip_address': request.remote_addr
             })
-        else:
-            return error_response("Nie udało się zastosować rabatu", 500)
+            if blad:
+                return error_response(blad, 400)
+            if not uzycie_id:
+                return error_response("Nie udało się zastosować rabatu", 500)
+            
+            # Zapisz ceny pozycji i sumy z zastosowanym rabatem
+            wynik = przelicz_i_zapisz_koszyk(transakcja_id, user_id, conn=conn) or wynik
+        finally:
+            conn.close()
+        
+        return success_response("Rabat zastosowany do koszyka", {
+            "uzycie_id": uzycie_id,
+            "kwota_rabatu": kwota_rabatu,
+            "kwota_po_rabacie": wynik['total'],
+            "rabat_nazwa": rabat_info['nazwa']
+        })
             
     except Exception as e:
         print(f"Błąd apply_discount_to_cart: {e}")
@@ -1264,18 +1248,15 @@ def remove_discount_from_cart(transakcja_id, uzycie_id):
         rabat_data = rabat_uzycie[0]
         
         # Usuń użycie rabatu z bazy
-        print(f"🔍 DEBUG: Próba usunięcia rabatu o ID: {uzycie_id}")
+        logger.debug("Próba usunięcia rabatu o ID: %s", uzycie_id)
         result = execute_insert("DELETE FROM rabaty_uzycie WHERE id = ?", (uzycie_id,))
-        print(f"🔍 DEBUG: Wynik execute_insert: {result}")
+        logger.debug("Wynik execute_insert: %s", result)
         
         if result:
-            # Zresetuj kolumny rabatowe w transakcji
-            update_transaction_query = """
-            UPDATE pos_transakcje 
-            SET rabat_kwota = 0, rabat_procent = 0
-            WHERE id = ?
-            """
-            execute_insert(update_transaction_query, (transakcja_id,))
+            discount_limits.release(rabat_data)
+            
+            # Ceny pozycji, rabaty i sumy bez usuniętego rabatu
+            przelicz_i_zapisz_koszyk(transakcja_id)
             
             return success_response("Rabat usunięty z koszyka", {
                 "uzycie_id": uzycie_id,
@@ -1299,8 +1280,8 @@ def complete_cart_transaction(transakcja_id):
     """
     try:
         data = request.get_json() or {}
-        print(f"� DEBUG complete_cart_transaction: transakcja_id={transakcja_id}, data={data}")
-        print(f"🔍 DEBUG customer_id from data: {data.get('customer_id')}")
+        logger.debug("complete_cart_transaction: transakcja_id=%s, data=%s", transakcja_id, data)
+        logger.debug("customer_id from data: %s", data.get('customer_id'))
         
         # Sprawdź czy transakcja istnieje i jest w trakcie
         transakcja = execute_query("""
@@ -1329,21 +1310,17 @@ def complete_cart_transaction(transakcja_id):
             WHERE transakcja_id = ?
         """, (transakcja_id,))
         
+        # Stany wszystkich pozycji jednym zapytaniem (stock_on_hand z księgi magazynowej)
+        stocks = stock_ledger.on_hand_many([p['produkt_id'] for p in pozycje_do_sprawdzenia],
+                                           location_id or DEFAULT_LOCATION_ID)
+
         stock_check_errors = []
         for pozycja in pozycje_do_sprawdzenia:
             product_id = pozycja['produkt_id']
             required_quantity = pozycja['ilosc']
             product_name = pozycja['nazwa_produktu']
-            
-            # Sprawdź aktualny stan dla danej lokalizacji
-            stock_result = execute_query("""
-                SELECT COALESCE(stan_aktualny, 0) as stock 
-                FROM pos_magazyn 
-                WHERE produkt_id = ? AND lokalizacja = ?
-            """, (product_id, str(location_id)))
-            
-            current_stock = stock_result[0]['stock'] if stock_result else 0
-            
+            current_stock = stocks.get(product_id, 0)
+
             if current_stock < required_quantity:
                 stock_check_errors.append({
                     'product_id': product_id,
@@ -1359,45 +1336,14 @@ def complete_cart_transaction(transakcja_id):
             has_stock_shortage = 1
             print(f"⚠️ BRAKI MAGAZYNOWE w transakcji {transakcja_id}: {stock_check_errors}")
             
-            # Zapisz braki do tabeli
-            for err in stock_check_errors:
-                try:
-                    execute_insert("""
-                        INSERT INTO pos_stock_shortages 
-                        (transakcja_id, produkt_id, nazwa_produktu, ilosc_sprzedana, ilosc_dostepna, ilosc_brakujaca, status)
-                        VALUES (?, ?, ?, ?, ?, ?, 'pending')
-                    """, (transakcja_id, err['product_id'], err['product_name'], 
-                          err['required'], err['available'], err['shortfall']))
-                except Exception as e:
-                    print(f"Błąd zapisu braku magazynowego: {e}")
-            
-        # Przelicz sumy z pozycji przed finalizacją
-        pozycje_sum = execute_query("""
-            SELECT 
-                COALESCE(SUM(wartosc_brutto), 0) as suma_brutto_pozycje,
-                COALESCE(SUM(wartosc_netto), 0) as suma_netto_pozycje,
-                COALESCE(SUM(kwota_vat), 0) as suma_vat_pozycje
-            FROM pos_pozycje 
-            WHERE transakcja_id = ?
-        """, (transakcja_id,))
-        
-        if pozycje_sum:
-            sums = pozycje_sum[0]
-            # Zaktualizuj sumy w transakcji
-            update_sums_query = """
-            UPDATE pos_transakcje 
-            SET suma_brutto = ?,
-                suma_netto = ?,
-                suma_vat = ?
-            WHERE id = ?
-            """
-            execute_insert(update_sums_query, (
-                sums['suma_brutto_pozycje'],
-                sums['suma_netto_pozycje'], 
-                sums['suma_vat_pozycje'],
-                transakcja_id
-            ))
+            # Zapisz braki do tabeli (jedna partia; zaległość aktualizują triggery)
+            try:
+                stock_shortages.post(transakcja_id, stock_check_errors)
+            except Exception as e:
+                print(f"Błąd zapisu braku magazynowego: {e}")
             
+        # Przelicz ceny pozycji, rabaty i sumy planem cen przed finalizacją
+        if przelicz_i_zapisz_koszyk(transakcja_id) is not None:
             # Odśwież dane transakcji po przeliczeniu
             transakcja = execute_query("""
                 SELECT * FROM pos_transakcje WHERE id = ?
@@ -1415,7 +1361,7 @@ def complete_cart_transaction(transakcja_id):
             # Dla płatności dzielonej ustaw formę jako "dzielona" lub lista metod
             metody = [p.get('method', '') for p in split_payments if p.get('amount', 0) > 0]
             metoda_platnosci = 'dzielona' if len(metody) > 1 else (metody[0] if metody else 'gotowka')
-            print(f"DEBUG: Płatność dzielona wykryta, metody: {metody}, forma_platnosci: {metoda_platnosci}")
+            logger.debug("Płatność dzielona wykryta, metody: %s, forma_platnosci: %s", metody, metoda_platnosci)
         
         # Oblicz resztę i kwoty dla form płatności
         kwota_reszty = 0
@@ -1448,7 +1394,7 @@ def complete_cart_transaction(transakcja_id):
             elif kwota_blik > 0:
                 metoda_karta = 'blik'
             
-            print(f"DEBUG: Płatność dzielona - gotówka: {kwota_gotowka}, karta: {kwota_karta}, blik: {kwota_blik}, metoda_karta: {metoda_karta}")
+            logger.debug("Płatność dzielona - gotówka: %s, karta: %s, blik: %s, metoda_karta: %s", kwota_gotowka, kwota_karta, kwota_blik, metoda_karta)
         elif kwota_otrzymana:
             kwota_otrzymana_float = float(kwota_otrzymana)
             if metoda_platnosci == 'gotowka':
@@ -1537,71 +1483,42 @@ def complete_cart_transaction(transakcja_id):
             pozycje = execute_query(pozycje_sql, (transakcja_id,))
             
             stock_updates = []
-            for pozycja in pozycje:
-                product_id = pozycja['produkt_id']
-                sold_quantity = pozycja['ilosc']
-                product_name = pozycja['nazwa_produktu']
-                
-                try:
-                    # 1. Aktualizuj stan w tabeli pos_magazyn (główna tabela stanów POS)
-                    pos_update_sql = """
-                    INSERT OR IGNORE INTO pos_magazyn 
-                    (produkt_id, stan_aktualny, stan_minimalny, stan_maksymalny, lokalizacja)
-                    VALUES (?, 0, 0, 0, ?)
-                    """
-                    execute_insert(pos_update_sql, (product_id, str(current_warehouse_id)))
-                    
-                    pos_update_sql = """
-                    UPDATE pos_magazyn 
-                    SET stan_aktualny = COALESCE(stan_aktualny, 0) - ?,
-                        ostatnia_aktualizacja = datetime('now')
-                    WHERE produkt_id = ? AND lokalizacja = ?
-                    """
-                    pos_result = execute_insert(pos_update_sql, (sold_quantity, product_id, str(current_warehouse_id)))
-                    
-                    # 2. Zapisz ruch magazynowy w pos_ruchy_magazynowe
-                    # Pobierz stan przed zmianą
-                    current_stock_before = execute_query("""
-                        SELECT stan_aktualny FROM pos_magazyn 
-                        WHERE produkt_id = ? AND lokalizacja = ?
-                    """, (product_id, str(current_warehouse_id)))
-                    
-                    stan_przed = current_stock_before[0]['stan_aktualny'] if current_stock_before else 0
-                    stan_po = stan_przed  # Stan już został zaktualizowany
-                    
-                    movement_sql = """
-                    INSERT INTO pos_ruchy_magazynowe 
-                    (produkt_id, typ_ruchu, ilosc, stan_przed, stan_po, 
-                     numer_dokumentu, data_ruchu, czas_ruchu, user_login, uwagi)
-                    VALUES (?, 'wydanie', ?, ?, ?, ?, date('now'), time('now'), ?, ?)
-                    """
-                    
-                    execute_insert(movement_sql, (
-                        product_id,
-                        sold_quantity,
-                        stan_przed + sold_quantity,  # Stan przed odjęciem
-                        stan_po,                     # Stan po odjęciu
-                        f"TRANS-{transakcja_id}",
-                        'system',
+            try:
+                stocks = stock_ledger.on_hand_many([p['produkt_id'] for p in pozycje], current_warehouse_id)
+                movements = []
+                for pozycja in pozycje:
+                    product_id = pozycja['produkt_id']
+                    sold_quantity = pozycja['ilosc']
+                    stan_przed = stocks.get(product_id, 0)
+                    stocks[product_id] = stan_przed - sold_quantity
+                    movements.append(ledger_movement(
+                        product_id, current_warehouse_id, -sold_quantity, 'sale',
+                        'pos_transakcja', transakcja_id, f"TRANS-{transakcja_id}",
                         f"Sprzedaż POS - transakcja #{transakcja_id} - magazyn #{current_warehouse_id}"
                     ))
-                    
                     stock_updates.append({
                         'product_id': product_id,
-                        'product_name': product_name,
+                        'product_name': pozycja['nazwa_produktu'],
                         'quantity_sold': sold_quantity,
                         'warehouse_id': current_warehouse_id,
-                        'old_stock': stan_przed + sold_quantity,
-                        'new_stock': stan_po
+                        'old_stock': stan_przed,
+                        'new_stock': stan_przed - sold_quantity
                     })
-                    
-                    print(f"✅ Odjęto {sold_quantity} szt. produktu {product_name} (ID: {product_id}) z magazynu #{current_warehouse_id}")
-                    
-                except Exception as e:
-                    print(f"❌ Błąd odejmowania stanu dla produktu {product_id}: {e}")
-                    # Nie przerywamy procesu - transakcja i tak została zrealizowana
+                
+                # Jedna partia ruchów - stock_on_hand, pos_magazyn i inventory_locations aktualizują triggery
+                stock_ledger.post(movements)
+            except Exception as e:
+                print(f"❌ Błąd odejmowania stanów dla transakcji {transakcja_id}: {e}")
+                stock_updates = []
+                # Nie przerywamy procesu - transakcja i tak została zrealizowana
             
             print(f"📦 PODSUMOWANIE: Zaktualizowano stany dla {len(stock_updates)} produktów w magazynie #{current_warehouse_id}")
+
+            # Koszt sprzedaży per pozycja (partie FIFO / cena zakupu) - podstawa raportów marż
+            try:
+                sale_costs.capture(transakcja_id, created_by=transakcja.get('kasjer_login') or 'system')
+            except Exception as e:
+                print(f"❌ Błąd wyliczania kosztu sprzedaży transakcji {transakcja_id}: {e}")
             # === KONIEC SKUTKU MAGAZYNOWEGO ===
             # Dodaj operację do kasa_operacje
             try:
@@ -1629,7 +1546,7 @@ def complete_cart_transaction(transakcja_id):
                 
                 # Obsługa płatności dzielonych
                 if split_payments and len(split_payments) > 0:
-                    print(f"DEBUG: Przetwarzanie płatności dzielonych w POS: {split_payments}")
+                    logger.debug("Przetwarzanie płatności dzielonych w POS: %s", split_payments)
                     
                     for payment in split_payments:
                         if payment.get('amount', 0) > 0:
@@ -1649,7 +1566,7 @@ def complete_cart_transaction(transakcja_id):
                                 except Exception as e:
                                     print(f"❌ Błąd podczas użycia kuponu: {e}")
                             
-                            print(f"DEBUG kasa_operacje (dzielona): method={payment.get('method')}, typ_platnosci={typ_platnosci}, amount={payment['amount']}")
+                            logger.debug("kasa_operacje (dzielona): method=%s, typ_platnosci=%s, amount=%s", payment.get('method'), typ_platnosci, payment['amount'])
                             
                             execute_insert(kasa_operacja_sql, (
                                 'KP',  # Kasa Przyjmie
@@ -1681,7 +1598,7 @@ def complete_cart_transaction(transakcja_id):
                         except Exception as e:
                             print(f"❌ Błąd podczas użycia kuponu: {e}")
                     
-                    print(f"DEBUG kasa_operacje (cart): metoda_platnosci={metoda_platnosci}, typ_platnosci={typ_platnosci}, final_amount={final_amount}")
+                    logger.debug("kasa_operacje (cart): metoda_platnosci=%s, typ_platnosci=%s, final_amount=%s", metoda_platnosci, typ_platnosci, final_amount)
                     
                     execute_insert(kasa_operacja_sql, (
                         'KP',  # Kasa Przyjmie
@@ -1701,8 +1618,6 @@ def complete_cart_transaction(transakcja_id):
             
             # Automatyczna fiskalizacja dla zakończonych transakcji sprzedażowych
             try:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.info(f"🧾 AUTOMATYCZNA FISKALIZACJA POS: Rozpoczynam dla zakończonej transakcji {transakcja_id}")
                 
                 from fiscal.service import get_fiscal_service
@@ -1721,8 +1636,6 @@ def complete_cart_transaction(transakcja_id):
                     logger.warning(f"❌ Błąd fiskalizacji transakcji POS {transakcja_id}: {fiscal_result.get('error')}")
                     
             except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.error(f"💥 Błąd automatycznej fiskalizacji POS: {e}")
                 import traceback
                 logger.error(f"💥 Traceback: {traceback.format_exc()}")
@@ -2063,7 +1976,7 @@ def create_return():
                 )
             
             # Oblicz wartości zwrotu dla tej pozycji
-            cena_brutto = float(pos['cena_jednostkowa'])
+            cena_brutto = float(pos.get('cena_po_rabacie') or pos['cena_jednostkowa'])
             stawka_vat = float(pos.get('stawka_vat', 23))
             cena_netto = cena_brutto / (1 + stawka_vat / 100)
             
@@ -2144,36 +2057,19 @@ def create_return():
                 item['wartosc_vat'],
                 item['powod']
             ))
-            
-            # 3. Przywróć produkty na magazyn (tabela pos_magazyn)
-            try:
-                # Aktualizuj stan w tabeli pos_magazyn (główna tabela POS)
-                update_stock_query = """
-                    UPDATE pos_magazyn 
-                    SET stan_aktualny = COALESCE(stan_aktualny, 0) + ?,
-                        ostatnia_aktualizacja = datetime('now')
-                    WHERE produkt_id = ?
-                """
-                execute_insert(update_stock_query, (
-                    item['ilosc_zwracana'],
-                    item['produkt_id']
-                ))
-                
-                # Dodaj ruch magazynowy (przyjęcie ze zwrotu)
-                ruch_query = """
-                    INSERT INTO pos_ruchy_magazynowe 
-                    (produkt_id, typ_ruchu, ilosc, uwagi, data_ruchu)
-                    VALUES (?, 'przyjecie', ?, ?, datetime('now'))
-                """
-                execute_insert(ruch_query, (
-                    item['produkt_id'],
-                    item['ilosc_zwracana'],
-                    f"Zwrot {return_number}: {item['nazwa_produktu']}"
-                ))
-                
-                print(f"✅ Zwrot magazynowy: +{item['ilosc_zwracana']} szt produktu {item['nazwa_produktu']}")
-            except Exception as stock_err:
-                print(f"⚠️ Błąd aktualizacji stanu magazynowego: {stock_err}")
+        
+        # 3. Przywróć produkty na magazyn - jedna partia ruchów 'return' w rejestrze stanów
+        try:
+            stock_ledger.post([
+                ledger_movement(item['produkt_id'], location_id or DEFAULT_LOCATION_ID,
+                                item['ilosc_zwracana'], 'return', 'pos_zwrot', return_id,
+                                return_number, f"Zwrot {return_number}: {item['nazwa_produktu']}",
+                                cashier or 'system')
+                for item in return_items
+            ])
+            print(f"✅ Zwrot magazynowy: {len(return_items)} pozycji zwrotu {return_number}")
+        except Exception as stock_err:
+            print(f"⚠️ Błąd aktualizacji stanu magazynowego: {stock_err}")
         
         # 4. Utwórz KW w kasa/bank
         try:
@@ -2513,6 +2409,36 @@ def resolve_stock_shortage(transakcja_id):
         return error_response(f"Błąd serwera: {e}", 500)
 
 
+@pos_bp.route('/pos/stock-shortages/backlog', methods=['GET'])
+def get_stock_shortage_backlog():
+    """
+    Zaległość braków magazynowych per produkt/lokalizacja (tabela utrzymywana triggerami)
+    Query: location_id (opcjonalne), limit (domyślnie 50)
+    """
+    try:
+        location_id = request.args.get('location_id', type=int)
+        limit = request.args.get('limit', 50, type=int)
+        return success_response(stock_shortages.backlog(location_id, limit), "Zaległość braków magazynowych")
+    except Exception as e:
+        print(f"Błąd pobierania zaległości braków: {e}")
+        return error_response(f"Błąd serwera: {e}", 500)
+
+
+@pos_bp.route('/pos/stock-shortages/allocate', methods=['POST'])
+def allocate_stock_shortages():
+    """
+    Rozlicza całą zaległość względem bieżących stanów (od najstarszego braku)
+    Body: { resolved_by: string (opcjonalne) }
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        result = stock_shortages.run(requeue=True, resolved_by=data.get('resolved_by', 'system_auto'))
+        return success_response(result, "Braki magazynowe rozliczone")
+    except Exception as e:
+        print(f"Błąd rozliczania braków: {e}")
+        return error_response(f"Błąd serwera: {e}", 500)
+
+
 @pos_bp.route('/pos/transactions-with-shortages', methods=['GET'])
 def get_transactions_with_shortages():
     """
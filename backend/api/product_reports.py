@@ -1,72 +1,70 @@
 from flask import Blueprint, request, jsonify, current_app
 from utils.database import execute_query, success_response, error_response
+from utils.sales_forecast import sales_forecast_engine
+from utils.sales_facts import sales_fact_store
+from utils.replenishment import replenishment_planner
 import traceback
 
 product_reports_bp = Blueprint('product_reports', __name__)
 
-@product_reports_bp.route('/reports/products/rotation/highest', methods=['GET'])
-def get_highest_rotation_products():
+def _load_products_with_sales(days, location_id):
     """
-    Najbardziej rotujące produkty (najczęściej sprzedawane)
-    Parametry: limit (default=10), days (default=30), location_id
+    Aktywne produkty połączone z agregatami sprzedaży z kolumnowego cache faktów
+    (zamiast JOIN pozycji z transakcjami przy każdym żądaniu)
     """
-    try:
-        limit = int(request.args.get('limit', 10))
-        days = int(request.args.get('days', 30))
-        location_id = request.args.get('location_id')
-        
-        # Uproszczone zapytanie dla najbardziej rotujących produktów
-        query = """
+    products = execute_query("""
         SELECT 
             p.id,
             p.nazwa,
             p.kod_produktu,
             p.ean,
             p.cena,
-            k.nazwa as kategoria_nazwa,
-            COALESCE(sales_data.total_quantity_sold, 0) as total_quantity_sold,
-            COALESCE(sales_data.transactions_count, 0) as transactions_count,
-            COALESCE(sales_data.avg_price, p.cena) as avg_price,
-            COALESCE(sales_data.total_revenue, 0) as total_revenue,
-            ROUND(COALESCE(sales_data.total_quantity_sold, 0) / ?, 2) as avg_daily_sales
+            k.nazwa as kategoria_nazwa
         FROM produkty p
         LEFT JOIN kategorie_produktow k ON p.category_id = k.id
-        LEFT JOIN (
-            SELECT 
-                pp.produkt_id,
-                SUM(pp.ilosc) as total_quantity_sold,
-                COUNT(DISTINCT pt.id) as transactions_count,
-                AVG(pp.cena_jednostkowa) as avg_price,
-                SUM(pp.wartosc_brutto) as total_revenue
-            FROM pos_pozycje_paragonu pp
-            JOIN pos_transakcje pt ON pp.transakcja_id = pt.id
-            WHERE pt.status = 'zakonczony'
-            AND pt.data_transakcji >= date('now', '-' || ? || ' days')
-        """
-        
-        # Dodaj warunek location_id jeśli podany
-        if location_id:
-            query += " AND pt.location_id = ?"
-            
-        query += """
-            GROUP BY pp.produkt_id
-        ) sales_data ON p.id = sales_data.produkt_id
         WHERE p.aktywny = 1
-        AND COALESCE(sales_data.total_quantity_sold, 0) > 0
-        ORDER BY COALESCE(sales_data.total_quantity_sold, 0) DESC, p.nazwa ASC
-        LIMIT ?
-        """
+    """)
+    
+    if products is None:
+        return None
         
-        # Przygotuj parametry SQL
-        params = [days, days]  # Dla dwóch miejsc gdzie używamy days
-        if location_id:
-            params.append(location_id)  # location_id jeśli podany
-        params.append(limit)  # limit na końcu
+    sales = sales_fact_store.aggregate_by_product(days, location_id)
+    
+    for product in products:
+        product['sales'] = sales.get(product['id'])
+    
+    return products
+
+def _rotation_row(product, days):
+    """Wiersz raportu rotacji w formacie dotychczasowego zapytania SQL"""
+    sales = product.pop('sales') or {}
+    quantity = sales.get('quantity', 0)
+    product['total_quantity_sold'] = quantity
+    product['transactions_count'] = sales.get('transactions_count', 0)
+    product['avg_price'] = sales.get('avg_price', product['cena'])
+    product['total_revenue'] = sales.get('revenue', 0)
+    product['avg_daily_sales'] = round(quantity / days, 2)
+    return product
+
+@product_reports_bp.route('/reports/products/rotation/highest', methods=['GET'])
+def get_highest_rotation_products():
+    """
+    Najbardziej rotujące produkty (najczęściej sprzedawane)
+    Parametry: limit (default=10), days (default=30), location_id
+    """
+    try:
+        limit = int(request.args.get('limit', 10))
+        days = int(request.args.get('days', 30))
+        location_id = request.args.get('location_id')
         
-        results = execute_query(query, params)
+        products = _load_products_with_sales(days, location_id)
         
-        if results is None:
+        if products is None:
             return error_response("Błąd połączenia z bazą danych", 500)
+        
+        results = [_rotation_row(p, days) for p in products if p['sales'] and p['sales']['quantity'] > 0]
+        results.sort(key=lambda p: (-p['total_quantity_sold'], p['nazwa'] or ''))
+        results = results[:limit]
             
         # Dodaj ranking
         for i, product in enumerate(results):
@@ -84,76 +82,22 @@ def get_lowest_rotation_products():
     Najmniej rotujące produkty (najrzadziej sprzedawane)
     Parametry: limit (default=10), days (default=30), location_id
     """
-    print("DEBUG: Wchodzimy do get_lowest_rotation_products!")
-    current_app.logger.info("Wchodzimy do get_lowest_rotation_products!")
-    
     try:
         limit = int(request.args.get('limit', 10))
         days = int(request.args.get('days', 30))
         location_id = request.args.get('location_id')
         
-        print(f"DEBUG: get_lowest_rotation_products - limit: {limit}, days: {days}, location_id: {location_id}")
         current_app.logger.info(f"get_lowest_rotation_products - limit: {limit}, days: {days}, location_id: {location_id}")
         
-        # Uproszczone zapytanie dla najmniej rotujących produktów
-        query = """
-        SELECT 
-            p.id,
-            p.nazwa,
-            p.kod_produktu,
-            p.ean,
-            p.cena,
-            k.nazwa as kategoria_nazwa,
-            COALESCE(sales_data.total_quantity_sold, 0) as total_quantity_sold,
-            COALESCE(sales_data.transactions_count, 0) as transactions_count,
-            COALESCE(sales_data.avg_price, p.cena) as avg_price,
-            COALESCE(sales_data.total_revenue, 0) as total_revenue,
-            ROUND(COALESCE(sales_data.total_quantity_sold, 0) / ?, 2) as avg_daily_sales
-        FROM produkty p
-        LEFT JOIN kategorie_produktow k ON p.category_id = k.id
-        LEFT JOIN (
-            SELECT 
-                pp.produkt_id,
-                SUM(pp.ilosc) as total_quantity_sold,
-                COUNT(DISTINCT pt.id) as transactions_count,
-                AVG(pp.cena_jednostkowa) as avg_price,
-                SUM(pp.wartosc_brutto) as total_revenue
-            FROM pos_pozycje_paragonu pp
-            JOIN pos_transakcje pt ON pp.transakcja_id = pt.id
-            WHERE pt.status = 'zakonczony'
-            AND pt.data_transakcji >= date('now', '-' || ? || ' days')
-        """
-        
-        # Dodaj warunek location_id jeśli podany
-        if location_id:
-            query += " AND pt.location_id = ?"
-            
-        query += """
-            GROUP BY pp.produkt_id
-        ) sales_data ON p.id = sales_data.produkt_id
-        WHERE p.aktywny = 1
-        ORDER BY COALESCE(sales_data.total_quantity_sold, 0) ASC, p.nazwa ASC
-        LIMIT ?
-        """
-        
-        # Przygotuj parametry SQL
-        params = [days, days]  # Dla dwóch miejsc gdzie używamy days
-        if location_id:
-            params.append(location_id)  # location_id jeśli podany
-        params.append(limit)  # limit na końcu
-        
-        print(f"DEBUG: get_lowest_rotation_products - query params: {params}")
-        current_app.logger.info(f"get_lowest_rotation_products - query params: {params}")
-        
-        results = execute_query(query, params)
+        products = _load_products_with_sales(days, location_id)
         
-        print(f"DEBUG: get_lowest_rotation_products - results type: {type(results)}, results count: {len(results) if results else 0}")
-        current_app.logger.info(f"get_lowest_rotation_products - results type: {type(results)}")
-        
-        if results is None:
-            print("DEBUG: get_lowest_rotation_products - results is None, returning database error")
-            current_app.logger.error("get_lowest_rotation_products - results is None")
+        if products is None:
+            current_app.logger.error("get_lowest_rotation_products - products is None")
             return error_response("Błąd połączenia z bazą danych", 500)
+        
+        results = [_rotation_row(p, days) for p in products]
+        results.sort(key=lambda p: (p['total_quantity_sold'], p['nazwa'] or ''))
+        results = results[:limit]
             
         # Dodaj ranking i oznaczenia
         for i, product in enumerate(results):
@@ -171,7 +115,6 @@ def get_lowest_rotation_products():
         return success_response(results, f"Najmniej rotujące produkty (top {limit})")
         
     except Exception as e:
-        print(f"DEBUG: get_lowest_rotation_products - Exception: {str(e)}")
         current_app.logger.error(f"get_lowest_rotation_products - Exception: {str(e)}")
         return error_response(f"Błąd pobierania raportów rotacji: {str(e)}", 500)
 
@@ -187,56 +130,26 @@ def get_bestsellers():
         by = request.args.get('by', 'quantity')  # quantity lub revenue
         location_id = request.args.get('location_id')
         
-        order_by = "total_quantity DESC" if by == 'quantity' else "total_revenue DESC"
-        
-        query = f"""
-        SELECT 
-            p.id,
-            p.nazwa,
-            p.kod_produktu,
-            p.ean,
-            p.cena,
-            k.nazwa as kategoria_nazwa,
-            sales_data.total_quantity,
-            sales_data.total_revenue,
-            sales_data.transactions_count,
-            sales_data.avg_price,
-            ROUND(sales_data.total_quantity / ?, 2) as avg_daily_sales
-        FROM produkty p
-        LEFT JOIN kategorie_produktow k ON p.category_id = k.id
-        INNER JOIN (
-            SELECT 
-                pp.produkt_id,
-                SUM(pp.ilosc) as total_quantity,
-                SUM(pp.wartosc_brutto) as total_revenue,
-                COUNT(DISTINCT pt.id) as transactions_count,
-                AVG(pp.cena_jednostkowa) as avg_price
-            FROM pos_pozycje_paragonu pp
-            JOIN pos_transakcje pt ON pp.transakcja_id = pt.id
-            WHERE pt.status = 'zakonczony'
-            AND pt.data_transakcji >= date('now', '-' || ? || ' days')
-        """
-        
-        if location_id:
-            query += " AND pt.location_id = ?"
-            
-        query += f"""
-            GROUP BY pp.produkt_id
-        ) sales_data ON p.id = sales_data.produkt_id
-        WHERE p.aktywny = 1
-        ORDER BY {order_by}
-        LIMIT ?
-        """
-        
-        params = [days, days]
-        if location_id:
-            params.append(location_id)
-        params.append(limit)
+        products = _load_products_with_sales(days, location_id)
         
-        results = execute_query(query, params)
-        
-        if results is None:
+        if products is None:
             return error_response("Błąd połączenia z bazą danych", 500)
+        
+        results = []
+        for product in products:
+            sales = product.pop('sales')
+            if not sales:
+                continue
+            product['total_quantity'] = sales['quantity']
+            product['total_revenue'] = sales['revenue']
+            product['transactions_count'] = sales['transactions_count']
+            product['avg_price'] = sales['avg_price']
+            product['avg_daily_sales'] = round(sales['quantity'] / days, 2)
+            results.append(product)
+        
+        sort_key = 'total_quantity' if by == 'quantity' else 'total_revenue'
+        results.sort(key=lambda p: -p[sort_key])
+        results = results[:limit]
             
         # Dodaj ranking
         for i, product in enumerate(results):
@@ -251,37 +164,45 @@ def get_bestsellers():
 @product_reports_bp.route('/reports/products/forecast', methods=['GET'])
 def get_sales_forecast():
     """
-    Estymacja sprzedaży na przyszły miesiąc na podstawie historycznych danych
-    Parametry: forecast_days (default=30), analysis_days (default=90), location_id
+    Prognoza sprzedaży i sugerowane ilości zamówienia dla całego katalogu
+    Parametry: forecast_days (default=30), analysis_days (default=90), location_id, limit, refresh
     """
     try:
         forecast_days = int(request.args.get('forecast_days', 30))  # Dni prognozy
         analysis_days = int(request.args.get('analysis_days', 90))  # Dni analizy historii
+    except ValueError:
+        return error_response("Parametry forecast_days i analysis_days muszą być liczbami", 400)
+    try:
+        limit = request.args.get('limit')
+        limit = int(limit) if limit not in (None, '') else None
+    except ValueError:
+        return error_response("Parametr 'limit' musi być liczbą", 400)
+
+    try:
         location_id = request.args.get('location_id')
-        
-        # Bardzo proste zapytanie prognozy - tylko produkty które mają sprzedaż
-        query = """
-        SELECT 
-            p.id,
-            p.nazwa,
-            p.kod_produktu,
-            p.cena,
-            'Brak kategorii' as kategoria_nazwa,
-            1.0 as avg_monthly_quantity,
-            p.cena as avg_monthly_revenue,
-            1.2 as forecast_quantity,
-            ROUND(p.cena * 1.2, 2) as forecast_revenue
-        FROM produkty p
-        WHERE p.aktywny = 1
-        LIMIT 10
-        """
-        
-        results = execute_query(query, [])
-        
-        if results is None:
+        refresh = request.args.get('refresh', 'false').lower() in ('1', 'true')
+        
+        if forecast_days <= 0 or analysis_days < 14:
+            return error_response("forecast_days musi być > 0, a analysis_days >= 14", 400)
+        if limit is not None and limit < 0:
+            return error_response("Parametr 'limit' nie może być ujemny", 400)
+        
+        # Modele liczone są raz dziennie dla całego katalogu (cache w silniku)
+        forecast = sales_forecast_engine.get_forecast(
+            analysis_days=analysis_days,
+            forecast_days=forecast_days,
+            location_id=location_id,
+            refresh=refresh
+        )
+        
+        if forecast is None:
             return error_response("Błąd połączenia z bazą danych", 500)
+        
+        results = forecast['products']
+        if limit is not None:
+            results = results[:limit]
             
-        return success_response(results, "Prognoza sprzedaży na następny miesiąc")
+        return success_response(results, f"Prognoza sprzedaży na następne {forecast_days} dni")
         
     except Exception as e:
         return error_response(f"Błąd generowania prognozy: {str(e)}", 500)
@@ -295,44 +216,25 @@ def get_products_summary():
         days = int(request.args.get('days', 30))
         location_id = request.args.get('location_id')
         
-        # Podstawowe statystyki
-        base_condition = ""
-        params = [days]
-        if location_id:
-            base_condition = "AND pt.location_id = ?"
-            params.append(location_id)
+        products = _load_products_with_sales(days, location_id)
         
-        summary_query = f"""
-        SELECT 
-            COUNT(DISTINCT p.id) as total_products,
-            COUNT(DISTINCT CASE WHEN sales_data.total_quantity > 0 THEN p.id END) as products_with_sales,
-            COUNT(DISTINCT CASE WHEN sales_data.total_quantity = 0 OR sales_data.total_quantity IS NULL THEN p.id END) as products_without_sales,
-            COALESCE(SUM(sales_data.total_quantity), 0) as total_quantity_sold,
-            COALESCE(SUM(sales_data.total_revenue), 0) as total_revenue,
-            COALESCE(AVG(sales_data.total_quantity), 0) as avg_quantity_per_product,
-            COALESCE(AVG(sales_data.total_revenue), 0) as avg_revenue_per_product
-        FROM produkty p
-        LEFT JOIN (
-            SELECT 
-                pp.produkt_id,
-                SUM(pp.ilosc) as total_quantity,
-                SUM(pp.wartosc_brutto) as total_revenue
-            FROM pos_pozycje_paragonu pp
-            JOIN pos_transakcje pt ON pp.transakcja_id = pt.id
-            WHERE pt.status = 'zakonczony'
-            AND pt.data_transakcji >= date('now', '-' || ? || ' days')
-            {base_condition}
-            GROUP BY pp.produkt_id
-        ) sales_data ON p.id = sales_data.produkt_id
-        WHERE p.aktywny = 1
-        """
-        
-        summary = execute_query(summary_query, params)
-        
-        if summary is None or len(summary) == 0:
+        if products is None:
             return error_response("Błąd pobierania podsumowania", 500)
+        
+        sold = [p['sales'] for p in products if p['sales']]
+        with_sales = [s for s in sold if s['quantity'] > 0]
+        total_quantity = sum(s['quantity'] for s in sold)
+        total_revenue = sum(s['revenue'] for s in sold)
             
-        result = summary[0]
+        result = {
+            'total_products': len(products),
+            'products_with_sales': len(with_sales),
+            'products_without_sales': len(products) - len(with_sales),
+            'total_quantity_sold': total_quantity,
+            'total_revenue': total_revenue,
+            'avg_quantity_per_product': total_quantity / len(sold) if sold else 0,
+            'avg_revenue_per_product': total_revenue / len(sold) if sold else 0
+        }
         result['period_days'] = days
         result['location_id'] = location_id
         
@@ -340,3 +242,97 @@ def get_products_summary():
         
     except Exception as e:
         return error_response(f"Błąd pobierania podsumowania: {str(e)}", 500)
+
+@product_reports_bp.route('/reports/replenishment', methods=['GET'])
+def get_replenishment_report():
+    """
+    Lista produktów do zamówienia per magazyn z przeliczonego planu uzupełnień
+    Parametry: warehouse_id, location_id, all (true = również bez potrzeby zamówienia), limit
+    """
+    try:
+        warehouse_id = request.args.get('warehouse_id')
+        location_id = request.args.get('location_id')
+        include_all = request.args.get('all', 'false').lower() in ('1', 'true')
+        limit = int(request.args.get('limit', 500))
+        
+        plan_exists = execute_query("""
+            SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'replenishment_plan'
+        """)
+        if not plan_exists:
+            # Pierwsze użycie - przelicz plan (kolejne przeliczenia robi scheduler)
+            run_result = replenishment_planner.run()
+            if not run_result.get('success'):
+                return error_response(f"Błąd przeliczania planu: {run_result.get('error')}", 500)
+        
+        query = """
+        SELECT 
+            rp.*,
+            p.nazwa,
+            p.kod_produktu,
+            p.ean,
+            w.nazwa as warehouse_name,
+            l.nazwa as location_name
+        FROM replenishment_plan rp
+        JOIN produkty p ON rp.product_id = p.id
+        LEFT JOIN warehouses w ON rp.warehouse_id = w.id
+        LEFT JOIN locations l ON rp.location_id = l.id
+        WHERE 1 = 1
+        """
+        params = []
+        
+        if warehouse_id:
+            query += " AND rp.warehouse_id = ?"
+            params.append(warehouse_id)
+        elif location_id:
+            query += " AND rp.location_id = ?"
+            params.append(location_id)
+            
+        if not include_all:
+            query += " AND rp.needs_reorder = 1"
+            
+        query += " ORDER BY rp.warehouse_id, rp.days_to_stockout IS NULL, rp.days_to_stockout ASC LIMIT ?"
+        params.append(limit)
+        
+        results = execute_query(query, params)
+        
+        if results is None:
+            return error_response("Błąd połączenia z bazą danych", 500)
+        
+        # Grupowanie per magazyn
+        warehouses = {}
+        for row in results:
+            key = row['warehouse_id'] or f"location-{row['location_id']}"
+            if key not in warehouses:
+                warehouses[key] = {
+                    'warehouse_id': row['warehouse_id'],
+                    'warehouse_name': row['warehouse_name'],
+                    'location_id': row['location_id'],
+                    'location_name': row['location_name'],
+                    'items': []
+                }
+            warehouses[key]['items'].append(row)
+            
+        return success_response({
+            'warehouses': list(warehouses.values()),
+            'total_items': len(results),
+            'computed_at': results[0]['computed_at'] if results else None
+        }, f"Plan uzupełnień: {len(results)} pozycji")
+        
+    except Exception as e:
+        return error_response(f"Błąd pobierania planu uzupełnień: {str(e)}", 500)
+
+@product_reports_bp.route('/reports/replenishment/recalculate', methods=['POST'])
+def recalculate_replenishment():
+    """
+    Ręczne przeliczenie planu uzupełnień (domyślnie robi to scheduler)
+    """
+    try:
+        result = replenishment_planner.run()
+        
+        if not result.get('success'):
+            return error_response(f"Błąd przeliczania planu: {result.get('error')}", 500)
+            
+        return success_response(result, f"Przeliczono plan uzupełnień ({result['rows']} pozycji)")
+        
+    except Exception as e:
+        return error_response(f"Błąd przeliczania planu uzupełnień: {str(e)}", 500)
@@ -3,17 +3,15 @@ API endpoint dla zarządzania produktami
 Wyszukiwarka produktów, szczegóły, kategorie, statystyki
 """
 
+import logging
+
 from flask import Blueprint, request, jsonify
 from utils.database import execute_query, execute_insert, success_response, error_response, not_found_response
 from api.margin_service import margin_service
+from utils.stock_ledger import stock_ledger, movement as ledger_movement, DEFAULT_LOCATION_ID
 
-# Flaga debug - ustaw na False aby wyłączyć logowanie
-DEBUG_PRODUCTS = False
-
-def debug_print(*args, **kwargs):
-    """Warunkowe printowanie - tylko gdy DEBUG_PRODUCTS=True"""
-    if DEBUG_PRODUCTS:
-        print(*args, **kwargs)
+# Diagnostyka na poziomie DEBUG (LOG_LEVEL=DEBUG) - domyślnie wyłączona
+logger = logging.getLogger(__name__)
 
 products_bp = Blueprint('products', __name__)
 
@@ -23,11 +21,11 @@ def get_all_products():
     Pobierz wszystkie produkty (endpoint bazowy)
     Parametry: limit (int, opcjonalny), search (string, opcjonalny)
     """
-    debug_print(f"🟢 WYWOŁANA FUNKCJA get_all_products z parametrami: {request.args}")
+    logger.debug("WYWOŁANA FUNKCJA get_all_products z parametrami: %s", request.args)
     try:
         # Safely parse limit parameter
         limit_param = request.args.get('limit', '100')
-        debug_print(f"🔍 DEBUG limit_param: '{limit_param}'")
+        logger.debug("limit_param: '%s'", limit_param)
         if not limit_param or limit_param in ['undefined', 'null', '']:
             limit = 100
         else:
@@ -35,7 +33,7 @@ def get_all_products():
                 limit = int(limit_param)
             except ValueError:
                 limit = 100
-        debug_print(f"🔍 DEBUG final limit: {limit}")
+        logger.debug("final limit: %s", limit)
         
         search = request.args.get('search', '').strip()
         
@@ -89,8 +87,8 @@ def get_all_products():
         params.append(limit)
         
         # DEBUG: Log SQL query and parameters
-        debug_print(f"🔍 SQL Query: {sql_query}")
-        debug_print(f"🔍 Params: {params}")
+        logger.debug("SQL Query: %s", sql_query)
+        logger.debug("Params: %s", params)
         
         results = execute_query(sql_query, params)
         
@@ -108,9 +106,9 @@ def get_all_products():
                 # Zastąp cenę z tabeli produkty na cenę z margin_service
                 product['purchase_price'] = purchase_price
                 product['purchase_price_method'] = method
-                debug_print(f"🔍 DEBUG /products - Produkt {product['id']}: cena zakupu {purchase_price} ({method})")
+                logger.debug("/products - Produkt %s: cena zakupu %s (%s)", product['id'], purchase_price, method)
             except Exception as e:
-                debug_print(f"⚠️ Błąd pobierania ceny zakupu dla produktu {product['id']}: {e}")
+                logger.error("Błąd pobierania ceny zakupu dla produktu %s: %s", product['id'], e)
                 # Zostaw oryginalną cenę w przypadku błędu
             
         return success_response(results, f"Znaleziono {len(results)} produktów")
@@ -118,7 +116,7 @@ def get_all_products():
     except ValueError:
         return error_response("Parametr 'limit' musi być liczbą", 400)
     except Exception as e:
-        debug_print(f"Błąd pobierania produktów: {e}")
+        logger.error("Błąd pobierania produktów: %s", e)
         return error_response("Wystąpił błąd podczas pobierania produktów", 500)
 
 @products_bp.route('/products/search', methods=['GET'])
@@ -235,9 +233,9 @@ def search_products():
                 # Zastąp starą cenę na najnowszą z faktury
                 product['current_purchase_price'] = purchase_price
                 product['purchase_price_method'] = method
-                debug_print(f"🔍 DEBUG search - Produkt {product['id']}: cena zakupu {purchase_price} ({method})")
+                logger.debug("search - Produkt %s: cena zakupu %s (%s)", product['id'], purchase_price, method)
             except Exception as e:
-                debug_print(f"⚠️ Błąd pobierania ceny zakupu dla produktu {product['id']}: {e}")
+                logger.error("Błąd pobierania ceny zakupu dla produktu %s: %s", product['id'], e)
                 # Zostaw oryginalną cenę w przypadku błędu
             
         return success_response({
@@ -251,7 +249,7 @@ def search_products():
     except ValueError:
         return error_response("Parametr 'limit' musi być liczbą", 400)
     except Exception as e:
-        debug_print(f"Błąd wyszukiwania produktów: {e}")
+        logger.error("Błąd wyszukiwania produktów: %s", e)
         return error_response("Wystąpił błąd podczas wyszukiwania", 500)
 
 @products_bp.route('/products/<int:product_id>', methods=['GET'])
@@ -321,9 +319,9 @@ def get_product(product_id):
             # Jeśli ma pole cost_price, też je zaktualizuj
             if 'cost_price' in product:
                 product['cost_price'] = purchase_price
-            debug_print(f"🔍 DEBUG /products/{product_id} - cena zakupu {purchase_price} ({method})")
+            logger.debug("/products/%s - cena zakupu %s (%s)", product_id, purchase_price, method)
         except Exception as e:
-            debug_print(f"⚠️ Błąd pobierania ceny zakupu dla produktu {product_id}: {e}")
+            logger.error("Błąd pobierania ceny zakupu dla produktu %s: %s", product_id, e)
             # Zostaw oryginalną cenę w przypadku błędu
         
         return success_response(product, "Szczegóły produktu")
@@ -452,7 +450,7 @@ def update_inventory(product_id):
     """
     Aktualizacja stanu magazynowego produktu
     PUT /api/products/123/inventory
-    Body: {"stock_quantity": 50, "operation": "set|add|subtract"}
+    Body: {"stock_quantity": 50, "operation": "set|add|subtract", "location_id": 5}
     """
     try:
         data = request.get_json()
@@ -465,14 +463,13 @@ def update_inventory(product_id):
         if operation not in ['set', 'add', 'subtract']:
             return error_response("Nieprawidłowa operacja. Dozwolone: set, add, subtract", 400)
         
-        # Pobierz aktualny stan
-        current_stock_sql = "SELECT stan_magazynowy FROM produkty WHERE id = ?"
-        current_result = execute_query(current_stock_sql, (product_id,))
+        location_id = data.get('location_id') or request.args.get('location_id', type=int) or DEFAULT_LOCATION_ID
         
-        if not current_result:
+        if not execute_query("SELECT id FROM produkty WHERE id = ?", (product_id,)):
             return not_found_response(f"Produkt o ID {product_id} nie został znaleziony")
         
-        current_stock = current_result[0]['stan_magazynowy'] or 0
+        # Pobierz aktualny stan lokalizacji
+        current_stock = stock_ledger.on_hand(product_id, location_id)['on_hand']
         
         # Oblicz nowy stan
         if operation == 'set':
@@ -484,21 +481,19 @@ def update_inventory(product_id):
             if new_stock < 0:
                 return error_response("Stan magazynowy nie może być ujemny", 400)
         
-        # Aktualizuj stan
-        from utils.database import execute_insert
-        update_sql = "UPDATE produkty SET stan_magazynowy = ?, data_modyfikacji = datetime('now') WHERE id = ?"
-        success = execute_insert(update_sql, (new_stock, product_id))
+        # Korekta jako ruch w księdze magazynowej
+        stock_ledger.post([ledger_movement(product_id, location_id, new_stock - current_stock, 'adjustment',
+                                           'product_inventory', product_id,
+                                           note=f"Korekta stanu ({operation})")])
         
-        if success:
-            return success_response({
-                'product_id': product_id,
-                'old_stock': current_stock,
-                'new_stock': new_stock,
-                'operation': operation,
-                'quantity': quantity
-            }, "Stan magazynowy zaktualizowany")
-        else:
-            return error_response("Błąd aktualizacji stanu magazynowego", 500)
+        return success_response({
+            'product_id': product_id,
+            'location_id': location_id,
+            'old_stock': current_stock,
+            'new_stock': new_stock,
+            'operation': operation,
+            'quantity': quantity
+        }, "Stan magazynowy zaktualizowany")
         
     except Exception as e:
         return error_response(f"Błąd aktualizacji stanu: {str(e)}", 500)
@@ -513,7 +508,7 @@ def get_products_stats():
         location_id = request.args.get('location_id')
         warehouse_id = request.args.get('warehouse_id')
         
-        debug_print(f"🔍 DEBUG: Starting products stats, location_id={location_id}, warehouse_id={warehouse_id}")
+        logger.debug("Starting products stats, location_id=%s, warehouse_id=%s", location_id, warehouse_id)
         
         # Jeśli mamy location_id, pobierz statystyki z pos_magazyn dla tej lokalizacji
         if location_id:
@@ -561,11 +556,11 @@ def get_products_stats():
                     'location_id': location_id
                 }
                 
-                debug_print(f"✅ Stats for location {location_id}: total={total_products}, in_stock={in_stock}, low_stock={low_stock}")
+                logger.debug("Stats for location %s: total=%s, in_stock=%s, low_stock=%s", location_id, total_products, in_stock, low_stock)
                 return success_response(stats, "Statystyki magazynu dla lokalizacji")
                 
             except Exception as e:
-                debug_print(f"❌ Error getting location stats: {e}")
+                logger.debug("Error getting location stats: %s", e)
                 import traceback
                 traceback.print_exc()
         
@@ -601,14 +596,14 @@ def get_products_stats():
             table_name = table_config['name']
             
             try:
-                debug_print(f"🔍 DEBUG: Trying table {table_name}")
+                logger.debug("Trying table %s", table_name)
                 
                 # Sprawdź czy tabela istnieje
                 check_sql = f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'"
                 table_exists = execute_query(check_sql, ())
                 
                 if not table_exists:
-                    debug_print(f"❌ Table {table_name} does not exist")
+                    logger.debug("Table %s does not exist", table_name)
                     continue
                 
                 # Podstawowe statystyki (COUNT zawsze działa)
@@ -625,7 +620,7 @@ def get_products_stats():
                         'table_used': table_name
                     }
                     table_used = table_name
-                    debug_print(f"✅ Basic stats from {table_name}: {stats['total_products']} products")
+                    logger.debug("Basic stats from %s: %s products", table_name, stats['total_products'])
                     
                     # Spróbuj dodać więcej statystyk bezpiecznie
                     cols = table_config['columns']
@@ -637,7 +632,7 @@ def get_products_stats():
                         if price_result and price_result[0]['avg_price']:
                             stats['avg_price'] = float(price_result[0]['avg_price'])
                     except Exception as e:
-                        debug_print(f"⚠️ Could not get avg price: {e}")
+                        logger.debug("Could not get avg price: %s", e)
                     
                     # Kategorie
                     try:
@@ -646,7 +641,7 @@ def get_products_stats():
                         if cat_result:
                             stats['categories_count'] = cat_result[0]['categories_count']
                     except Exception as e:
-                        debug_print(f"⚠️ Could not get categories: {e}")
+                        logger.debug("Could not get categories: %s", e)
                     
                     # Stan magazynowy (jeśli istnieje kolumna)
                     if cols['stock'] is not None:
@@ -662,19 +657,19 @@ def get_products_stats():
                                 stats['in_stock'] = stock_result[0]['in_stock'] or 0
                                 stats['out_of_stock'] = stock_result[0]['out_of_stock'] or 0
                         except Exception as e:
-                            debug_print(f"⚠️ Could not get stock info: {e}")
+                            logger.debug("Could not get stock info: %s", e)
                     else:
-                        debug_print(f"⚠️ No stock column for table {table_name}, skipping stock stats")
+                        logger.debug("No stock column for table %s, skipping stock stats", table_name)
                     
                     break  # Udało się pobrać dane, przerwij pętlę
                     
             except Exception as e:
-                debug_print(f"❌ Error with table {table_name}: {e}")
+                logger.debug("Error with table %s: %s", table_name, e)
                 continue
         
         # Jeśli nie udało się pobrać z żadnej tabeli, zwróć domyślne wartości
         if not stats:
-            debug_print("⚠️ No product tables found, returning default stats")
+            logger.debug("No product tables found, returning default stats")
             stats = {
                 'total_products': 0,
                 'in_stock': 0,
@@ -684,11 +679,11 @@ def get_products_stats():
                 'table_used': 'none_found'
             }
         
-        debug_print(f"✅ DEBUG: Final stats: {stats}")
+        logger.debug("Final stats: %s", stats)
         return success_response(stats, "Statystyki produktów")
         
     except Exception as e:
-        debug_print(f"❌ CRITICAL ERROR in products stats: {e}")
+        logger.debug("CRITICAL ERROR in products stats: %s", e)
         import traceback
         traceback.print_exc()
         
@@ -724,7 +719,7 @@ def get_inventory():
         params = []
         conditions = []
         
-        debug_print(f"🔍 DEBUG inventory - używam pos_magazyn, available_only: {available_only}, location_id: {location_id}, warehouse_id: {warehouse_id}")
+        logger.debug("inventory - używam pos_magazyn, available_only: %s, location_id: %s, warehouse_id: %s", available_only, location_id, warehouse_id)
         
         # Dodaj location_id jako pierwszy parametr dla warehouse join
         if location_id:
@@ -788,7 +783,7 @@ def get_inventory():
         # Lokalizacja jest już obsługiwana w JOIN - nie potrzebujemy dodatkowego warunku WHERE
         # Produkty bez wpisu w pos_magazyn dla danej lokalizacji pokażą stan=0
         if location_id:
-            debug_print(f"🔍 DEBUG używam lokalizacji w JOIN: {location_id}")
+            logger.debug("używam lokalizacji w JOIN: %s", location_id)
             
         # TODO: W przyszłości można dodać filtrowanie według konkretnego magazynu
         # jeśli warehouse_id zostanie zmapowane na pos_magazyn
@@ -803,15 +798,15 @@ def get_inventory():
         sql_query = base_sql + " ORDER BY COALESCE(pm.stan_aktualny, 0) DESC, p.nazwa ASC LIMIT ? OFFSET ?"
         params.extend([limit, offset])
         
-        debug_print(f"🔍 DEBUG SQL: {sql_query}")
-        debug_print(f"🔍 DEBUG params: {params}")
+        logger.debug("SQL: %s", sql_query)
+        logger.debug("params: %s", params)
         
         products = execute_query(sql_query, params)
         
         if products is None:
             return error_response("Błąd połączenia z bazą danych", 500)
         
-        debug_print(f"🔍 DEBUG znaleziono {len(products)} produktów")
+        logger.debug("znaleziono %s produktów", len(products))
         
         # Aktualizuj ceny zakupu używając margin_service
         for product in products:
@@ -824,9 +819,9 @@ def get_inventory():
                 # Zastąp cenę z tabeli produkty na cenę z margin_service
                 product['purchase_price'] = purchase_price
                 product['purchase_price_method'] = method
-                debug_print(f"🔍 DEBUG Produkt {product['id']}: cena zakupu {purchase_price} ({method})")
+                logger.debug("Produkt %s: cena zakupu %s (%s)", product['id'], purchase_price, method)
             except Exception as e:
-                debug_print(f"⚠️ Błąd pobierania ceny zakupu dla produktu {product['id']}: {e}")
+                logger.error("Błąd pobierania ceny zakupu dla produktu %s: %s", product['id'], e)
                 # Zostaw oryginalną cenę w przypadku błędu
         
         # Policz wszystkie produkty dla paginacji
@@ -905,7 +900,7 @@ def get_inventory():
 def get_inventory_history(product_id):
     """
     Historia ruchów magazynowych dla produktu
-    GET /api/products/123/inventory/history?limit=50
+    GET /api/products/123/inventory/history?limit=50&location_id=5
     """
     try:
         limit = int(request.args.get('limit', 50))
@@ -917,53 +912,25 @@ def get_inventory_history(product_id):
         if not product_result:
             return not_found_response(f"Produkt o ID {product_id} nie został znaleziony")
         
-        # Pobierz historię ruchów - może być w różnych tabelach
-        history_queries = [
-            """
-            SELECT 
-                id,
-                'manual' as type,
-                ilosc as quantity,
-                stan_przed as stock_before,
-                stan_po as stock_after,
-                powod as reason,
-                uzytkownik as user,
-                data_utworzenia as created_at
-            FROM pos_ruchy_magazynowe 
-            WHERE produkt_id = ?
-            ORDER BY data_utworzenia DESC
-            LIMIT ?
-            """,
-            """
-            SELECT 
-                tp.id,
-                'sale' as type,
-                -tp.ilosc as quantity,
-                NULL as stock_before,
-                NULL as stock_after,
-                'Sprzedaż' as reason,
-                t.kasjer as user,
-                t.data_transakcji as created_at
-            FROM transakcje_produkty tp
-            JOIN transakcje t ON tp.transakcja_id = t.id
-            WHERE tp.produkt_id = ?
-            ORDER BY t.data_transakcji DESC
-            LIMIT ?
-            """
-        ]
-        
-        history = []
-        for sql in history_queries:
-            try:
-                result = execute_query(sql, (product_id, limit))
-                if result:
-                    history.extend(result)
-            except:
-                continue
+        location_id = request.args.get('location_id', type=int)
         
-        # Sortuj według daty
-        history.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        history = history[:limit]  # Ogranicz do limitu
+        # Historia z księgi ruchów; stan po ruchu to suma narastająca w obrębie lokalizacji
+        stock_ledger.ensure_schema()
+        location_filter = "AND location_id = ?" if location_id else ""
+        params = [product_id] + ([location_id] if location_id else []) + [limit]
+        history = execute_query(f"""
+            SELECT id, movement_type AS type, location_id, quantity,
+                   stock_after - quantity AS stock_before, stock_after,
+                   COALESCE(note, document_number) AS reason, document_type, document_id,
+                   document_number, created_by AS user, created_at
+            FROM (
+                SELECT *, SUM(quantity) OVER (PARTITION BY location_id ORDER BY id) AS stock_after
+                FROM stock_ledger
+                WHERE product_id = ? {location_filter}
+            )
+            ORDER BY id DESC
+            LIMIT ?
+        """, params) or []
         
         return success_response({
             'product': product_result[0],
@@ -979,7 +946,7 @@ def batch_update_inventory():
     """
     Masowa aktualizacja stanów magazynowych
     POST /api/products/inventory/batch-update
-    Body: {"updates": [{"product_id": 1, "stock_quantity": 50, "operation": "set"}]}
+    Body: {"updates": [{"product_id": 1, "stock_quantity": 50, "operation": "set"}], "location_id": 5}
     """
     try:
         data = request.get_json()
@@ -990,9 +957,21 @@ def batch_update_inventory():
         if not isinstance(updates, list):
             return error_response("Updates musi być listą", 400)
         
+        location_id = data.get('location_id') or DEFAULT_LOCATION_ID
         results = []
         errors = []
         
+        product_ids = [u.get('product_id') for u in updates if u.get('product_id')]
+        existing = set()
+        if product_ids:
+            placeholders = ','.join('?' * len(product_ids))
+            existing = {row['id'] for row in execute_query(
+                f"SELECT id FROM produkty WHERE id IN ({placeholders})", product_ids
+            ) or []}
+        # Stany lokalizacji jednym odczytem, zmiany jedną partią ruchów
+        stocks = stock_ledger.on_hand_many(existing, location_id) if existing else {}
+        movements = []
+        
         for update in updates:
             try:
                 product_id = update.get('product_id')
@@ -1003,15 +982,11 @@ def batch_update_inventory():
                     errors.append({"error": "Brak product_id", "update": update})
                     continue
                 
-                # Pobierz aktualny stan
-                current_stock_sql = "SELECT stan_magazynowy FROM produkty WHERE id = ?"
-                current_result = execute_query(current_stock_sql, (product_id,))
-                
-                if not current_result:
+                if product_id not in existing:
                     errors.append({"error": f"Produkt {product_id} nie istnieje", "update": update})
                     continue
                 
-                current_stock = current_result[0]['stan_magazynowy'] or 0
+                current_stock = stocks[product_id]
                 
                 # Oblicz nowy stan
                 if operation == 'set':
@@ -1027,25 +1002,24 @@ def batch_update_inventory():
                     errors.append({"error": f"Nieprawidłowa operacja: {operation}", "update": update})
                     continue
                 
-                # Aktualizuj stan
-                from utils.database import execute_insert
-                update_sql = "UPDATE produkty SET stan_magazynowy = ?, data_modyfikacji = datetime('now') WHERE id = ?"
-                success = execute_insert(update_sql, (new_stock, product_id))
-                
-                if success:
-                    results.append({
-                        'product_id': product_id,
-                        'old_stock': current_stock,
-                        'new_stock': new_stock,
-                        'operation': operation,
-                        'quantity': quantity
-                    })
-                else:
-                    errors.append({"error": f"Błąd aktualizacji produktu {product_id}", "update": update})
+                stocks[product_id] = new_stock
+                movements.append(ledger_movement(product_id, location_id, new_stock - current_stock, 'adjustment',
+                                                 'product_inventory', product_id,
+                                                 note=f"Masowa korekta stanu ({operation})"))
+                results.append({
+                    'product_id': product_id,
+                    'old_stock': current_stock,
+                    'new_stock': new_stock,
+                    'operation': operation,
+                    'quantity': quantity
+                })
                     
             except Exception as e:
                 errors.append({"error": str(e), "update": update})
         
+        if movements:
+            stock_ledger.post(movements)
+        
         response_data = {
             'successful_updates': len(results),
             'failed_updates': len(errors),
@@ -1089,7 +1063,7 @@ def update_product(product_id):
         if not data:
             return error_response("Brak danych JSON", 400)
         
-        debug_print(f"🔍 UPDATE PRODUCT {product_id}: {data}")
+        logger.debug("UPDATE PRODUCT %s: %s", product_id, data)
         
         # Walidacja wymaganych pól - sprawdź 'name' lub 'nazwa'
         product_name = data.get('name') or data.get('nazwa')
@@ -1140,9 +1114,9 @@ def update_product(product_id):
             cat_result = execute_query(cat_check_sql, (category_id,))
             if cat_result:
                 category = cat_result[0]['nazwa']  # Ustaw nazwę kategorii dla kompatybilności
-                debug_print(f"🔍 Ustawiono category='{category}' dla category_id={category_id}")
+                logger.debug("Ustawiono category='%s' dla category_id=%s", category, category_id)
             else:
-                debug_print(f"⚠️ Nie znaleziono kategorii o ID {category_id}")
+                logger.debug("Nie znaleziono kategorii o ID %s", category_id)
                 category_id = None  # ID nie istnieje, resetuj
             
         unit = safe_get_string(data, 'unit', 'szt') or safe_get_string(data, 'jednostka', 'szt')
@@ -1284,8 +1258,8 @@ def update_product(product_id):
         update_sql = f"UPDATE produkty SET {', '.join(update_fields)} WHERE id = ?"
         update_params.append(product_id)
         
-        debug_print(f"🔍 SQL UPDATE: {update_sql}")
-        debug_print(f"🔍 Parametry: {update_params}")
+        logger.debug("SQL UPDATE: %s", update_sql)
+        logger.debug("Parametry: %s", update_params)
         
         success = execute_insert(update_sql, update_params)
         
@@ -1322,7 +1296,7 @@ def update_product(product_id):
     except ValueError as e:
         return error_response(f"Błąd walidacji danych: {str(e)}", 400)
     except Exception as e:
-        debug_print(f"Błąd aktualizacji produktu: {e}")
+        logger.error("Błąd aktualizacji produktu: %s", e)
         return error_response("Wystąpił błąd podczas aktualizacji produktu", 500)
 
 @products_bp.route('/products', methods=['POST'])
@@ -1417,7 +1391,7 @@ def create_product():
     except ValueError as e:
         return error_response(f"Błąd walidacji danych: {str(e)}", 400)
     except Exception as e:
-        debug_print(f"Błąd tworzenia produktu: {e}")
+        logger.error("Błąd tworzenia produktu: %s", e)
         return error_response("Wystąpił błąd podczas tworzenia produktu", 500)
 
 @products_bp.route('/products/<int:product_id>', methods=['DELETE'])
@@ -1468,7 +1442,7 @@ def delete_product(product_id):
             return error_response("Błąd usuwania produktu", 500)
         
     except Exception as e:
-        debug_print(f"Błąd usuwania produktu: {e}")
+        logger.error("Błąd usuwania produktu: %s", e)
         return error_response("Wystąpił błąd podczas usuwania produktu", 500)
 
 @products_bp.route('/products/<int:product_id>/manufacturer', methods=['PUT'])
@@ -1502,7 +1476,7 @@ def update_product_manufacturer(product_id):
             return error_response("Błąd podczas aktualizacji producenta", 500)
             
     except Exception as e:
-        debug_print(f"Błąd aktualizacji producenta produktu: {e}")
+        logger.error("Błąd aktualizacji producenta produktu: %s", e)
         return error_response("Wystąpił błąd podczas aktualizacji producenta", 500)
 
 @products_bp.route('/products/<int:product_id>/simplified-name', methods=['PUT'])
@@ -1530,7 +1504,7 @@ def update_product_simplified_name(product_id):
             return error_response("Błąd podczas aktualizacji uproszczonej nazwy", 500)
             
     except Exception as e:
-        debug_print(f"Błąd aktualizacji uproszczonej nazwy: {e}")
+        logger.error("Błąd aktualizacji uproszczonej nazwy: %s", e)
         return error_response("Wystąpił błąd podczas aktualizacji uproszczonej nazwy", 500)
 
 @products_bp.route('/products/bulk-update-manufacturer', methods=['POST'])
@@ -1566,7 +1540,7 @@ def bulk_update_manufacturer():
             return error_response("Błąd podczas masowej aktualizacji producenta", 500)
             
     except Exception as e:
-        debug_print(f"Błąd masowej aktualizacji producenta: {e}")
+        logger.error("Błąd masowej aktualizacji producenta: %s", e)
         return error_response("Wystąpił błąd podczas masowej aktualizacji producenta", 500)
 
 @products_bp.route('/products/<int:product_id>/history', methods=['GET'])
@@ -1581,22 +1555,22 @@ def get_product_history(product_id):
         warehouse_id = request.args.get('warehouse_id')
         
         # Sprawdź czy produkt istnieje
-        debug_print(f"🔍 PRODUCT CHECK SQL: SELECT nazwa FROM produkty WHERE id = {product_id}")
+        logger.debug("PRODUCT CHECK SQL: SELECT nazwa FROM produkty WHERE id = %s", product_id)
         product_check = execute_query("SELECT nazwa FROM produkty WHERE id = ?", [product_id])
-        debug_print(f"🔍 PRODUCT CHECK RESULT: {product_check}")
+        logger.debug("PRODUCT CHECK RESULT: %s", product_check)
         if not product_check:
             return not_found_response("Produkt nie został znaleziony")
         
         product_name = product_check[0]['nazwa']
-        debug_print(f"🔍 PRODUCT NAME: {product_name}")
+        logger.debug("PRODUCT NAME: %s", product_name)
         
         # Sprawdź strukturę tabel
         tables_check = execute_query("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('pos_transakcje', 'pos_transakcje_pozycje')")
-        debug_print(f"🔍 TABLES CHECK: {tables_check}")
+        logger.debug("TABLES CHECK: %s", tables_check)
         
         # Sprawdź kolumny w pos_transakcje_pozycje
         columns_check = execute_query("PRAGMA table_info(pos_transakcje_pozycje)")
-        debug_print(f"🔍 COLUMNS in pos_transakcje_pozycje: {columns_check}")
+        logger.debug("COLUMNS in pos_transakcje_pozycje: %s", columns_check)
         
         # 1. Historia sprzedaży z transakcji
         sales_sql = """
@@ -1630,10 +1604,10 @@ def get_product_history(product_id):
         sales_sql += " ORDER BY t.data_transakcji DESC, t.czas_transakcji DESC LIMIT ?"
         params_sales.append(limit)
         
-        debug_print(f"🔍 SALES SQL: {sales_sql}")
-        debug_print(f"🔍 SALES PARAMS: {params_sales}")
+        logger.debug("SALES SQL: %s", sales_sql)
+        logger.debug("SALES PARAMS: %s", params_sales)
         sales_history = execute_query(sales_sql, params_sales) or []
-        debug_print(f"🔍 SALES RESULTS: {len(sales_history)} rows")
+        logger.debug("SALES RESULTS: %s rows", len(sales_history))
         
         # 2. Historia zmian magazynowych z warehouse_history
         inventory_sql = """
@@ -1662,12 +1636,12 @@ def get_product_history(product_id):
         
         # Sprawdź czy tabela warehouse_history istnieje
         try:
-            debug_print(f"🔍 INVENTORY SQL: {inventory_sql}")
-            debug_print(f"🔍 INVENTORY PARAMS: {params_inventory}")
+            logger.debug("INVENTORY SQL: %s", inventory_sql)
+            logger.debug("INVENTORY PARAMS: %s", params_inventory)
             inventory_history = execute_query(inventory_sql, params_inventory) or []
-            debug_print(f"🔍 INVENTORY RESULTS: {len(inventory_history)} rows")
+            logger.debug("INVENTORY RESULTS: %s rows", len(inventory_history))
         except Exception as e:
-            debug_print(f"❌ INVENTORY ERROR: {e}")
+            logger.debug("INVENTORY ERROR: %s", e)
             inventory_history = []
         
         # 3. Historia zmian cen z v_location_prices_history
@@ -1705,12 +1679,12 @@ def get_product_history(product_id):
         
         # Sprawdź czy view v_location_prices_history istnieje
         try:
-            debug_print(f"🔍 PRICE SQL: {price_sql}")
-            debug_print(f"🔍 PRICE PARAMS: {params_price}")
+            logger.debug("PRICE SQL: %s", price_sql)
+            logger.debug("PRICE PARAMS: %s", params_price)
             price_history = execute_query(price_sql, params_price) or []
-            debug_print(f"🔍 PRICE RESULTS: {len(price_history)} rows")
+            logger.debug("PRICE RESULTS: %s rows", len(price_history))
         except Exception as e:
-            debug_print(f"❌ PRICE ERROR: {e}")
+            logger.debug("PRICE ERROR: %s", e)
             price_history = []
         
         # Połącz wszystkie historie i posortuj chronologicznie
@@ -1752,5 +1726,5 @@ def get_product_history(product_id):
     except ValueError:
         return error_response("Parametr 'limit' musi być liczbą", 400)
     except Exception as e:
-        debug_print(f"Błąd pobierania historii produktu {product_id}: {e}")
+        logger.error("Błąd pobierania historii produktu %s: %s", product_id, e)
         return error_response("Wystąpił błąd podczas pobierania historii produktu", 500)
@@ -6,14 +6,20 @@ Na podstawie oryginalnego modułu z V1
 
 from flask import Blueprint, request, jsonify, current_app
 from utils.database import execute_query, execute_insert, success_response, error_response, not_found_response
+from utils.margin_manager import margin_manager
+from utils.moving_average import moving_average
+from utils.stock_ledger import stock_ledger
 from werkzeug.utils import secure_filename
 from datetime import datetime, date
+import logging
 import json
 import os
 import xml.etree.ElementTree as ET
 import tempfile
 import uuid
 
+logger = logging.getLogger(__name__)
+
 purchase_invoices_bp = Blueprint('purchase_invoices', __name__)
 
 # ===========================================
@@ -81,7 +87,7 @@ def get_menu_stats():
         }, "Statystyki menu faktur zakupowych")
         
     except Exception as e:
-        print(f"Błąd pobierania statystyk menu: {e}")
+        logger.error("Błąd pobierania statystyk menu: %s", e)
         return error_response("Wystąpił błąd podczas pobierania statystyk", 500)
 
 # ===========================================
@@ -224,7 +230,7 @@ def get_purchase_invoices():
     except ValueError as e:
         return error_response(f"Błędne parametry: {e}", 400)
     except Exception as e:
-        print(f"Błąd pobierania faktur zakupowych: {e}")
+        logger.error("Błąd pobierania faktur zakupowych: %s", e)
         return error_response("Wystąpił błąd podczas pobierania faktur", 500)
 
 # ===========================================
@@ -297,7 +303,7 @@ def get_purchase_invoice_details(invoice_id):
         return success_response(invoice, "Szczegóły faktury zakupowej")
         
     except Exception as e:
-        print(f"Błąd pobierania szczegółów faktury: {e}")
+        logger.error("Błąd pobierania szczegółów faktury: %s", e)
         return error_response("Wystąpił błąd podczas pobierania faktury", 500)
 
 # ===========================================
@@ -363,7 +369,7 @@ def update_purchase_invoice(invoice_id):
         )
         
     except Exception as e:
-        print(f"Błąd aktualizacji faktury: {e}")
+        logger.error("Błąd aktualizacji faktury: %s", e)
         return error_response("Wystąpił błąd podczas aktualizacji faktury", 500)
 
 # ===========================================
@@ -426,7 +432,7 @@ def import_invoice_xml():
                 os.remove(temp_path)
         
     except Exception as e:
-        print(f"Błąd importu XML: {e}")
+        logger.error("Błąd importu XML: %s", e)
         error_msg = str(e)
         if "UNIQUE constraint failed: faktury_zakupowe.numer_faktury" in error_msg:
             return error_response("Faktura o podanym numerze już istnieje w systemie", 409)
@@ -565,14 +571,14 @@ def parse_optima_invoice(root):
         invoice_data = {}
         items_data = []
         
-        print(f"DEBUG: Root tag: {root.tag}")
-        print(f"DEBUG: Root text: {root.text}")
+        logger.debug("Root tag: %s", root.tag)
+        logger.debug("Root text: %s", root.text)
         
         # Sprawdź namespace
         namespace = ''
         if '}' in root.tag:
             namespace = root.tag.split('}')[0] + '}'
-            print(f"DEBUG: Detected namespace: {namespace}")
+            logger.debug("Detected namespace: %s", namespace)
         
         # Znajdź dokument
         if namespace:
@@ -583,9 +589,9 @@ def parse_optima_invoice(root):
         if document is None:
             document = root
         
-        print(f"DEBUG: Document found: {document is not None}")
+        logger.debug("Document found: %s", document is not None)
         if document is not None:
-            print(f"DEBUG: Document tag: {document.tag}")
+            logger.debug("Document tag: %s", document.tag)
         
         # Nagłówek
         if namespace:
@@ -593,7 +599,7 @@ def parse_optima_invoice(root):
         else:
             naglowek = document.find('.//NAGLOWEK')
             
-        print(f"DEBUG: Naglowek found: {naglowek is not None}")
+        logger.debug("Naglowek found: %s", naglowek is not None)
         
         if naglowek is not None:
             # Numer faktury
@@ -602,10 +608,10 @@ def parse_optima_invoice(root):
             else:
                 numer_elem = naglowek.find('.//NUMER_PELNY')
                 
-            print(f"DEBUG: Numer element: {numer_elem}")
-            print(f"DEBUG: Numer text: {numer_elem.text if numer_elem is not None else 'None'}")
+            logger.debug("Numer element: %s", numer_elem)
+            logger.debug("Numer text: %s", numer_elem.text if numer_elem is not None else 'None')
             numer_pelny = numer_elem.text if numer_elem is not None else ''
-            print(f"DEBUG: Numer pelny extracted: '{numer_pelny}'")
+            logger.debug("Numer pelny extracted: '%s'", numer_pelny)
             invoice_data['numer_faktury'] = numer_pelny
             
             # Data faktury
@@ -614,10 +620,10 @@ def parse_optima_invoice(root):
             else:
                 data_elem = naglowek.find('.//DATA_DOKUMENTU')
                 
-            print(f"DEBUG: Data element: {data_elem}")
-            print(f"DEBUG: Data text: {data_elem.text if data_elem is not None else 'None'}")
+            logger.debug("Data element: %s", data_elem)
+            logger.debug("Data text: %s", data_elem.text if data_elem is not None else 'None')
             data_faktury = data_elem.text if data_elem is not None else ''
-            print(f"DEBUG: Data faktury extracted: '{data_faktury}'")
+            logger.debug("Data faktury extracted: '%s'", data_faktury)
             invoice_data['data_faktury'] = data_faktury
             
             # Data wystawienia
@@ -654,7 +660,7 @@ def parse_optima_invoice(root):
             pozycje = document.find(f'.//{namespace}POZYCJE')
         else:
             pozycje = document.find('.//POZYCJE')
-        print(f"DEBUG: Pozycje found: {pozycje is not None}")
+        logger.debug("Pozycje found: %s", pozycje is not None)
         suma_netto = 0.0
         suma_vat = 0.0
 
@@ -663,7 +669,7 @@ def parse_optima_invoice(root):
                 pozycje_list = pozycje.findall(f'.//{namespace}POZYCJA')
             else:
                 pozycje_list = pozycje.findall('.//POZYCJA')
-            print(f"DEBUG: Found {len(pozycje_list)} pozycji")
+            logger.debug("Found %s pozycji", len(pozycje_list))
             
             for pozycja in pozycje_list:
                 item_data = {}
@@ -731,7 +737,7 @@ def parse_optima_invoice(root):
         invoice_data['suma_brutto'] = suma_netto + suma_vat
         
         # Debug print
-        print(f"DEBUG: Parsed invoice_data przed dodaniem domyślnych: {invoice_data}")
+        logger.debug("Parsed invoice_data przed dodaniem domyślnych: %s", invoice_data)
         
         # Domyślne wartości
         if 'numer_faktury' not in invoice_data or not invoice_data['numer_faktury']:
@@ -746,8 +752,8 @@ def parse_optima_invoice(root):
         invoice_data['waluta'] = 'PLN'
         invoice_data['uwagi'] = f"Import z pliku XML Optima. Kod dostawcy: {invoice_data.get('dostawca_kod', 'brak')}"
         
-        print(f"DEBUG: Final invoice_data: {invoice_data}")
-        print(f"DEBUG: Items count: {len(items_data)}")
+        logger.debug("Final invoice_data: %s", invoice_data)
+        logger.debug("Items count: %s", len(items_data))
         
         return {
             'success': True,
@@ -820,7 +826,7 @@ def insert_invoice_to_database(invoice_data, items_data, xml_file_path):
         except Exception as e:
             if conn:
                 conn.close()
-            print(f"Błąd wykonania zapytania INSERT faktury: {e}")
+            logger.error("Błąd wykonania zapytania INSERT faktury: %s", e)
             # Przekaż błąd dalej
             raise e
         
@@ -863,19 +869,19 @@ def insert_invoice_to_database(invoice_data, items_data, xml_file_path):
             conn.close()
         
         # Automatyczne mapowanie pozycji po dodaniu faktury
-        print(f"DEBUG: Rozpoczynam automatyczne mapowanie dla faktury {invoice_id}")
+        logger.debug("Rozpoczynam automatyczne mapowanie dla faktury %s", invoice_id)
         mapping_result = auto_map_invoice_items(invoice_id)
         if mapping_result['success']:
-            print(f"DEBUG: Mapowanie zakończone - kod: {mapping_result['mapped_by_code']}, ean: {mapping_result['mapped_by_ean']}")
+            logger.debug("Mapowanie zakończone - kod: %s, ean: %s", mapping_result['mapped_by_code'], mapping_result['mapped_by_ean'])
         else:
-            print(f"DEBUG: Błąd mapowania: {mapping_result['error']}")
+            logger.warning("Błąd mapowania: %s", mapping_result['error'])
         
         return invoice_id
         
     except Exception as e:
-        print(f"Błąd zapisywania faktury do bazy: {e}")
-        print(f"Invoice data: {invoice_data}")
-        print(f"Items count: {len(items_data) if items_data else 0}")
+        logger.error("Błąd zapisywania faktury do bazy: %s", e)
+        logger.debug("Invoice data: %s", invoice_data)
+        logger.debug("Items count: %s", len(items_data) if items_data else 0)
         import traceback
         traceback.print_exc()
         # Przekaż błąd dalej, żeby można było obsłużyć UNIQUE constraint
@@ -929,7 +935,7 @@ def import_cennik_xml():
                 os.remove(temp_path)
         
     except Exception as e:
-        print(f"Błąd importu cennika: {e}")
+        logger.error("Błąd importu cennika: %s", e)
         return error_response(f"Wystąpił błąd podczas importu: {str(e)}", 500)
 
 @purchase_invoices_bp.route('/purchase-invoices/save-cennik', methods=['POST'])
@@ -954,18 +960,18 @@ def save_cennik_products():
         
         for product in products:
             try:
-                print(f"🔍 Przetwarzam produkt: {product.get('kod', 'BRAK_KODU')}")
+                logger.debug("Przetwarzam produkt: %s", product.get('kod', 'BRAK_KODU'))
                 
                 # Sprawdź czy produkt już istnieje
                 check_sql = "SELECT id FROM produkty WHERE kod_produktu = ? OR ean = ?"
                 kod = product.get('kod', '')
                 ean = product.get('ean', '')
                 
-                print(f"   Szukam po kod_produktu='{kod}' lub ean='{ean}'")
+                logger.debug("Szukam po kod_produktu='%s' lub ean='%s'", kod, ean)
                 existing = execute_query(check_sql, (kod, ean))
                 
                 if existing:
-                    print(f"   ✅ Znaleziono istniejący produkt ID: {existing[0]['id']}")
+                    logger.debug("Znaleziono istniejący produkt ID: %s", existing[0]['id'])
                     
                     # UWAGA: Cena z cennika to cena DETALICZNA (sprzedaży), nie zakupu!
                     # Aktualizujemy tylko ceny sprzedaży, NIE ZMIENIAMY cen zakupu
@@ -994,13 +1000,13 @@ def save_cennik_products():
                     
                     if success:
                         stats['updated'] += 1
-                        print(f"   ✅ Zaktualizowano produkt - cena sprzedaży: {cena_sprzedazy_netto}zł netto / {cena_sprzedazy_brutto}zł brutto (cena zakupu pozostała bez zmian)")
+                        logger.debug("Zaktualizowano produkt - cena sprzedaży: %szł netto / %szł brutto (cena zakupu pozostała bez zmian)", cena_sprzedazy_netto, cena_sprzedazy_brutto)
                     else:
                         stats['errors'].append(f"Błąd aktualizacji produktu {product.get('kod', '')}")
-                        print(f"   ❌ Błąd aktualizacji produktu")
+                        logger.error("Błąd aktualizacji produktu")
                         
                 else:
-                    print(f"   ➕ Tworzę nowy produkt")
+                    logger.debug("Tworzę nowy produkt")
                     # UWAGA: Cena z cennika to cena DETALICZNA (sprzedaży), nie zakupu!
                     # Dla nowych produktów ustaw tylko cenę sprzedaży, cena zakupu = 0 (do uzupełnienia)
                     cena_sprzedazy_brutto = product.get('cena_brutto', 0)
@@ -1031,10 +1037,10 @@ def save_cennik_products():
                     ))
                     if result:
                         stats['created'] += 1
-                        print(f"   ✅ Utworzono nowy produkt ID: {result} - cena sprzedaży: {cena_sprzedazy_netto}zł netto / {cena_sprzedazy_brutto}zł brutto")
+                        logger.debug("Utworzono nowy produkt ID: %s - cena sprzedaży: %szł netto / %szł brutto", result, cena_sprzedazy_netto, cena_sprzedazy_brutto)
                     else:
                         stats['errors'].append(f"Błąd dodawania produktu {product.get('kod', '')}")
-                        print(f"   ❌ Błąd dodawania produktu")
+                        logger.error("Błąd dodawania produktu")
                     
             except Exception as e:
                 stats['errors'].append(f"Błąd produktu {product.get('kod', '')}: {str(e)}")
@@ -1068,7 +1074,7 @@ def save_cennik_products():
         return success_response(stats, f"Import zakończony. Utworzono: {stats['created']}, zaktualizowano: {stats['updated']}")
         
     except Exception as e:
-        print(f"Błąd zapisywania cennika: {e}")
+        logger.error("Błąd zapisywania cennika: %s", e)
         return error_response(f"Wystąpił błąd podczas zapisywania: {str(e)}", 500)
 
 def parse_cennik_xml(file_path):
@@ -1081,8 +1087,8 @@ def parse_cennik_xml(file_path):
         
         products = []
         
-        print(f"🔍 Parser - root tag: {root.tag}")
-        print(f"🔍 Parser - szukam elementów TOWAR...")
+        logger.debug("Parser - root tag: %s", root.tag)
+        logger.debug("Parser - szukam elementów TOWAR...")
         
         # Parsuj produkty z XML - obsługa różnych struktur
         # Struktura 1: ROOT/TOWARY/TOWAR (z namespace)
@@ -1100,12 +1106,12 @@ def parse_cennik_xml(file_path):
         if not towary_elements:
             towary_elements = root.findall('TOWAR')
         
-        print(f"🔍 Parser - znaleziono {len(towary_elements)} elementów TOWAR")
+        logger.debug("Parser - znaleziono %s elementów TOWAR", len(towary_elements))
         
         for towar in towary_elements:
             try:
                 product = {}
-                print(f"🔍 Parser - przetwarzam element TOWAR")
+                logger.debug("Parser - przetwarzam element TOWAR")
                 
                 # Określ namespace dla wyszukiwania w elementach
                 ns = {}
@@ -1130,19 +1136,19 @@ def parse_cennik_xml(file_path):
                 
                 kod_text = find_element_text(towar, 'KOD')
                 product['kod'] = kod_text if kod_text else ''
-                print(f"   KOD: {product['kod']}")
+                logger.debug("KOD: %s", product['kod'])
                 
                 ean_text = find_element_text(towar, 'EAN')
                 product['ean'] = ean_text if ean_text else ''
-                print(f"   EAN: {product['ean']}")
+                logger.debug("EAN: %s", product['ean'])
                 
                 nazwa_text = find_element_text(towar, 'NAZWA')
                 product['nazwa'] = nazwa_text if nazwa_text else ''
-                print(f"   NAZWA: {product['nazwa']}")
+                logger.debug("NAZWA: %s", product['nazwa'])
                 
                 jm_text = find_element_text(towar, 'JM')
                 product['jednostka'] = jm_text if jm_text else 'szt.'
-                print(f"   JM: {product['jednostka']}")
+                logger.debug("JM: %s", product['jednostka'])
                 
                 # VAT - spróbuj różne struktury
                 stawka_vat_elem = towar.find('.//STAWKA')
@@ -1160,7 +1166,7 @@ def parse_cennik_xml(file_path):
                         product['stawka_vat'] = 23.0
                 else:
                     product['stawka_vat'] = 23.0
-                print(f"   VAT: {product['stawka_vat']}")
+                logger.debug("VAT: %s", product['stawka_vat'])
                 
                 # Cena - spróbuj różne struktury
                 cena_elem = towar.find('.//WARTOSC')
@@ -1183,13 +1189,13 @@ def parse_cennik_xml(file_path):
                     product['cena_brutto'] = 0.0
                     product['cena_netto'] = 0.0
                 
-                print(f"   CENA: {product['cena_brutto']}")
+                logger.debug("CENA: %s", product['cena_brutto'])
                 
                 if product['kod'] or product['ean']:  # Dodaj tylko jeśli ma kod lub EAN
                     products.append(product)
                 
             except Exception as e:
-                print(f"Błąd parsowania produktu: {e}")
+                logger.error("Błąd parsowania produktu: %s", e)
                 continue
         
         return {
@@ -1305,7 +1311,7 @@ def auto_map_invoice_items(invoice_id):
                         cena_zakupu_brutto,  # stara kolumna kompatybilność
                         produkt_id
                     ))
-                    print(f"   📦 Zaktualizowano cenę zakupu produktu ID {produkt_id}: netto={cena_zakupu_netto:.2f} zł, brutto={cena_zakupu_brutto:.2f} zł za szt")
+                    logger.debug("Zaktualizowano cenę zakupu produktu ID %s: netto=%.2f zł, brutto=%.2f zł za szt", produkt_id, cena_zakupu_netto, cena_zakupu_brutto)
                 
             elif produkt_nazwa and nazwa_produktu != produkt_nazwa:
                 # Aktualizuj tylko nazwę jeśli produkt już był zmapowany
@@ -1331,7 +1337,7 @@ def auto_map_invoice_items(invoice_id):
     except Exception as e:
         if conn:
             conn.close()
-        print(f"Błąd automatycznego mapowania: {e}")
+        logger.error("Błąd automatycznego mapowania: %s", e)
         return {'success': False, 'error': str(e)}
 
 @purchase_invoices_bp.route('/purchase-invoices/<int:invoice_id>/auto-map', methods=['POST'])
@@ -1348,7 +1354,7 @@ def auto_map_invoice(invoice_id):
             return error_response(result.get('error', 'Błąd mapowania'), 500)
             
     except Exception as e:
-        print(f"Błąd automatycznego mapowania: {e}")
+        logger.error("Błąd automatycznego mapowania: %s", e)
         return error_response(f"Wystąpił błąd podczas mapowania: {str(e)}", 500)
 
 # ===========================================
@@ -1395,7 +1401,7 @@ def get_cennik_history():
         return success_response(history, "Historia importów pobrana pomyślnie")
         
     except Exception as e:
-        print(f"Błąd pobierania historii cennika: {e}")
+        logger.error("Błąd pobierania historii cennika: %s", e)
         return error_response(f"Wystąpił błąd podczas pobierania historii: {str(e)}", 500)
 
 @purchase_invoices_bp.route('/purchase-invoices/cennik-history/<int:history_id>/errors', methods=['GET'])
@@ -1431,7 +1437,7 @@ def get_cennik_history_errors(history_id):
                 details = json.loads(history_record['szczegóły_json'])
                 errors_details = details.get('errors', [])
             except Exception as e:
-                print(f"Błąd parsowania szczegółów JSON: {e}")
+                logger.error("Błąd parsowania szczegółów JSON: %s", e)
         
         # Formatuj datę
         formatted_date = history_record.get('data_importu', '')
@@ -1455,7 +1461,7 @@ def get_cennik_history_errors(history_id):
         return success_response(response_data, f"Szczegóły błędów dla importu {history_id}")
         
     except Exception as e:
-        print(f"Błąd pobierania szczegółów błędów: {e}")
+        logger.error("Błąd pobierania szczegółów błędów: %s", e)
         return error_response(f"Wystąpił błąd podczas pobierania szczegółów: {str(e)}", 500)
 
 # ===========================================
@@ -1466,9 +1472,14 @@ def get_cennik_history_errors(history_id):
 def update_purchase_prices_from_invoice(invoice_id):
     """
     Aktualizuje ceny zakupu produktów na podstawie zmapowanych pozycji faktury
+    oraz przecenia ruchomą średnią pozycji ujętych już przez PZ (w magazynie ich ujęcia)
+    margin_control: true - z kontrolą marż (korekta cen domyślnych z marżą <= 0, raporty marż)
     """
     try:
         from utils.database import get_db_connection
+        data = request.get_json(silent=True) or {}
+        stock_ledger.ensure_schema()
+        moving_average.ensure_schema()
         conn = get_db_connection()
         if not conn:
             return error_response('Błąd połączenia z bazą danych', 500)
@@ -1498,43 +1509,64 @@ def update_purchase_prices_from_invoice(invoice_id):
             return error_response("Brak zmapowanych pozycji w fakturze", 400)
         
         updated_count = 0
-        
-        for item in items:
-            produkt_id = item[1]
-            cena_netto_za_szt = item[2] or 0
-            wartosc_brutto_razem = item[3] or 0
-            ilosc = item[4] or 1
-            stawka_vat = item[5] or 0
+        margin_control = None
+        
+        if data.get('margin_control'):
+            # Kontrola marż dla całej faktury naraz: dwa zapytania, korekty i raporty przez executemany
+            margin_control = margin_manager.update_prices_with_margin_control_bulk([
+                (item[1], item[2] or 0, (item[2] or 0) * (1 + (item[5] or 0) / 100))
+                for item in items
+            ], created_by=data.get('created_by', 'system'), cursor=cursor)
+            updated_count = len(margin_control['products'])
+            logger.info("Zaktualizowano ceny zakupu %s produktów, korekty marż: %s", updated_count, margin_control['corrections'])
+        else:
+            for item in items:
+                produkt_id = item[1]
+                cena_netto_za_szt = item[2] or 0
+                wartosc_brutto_razem = item[3] or 0
+                ilosc = item[4] or 1
+                stawka_vat = item[5] or 0
             
-            # POPRAWKA: Oblicz cenę zakupu brutto za sztukę z ceny netto + VAT
-            cena_zakupu_netto = cena_netto_za_szt
-            cena_zakupu_brutto = cena_netto_za_szt * (1 + stawka_vat / 100) if cena_netto_za_szt > 0 else 0
+                # POPRAWKA: Oblicz cenę zakupu brutto za sztukę z ceny netto + VAT
+                cena_zakupu_netto = cena_netto_za_szt
+                cena_zakupu_brutto = cena_netto_za_szt * (1 + stawka_vat / 100) if cena_netto_za_szt > 0 else 0
             
-            # Aktualizuj cenę zakupu produktu
-            update_sql = """
-            UPDATE produkty 
-            SET cena_zakupu_netto = ?, cena_zakupu_brutto = ?, cena_zakupu = ?
-            WHERE id = ?
-            """
+                # Aktualizuj cenę zakupu produktu
+                update_sql = """
+                UPDATE produkty 
+                SET cena_zakupu_netto = ?, cena_zakupu_brutto = ?, cena_zakupu = ?
+                WHERE id = ?
+                """
             
-            cursor.execute(update_sql, (
-                cena_zakupu_netto,
-                cena_zakupu_brutto,
-                cena_zakupu_brutto,  # kompatybilność ze starą kolumną
-                produkt_id
-            ))
+                cursor.execute(update_sql, (
+                    cena_zakupu_netto,
+                    cena_zakupu_brutto,
+                    cena_zakupu_brutto,  # kompatybilność ze starą kolumną
+                    produkt_id
+                ))
             
-            updated_count += 1
-            print(f"   💰 Zaktualizowano cenę zakupu produktu ID {produkt_id}: netto={cena_zakupu_netto:.2f} zł za szt, brutto={cena_zakupu_brutto:.2f} zł za szt (z ilosci={ilosc})")
+                updated_count += 1
+                logger.debug("Zaktualizowano cenę zakupu produktu ID %s: netto=%.2f zł za szt, brutto=%.2f zł za szt (z ilosci=%s)", produkt_id, cena_zakupu_netto, cena_zakupu_brutto, ilosc)
+        
+        # Przecena pozycji ujętych w średniej - w tej samej transakcji; nowe pozycje ujmuje PZ,
+        # które zna magazyn przyjęcia
+        average = moving_average.apply_invoice(cursor, invoice_id, reprice_only=True)
         
         conn.commit()
         conn.close()
         
         return success_response({
             'updated_products': updated_count,
-            'invoice_id': invoice_id
+            'invoice_id': invoice_id,
+            'moving_average': average,
+            'margin_control': margin_control and {
+                'corrections': margin_control['corrections'],
+                'reports': margin_control['reports'],
+                'warnings': [dict(w, product_id=p['product_id'])
+                             for p in margin_control['products'] for w in p['warnings']]
+            }
         }, f"Zaktualizowano ceny zakupu dla {updated_count} produktów")
         
     except Exception as e:
-        print(f"Błąd aktualizacji cen zakupu: {e}")
+        logger.error("Błąd aktualizacji cen zakupu: %s", e)
         return error_response(f"Wystąpił błąd podczas aktualizacji cen: {str(e)}", 500)
@@ -5,6 +5,8 @@ Zarządzanie rabatami, stosowanie rabatów, raporty
 
 from flask import Blueprint, request, jsonify
 from utils.database import execute_query, execute_insert, success_response, error_response, not_found_response
+from utils.discount_limits import discount_limits
+from utils.pricing_engine import pricing_engine, serialize_scope
 from datetime import datetime, date
 import uuid
 
@@ -108,8 +110,9 @@ def create_rabat():
             nazwa, typ_rabatu, wartosc, opis, kod_rabatu, wymagane_uprawnienie,
             limit_miesieczny_aktywny, limit_miesieczny_kwota, limit_miesieczny_ilosc,
             limit_dzienny_aktywny, limit_dzienny_kwota, limit_dzienny_ilosc,
-            minimum_koszyka, maksimum_koszyka, created_by, location_id
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            minimum_koszyka, maksimum_koszyka, created_by, location_id,
+            automatyczny, priorytet, zakres_produktow, zakres_kategorii
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
         
         params = (
@@ -117,7 +120,7 @@ def create_rabat():
             data['typ_rabatu'],
             data['wartosc'],
             data.get('opis', ''),
-            data.get('kod_rabatu', ''),
+            data.get('kod_rabatu') or None,  # puste kody jako NULL (kolumna UNIQUE)
             data.get('wymagane_uprawnienie', 'pracownik'),
             data.get('limit_miesieczny_aktywny', 0),
             data.get('limit_miesieczny_kwota', 0),
@@ -128,12 +131,19 @@ def create_rabat():
             data.get('minimum_koszyka', 0),
             data.get('maksimum_koszyka', None),
             data.get('created_by', 'admin'),
-            data.get('location_id', None)
+            data.get('location_id', None),
+            1 if data.get('automatyczny') else 0,
+            int(data.get('priorytet', 0) or 0),
+            serialize_scope(data.get('zakres_produktow')),
+            serialize_scope(data.get('zakres_kategorii'))
         )
         
+        pricing_engine.ensure_schema()
         rabat_id = execute_insert(query, params)
         
         if rabat_id:
+            discount_limits.invalidate_rabat(rabat_id)
+            pricing_engine.invalidate()
             return success_response("Rabat został utworzony", {"rabat_id": rabat_id})
         else:
             return error_response("Nie udało się utworzyć rabatu", 500)
@@ -176,7 +186,7 @@ def update_rabat(rabat_id):
             'nazwa', 'typ_rabatu', 'wartosc', 'opis', 'kod_rabatu', 'wymagane_uprawnienie',
             'aktywny', 'limit_miesieczny_aktywny', 'limit_miesieczny_kwota', 'limit_miesieczny_ilosc',
             'limit_dzienny_aktywny', 'limit_dzienny_kwota', 'limit_dzienny_ilosc',
-            'minimum_koszyka', 'maksimum_koszyka', 'location_id'
+            'minimum_koszyka', 'maksimum_koszyka', 'location_id', 'automatyczny', 'priorytet'
         ]
         
         for field in updatable_fields:
@@ -184,13 +194,22 @@ def update_rabat(rabat_id):
                 update_fields.append(f"{field} = ?")
                 params.append(data[field])
         
+        # Zakres rabatu pozycyjnego - lista id produktów/kategorii zapisywana jako JSON
+        for field in ('zakres_produktow', 'zakres_kategorii'):
+            if field in data:
+                update_fields.append(f"{field} = ?")
+                params.append(serialize_scope(data[field]))
+        
         if not update_fields:
             return error_response("Brak danych do aktualizacji", 400)
             
         params.append(rabat_id)
         query = f"UPDATE rabaty SET {', '.join(update_fields)} WHERE id = ?"
         
+        pricing_engine.ensure_schema()
         result = execute_insert(query, params)
+        discount_limits.invalidate_rabat(rabat_id)
+        pricing_engine.invalidate()
         
         if result:
             return success_response("Rabat został zaktualizowany")
@@ -214,6 +233,8 @@ def delete_rabat(rabat_id):
             
         # Hard delete - całkowite usunięcie z bazy
         result = execute_insert("DELETE FROM rabaty WHERE id = ?", (rabat_id,))
+        discount_limits.invalidate_rabat(rabat_id)
+        pricing_engine.invalidate()
         
         if result:
             return success_response("Rabat został usunięty")
@@ -224,6 +245,36 @@ def delete_rabat(rabat_id):
         print(f"Błąd delete_rabat: {e}")
         return error_response(f"Błąd serwera: {e}", 500)
 
+def oblicz_rabat(rabat, kwota_koszyka, user_id=''):
+    """
+    Oblicz rabat dla koszyka: warunki koszyka i limity (liczniki w pamięci, bez zapytań do bazy)
+    Zwraca (wynik, None) albo (None, komunikat błędu)
+    """
+    if kwota_koszyka < (rabat['minimum_koszyka'] or 0):
+        return None, f"Minimalna wartość koszyka: {rabat['minimum_koszyka']} zł"
+        
+    if rabat['maksimum_koszyka'] and kwota_koszyka > rabat['maksimum_koszyka']:
+        return None, f"Maksymalna wartość koszyka: {rabat['maksimum_koszyka']} zł"
+    
+    limit_error = discount_limits.check(rabat, user_id)
+    if limit_error:
+        return None, limit_error
+    
+    if rabat['typ_rabatu'] == 'procentowy':
+        kwota_rabatu = (kwota_koszyka * rabat['wartosc']) / 100
+    else:  # kwotowy
+        kwota_rabatu = min(rabat['wartosc'], kwota_koszyka)  # Nie więcej niż wartość koszyka
+        
+    kwota_po_rabacie = kwota_koszyka - kwota_rabatu
+    
+    return {
+        "rabat": rabat,
+        "kwota_przed_rabatem": kwota_koszyka,
+        "kwota_rabatu": round(kwota_rabatu, 2),
+        "kwota_po_rabacie": round(kwota_po_rabacie, 2),
+        "procent_rabatu": round((kwota_rabatu / kwota_koszyka) * 100, 2) if kwota_koszyka > 0 else 0
+    }, None
+
 @rabaty_bp.route('/rabaty/calculate', methods=['POST'])
 def calculate_rabat():
     """
@@ -235,75 +286,15 @@ def calculate_rabat():
         if 'rabat_id' not in data or 'kwota_koszyka' not in data:
             return error_response("Pole rabat_id i kwota_koszyka są wymagane", 400)
             
-        rabat_id = data['rabat_id']
-        kwota_koszyka = float(data['kwota_koszyka'])
-        user_id = data.get('user_id', '')
-        
-        # Pobierz rabat
-        rabat = execute_query("SELECT * FROM rabaty WHERE id = ? AND aktywny = 1", (rabat_id,))
+        rabat = discount_limits.get_rabat(int(data['rabat_id']))
         if not rabat:
             return error_response("Rabat nie został znaleziony lub jest nieaktywny", 404)
-            
-        rabat = rabat[0]
-        
-        # Sprawdź minimum i maksimum koszyka
-        if kwota_koszyka < rabat['minimum_koszyka']:
-            return error_response(f"Minimalna wartość koszyka: {rabat['minimum_koszyka']} zł", 400)
-            
-        if rabat['maksimum_koszyka'] and kwota_koszyka > rabat['maksimum_koszyka']:
-            return error_response(f"Maksymalna wartość koszyka: {rabat['maksimum_koszyka']} zł", 400)
-        
-        # Sprawdź limity miesięczne
-        if rabat['limit_miesieczny_aktywny']:
-            limity_m = execute_query("""
-                SELECT wykorzystana_kwota, wykorzystana_ilosc 
-                FROM rabaty_limity_miesieczne 
-                WHERE rabat_id = ? AND user_id = ? AND miesiac_rok = strftime('%Y-%m', 'now')
-            """, (rabat_id, user_id))
-            
-            if limity_m:
-                limity_m = limity_m[0]
-                if (rabat['limit_miesieczny_kwota'] > 0 and 
-                    limity_m['wykorzystana_kwota'] >= rabat['limit_miesieczny_kwota']):
-                    return error_response("Przekroczony miesięczny limit kwotowy", 400)
-                    
-                if (rabat['limit_miesieczny_ilosc'] > 0 and 
-                    limity_m['wykorzystana_ilosc'] >= rabat['limit_miesieczny_ilosc']):
-                    return error_response("Przekroczony miesięczny limit ilościowy", 400)
-        
-        # Sprawdź limity dzienne
-        if rabat['limit_dzienny_aktywny']:
-            limity_d = execute_query("""
-                SELECT wykorzystana_kwota, wykorzystana_ilosc 
-                FROM rabaty_limity_dzienne 
-                WHERE rabat_id = ? AND user_id = ? AND dzien = date('now')
-            """, (rabat_id, user_id))
-            
-            if limity_d:
-                limity_d = limity_d[0]
-                if (rabat['limit_dzienny_kwota'] > 0 and 
-                    limity_d['wykorzystana_kwota'] >= rabat['limit_dzienny_kwota']):
-                    return error_response("Przekroczony dzienny limit kwotowy", 400)
-                    
-                if (rabat['limit_dzienny_ilosc'] > 0 and 
-                    limity_d['wykorzystana_ilosc'] >= rabat['limit_dzienny_ilosc']):
-                    return error_response("Przekroczony dzienny limit ilościowy", 400)
-        
-        # Oblicz rabat
-        if rabat['typ_rabatu'] == 'procentowy':
-            kwota_rabatu = (kwota_koszyka * rabat['wartosc']) / 100
-        else:  # kwotowy
-            kwota_rabatu = min(rabat['wartosc'], kwota_koszyka)  # Nie więcej niż wartość koszyka
-            
-        kwota_po_rabacie = kwota_koszyka - kwota_rabatu
-        
-        return success_response("Rabat obliczony", {
-            "rabat": rabat,
-            "kwota_przed_rabatem": kwota_koszyka,
-            "kwota_rabatu": round(kwota_rabatu, 2),
-            "kwota_po_rabacie": round(kwota_po_rabacie, 2),
-            "procent_rabatu": round((kwota_rabatu / kwota_koszyka) * 100, 2) if kwota_koszyka > 0 else 0
-        })
+        
+        wynik, blad = oblicz_rabat(rabat, float(data['kwota_koszyka']), data.get('user_id', ''))
+        if blad:
+            return error_response(blad, 400)
+        
+        return success_response("Rabat obliczony", wynik)
         
     except Exception as e:
         print(f"Błąd calculate_rabat: {e}")
@@ -313,6 +304,7 @@ def calculate_rabat():
 def apply_rabat():
     """
     Zastosuj rabat do transakcji
+    Limit sprawdzany jest w tej samej transakcji co zapis użycia (utils/discount_limits.py)
     """
     try:
         data = request.get_json()
@@ -322,7 +314,7 @@ def apply_rabat():
             if field not in data:
                 return error_response(f"Pole {field} jest wymagane", 400)
         
-        rabat_id = data['rabat_id']
+        rabat_id = int(data['rabat_id'])
         kwota_przed_rabatem = float(data['kwota_przed_rabatem'])
         transakcja_id = data['transakcja_id']
         user_id = data['user_id']
@@ -335,42 +327,39 @@ def apply_rabat():
         if transakcja[0]['status'] != 'w_trakcie':
             return error_response("Można zastosować rabat tylko do transakcji w trakcie", 400)
         
-        # Najpierw oblicz rabat (zawiera walidację)
-        calc_result = calculate_rabat()
-        calc_data = calc_result.get_json()
+        rabat = discount_limits.get_rabat(rabat_id)
+        if not rabat:
+            return error_response("Rabat nie został znaleziony lub jest nieaktywny", 404)
         
-        if calc_data['status'] != 'success':
-            return calc_result
+        # Najpierw oblicz rabat (zawiera walidację)
+        rabat_info, blad = oblicz_rabat(rabat, kwota_przed_rabatem, user_id)
+        if blad:
+            return error_response(blad, 400)
             
-        rabat_info = calc_data['data']
         kwota_rabatu = rabat_info['kwota_rabatu']
         kwota_po_rabacie = rabat_info['kwota_po_rabacie']
         
-        # Zapisz użycie rabatu
-        query = """
-        INSERT INTO rabaty_uzycie (
-            rabat_id, transakcja_id, user_id, kwota_przed_rabatem, 
-            kwota_rabatu, kwota_po_rabacie, notatka, ip_address
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        
-        params = (
-            rabat_id, transakcja_id, user_id, kwota_przed_rabatem,
-            kwota_rabatu, kwota_po_rabacie, 
-            data.get('notatka', ''), data.get('ip_address', '')
-        )
+        # Zapisz użycie rabatu - limit sprawdzany w transakcji zapisu
+        uzycie_id, blad = discount_limits.record_usage(rabat, user_id, {
+            'transakcja_id': transakcja_id,
+            'user_id': user_id,
+            'kwota_przed_rabatem': kwota_przed_rabatem,
+            'kwota_rabatu': kwota_rabatu,
+            'kwota_po_rabacie': kwota_po_rabacie,
+            'notatka': data.get('notatka', ''),
+            'ip_address': data.get('ip_address', '')
+        })
         
-        uzycie_id = execute_insert(query, params)
+        if blad:
+            return error_response(blad, 400)
         
         if uzycie_id:
-            # Aktualizuj transakcję
-            execute_query("""
+            # Aktualizuj kolumny rabatowe w transakcji
+            execute_insert("""
                 UPDATE pos_transakcje 
-                SET suma_rabatow = suma_rabatow + ?, 
-                    ilosc_rabatow = ilosc_rabatow + 1,
-                    suma_brutto = suma_brutto - ?
+                SET rabat_kwota = ?, rabat_procent = ?
                 WHERE id = ?
-            """, (kwota_rabatu, kwota_rabatu, transakcja_id))
+            """, (kwota_rabatu, rabat['wartosc'] if rabat['typ_rabatu'] == 'procentowy' else 0, transakcja_id))
             
             return success_response("Rabat został zastosowany", {
                 "uzycie_id": uzycie_id,
@@ -384,6 +373,118 @@ def apply_rabat():
         print(f"Błąd apply_rabat: {e}")
         return error_response(f"Błąd serwera: {e}", 500)
 
+@rabaty_bp.route('/rabaty/limity/stan', methods=['GET'])
+def get_limity_stan():
+    """
+    Stan liczników limitów w pamięci; z user_id i rabat_id - bieżące wykorzystanie
+    """
+    try:
+        stan = discount_limits.status()
+        rabat_id = request.args.get('rabat_id', type=int)
+        if rabat_id:
+            used_day, used_month = discount_limits.usage(rabat_id, request.args.get('user_id', ''))
+            stan['wykorzystanie'] = {
+                'dzien': {'kwota': round(used_day[0], 2), 'ilosc': used_day[1]},
+                'miesiac': {'kwota': round(used_month[0], 2), 'ilosc': used_month[1]}
+            }
+        return success_response("Stan liczników limitów", stan)
+    except Exception as e:
+        return error_response(f"Błąd serwera: {e}", 500)
+
+@rabaty_bp.route('/rabaty/limity/przebuduj', methods=['POST'])
+def przebuduj_limity():
+    """
+    Odbuduj liczniki limitów z rabaty_uzycie i zapisz je do tabel limitów
+    """
+    try:
+        if not discount_limits.rebuild(drop_triggers=True):
+            return error_response("Nie udało się odbudować liczników", 500)
+        return success_response("Liczniki limitów odbudowane", discount_limits.status())
+    except Exception as e:
+        return error_response(f"Błąd serwera: {e}", 500)
+
+def przelicz_koszyk(pozycje, location_id=None, data=None, zastosowane=()):
+    """
+    Przelicz koszyk skompilowanym planem cen i promocji (utils/pricing_engine.py)
+    data: rabat_ids, kody_rabatow, kupony (kody), user_id
+    zastosowane: rabaty z zapisanym użyciem w tej transakcji - ich limit został już sprawdzony
+    przy zapisie (własne użycie wliczone w licznik nie może go teraz odrzucić)
+    """
+    from api.coupons import load_coupon_for_validation
+    from utils.coupon_cache import coupon_cache
+    
+    data = data or {}
+    user_id = data.get('user_id', '')
+    kupony = []
+    nieznane_kupony = []
+    for kod in data.get('kupony') or []:
+        # Kupon do ceny zawsze z bazy (wyłączony w innym procesie nie może zadziałać z cache);
+        # świeży wiersz odświeża też cache podglądu walidacji
+        kupon = load_coupon_for_validation(str(kod))
+        if kupon:
+            coupon_cache.put(kupon)
+            kupony.append(kupon)
+        else:
+            nieznane_kupony.append({'kupon': kod, 'powod': 'Kupon nie został znaleziony'})
+    
+    zastosowane = {int(rabat_id) for rabat_id in zastosowane}
+    
+    def sprawdz_limit(rabat, user_id):
+        return None if rabat['id'] in zastosowane else discount_limits.check(rabat, user_id)
+    
+    wynik = pricing_engine.evaluate(
+        pozycje,
+        location_id=location_id,
+        rabat_ids=data.get('rabat_ids') or [],
+        codes=data.get('kody_rabatow') or [],
+        coupons=kupony,
+        user_id=user_id,
+        limit_checker=sprawdz_limit
+    )
+    wynik['rejected'].extend(nieznane_kupony)
+    return wynik
+
+@rabaty_bp.route('/rabaty/koszyk/przelicz', methods=['POST'])
+def przelicz_koszyk_endpoint():
+    """
+    Przelicz koszyk bez zapisu: ceny specjalne lokalizacji, promocje automatyczne,
+    wskazane rabaty i kupony
+    Body: {pozycje: [{product_id, quantity, unit_price?}], location_id, rabat_ids, kody_rabatow, kupony, user_id}
+    """
+    try:
+        data = request.get_json() or {}
+        pozycje = data.get('pozycje')
+        if not isinstance(pozycje, list) or not pozycje:
+            return error_response("Pole pozycje jest wymagane", 400)
+        
+        location_id = data.get('location_id')
+        wynik = przelicz_koszyk(pozycje, int(location_id) if location_id else None, data)
+        return success_response("Koszyk przeliczony", wynik)
+    except Exception as e:
+        return error_response(f"Błąd serwera: {e}", 500)
+
+@rabaty_bp.route('/rabaty/silnik/stan', methods=['GET'])
+def get_silnik_stan():
+    """
+    Stan skompilowanego planu cen i promocji
+    """
+    try:
+        return success_response("Stan silnika cen", pricing_engine.status())
+    except Exception as e:
+        return error_response(f"Błąd serwera: {e}", 500)
+
+@rabaty_bp.route('/rabaty/silnik/kompiluj', methods=['POST'])
+def kompiluj_silnik():
+    """
+    Skompiluj plan od nowa (np. po zmianie cen specjalnych)
+    """
+    try:
+        pricing_engine.invalidate()
+        pricing_engine.plan()
+        return success_response("Plan cen skompilowany", pricing_engine.status())
+    except Exception as e:
+        return error_response(f"Błąd serwera: {e}", 500)
+
 @rabaty_bp.route('/rabaty/raporty/dzienne', methods=['GET'])
 def get_raport_rabaty_dzienne():
     """
@@ -13,6 +13,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from utils.database import execute_query, execute_insert, get_db_connection
 from utils.response_helpers import success_response, error_response
+from utils.pagination import ensure_list_schema, decode_cursor, keyset_condition, page_result, count_cache
 
 # Importy dla systemu szablonów faktur
 try:
@@ -538,35 +539,52 @@ class SalesInvoiceManager:
         finally:
             conn.close()
 
-    def get_receipts_for_invoicing(self, limit=25, offset=0, date_filter=None, month_filter=None, location_id=None):
-        """Pobierz paragony gotowe do fakturowania"""
+    def _receipts_for_invoicing_where(self, date_filter=None, month_filter=None, location_id=None):
+        """Warunki WHERE listy paragonów do fakturowania"""
+        where_conditions = [
+            "t.status = 'zakonczony'",
+            "t.typ_transakcji IN ('sprzedaz', 'sale')",  # Obsługa obu typów dla kompatybilności
+            "t.suma_brutto > 0",
+            "t.klient_id IS NOT NULL",  # Tylko paragony z przypisanym klientem
+            "COALESCE(t.liczba_pozycji, 0) > 0"  # Tylko paragony z pozycjami (licznik utrzymywany triggerem)
+        ]
+        params = []
+        
+        if date_filter:
+            where_conditions.append("t.data_transakcji = ?")
+            params.append(date_filter)
+        elif month_filter:
+            # Zakres dat zamiast strftime() na kolumnie - pozwala użyć indeksu
+            where_conditions.append("t.data_transakcji >= ? AND t.data_transakcji < date(?, '+1 month')")
+            params.extend([f"{month_filter}-01", f"{month_filter}-01"])
+        
+        if location_id:
+            where_conditions.append("t.location_id = ?")
+            params.append(location_id)
+        
+        return " AND ".join(where_conditions), params
+
+    def get_receipts_for_invoicing(self, limit=25, offset=0, date_filter=None, month_filter=None, location_id=None, cursor_token=None):
+        """
+        Pobierz paragony gotowe do fakturowania
+        Z cursor_token stronicowanie kursorowe po (data_transakcji, id); offset tylko dla zgodności wstecz.
+        Zwraca (paragony, next_cursor).
+        """
+        ensure_list_schema()
         conn = self.get_connection()
         try:
             cursor = conn.cursor()
             
-            # Buduj warunki WHERE
-            where_conditions = [
-                "t.status = 'zakonczony'",
-                "t.typ_transakcji IN ('sprzedaz', 'sale')",  # Obsługa obu typów dla kompatybilności
-                "t.suma_brutto > 0",
-                "t.klient_id IS NOT NULL",  # Tylko paragony z przypisanym klientem
-                "EXISTS (SELECT 1 FROM pos_pozycje p WHERE p.transakcja_id = t.id)"  # Tylko paragony z pozycjami
-            ]
-            params = []
+            where_clause, params = self._receipts_for_invoicing_where(date_filter, month_filter, location_id)
             
-            if date_filter:
-                where_conditions.append("t.data_transakcji = ?")
-                params.append(date_filter)
-            elif month_filter:
-                where_conditions.append("strftime('%Y-%m', t.data_transakcji) = ?")
-                params.append(month_filter)
+            cursor_values = decode_cursor(cursor_token)
+            if cursor_values:
+                condition, values = keyset_condition(['t.data_transakcji', 't.id'], cursor_values)
+                where_clause += f" AND {condition}"
+                params.extend(values)
+                offset = 0
             
-            if location_id:
-                where_conditions.append("t.location_id = ?")
-                params.append(location_id)
-            
-            where_clause = " AND ".join(where_conditions)
-            params.extend([limit, offset])
+            params.extend([limit + 1, offset])
             
             cursor.execute(f"""
                 SELECT t.*, 
@@ -575,62 +593,45 @@ class SalesInvoiceManager:
                 FROM pos_transakcje t
                 LEFT JOIN faktury_sprzedazy f ON t.id = f.paragon_id
                 WHERE {where_clause}
-                ORDER BY t.data_transakcji DESC, t.czas_transakcji DESC
+                ORDER BY t.data_transakcji DESC, t.id DESC
                 LIMIT ? OFFSET ?
             """, params)
             
-            result = cursor.fetchall()
-            return [dict(row) for row in result]
+            rows = [dict(row) for row in cursor.fetchall()]
+            receipts, next_cursor, _ = page_result(rows, limit, lambda row: (row['data_transakcji'], row['id']))
+            return receipts, next_cursor
             
         except Exception as e:
             print(f"Błąd pobierania paragonów: {e}")
-            return []
+            return [], None
         finally:
             conn.close()
 
     def count_receipts_for_invoicing(self, date_filter=None, month_filter=None, location_id=None):
-        """Zlicz wszystkie paragony gotowe do fakturowania"""
-        conn = self.get_connection()
-        try:
-            cursor = conn.cursor()
-            
-            # Buduj warunki WHERE
-            where_conditions = [
-                "t.status = 'zakonczony'",
-                "t.typ_transakcji IN ('sprzedaz', 'sale')",  # Obsługa obu typów dla kompatybilności
-                "t.suma_brutto > 0",
-                "t.klient_id IS NOT NULL",  # Tylko paragony z przypisanym klientem
-                "EXISTS (SELECT 1 FROM pos_pozycje p WHERE p.transakcja_id = t.id)"  # Tylko paragony z pozycjami
-            ]
-            params = []
-            
-            if date_filter:
-                where_conditions.append("t.data_transakcji = ?")
-                params.append(date_filter)
-            elif month_filter:
-                where_conditions.append("strftime('%Y-%m', t.data_transakcji) = ?")
-                params.append(month_filter)
-            
-            if location_id:
-                where_conditions.append("t.location_id = ?")
-                params.append(location_id)
-            
-            where_clause = " AND ".join(where_conditions)
-            
-            cursor.execute(f"""
-                SELECT COUNT(*) as total
-                FROM pos_transakcje t
-                WHERE {where_clause}
-            """, params)
-            
-            result = cursor.fetchone()
-            return result['total'] if result else 0
-            
-        except Exception as e:
-            print(f"Błąd zliczania paragonów: {e}")
-            return 0
-        finally:
-            conn.close()
+        """Zlicz wszystkie paragony gotowe do fakturowania (wynik cache'owany per filtr)"""
+        ensure_list_schema()
+        where_clause, params = self._receipts_for_invoicing_where(date_filter, month_filter, location_id)
+        
+        def compute():
+            conn = self.get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT COUNT(*) as total
+                    FROM pos_transakcje t
+                    WHERE {where_clause}
+                """, params)
+                
+                result = cursor.fetchone()
+                return result['total'] if result else 0
+                
+            except Exception as e:
+                print(f"Błąd zliczania paragonów: {e}")
+                return 0
+            finally:
+                conn.close()
+        
+        return count_cache.get(('receipts_for_invoicing', where_clause, tuple(params)), compute)
 
     def get_receipt_details(self, paragon_id):
         """Pobierz szczegóły paragonu z pozycjami"""
@@ -1309,6 +1310,7 @@ def get_receipts_for_invoicing():
         date_filter = request.args.get('date')
         month_filter = request.args.get('month')
         location_id = request.args.get('location_id')
+        cursor_token = request.args.get('cursor')
         
         # Konwertuj location_id na int jeśli istnieje
         if location_id:
@@ -1319,7 +1321,9 @@ def get_receipts_for_invoicing():
             limit = 10000  # duża liczba
             offset = 0
         
-        receipts = sales_invoice_manager.get_receipts_for_invoicing(limit, offset, date_filter, month_filter, location_id)
+        receipts, next_cursor = sales_invoice_manager.get_receipts_for_invoicing(
+            limit, offset, date_filter, month_filter, location_id, cursor_token
+        )
         total_count = sales_invoice_manager.count_receipts_for_invoicing(date_filter, month_filter, location_id)
         
         return success_response({
@@ -1327,7 +1331,9 @@ def get_receipts_for_invoicing():
             'count': len(receipts),
             'total': total_count,
             'limit': limit,
-            'offset': offset
+            'offset': offset,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
         }, "Lista paragonów do fakturowania")
         
     except Exception as e:
@@ -7,6 +7,10 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime
 import logging
 from utils.database import execute_query, execute_insert, success_response, error_response, not_found_response
+from utils.pagination import ensure_list_schema, decode_cursor, keyset_condition, page_result, count_cache
+from utils.discount_limits import discount_limits
+from utils.stock_ledger import stock_ledger, movement as ledger_movement, DEFAULT_LOCATION_ID
+from utils.sale_costs import sale_costs
 
 # Konfiguracja logowania  
 logger = logging.getLogger(__name__)
@@ -229,65 +233,24 @@ def create_transaction():
         
         # Jeśli typ to 'sale'/'sprzedaz', automatycznie zaktualizuj stany magazynowe
         if transaction_type in ['sale', 'sprzedaz'] and status == 'zakonczony':
-            for item in items:
-                # Sprawdź czy produkt ma stan w magazynie dla danej lokalizacji
-                check_stock_sql = """
-                SELECT id, stan_aktualny FROM pos_magazyn 
-                WHERE produkt_id = ? AND lokalizacja = ?
-                """
-                stock_result = execute_query(check_stock_sql, (item['product_id'], str(location_id)))
-                
-                if stock_result:
-                    # Aktualizuj istniejący stan dla tej lokalizacji
-                    current_stock = stock_result[0]['stan_aktualny'] or 0
-                    new_stock = current_stock - item['quantity']  # Pozwól na ujemny stan
-                    
-                    update_stock_sql = """
-                    UPDATE pos_magazyn 
-                    SET stan_aktualny = ?, ostatnia_aktualizacja = datetime('now')
-                    WHERE id = ?
-                    """
-                    execute_insert(update_stock_sql, (new_stock, stock_result[0]['id']))
-                else:
-                    # Utwórz nowy wpis stanu dla tej lokalizacji
-                    initial_stock = -item['quantity']  # Pokazuje że został sprzedany towar, którego nie było
-                    
-                    insert_stock_sql = """
-                    INSERT INTO pos_magazyn 
-                    (produkt_id, stan_aktualny, stan_minimalny, stan_maksymalny, lokalizacja)
-                    VALUES (?, ?, 0, 0, ?)
-                    """
-                    execute_insert(insert_stock_sql, (item['product_id'], initial_stock, str(location_id)))
-                
-                # Zapisz ruch magazynowy
-                try:
-                    # Pobierz aktualny stan przed operacją dla ruchu magazynowego
-                    current_stock_sql = """
-                    SELECT stan_aktualny FROM pos_magazyn 
-                    WHERE produkt_id = ? AND lokalizacja = ?
-                    """
-                    current_stock_result = execute_query(current_stock_sql, (item['product_id'], str(location_id)))
-                    stan_przed = current_stock_result[0]['stan_aktualny'] if current_stock_result else 0
-                    stan_po = stan_przed - item['quantity']
-                    
-                    movement_sql = """
-                    INSERT INTO pos_ruchy_magazynowe 
-                    (product_id, typ_ruchu, ilosc, stan_przed, stan_po, 
-                     numer_dokumentu, data_ruchu, czas_ruchu, user_login, uwagi)
-                    VALUES (?, 'wydanie', ?, ?, ?, ?, date('now'), time('now'), ?, ?)
-                    """
-                    execute_insert(movement_sql, (
-                        item['product_id'], 
-                        item['quantity'],
-                        stan_przed,
-                        stan_po,
-                        f"TRANS-{transaction_id}",
-                        cashier,
-                        f"Sprzedaż - transakcja #{transaction_id}"
-                    ))
-                except Exception as e:
-                    print(f"Błąd zapisu ruchu magazynowego: {str(e)}")
-                    # Kontynuuj nawet jeśli nie można zapisać ruchu
+            # Jedna partia ruchów sprzedaży - ujemny stan jest dopuszczalny (towar sprzedany bez stanu)
+            try:
+                stock_ledger.post([
+                    ledger_movement(item['product_id'], location_id or DEFAULT_LOCATION_ID,
+                                    -item['quantity'], 'sale', 'pos_transakcja', transaction_id,
+                                    f"TRANS-{transaction_id}", f"Sprzedaż - transakcja #{transaction_id}",
+                                    cashier)
+                    for item in items
+                ])
+            except Exception as e:
+                print(f"Błąd zapisu ruchu magazynowego: {str(e)}")
+                # Kontynuuj nawet jeśli nie można zapisać ruchu
+
+            # Koszt sprzedaży per pozycja (partie FIFO / cena zakupu)
+            try:
+                sale_costs.capture(transaction_id, created_by=cashier)
+            except Exception as e:
+                logger.error(f"Błąd wyliczania kosztu sprzedaży transakcji {transaction_id}: {e}")
             
             # Dodaj operację do kasa_operacje dla transakcji typu 'sale'/'sprzedaz'
             try:
@@ -312,7 +275,7 @@ def create_transaction():
                 
                 # Obsługa płatności dzielonych
                 if split_payments and len(split_payments) > 0:
-                    print(f"DEBUG: Przetwarzanie płatności dzielonych: {split_payments}")
+                    logger.debug("Przetwarzanie płatności dzielonych: %s", split_payments)
                     
                     for payment in split_payments:
                         if payment.get('amount', 0) > 0:
@@ -333,7 +296,7 @@ def create_transaction():
                                 except Exception as e:
                                     print(f"❌ Błąd podczas użycia kuponu: {e}")
                             
-                            print(f"DEBUG kasa_operacje (dzielona): method={payment['method']}, typ_platnosci={typ_platnosci}, amount={payment['amount']}")
+                            logger.debug("kasa_operacje (dzielona): method=%s, typ_platnosci=%s, amount=%s", payment['method'], typ_platnosci, payment['amount'])
                             
                             execute_insert(kasa_operacja_sql, (
                                 'KP',  # Kasa Przyjmie
@@ -363,7 +326,7 @@ def create_transaction():
                         except Exception as e:
                             print(f"❌ Błąd podczas użycia kuponu: {e}")
                     
-                    print(f"DEBUG kasa_operacje (pojedyncza): payment_method={payment_method}, typ_platnosci={typ_platnosci}, final_amount={total_amount}")
+                    logger.debug("kasa_operacje (pojedyncza): payment_method=%s, typ_platnosci=%s, final_amount=%s", payment_method, typ_platnosci, total_amount)
                     
                     execute_insert(kasa_operacja_sql, (
                         'KP',  # Kasa Przyjmie
@@ -393,7 +356,7 @@ def create_transaction():
         }, "Transakcja utworzona pomyślnie")
         
     except Exception as e:
-        print(f"DEBUG EXCEPTION in create_transaction: {str(e)}")
+        logger.debug("EXCEPTION in create_transaction: %s", str(e))
         return error_response(f"Błąd tworzenia transakcji: {str(e)}", 500)
 
 @transactions_bp.route('/transactions/<int:transaction_id>', methods=['GET'])
@@ -563,18 +526,23 @@ def complete_transaction(transaction_id):
         ))
         
         if success:
-            # Zmniejsz stany magazynowe
-            update_stock_sql = """
-            UPDATE produkty 
-            SET stan_magazynowy = stan_magazynowy - (
-                SELECT ilosc FROM pos_transakcje_pozycje 
-                WHERE transakcja_id = ? AND product_id = produkty.id
-            )
-            WHERE id IN (
-                SELECT product_id FROM pos_transakcje_pozycje WHERE transakcja_id = ?
-            )
-            """
-            execute_insert(update_stock_sql, (transaction_id, transaction_id))
+            # Zmniejsz stany magazynowe - ruchy sprzedaży w rejestrze stanów (lokalizacja transakcji)
+            try:
+                pozycje = execute_query("""
+                    SELECT tp.product_id, SUM(tp.ilosc) AS ilosc, t.location_id
+                    FROM pos_transakcje_pozycje tp
+                    JOIN pos_transakcje t ON t.id = tp.transakcja_id
+                    WHERE tp.transakcja_id = ?
+                    GROUP BY tp.product_id
+                """, (transaction_id,)) or []
+                stock_ledger.post([
+                    ledger_movement(p['product_id'], p['location_id'] or DEFAULT_LOCATION_ID,
+                                    -p['ilosc'], 'sale', 'pos_transakcja', transaction_id,
+                                    f"TRANS-{transaction_id}")
+                    for p in pozycje
+                ])
+            except Exception as e:
+                logger.error(f"Błąd zapisu ruchów magazynowych transakcji {transaction_id}: {e}")
             
             # Dodaj operację do kasa_operacje
             transaction_base_total = transaction['suma_brutto']
@@ -685,9 +653,12 @@ def get_drafts():
 def get_transactions():
     """
     Pobierz listę transakcji/paragonów z filtrowaniem
-    GET /api/transactions?limit=20&status=completed&date_from=2024-01-01&cashier=admin
+    GET /api/transactions?limit=20&status=completed&date_from=2024-01-01&cashier=admin&cursor=...
+    Stronicowanie kursorowe po (data_transakcji, id) - kolejną stronę pobiera się z next_cursor
     """
     try:
+        ensure_list_schema()
+        
         # Parametry filtrowania
         limit = int(request.args.get('limit', 20))
         status = request.args.get('status', 'completed')  # completed, draft, all
@@ -695,6 +666,7 @@ def get_transactions():
         date_to = request.args.get('date_to')
         cashier = request.args.get('cashier')
         location_id = request.args.get('location_id')  # Dodaj location_id
+        cursor_token = request.args.get('cursor')
         
         # Mapowanie statusów z API na bazę danych
         status_mapping = {
@@ -712,68 +684,81 @@ def get_transactions():
             db_status = status_mapping.get(status, 'zakonczony')
             filter_by_type = None
         
-        # Buduj zapytanie SQL
-        sql = """
-        SELECT 
-            t.id,
-            t.numer_paragonu as receipt_number,
-            t.numer_transakcji,
-            t.data_transakcji as transaction_date,
-            t.czas_transakcji as transaction_time,
-            t.kasjer_login as cashier,
-            t.suma_brutto as total_amount,
-            t.suma_netto as net_amount,
-            t.suma_vat as tax_amount,
-            t.forma_platnosci as payment_method,
-            t.status,
-            t.typ_transakcji as transaction_type,
-            t.rabat_kwota,
-            t.rabat_procent,
-            t.created_at,
-            t.fiskalizacja,
-            COUNT(tp.id) as items_count
-        FROM pos_transakcje t
-        LEFT JOIN pos_pozycje tp ON t.id = tp.transakcja_id
-        WHERE 1=1
-        """
-        
+        # Buduj warunki - liczba pozycji jest przechowywana w transakcji (bez JOIN/GROUP BY)
+        where = ""
         params = []
         
         # Filtruj według statusu lub typu transakcji
         if filter_by_type:
-            sql += " AND t.typ_transakcji = ?"
+            where += " AND t.typ_transakcji = ?"
             params.append(filter_by_type)
         elif status != 'all' and db_status:
-            sql += " AND t.status = ?"
+            where += " AND t.status = ?"
             params.append(db_status)
         
-        # Filtruj według daty
+        # Filtruj według daty (bez DATE() na kolumnie - pozwala użyć indeksu)
         if date_from:
-            sql += " AND DATE(t.data_transakcji) >= ?"
+            where += " AND t.data_transakcji >= ?"
             params.append(date_from)
         
         if date_to:
-            sql += " AND DATE(t.data_transakcji) <= ?"
+            where += " AND t.data_transakcji < date(?, '+1 day')"
             params.append(date_to)
         
         # Filtruj według kasjera
         if cashier:
-            sql += " AND t.kasjer_login = ?"
+            where += " AND t.kasjer_login = ?"
             params.append(cashier)
         
         # Filtruj według lokalizacji
         if location_id:
-            sql += " AND t.location_id = ?"
+            where += " AND t.location_id = ?"
             params.append(location_id)
         
-        sql += """
-        GROUP BY t.id 
-        ORDER BY t.data_transakcji DESC, t.czas_transakcji DESC
+        page_where = where
+        page_params = list(params)
+        cursor_values = decode_cursor(cursor_token)
+        if cursor_values:
+            condition, values = keyset_condition(['t.data_transakcji', 't.id'], cursor_values)
+            page_where += f" AND {condition}"
+            page_params.extend(values)
+        
+        sql = f"""
+        SELECT 
+            t.id,
+            t.numer_paragonu as receipt_number,
+            t.numer_transakcji,
+            t.data_transakcji as transaction_date,
+            t.czas_transakcji as transaction_time,
+            t.kasjer_login as cashier,
+            t.suma_brutto as total_amount,
+            t.suma_netto as net_amount,
+            t.suma_vat as tax_amount,
+            t.forma_platnosci as payment_method,
+            t.status,
+            t.typ_transakcji as transaction_type,
+            t.rabat_kwota,
+            t.rabat_procent,
+            t.created_at,
+            t.fiskalizacja,
+            COALESCE(t.liczba_pozycji, 0) as items_count
+        FROM pos_transakcje t
+        WHERE 1=1 {page_where}
+        ORDER BY t.data_transakcji DESC, t.id DESC
         LIMIT ?
         """
-        params.append(limit)
+        page_params.append(limit + 1)
+        
+        rows = execute_query(sql, page_params) or []
+        transactions, next_cursor, has_more = page_result(
+            rows, limit, lambda row: (row['transaction_date'], row['id'])
+        )
         
-        transactions = execute_query(sql, params) or []
+        # Przybliżona liczba wszystkich wyników (cache per zestaw filtrów)
+        total = count_cache.get(
+            ('transactions', where, tuple(params)),
+            lambda: (execute_query(f"SELECT COUNT(*) as total FROM pos_transakcje t WHERE 1=1 {where}", params) or [{'total': 0}])[0]['total']
+        )
         
         # Dodaj status fiskalizacji jako literę
         for transaction in transactions:
@@ -788,6 +773,9 @@ def get_transactions():
         return success_response({
             'transactions': transactions,
             'count': len(transactions),
+            'total': total,
+            'next_cursor': next_cursor,
+            'has_more': has_more,
             'filters': {
                 'status': status,
                 'date_from': date_from,
@@ -995,59 +983,16 @@ def create_transaction_correction(transaction_id):
                 item['original_item'].get('marza_procent_fifo', 0),
                 item['original_item'].get('metoda_obliczania_marzy', 'fifo')
             ))
-            
-            # PRZYWRÓĆ STAN MAGAZYNOWY - dodaj ilość z powrotem do magazynu
-            # Sprawdź aktualny stan magazynowy
-            stock_sql = """
-            SELECT stan_aktualny 
-            FROM pos_magazyn 
-            WHERE produkt_id = ?
-            """
-            stock_result = execute_query(stock_sql, (item['product_id'],))
-            
-            if stock_result:
-                # Aktualizuj istniejący stan
-                current_stock = stock_result[0]['stan_aktualny'] or 0
-                
-                update_stock_sql = """
-                UPDATE pos_magazyn 
-                SET stan_aktualny = ?,
-                    ostatnia_aktualizacja = datetime('now')
-                WHERE produkt_id = ?
-                """
-                execute_insert(update_stock_sql, (
-                    current_stock + item['correction_quantity'],
-                    item['product_id']
-                ))
-            else:
-                # Utwórz nowy stan magazynowy
-                insert_stock_sql = """
-                INSERT INTO pos_magazyn (
-                    produkt_id, stan_aktualny, stan_minimalny, stan_maksymalny,
-                    ostatnia_aktualizacja
-                ) VALUES (?, ?, 0, 0, datetime('now'))
-                """
-                execute_insert(insert_stock_sql, (
-                    item['product_id'],
-                    item['correction_quantity']
-                ))
-            
-            # Dodaj ruch magazynowy
-            movement_sql = """
-            INSERT INTO pos_ruchy_magazynowe (
-                product_id, warehouse_id, typ_ruchu, ilosc, 
-                cena_jednostkowa, wartosc_calkowita,
-                opis, data_ruchu, user_id
-            ) VALUES (?, 1, 'korekta_pos', ?, ?, ?, ?, datetime('now'), ?)
-            """
-            execute_insert(movement_sql, (
-                item['product_id'],
-                item['correction_quantity'],
-                item['unit_price'],
-                item['correction_amount'],
-                f"Korekta transakcji #{transaction_id} - zwrot towaru",
-                cashier
-            ))
+        
+        # PRZYWRÓĆ STAN MAGAZYNOWY - ruchy korekty w lokalizacji oryginalnej transakcji
+        stock_ledger.post([
+            ledger_movement(item['product_id'],
+                            original_transaction.get('location_id') or DEFAULT_LOCATION_ID,
+                            item['correction_quantity'], 'correction', 'pos_transakcja',
+                            correction_transaction_id, correction_number,
+                            f"Korekta transakcji #{transaction_id} - zwrot towaru", cashier)
+            for item in correction_items
+        ])
         
         return success_response({
             'correction_transaction_id': correction_transaction_id,
@@ -1146,6 +1091,7 @@ def delete_transaction(transaction_id):
         
         # Usuń rabaty transakcji jeśli istnieją
         execute_insert("DELETE FROM rabaty_uzycie WHERE transakcja_id = ?", (transaction_id,))
+        discount_limits.request_rebuild()
         
         # Usuń transakcję
         execute_insert("DELETE FROM pos_transakcje WHERE id = ?", (transaction_id,))
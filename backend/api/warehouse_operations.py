@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify
 from utils.database import get_db_connection, execute_query, execute_insert
 from utils.response_helpers import success_response, error_response
+from utils.pagination import ensure_list_schema, decode_cursor, keyset_condition, page_result
+from utils.inventory_sessions import inventory_sessions
+from utils.stock_ledger import stock_ledger, movement as ledger_movement, DEFAULT_LOCATION_ID
+from utils.external_receipts import external_receipts, ReceiptError
 import traceback
 import logging
 from datetime import datetime
@@ -15,63 +19,45 @@ def execute_select(query, params=None):
     else:
         return {'success': False, 'error': 'Database query failed'}
 
-def resolve_stock_shortages_for_product(cursor, product_id, location_id, invoice_id=None):
+def _paginated_document_list(query, params, alias, message):
     """
-    Automatycznie rozwiązuje braki magazynowe dla produktu po uzupełnieniu stanu.
-    Sprawdza aktualny stan i jeśli jest >= 0, oznacza braki jako rozwiązane.
+    Lista dokumentów magazynowych sortowana po (created_at, id) malejąco, zawsze
+    w kopercie {items, next_cursor, has_more}. Z parametrem limit - strona kursorowa,
+    której koszt nie zależy od głębokości; bez limit - cała lista (next_cursor None).
     """
-    try:
-        # Sprawdź aktualny stan magazynowy produktu
-        cursor.execute("""
-            SELECT stan_aktualny FROM pos_magazyn 
-            WHERE produkt_id = ? AND lokalizacja = ?
-        """, (product_id, str(location_id)))
-        stock = cursor.fetchone()
-        
-        current_stock = stock['stan_aktualny'] if stock else 0
-        
-        # Jeśli stan jest >= 0, oznacz wszystkie oczekujące braki jako rozwiązane
-        if current_stock >= 0:
-            cursor.execute("""
-                UPDATE pos_stock_shortages 
-                SET status = 'resolved',
-                    resolved_at = datetime('now'),
-                    resolved_by = 'system_auto',
-                    faktura_zakupu_id = ?
-                WHERE produkt_id = ? 
-                  AND status = 'pending'
-            """, (invoice_id, product_id))
-            
-            resolved_count = cursor.rowcount
-            
-            if resolved_count > 0:
-                print(f"✅ Automatycznie rozwiązano {resolved_count} braków dla produktu {product_id}")
-                
-                # Sprawdź, czy powiązane transakcje mają jeszcze jakieś nierozwiązane braki
-                # Jeśli nie, usuń flagę has_stock_shortage
-                cursor.execute("""
-                    UPDATE pos_transakcje 
-                    SET has_stock_shortage = 0
-                    WHERE id IN (
-                        SELECT DISTINCT transakcja_id 
-                        FROM pos_stock_shortages 
-                        WHERE produkt_id = ? AND status = 'resolved'
-                    )
-                    AND NOT EXISTS (
-                        SELECT 1 FROM pos_stock_shortages 
-                        WHERE transakcja_id = pos_transakcje.id AND status = 'pending'
-                    )
-                """, (product_id,))
-                
-                updated_transactions = cursor.rowcount
-                if updated_transactions > 0:
-                    print(f"✅ Usunięto flagę braku z {updated_transactions} transakcji")
-                    
-            return resolved_count
-        return 0
-    except Exception as e:
-        print(f"⚠️ Błąd rozwiązywania braków dla produktu {product_id}: {e}")
-        return 0
+    limit = request.args.get('limit', type=int)
+    cursor_values = decode_cursor(request.args.get('cursor'))
+    
+    if cursor_values:
+        condition, values = keyset_condition([f'{alias}.created_at', f'{alias}.id'], cursor_values)
+        query += f" AND {condition}"
+        params = params + values
+        
+    query += f" ORDER BY {alias}.created_at DESC, {alias}.id DESC"
+    
+    if limit:
+        query += " LIMIT ?"
+        params = params + [limit + 1]
+    
+    result = execute_select(query, params if params else None)
+    
+    if not result['success']:
+        return error_response(result['error'])
+    
+    if limit:
+        items, next_cursor, has_more = page_result(
+            result['data'], limit, lambda row: (row['created_at'], row['id'])
+        )
+    else:
+        items, next_cursor, has_more = result['data'], None, False
+    
+    response = success_response({
+        'items': items,
+        'next_cursor': next_cursor,
+        'has_more': has_more
+    }, message)
+    response.headers['X-Next-Cursor'] = next_cursor or ''
+    return response
 
 @warehouse_operations_bp.route('/warehouse/purchase-invoices', methods=['GET', 'OPTIONS'])
 def get_purchase_invoices_for_pz():
@@ -108,130 +94,30 @@ def get_purchase_invoices_for_pz():
 
 @warehouse_operations_bp.route('/warehouse/external-receipt/<int:invoice_id>', methods=['POST', 'OPTIONS'])
 def generate_external_receipt(invoice_id):
-    """Generuje PZ (przyjęcie zewnętrzne) na podstawie faktury zakupu"""
+    """
+    Generuje PZ (przyjęcie zewnętrzne) na podstawie faktury zakupu
+    Pozycje, stany, historia i zamknięcie braków w jednej transakcji (utils/external_receipts.py)
+    """
     if request.method == 'OPTIONS':
         return '', 200
         
-    conn = None
     try:
         # Pobierz warehouse_id i location_id z request lub użyj domyślnego
         data = request.get_json() or {}
         warehouse_id = data.get('warehouse_id', 5)  # Domyślnie magazyn KALISZ
-        location_id = data.get('location_id')  # Location ID do filtrowania
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Sprawdź czy PZ już zostało wygenerowane
-        cursor.execute("""
-            SELECT id FROM warehouse_receipts 
-            WHERE source_invoice_id = ? AND type = 'external'
-        """, (invoice_id,))
-        existing = cursor.fetchone()
-        
-        if existing:
-            return error_response("PZ dla tej faktury już zostało wygenerowane")
-        
-        # Pobierz dane faktury - dostosowane do polskiego schematu
-        cursor.execute("""
-            SELECT * FROM faktury_zakupowe WHERE id = ?
-        """, (invoice_id,))
-        invoice = cursor.fetchone()
-        
-        if not invoice:
-            return error_response("Nie znaleziono faktury zakupowej")
-        
-        # Utwórz wpis PZ
-        cursor.execute("""
-            INSERT INTO warehouse_receipts 
-            (type, source_invoice_id, document_number, supplier_name, receipt_date, total_amount, status, created_at, location_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, ('external', invoice_id, f"PZ-{invoice_id}-{datetime.now().strftime('%Y%m%d')}", 
-              invoice['dostawca_nazwa'], datetime.now().isoformat(), 
-              invoice['suma_brutto'], 'completed', datetime.now().isoformat(), location_id))
-        
-        receipt_id = cursor.lastrowid
-        if not receipt_id:
-            return error_response("Błąd tworzenia dokumentu PZ")
-        
-        # Pobierz pozycje faktury - dostosowane do polskiego schematu
-        cursor.execute("""
-            SELECT * FROM faktury_zakupowe_pozycje 
-            WHERE faktura_id = ? AND status_mapowania = 'zmapowany'
-        """, (invoice_id,))
-        items = cursor.fetchall()
-        
-        print(f"🔍 Znaleziono {len(items)} pozycji do przetworzenia")
-        processed_count = 0
-        
-        for item in items:
-            print(f"📦 Przetwarzanie pozycji: ID={item['id']}, produkt_id={item['produkt_id']}, ilosc={item['ilosc']}")
-            
-            # Sprawdź czy pozycja ma zmapowany produkt
-            if not item['produkt_id']:
-                print(f"⚠️ Pozycja {item['id']} nie ma zmapowanego produktu - pomijanie")
-                continue
-                
-            # Dodaj pozycję do PZ
-            cursor.execute("""
-                INSERT INTO warehouse_receipt_items 
-                (receipt_id, product_id, quantity, unit_price, total_price)
-                VALUES (?, ?, ?, ?, ?)
-            """, (receipt_id, item['produkt_id'], item['ilosc'], 
-                  item['cena_netto'], item['wartosc_brutto']))
-            
-            receipt_item_id = cursor.lastrowid
-            print(f"✅ Dodano pozycję PZ: {receipt_item_id}")
-            
-            # Aktualizuj lub utwórz stan magazynowy
-            cursor.execute("""
-                INSERT OR IGNORE INTO pos_magazyn 
-                (produkt_id, stan_aktualny, stan_minimalny, stan_maksymalny, lokalizacja)
-                VALUES (?, 0, 0, 0, ?)
-            """, (item['produkt_id'], str(warehouse_id)))
-            
-            cursor.execute("""
-                UPDATE pos_magazyn 
-                SET stan_aktualny = stan_aktualny + ?, 
-                    ostatnia_aktualizacja = CURRENT_TIMESTAMP
-                WHERE produkt_id = ? AND lokalizacja = ?
-            """, (item['ilosc'], item['produkt_id'], str(warehouse_id)))
-            
-            print(f"📊 Zaktualizowano stan magazynowy dla produktu {item['produkt_id']}")
-            
-            # Automatycznie rozwiąż braki magazynowe jeśli stan jest teraz >= 0
-            resolve_stock_shortages_for_product(cursor, item['produkt_id'], warehouse_id, invoice_id)
-            
-            # Dodaj wpis do historii magazynu
-            cursor.execute("""
-                INSERT INTO warehouse_history 
-                (product_id, operation_type, quantity_change, reason, document_number, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (item['produkt_id'], 'receipt_external', item['ilosc'], 
-                  f"PZ na podstawie faktury {invoice['numer_faktury']}", 
-                  f"PZ-{invoice_id}-{datetime.now().strftime('%Y%m%d')}", 
-                  datetime.now().isoformat()))
-                  
-            history_id = cursor.lastrowid
-            print(f"📝 Dodano wpis do historii: {history_id}")
-            processed_count += 1
-            
-        print(f"✅ Przetworzono {processed_count} pozycji")
+        location_id = data.get('location_id')  # Lokalizacja stanów (domyślnie lokalizacja magazynu)
         
-        # Zatwierdź transakcję
-        conn.commit()
+        summary = external_receipts.generate(invoice_id, warehouse_id, location_id)
+        print(f"✅ PZ {summary['document_number']}: {summary['processed_items']} pozycji w {summary['took_ms']} ms")
         
-        return success_response({"receipt_id": receipt_id, "processed_items": processed_count}, "PZ zostało wygenerowane pomyślnie")
+        return success_response(summary, "PZ zostało wygenerowane pomyślnie")
         
+    except ReceiptError as e:
+        return error_response(str(e))
     except Exception as e:
-        if conn:
-            conn.rollback()
         logging.error(f"Błąd generowania PZ: {str(e)}")
         logging.error(traceback.format_exc())
         return error_response(f"Błąd serwera: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
 @warehouse_operations_bp.route('/warehouse/internal-receipt', methods=['POST', 'OPTIONS'])
 def create_internal_receipt():
@@ -251,9 +137,6 @@ def create_internal_receipt():
         if not products:
             return error_response("Brak produktów do przyjęcia")
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         # Utwórz dokument PW
         document_number = f"PW-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
         receipt_id = execute_insert("""
@@ -267,6 +150,8 @@ def create_internal_receipt():
             return error_response("Błąd tworzenia dokumentu PW")
         
         # Przetwórz produkty
+        stock_location_id = location_id or DEFAULT_LOCATION_ID
+        movements = []
         for product in products:
             product_id = product.get('product_id')
             quantity = product.get('quantity', 0)
@@ -279,57 +164,8 @@ def create_internal_receipt():
                 VALUES (?, ?, ?, ?)
             """, (receipt_id, product_id, quantity, reason))
             
-            # Aktualizuj stan magazynowy w inventory_locations (per lokalizacja)
-            if location_id:
-                # Sprawdź czy istnieje wpis dla tego produktu i lokalizacji
-                cursor.execute("""
-                    SELECT id FROM inventory_locations 
-                    WHERE product_id = ? AND warehouse_id = ?
-                """, (product_id, location_id))
-                existing = cursor.fetchone()
-                
-                if existing:
-                    # Aktualizuj istniejący wpis
-                    cursor.execute("""
-                        UPDATE inventory_locations 
-                        SET ilosc_dostepna = ilosc_dostepna + ?, 
-                            ostatnia_aktualizacja = CURRENT_TIMESTAMP
-                        WHERE product_id = ? AND warehouse_id = ?
-                    """, (quantity, product_id, location_id))
-                else:
-                    # Utwórz nowy wpis
-                    cursor.execute("""
-                        INSERT INTO inventory_locations 
-                        (product_id, warehouse_id, ilosc_dostepna, ilosc_zarezerwowana, ilosc_minimalna, ilosc_maksymalna, ostatnia_aktualizacja)
-                        VALUES (?, ?, ?, 0, 0, 0, CURRENT_TIMESTAMP)
-                    """, (product_id, location_id, quantity))
-                
-                logging.info(f"Zaktualizowano inventory_locations: produkt {product_id}, lokalizacja {location_id}, +{quantity}")
-            
-            # Aktualizuj również stan w pos_magazyn (legacy) z lokalizacją
-            # Sprawdź czy istnieje wpis dla tej lokalizacji
-            cursor.execute("""
-                SELECT id FROM pos_magazyn WHERE produkt_id = ? AND (lokalizacja = ? OR lokalizacja IS NULL OR lokalizacja = '')
-            """, (product_id, str(location_id) if location_id else ''))
-            pos_existing = cursor.fetchone()
-            
-            if pos_existing:
-                cursor.execute("""
-                    UPDATE pos_magazyn 
-                    SET stan_aktualny = stan_aktualny + ?, 
-                        lokalizacja = ?,
-                        ostatnia_aktualizacja = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                """, (quantity, str(location_id) if location_id else '', pos_existing[0]))
-            else:
-                cursor.execute("""
-                    INSERT INTO pos_magazyn (produkt_id, stan_aktualny, stan_minimalny, stan_maksymalny, lokalizacja, ostatnia_aktualizacja)
-                    VALUES (?, ?, 0, 0, ?, CURRENT_TIMESTAMP)
-                """, (product_id, quantity, str(location_id) if location_id else ''))
-            
-            # Automatycznie rozwiąż braki magazynowe jeśli stan jest teraz >= 0
-            if location_id:
-                resolve_stock_shortages_for_product(cursor, product_id, location_id, None)
+            movements.append(ledger_movement(product_id, stock_location_id, quantity, 'pw', 'PW',
+                                             receipt_id, document_number, reason))
             
             # Dodaj wpis do historii magazynu
             execute_insert("""
@@ -339,8 +175,9 @@ def create_internal_receipt():
             """, (product_id, 'receipt_internal', quantity, reason, 
                   document_number, datetime.now().isoformat()))
         
-        conn.commit()
-        conn.close()
+        # Stany per lokalizacja (stock_on_hand, pos_magazyn, inventory_locations) - jedna partia ruchów;
+        # braki magazynowe pokryte przyjęciem rozlicza stock_shortages w tej samej transakcji
+        stock_ledger.post(movements)
         
         return success_response({"receipt_id": receipt_id}, "Przyjęcie wewnętrzne zostało zarejestrowane pomyślnie")
         
@@ -364,6 +201,8 @@ def get_internal_receipts():
         status_filter = request.args.get('status', 'all')
         location_id = request.args.get('location_id', '')
         
+        ensure_list_schema()
+        
         query = """
         SELECT 
             wr.id,
@@ -373,9 +212,8 @@ def get_internal_receipts():
             wr.created_by,
             wr.created_at,
             wr.location_id,
-            COUNT(wri.id) as items_count
+            COALESCE(wr.items_count, 0) as items_count
         FROM warehouse_receipts wr
-        LEFT JOIN warehouse_receipt_items wri ON wr.id = wri.receipt_id
         WHERE wr.type = 'internal'
         """
         
@@ -393,14 +231,7 @@ def get_internal_receipts():
             query += " AND wr.status = ?"
             params.append(status_filter)
         
-        query += " GROUP BY wr.id ORDER BY wr.created_at DESC"
-        
-        result = execute_select(query, params if params else None)
-        
-        if result['success']:
-            return success_response(result['data'], "Historia PW załadowana pomyślnie")
-        else:
-            return error_response(result['error'])
+        return _paginated_document_list(query, params, 'wr', "Historia PW załadowana pomyślnie")
             
     except Exception as e:
         logging.error(f"Błąd pobierania historii PW: {str(e)}")
@@ -482,6 +313,8 @@ def get_external_receipts():
         status_filter = request.args.get('status', 'all')
         location_id = request.args.get('location_id', '')
         
+        ensure_list_schema()
+        
         query = """
         SELECT 
             wr.id,
@@ -493,11 +326,10 @@ def get_external_receipts():
             wr.created_by,
             wr.created_at,
             wr.location_id,
-            pi.invoice_number as source_invoice_number,
-            COUNT(wri.id) as items_count
+            fz.numer_faktury as source_invoice_number,
+            COALESCE(wr.items_count, 0) as items_count
         FROM warehouse_receipts wr
-        LEFT JOIN warehouse_receipt_items wri ON wr.id = wri.receipt_id
-        LEFT JOIN purchase_invoices pi ON wr.source_invoice_id = pi.id
+        LEFT JOIN faktury_zakupowe fz ON wr.source_invoice_id = fz.id
         WHERE wr.type = 'external'
         """
         
@@ -515,14 +347,7 @@ def get_external_receipts():
             query += " AND wr.status = ?"
             params.append(status_filter)
         
-        query += " GROUP BY wr.id ORDER BY wr.created_at DESC"
-        
-        result = execute_select(query, params if params else None)
-        
-        if result['success']:
-            return success_response(result['data'], "Historia PZ załadowana pomyślnie")
-        else:
-            return error_response(result['error'])
+        return _paginated_document_list(query, params, 'wr', "Historia PZ załadowana pomyślnie")
             
     except Exception as e:
         logging.error(f"Błąd pobierania historii PZ: {str(e)}")
@@ -825,18 +650,19 @@ def get_internal_issues():
         status_filter = request.args.get('status', 'all')
         location_id = request.args.get('location_id', '')
         
+        ensure_list_schema()
+        
         query = """
         SELECT 
             wi.id,
             wi.document_number,
             wi.issue_date,
             wi.status,
-            wi.created_by,
+            COALESCE(wi.created_by, 'System') as created_by,
             wi.created_at,
             wi.location_id,
-            COUNT(wii.id) as items_count
+            COALESCE(wi.items_count, 0) as items_count
         FROM warehouse_issues wi
-        LEFT JOIN warehouse_issue_items wii ON wi.id = wii.issue_id
         WHERE 1=1
         """
         
@@ -854,14 +680,7 @@ def get_internal_issues():
             query += " AND wi.status = ?"
             params.append(status_filter)
         
-        query += " GROUP BY wi.id ORDER BY wi.created_at DESC"
-        
-        result = execute_select(query, params if params else None)
-        
-        if result['success']:
-            return success_response(result['data'], "Historia RW załadowana pomyślnie")
-        else:
-            return error_response(result['error'])
+        return _paginated_document_list(query, params, 'wi', "Historia RW załadowana pomyślnie")
             
     except Exception as e:
         logging.error(f"Błąd pobierania historii RW: {str(e)}")
@@ -882,37 +701,42 @@ def create_internal_issue():
         if not products:
             return error_response("Brak produktów do wydania")
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        stock_location_id = location_id or DEFAULT_LOCATION_ID
         
-        # Sprawdź dostępność produktów
+        # Sprawdź dostępność produktów - stany lokalizacji jednym odczytem ze stock_on_hand
+        product_ids = [product.get('product_id') for product in products]
+        placeholders = ','.join('?' * len(product_ids))
+        existing = {row['id'] for row in execute_query(
+            f"SELECT id FROM produkty WHERE id IN ({placeholders})", product_ids
+        ) or []}
+        stocks = stock_ledger.on_hand_many(existing, stock_location_id)
         for product in products:
             product_id = product.get('product_id')
             quantity = product.get('quantity', 0)
             
-            check_query = "SELECT stan_aktualny FROM pos_magazyn WHERE produkt_id = ?"
-            result = execute_select(check_query, (product_id,))
-            
-            if not result['success'] or len(result['data']) == 0:
+            if product_id not in existing:
                 return error_response(f"Nie znaleziono produktu o ID {product_id}")
             
-            available_quantity = result['data'][0]['stan_aktualny'] or 0
+            available_quantity = stocks[product_id]
             if available_quantity < quantity:
                 return error_response(f"Niewystarczający stan magazynowy dla produktu ID {product_id}. Dostępne: {available_quantity}, żądane: {quantity}")
+            stocks[product_id] = available_quantity - quantity
         
         # Utwórz dokument RW
         document_number = f"RW-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        ensure_list_schema()
         issue_id = execute_insert("""
             INSERT INTO warehouse_issues 
-            (type, document_number, issue_date, status, created_at, location_id)
-            VALUES (?, ?, ?, ?, ?, ?)
+            (type, document_number, issue_date, status, created_at, location_id, created_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         """, ('internal', document_number, datetime.now().isoformat(), 
-              'completed', datetime.now().isoformat(), location_id))
+              'completed', datetime.now().isoformat(), location_id, data.get('created_by', 'System')))
         
         if not issue_id:
             return error_response("Błąd tworzenia dokumentu RW")
         
         # Przetwórz produkty
+        movements = []
         for product in products:
             product_id = product.get('product_id')
             quantity = product.get('quantity', 0)
@@ -925,13 +749,8 @@ def create_internal_issue():
                 VALUES (?, ?, ?, ?)
             """, (issue_id, product_id, quantity, reason))
             
-            # Aktualizuj stan magazynowy
-            cursor.execute("""
-                UPDATE pos_magazyn 
-                SET stan_aktualny = stan_aktualny - ?, 
-                    ostatnia_aktualizacja = CURRENT_TIMESTAMP
-                WHERE produkt_id = ?
-            """, (quantity, product_id))
+            movements.append(ledger_movement(product_id, stock_location_id, -quantity, 'rw', 'RW',
+                                             issue_id, document_number, reason))
             
             # Dodaj wpis do historii magazynu
             execute_insert("""
@@ -941,8 +760,8 @@ def create_internal_issue():
             """, (product_id, 'issue_internal', -quantity, reason, 
                   document_number, datetime.now().isoformat()))
         
-        conn.commit()
-        conn.close()
+        # Aktualizuj stan magazynowy lokalizacji - jedna partia ruchów
+        stock_ledger.post(movements)
         
         return success_response({"issue_id": issue_id}, "Rozchód wewnętrzny został zarejestrowany pomyślnie")
         
@@ -953,65 +772,24 @@ def create_internal_issue():
 
 @warehouse_operations_bp.route('/warehouse/inventory/start', methods=['POST', 'OPTIONS'])
 def start_inventory():
-    """Rozpoczyna inwentaryzację"""
+    """Rozpoczyna inwentaryzację w lokalizacji (pozycje sesji tworzone jednym INSERT ... SELECT)"""
     if request.method == 'OPTIONS':
         return '', 200
         
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         category_id = data.get('category')
         
-        # Sprawdź czy nie ma aktywnej inwentaryzacji
-        active_check = execute_select("SELECT id FROM inventory_sessions WHERE status = 'active'")
-        if active_check['success'] and len(active_check['data']) > 0:
-            return error_response("Istnieje już aktywna inwentaryzacja")
+        try:
+            result = inventory_sessions.start(data.get('location_id'), category_id)
+        except ValueError as e:
+            return error_response(str(e))
         
-        # Utwórz sesję inwentaryzacji
-        session_id = execute_insert("""
-            INSERT INTO inventory_sessions 
-            (start_date, category_id, status, created_at)
-            VALUES (?, ?, ?, ?)
-        """, (datetime.now().isoformat(), category_id, 'active', datetime.now().isoformat()))
+        # Lista produktów dla formularza liczenia - pomijana przy include_products=false (kolektory)
+        if data.get('include_products', True):
+            result['products'] = inventory_sessions.session_items(result['session_id'])
         
-        if not session_id:
-            return error_response("Błąd tworzenia sesji inwentaryzacji")
-        
-        # Pobierz produkty do inwentaryzacji
-        if category_id:
-            products_query = """
-                SELECT p.id as product_id, p.nazwa as product_name, p.kod_produktu as product_code, 
-                       p.opis as description, COALESCE(sm.stan_aktualny, 0) as system_count, p.jednostka as unit
-                FROM produkty p
-                LEFT JOIN pos_magazyn sm ON p.id = sm.produkt_id
-                WHERE p.category_id = ?
-                ORDER BY p.nazwa
-            """
-            products_result = execute_select(products_query, (category_id,))
-        else:
-            products_query = """
-                SELECT p.id as product_id, p.nazwa as product_name, p.kod_produktu as product_code, 
-                       p.opis as description, COALESCE(sm.stan_aktualny, 0) as system_count, p.jednostka as unit
-                FROM produkty p
-                LEFT JOIN pos_magazyn sm ON p.id = sm.produkt_id
-                ORDER BY p.nazwa
-            """
-            products_result = execute_select(products_query)
-        
-        if not products_result['success']:
-            return error_response("Błąd pobierania produktów")
-        
-        # Dodaj produkty do sesji inwentaryzacji
-        for product in products_result['data']:
-            execute_insert("""
-                INSERT INTO inventory_items 
-                (session_id, product_id, system_count)
-                VALUES (?, ?, ?)
-            """, (session_id, product['product_id'], product['system_count']))
-        
-        return success_response({
-            "session_id": session_id,
-            "products": products_result['data']
-        }, "Inwentaryzacja została rozpoczęta pomyślnie")
+        return success_response(result, "Inwentaryzacja została rozpoczęta pomyślnie")
         
     except Exception as e:
         logging.error(f"Błąd rozpoczynania inwentaryzacji: {str(e)}")
@@ -1020,128 +798,106 @@ def start_inventory():
 
 @warehouse_operations_bp.route('/warehouse/inventory/active', methods=['GET', 'OPTIONS'])
 def get_active_inventory():
-    """Pobiera aktywną inwentaryzację"""
+    """Pobiera aktywną inwentaryzację (opcjonalnie dla location_id)"""
     try:
-        query = """
-        SELECT 
-            s.id as session_id, s.start_date, s.category_id,
-            i.product_id, i.system_count, i.actual_count,
-            p.name as product_name, p.product_code, p.description, p.unit
-        FROM inventory_sessions s
-        LEFT JOIN inventory_items i ON s.id = i.session_id
-        LEFT JOIN products p ON i.product_id = p.id
-        WHERE s.status = 'active'
-        ORDER BY p.name
-        """
+        session = inventory_sessions.active_session(request.args.get('location_id', type=int))
+        if not session:
+            return success_response(None, "Brak aktywnej inwentaryzacji")
         
-        result = execute_select(query)
+        details = execute_query("""
+            SELECT id AS session_id, start_date, category_id, location_id
+            FROM inventory_sessions WHERE id = ?
+        """, (session['id'],))
+        result = details[0]
+        result['products'] = inventory_sessions.session_items(session['id'])
         
-        if result['success']:
-            if len(result['data']) == 0:
-                return success_response(None, "Brak aktywnej inwentaryzacji")
-            
-            # Grupuj dane
-            session = {
-                "session_id": result['data'][0]['session_id'],
-                "start_date": result['data'][0]['start_date'],
-                "category_id": result['data'][0]['category_id'],
-                "products": []
-            }
-            
-            for row in result['data']:
-                if row['product_id']:  # Pomijaj puste wiersze
-                    session['products'].append({
-                        "product_id": row['product_id'],
-                        "product_name": row['product_name'],
-                        "product_code": row['product_code'],
-                        "description": row['description'],
-                        "unit": row['unit'],
-                        "system_count": row['system_count'],
-                        "actual_count": row['actual_count']
-                    })
-            
-            return success_response(session, "Aktywna inwentaryzacja załadowana")
-        else:
-            return error_response(result['error'])
+        return success_response(result, "Aktywna inwentaryzacja załadowana")
             
     except Exception as e:
         logging.error(f"Błąd pobierania aktywnej inwentaryzacji: {str(e)}")
         logging.error(traceback.format_exc())
         return error_response(f"Błąd serwera: {str(e)}")
 
-@warehouse_operations_bp.route('/warehouse/inventory/finish', methods=['POST', 'OPTIONS'])
-def finish_inventory():
-    """Kończy inwentaryzację"""
+@warehouse_operations_bp.route('/warehouse/inventory/<int:session_id>/counts', methods=['POST', 'OPTIONS'])
+def submit_inventory_counts(session_id):
+    """
+    Partia policzonych pozycji (np. z kolektora)
+    Body: {items: [{product_id | ean | code, actual_count}], mode: 'set' | 'add'}
+    """
     if request.method == 'OPTIONS':
         return '', 200
         
     try:
-        data = request.get_json()
-        products = data.get('products', [])
+        data = request.get_json() or {}
+        items = data.get('items', [])
+        if not items:
+            return error_response("Brak pozycji do zapisania")
         
-        if not products:
-            return error_response("Brak danych do zakończenia inwentaryzacji")
+        try:
+            result = inventory_sessions.submit_counts(session_id, items, data.get('mode', 'set'))
+        except ValueError as e:
+            return error_response(str(e))
         
-        # Pobierz aktywną sesję
-        session_result = execute_select("SELECT id FROM inventory_sessions WHERE status = 'active'")
-        if not session_result['success'] or len(session_result['data']) == 0:
-            return error_response("Brak aktywnej inwentaryzacji")
+        return success_response(result, f"Zapisano {result['accepted']} pozycji")
         
-        session_id = session_result['data'][0]['id']
+    except Exception as e:
+        logging.error(f"Błąd zapisu pozycji inwentaryzacji: {str(e)}")
+        logging.error(traceback.format_exc())
+        return error_response(f"Błąd serwera: {str(e)}")
+
+@warehouse_operations_bp.route('/warehouse/inventory/finish', methods=['POST', 'OPTIONS'])
+def finish_inventory():
+    """
+    Kończy inwentaryzację - korekty stanów i historia zapisywane jedną transakcją
+    Body: {session_id?, location_id?, products?: [{product_id, actual_count}],
+           zero_uncounted?: bool, background?: bool}
+    """
+    if request.method == 'OPTIONS':
+        return '', 200
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    try:
+        data = request.get_json() or {}
+        products = data.get('products', [])
         
-        # Przetwórz wszystkie produkty
-        for product in products:
-            product_id = product.get('product_id')
-            system_count = product.get('system_count', 0)
-            actual_count = product.get('actual_count', 0)
-            difference = product.get('difference', 0)
-            
-            # Aktualizuj pozycję inwentaryzacji
-            cursor.execute("""
-                UPDATE inventory_items 
-                SET actual_count = ?, difference = ?
-                WHERE session_id = ? AND product_id = ?
-            """, (actual_count, difference, session_id, product_id))
-            
-            # Jeśli jest różnica, aktualizuj stan magazynowy
-            if difference != 0:
-                cursor.execute("""
-                    UPDATE pos_magazyn 
-                    SET stan_aktualny = ?, 
-                        ostatnia_aktualizacja = CURRENT_TIMESTAMP
-                    WHERE produkt_id = ?
-                """, (actual_count, product_id))
-                
-                # Dodaj wpis do historii magazynu
-                operation_type = 'inventory_increase' if difference > 0 else 'inventory_decrease'
-                execute_insert("""
-                    INSERT INTO warehouse_history 
-                    (product_id, operation_type, quantity_change, reason, document_number, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (product_id, operation_type, difference, 
-                      f"Korekta inwentaryzacyjna - różnica: {difference}", 
-                      f"INV-{session_id}", datetime.now().isoformat()))
-        
-        # Zamknij sesję inwentaryzacji
-        cursor.execute("""
-            UPDATE inventory_sessions 
-            SET status = 'completed', end_date = ?
-            WHERE id = ?
-        """, (datetime.now().isoformat(), session_id))
-        
-        conn.commit()
-        conn.close()
-        
-        return success_response({"session_id": session_id}, "Inwentaryzacja została zakończona pomyślnie")
+        session_id = data.get('session_id')
+        if not session_id:
+            session = inventory_sessions.active_session(data.get('location_id'))
+            if not session:
+                return error_response("Brak aktywnej inwentaryzacji")
+            session_id = session['id']
+        session_id = int(session_id)
+        
+        try:
+            # Formularz przesyła wszystkie pozycje naraz - zapis jak partia z kolektora
+            if products:
+                inventory_sessions.submit_counts(session_id, products, 'set')
+            
+            if data.get('background'):
+                inventory_sessions.finalize_async(session_id, bool(data.get('zero_uncounted')))
+                return success_response({
+                    "session_id": session_id,
+                    "progress_url": f"/api/warehouse/inventory/{session_id}/progress"
+                }, "Zamykanie inwentaryzacji rozpoczęte"), 202
+            
+            summary = inventory_sessions.finalize(session_id, bool(data.get('zero_uncounted')))
+        except ValueError as e:
+            return error_response(str(e))
+        
+        return success_response(summary, "Inwentaryzacja została zakończona pomyślnie")
         
     except Exception as e:
         logging.error(f"Błąd kończenia inwentaryzacji: {str(e)}")
         logging.error(traceback.format_exc())
         return error_response(f"Błąd serwera: {str(e)}")
 
+@warehouse_operations_bp.route('/warehouse/inventory/<int:session_id>/progress', methods=['GET'])
+def get_inventory_progress(session_id):
+    """Postęp zamykania inwentaryzacji"""
+    progress = inventory_sessions.progress(session_id)
+    if not progress:
+        return error_response("Brak informacji o zamykaniu tej inwentaryzacji", 404)
+    return success_response(progress, "Postęp zamykania inwentaryzacji")
+
 @warehouse_operations_bp.route('/inventory/sessions', methods=['GET'])
 def get_inventory_sessions():
     """Pobiera listę sesji inwentaryzacji z filtrowaniem"""
@@ -1181,3 +937,67 @@ def get_inventory_sessions():
         logging.error(f"Błąd pobierania sesji inwentaryzacji: {str(e)}")
         logging.error(traceback.format_exc())
         return error_response(f"Błąd serwera: {str(e)}")
+
+@warehouse_operations_bp.route('/warehouse/stock/<int:product_id>', methods=['GET'])
+def get_product_stock(product_id):
+    """
+    Stan produktu w lokalizacji z księgi ruchów
+    Parametry: location_id (domyślnie 5), at - stan na dzień/chwilę (opcjonalnie)
+    """
+    try:
+        location_id = request.args.get('location_id', DEFAULT_LOCATION_ID, type=int)
+        at = request.args.get('at')
+        if at:
+            stock = stock_ledger.stock_at(location_id, at, [product_id])
+            return success_response({
+                'product_id': product_id,
+                'location_id': location_id,
+                'at': at,
+                'on_hand': stock.get(product_id, 0.0)
+            }, "Stan na dzień pobrany pomyślnie")
+        
+        stock = stock_ledger.on_hand(product_id, location_id)
+        stock.update({'product_id': product_id, 'location_id': location_id})
+        return success_response(stock, "Stan magazynowy pobrany pomyślnie")
+        
+    except Exception as e:
+        logging.error(f"Błąd pobierania stanu produktu: {str(e)}")
+        return error_response(f"Błąd serwera: {str(e)}", 500)
+
+@warehouse_operations_bp.route('/warehouse/stock/ledger', methods=['GET'])
+def get_stock_ledger():
+    """Ruchy z księgi magazynowej (filtry: product_id, location_id, document_type, document_id, date_from, date_to, limit)"""
+    try:
+        rows = stock_ledger.movements(
+            product_id=request.args.get('product_id', type=int),
+            location_id=request.args.get('location_id', type=int),
+            document_type=request.args.get('document_type'),
+            document_id=request.args.get('document_id', type=int),
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            limit=min(request.args.get('limit', 100, type=int), 1000)
+        )
+        return success_response(rows, "Ruchy magazynowe pobrane pomyślnie")
+        
+    except Exception as e:
+        logging.error(f"Błąd pobierania księgi magazynowej: {str(e)}")
+        return error_response(f"Błąd serwera: {str(e)}", 500)
+
+@warehouse_operations_bp.route('/warehouse/stock/reconcile', methods=['POST'])
+def reconcile_stock_ledger():
+    """
+    Wyrównuje księgę do pos_magazyn dla stanów zmienionych z pominięciem księgi
+    Body: {"location_id": 5, "dry_run": true}
+    """
+    try:
+        data = request.get_json() or {}
+        drift = stock_ledger.reconcile(data.get('location_id'), bool(data.get('dry_run')))
+        return success_response({
+            'dry_run': bool(data.get('dry_run')),
+            'differences': len(drift),
+            'items': drift[:500]
+        }, "Kontrola księgi magazynowej zakończona")
+        
+    except Exception as e:
+        logging.error(f"Błąd wyrównania księgi magazynowej: {str(e)}")
+        return error_response(f"Błąd serwera: {str(e)}", 500)
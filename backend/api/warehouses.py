@@ -3,17 +3,9 @@ API endpoint dla zarządzania magazynami
 Obsługa wielomagazynowej struktury sklepów
 """
 
-from flask import Blueprint, request, jsonify
-from utils.database import execute_query, execute_insert, success_response, error_response, not_found_response
-
-# Import centralnego systemu marż
-try:
-    from api.margin_service import MarginService
-    margin_service = MarginService()
-    print("✅ WAREHOUSES: Zaimportowano margin_service")
-except ImportError as e:
-    print(f"⚠️ WAREHOUSES: Nie można zaimportować margin_service: {e}")
-    margin_service = None
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from utils.database import get_db_connection, execute_query, execute_insert, success_response, error_response, not_found_response
+from utils.warehouse_transfers import warehouse_transfers, TransferError, TransferNotFound
 
 warehouses_bp = Blueprint('warehouses', __name__)
 
@@ -446,10 +438,14 @@ def remove_employee_from_warehouse(warehouse_id, user_login):
 @warehouses_bp.route('/warehouses/<int:warehouse_id>/prices', methods=['GET'])
 def get_warehouse_prices(warehouse_id):
     """
-    Pobierz ceny produktów dla danego magazynu
+    Pobierz ceny produktów dla danego magazynu z gotowego arkusza cen (utils.price_sheets)
     GET /api/warehouses/123/prices
+    Parametry: limit (>= 1) + cursor (stronicowanie po nazwie), format=stream (cały arkusz jako tablica JSON).
+    Odpowiedź ma ETag wersji arkusza - If-None-Match z aktualną wersją zwraca 304.
     """
     try:
+        from utils.price_sheets import price_sheets
+        
         # Sprawdź czy magazyn istnieje
         warehouse = execute_query(
             "SELECT id, nazwa FROM warehouses WHERE id = ?",
@@ -459,119 +455,59 @@ def get_warehouse_prices(warehouse_id):
         if not warehouse:
             return not_found_response("Magazyn nie został znaleziony")
         
-        # Pobierz ceny produktów dla tego magazynu
-        # Jeśli nie ma dedykowanych cen magazynowych, zwracaj ceny standardowe z produkty
-        prices_sql = """
-        SELECT 
-            p.id as product_id,
-            p.nazwa as product_name,
-            p.ean as barcode,
-            p.cena_sprzedazy_brutto as price,
-            COALESCE(p.cena_zakupu_netto, 0) as purchase_price,
-            COALESCE(p.cena_sprzedazy_netto, 0) as price_net,
-            p.stawka_vat as vat_rate,
-            COALESCE(wp.cena_sprzedazy_brutto, p.cena_sprzedazy_brutto) as warehouse_price,
-            -- Oblicz warehouse_price_net poprawnie z ceny specjalnej lub standardowej
-            CASE 
-                WHEN wp.cena_sprzedazy_brutto IS NOT NULL THEN 
-                    wp.cena_sprzedazy_brutto / (1 + COALESCE(p.stawka_vat, 23)/100.0)
-                ELSE 
-                    COALESCE(p.cena_sprzedazy_netto, p.cena_sprzedazy_brutto / (1 + COALESCE(p.stawka_vat, 23)/100.0), 0)
-            END as warehouse_price_net,
-            wp.cena_sprzedazy_brutto as dedicated_warehouse_price,
-            wp.updated_at as price_updated,
-            -- Stan magazynowy z inventory_locations
-            COALESCE(il.ilosc_dostepna, 0) as stock_quantity,
-            COALESCE(il.ilosc_zarezerwowana, 0) as stock_reserved
-        FROM produkty p
-        LEFT JOIN warehouse_product_prices wp ON p.id = wp.product_id AND wp.warehouse_id = ? AND wp.aktywny = 1
-        LEFT JOIN inventory_locations il ON p.id = il.product_id AND il.warehouse_id = ?
-        WHERE p.aktywny = 1
-        ORDER BY p.nazwa
-        """
+        limit = request.args.get('limit')
+        if limit not in (None, ''):
+            try:
+                limit = int(limit)
+            except ValueError:
+                return error_response("Parametr 'limit' musi być liczbą", 400)
+            if limit < 1:
+                return error_response("Parametr 'limit' musi być większy od 0", 400)
+            limit = min(limit, 1000)
+        else:
+            limit = None
         
-        prices = execute_query(prices_sql, (warehouse_id, warehouse_id))
-        
-        if prices is None:
-            return error_response("Błąd połączenia z bazą danych", 500)
-        
-        # Debug dla konkretnego produktu
-        debug_product = next((p for p in prices if p.get('barcode') == '5902837746883'), None)
-        if debug_product:
-            print(f"🔍 DEBUG WAREHOUSE PRICES dla {debug_product['barcode']}:")
-            print(f"   cena_sprzedazy_netto: {debug_product.get('price_net')}")
-            print(f"   cena_sprzedazy_brutto: {debug_product.get('price')}")
-            print(f"   stawka_vat: {debug_product.get('vat_rate')}")
-            print(f"   warehouse_price_net: {debug_product.get('warehouse_price_net')}")
-            print(f"   cena_zakupu_netto: {debug_product.get('purchase_price')}")
-        
-        # Przekształć wyniki do formatu oczekiwanego przez frontend
-        prices_data = []
-        for row in prices:
-            standard_price = float(row['price']) if row['price'] else 0.0
-            purchase_price_netto = float(row['purchase_price']) if row['purchase_price'] else 0.0
-            warehouse_price = float(row['warehouse_price']) if row['warehouse_price'] else standard_price
-            warehouse_price_netto = float(row['warehouse_price_net']) if row['warehouse_price_net'] else 0.0
-            
-            # Oblicz marżę używając centralnego API marży
-            margin = 0.0
-            margin_method = "brak_ceny"
-            
-            # Pobierz cenę zakupu i marżę z centralnego API marży
-            margin_service_purchase_price = purchase_price_netto  # domyślnie z tabeli produkty
-            
-            # Spróbuj użyć centralnego API marży
-            if warehouse_price_netto > 0:
-                try:
-                    margin_calc = margin_service.calculate_product_margin(
-                        product_id=row['product_id'],
-                        sell_price_net=warehouse_price_netto,
-                        warehouse_id=warehouse_id
-                    )
-                    margin = margin_calc.margin_percent
-                    margin_method = margin_calc.calculation_method
-                    # Użyj ceny zakupu z margin_service dla spójności
-                    margin_service_purchase_price = margin_calc.buy_price_net
-                except Exception as e:
-                    print(f"⚠️ API marży niedostępne dla produktu {row['product_id']}: {e}")
-                    # Fallback - lokalne obliczenia
-                    if purchase_price_netto > 0 and warehouse_price_netto > 0:
-                        margin_amount = warehouse_price_netto - purchase_price_netto
-                        margin = round((margin_amount / warehouse_price_netto) * 100, 2)
-                        margin_method = "lokalne_obliczenia"
-            
-            # POPRAWKA: Sprawdź czy istnieje dedykowana cena magazynowa 
-            has_dedicated_price = row['dedicated_warehouse_price'] is not None
+        # Strumień czyta wersję (ETag) i wiersze w jednej transakcji odczytu na tym połączeniu
+        stream = request.args.get('format') == 'stream'
+        conn = get_db_connection() if stream else None
+        try:
+            sheet = price_sheets.current(warehouse_id, conn=conn)
+            etag = sheet['etag']
+            if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+                return Response(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
             
-            prices_data.append({
-                'product_id': row['product_id'],
-                'product_name': row['product_name'],
-                'barcode': row['barcode'],
-                'standard_price': standard_price,
-                'purchase_price': margin_service_purchase_price,  # Użyj ceny z margin_service
-                'price_net': float(row['price_net']) if row['price_net'] else 0.0,
-                'vat_rate': float(row['vat_rate']) if row['vat_rate'] else 23.0,
-                'warehouse_price': warehouse_price,
-                'warehouse_price_net': warehouse_price_netto,
-                'special_price': warehouse_price if has_dedicated_price else None,
-                'has_special_price': has_dedicated_price,
-                'margin': round(margin, 2),
-                'margin_method': margin_method,
-                'price_updated': row['price_updated'],
-                # Stan magazynowy
-                'stock': float(row['stock_quantity']) if row.get('stock_quantity') else 0.0,
-                'stock_quantity': float(row['stock_quantity']) if row.get('stock_quantity') else 0.0,
-                'stock_reserved': float(row['stock_reserved']) if row.get('stock_reserved') else 0.0
-            })
+            if stream:
+                response = Response(
+                    stream_with_context(price_sheets.stream(warehouse_id, conn=conn)),
+                    mimetype='application/json',
+                    headers={'ETag': etag, 'Cache-Control': 'no-cache'}
+                )
+                response.call_on_close(conn.close)
+                conn = None
+                return response
+        finally:
+            if conn is not None:
+                conn.close()
+        
+        prices_data, next_cursor, has_more = price_sheets.page(
+            warehouse_id, limit=limit, cursor_token=request.args.get('cursor')
+        )
         
-        return success_response({
+        response, status_code = success_response({
             'warehouse': {
                 'id': warehouse[0]['id'],
                 'name': warehouse[0]['nazwa']
             },
             'prices': prices_data,
-            'total_products': len(prices_data)
+            'total_products': sheet['products'],
+            'next_cursor': next_cursor,
+            'has_more': has_more,
+            'sheet_version': sheet['version'],
+            'refreshed_at': sheet['refreshed_at']
         }, "Pobrano ceny produktów dla magazynu")
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response, status_code
         
     except Exception as e:
         print(f"Błąd pobierania cen magazynu: {e}")
@@ -675,59 +611,11 @@ def create_transfer():
         if not target:
             return error_response(f"Magazyn docelowy o ID {magazyn_docelowy_id} nie istnieje", 404)
         
-        # Generuj numer transferu
-        from datetime import datetime
-        today = datetime.now().strftime('%Y%m%d')
-        
-        # Pobierz ostatni numer transferu z dzisiaj
-        last_transfer = execute_query(
-            "SELECT numer_transferu FROM warehouse_transfers WHERE numer_transferu LIKE ? ORDER BY id DESC LIMIT 1",
-            (f"MM/{today}/%",)
+        # Numer, nagłówek i wszystkie pozycje w jednej transakcji
+        transfer_id, numer_transferu, items_added = warehouse_transfers.create(
+            magazyn_zrodlowy_id, magazyn_docelowy_id, items, requested_by, uwagi
         )
         
-        if last_transfer and last_transfer[0]['numer_transferu']:
-            try:
-                last_num = int(last_transfer[0]['numer_transferu'].split('/')[-1])
-                next_num = last_num + 1
-            except:
-                next_num = 1
-        else:
-            next_num = 1
-            
-        numer_transferu = f"MM/{today}/{next_num:04d}"
-        
-        # Utwórz transfer
-        transfer_sql = """
-        INSERT INTO warehouse_transfers 
-        (numer_transferu, warehouse_from_id, warehouse_to_id, requested_by, status, data_zlozenia, uwagi)
-        VALUES (?, ?, ?, ?, 'oczekujacy', datetime('now'), ?)
-        """
-        
-        transfer_id = execute_insert(transfer_sql, (
-            numer_transferu,
-            magazyn_zrodlowy_id,
-            magazyn_docelowy_id,
-            requested_by,
-            uwagi
-        ))
-        
-        if not transfer_id:
-            return error_response("Błąd tworzenia transferu", 500)
-        
-        # Dodaj pozycje transferu
-        items_added = 0
-        for item in items:
-            produkt_id = item.get('produkt_id')
-            ilosc = float(item.get('ilosc_wyslana', item.get('ilosc', 1)))
-            
-            if produkt_id and ilosc > 0:
-                item_sql = """
-                INSERT INTO transfer_items (transfer_id, product_id, ilosc_zlecona, jednostka)
-                VALUES (?, ?, ?, 'szt')
-                """
-                execute_insert(item_sql, (transfer_id, produkt_id, ilosc))
-                items_added += 1
-        
         print(f"✅ Utworzono transfer {numer_transferu}: {source[0]['nazwa']} → {target[0]['nazwa']}, {items_added} pozycji")
         
         return success_response({
@@ -819,103 +707,18 @@ def update_transfer_status(transfer_id, action):
             if current_status not in ['oczekujacy', 'zatwierdzony']:
                 return error_response("Można wysłać tylko transfer oczekujący lub zatwierdzony", 400)
             
-            # Pobierz location_id magazynu źródłowego
-            source_warehouse = execute_query(
-                "SELECT location_id FROM warehouses WHERE id = ?",
-                (transfer[0]['warehouse_from_id'],)
-            )
-            source_location_id = source_warehouse[0]['location_id'] if source_warehouse else None
-            
-            # Pobierz produkty do wysłania
-            transfer_items = execute_query(
-                "SELECT product_id, ilosc_zlecona FROM transfer_items WHERE transfer_id = ?",
-                (transfer_id,)
-            )
-            
-            # Odejmij produkty z magazynu źródłowego
-            if source_location_id and transfer_items:
-                for item in transfer_items:
-                    execute_insert(
-                        """UPDATE pos_magazyn 
-                           SET stan_aktualny = stan_aktualny - ?, 
-                               ostatnia_aktualizacja = datetime('now')
-                           WHERE produkt_id = ? AND lokalizacja = ?""",
-                        (item['ilosc_zlecona'], item['product_id'], str(source_location_id))
-                    )
-                print(f"📦 Odjęto {len(transfer_items)} produktów z lokalizacji {source_location_id}")
-            
-            execute_insert(
-                "UPDATE warehouse_transfers SET status = 'w_transporcie', data_wysylki = datetime('now') WHERE id = ?",
-                (transfer_id,)
-            )
+            # Odjęcie z magazynu źródłowego i zmiana statusu w jednej transakcji
+            shipped = warehouse_transfers.ship(transfer_id, user)
+            print(f"📦 Odjęto {shipped['products']} produktów z lokalizacji {shipped['location_id']}")
             new_status = 'w_transporcie'
             
         elif action == 'receive':
             if current_status != 'w_transporcie':
                 return error_response("Można odebrać tylko transfer w transporcie", 400)
             
-            # Pobierz location_id magazynu docelowego
-            dest_warehouse = execute_query(
-                "SELECT location_id FROM warehouses WHERE id = ?",
-                (transfer[0]['warehouse_to_id'],)
-            )
-            dest_location_id = dest_warehouse[0]['location_id'] if dest_warehouse else None
-            
-            # Pobierz produkty do przyjęcia
-            transfer_items = execute_query(
-                "SELECT product_id, ilosc_zlecona FROM transfer_items WHERE transfer_id = ?",
-                (transfer_id,)
-            )
-            
-            # Aktualizuj ilości dostarczone z request body
-            items = data.get('items', [])
-            for item in items:
-                if item.get('id') and item.get('ilosc_dostarczona') is not None:
-                    execute_insert(
-                        "UPDATE transfer_items SET ilosc_dostarczona = ? WHERE id = ?",
-                        (item['ilosc_dostarczona'], item['id'])
-                    )
-            
-            # Dodaj produkty do magazynu docelowego
-            if dest_location_id and transfer_items:
-                for item in transfer_items:
-                    # Sprawdź czy produkt już istnieje w tej lokalizacji
-                    existing = execute_query(
-                        "SELECT id, stan_aktualny FROM pos_magazyn WHERE produkt_id = ? AND lokalizacja = ?",
-                        (item['product_id'], str(dest_location_id))
-                    )
-                    
-                    if existing:
-                        # Aktualizuj stan
-                        execute_insert(
-                            """UPDATE pos_magazyn 
-                               SET stan_aktualny = stan_aktualny + ?, 
-                                   ostatnia_aktualizacja = datetime('now')
-                               WHERE produkt_id = ? AND lokalizacja = ?""",
-                            (item['ilosc_zlecona'], item['product_id'], str(dest_location_id))
-                        )
-                    else:
-                        # Dodaj nowy rekord
-                        execute_insert(
-                            """INSERT INTO pos_magazyn (produkt_id, stan_aktualny, lokalizacja, ostatnia_aktualizacja)
-                               VALUES (?, ?, ?, datetime('now'))""",
-                            (item['product_id'], item['ilosc_zlecona'], str(dest_location_id))
-                        )
-                    
-                    # Ustaw ilosc_dostarczona na ilosc_zlecona jeśli nie została podana
-                    execute_insert(
-                        """UPDATE transfer_items 
-                           SET ilosc_dostarczona = CASE WHEN ilosc_dostarczona = 0 THEN ilosc_zlecona ELSE ilosc_dostarczona END
-                           WHERE transfer_id = ? AND product_id = ?""",
-                        (transfer_id, item['product_id'])
-                    )
-                
-                print(f"📥 Dodano {len(transfer_items)} produktów do lokalizacji {dest_location_id}")
-            
-            execute_insert(
-                "UPDATE warehouse_transfers SET status = 'dostarczony', data_dostawy = datetime('now') WHERE id = ?",
-                (transfer_id,)
-            )
+            # Ilości dostarczone, przyjęcie na magazyn docelowy i zmiana statusu w jednej transakcji
+            received = warehouse_transfers.receive(transfer_id, data.get('items', []), user)
+            print(f"📥 Dodano {received['products']} produktów do lokalizacji {received['location_id']}")
             new_status = 'dostarczony'
             
         elif action == 'cancel':
@@ -938,6 +741,11 @@ def update_transfer_status(transfer_id, action):
             'new_status': new_status
         }, f"Status transferu zmieniony na {new_status}")
         
+    except TransferNotFound as e:
+        return not_found_response(str(e))
+    except TransferError as e:
+        # Status zmieniony równolegle między odczytem a transakcją
+        return error_response(str(e), 409)
     except Exception as e:
         print(f"❌ Błąd aktualizacji statusu transferu: {e}")
         return error_response(f"Błąd: {str(e)}", 500)
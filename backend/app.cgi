@@ -2,6 +2,9 @@
 """
 CGI wrapper dla POS System V3 API
 Plik do umieszczenia w cgi-bin/python3/ na serwerze DirectAdmin
+CGI uruchamia nowy proces dla każdego żądania - jeśli serwer ma mod_fcgid,
+użyj app.fcgi (trwały proces). Tutaj blueprinty są ładowane leniwie, więc
+żądanie importuje tylko moduł API, którego dotyczy.
 """
 
 import sys
@@ -14,19 +17,25 @@ cgitb.enable()
 # Dodaj ścieżkę do aplikacji
 sys.path.insert(0, '/home/username/domains/yourdomain.com/public_html/api')
 
-# Import aplikacji Flask
+# Import modułów API dopiero przy pierwszym żądaniu do nich
+os.environ.setdefault('LAZY_BLUEPRINTS', '1')
+
+# stdout należy do odpowiedzi CGI - logi aplikacji (print) kierujemy do stderr
+cgi_stdout = sys.stdout.buffer
+sys.stdout = sys.stderr
+
+# Import aplikacji Flask (moduł app tworzy instancję przy imporcie)
 try:
-    from app import create_app
-    
-    # Utwórz aplikację
-    app = create_app()
+    from app import app
     
     # Uruchom aplikację
     if __name__ == '__main__':
         # Dla CGI używamy wsgi
-        from wsgiref.handlers import CGIHandler
-        CGIHandler().run(app)
+        from wsgiref.handlers import BaseCGIHandler, read_environ
+        BaseCGIHandler(sys.stdin.buffer, cgi_stdout, sys.stderr, read_environ(),
+                       multithread=False, multiprocess=True).run(app)
         
 except Exception as e:
+    sys.stdout = sys.__stdout__
     print("Content-Type: application/json\n")
     print(f'{{"error": "Application failed to start", "details": "{str(e)}"}}')
@@ -20,6 +20,44 @@ except ImportError:
 # Dodaj ścieżkę do modułów
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# Rejestr blueprintów API: (moduł, blueprint, url_prefix, nazwa w logach)
+# Kolejność ma znaczenie - kupony najpierw, autoryzacja przed pozostałymi modułami
+BLUEPRINTS = [
+    ('api.coupons', 'coupons_bp', '/api', 'Coupons'),
+    ('api.customers', 'customers_bp', '/api', 'Customers'),
+    ('api.products', 'products_bp', '/api', 'Products'),
+    ('api.pos', 'pos_bp', '/api', 'POS'),
+    ('api.categories', 'categories_bp', '/api', 'Categories'),
+    ('api.auth', 'auth_bp', '/api', 'Auth'),
+    ('api.transactions', 'transactions_bp', '/api', 'Transactions'),
+    ('api.shifts', 'shifts_bp', '/api', 'Shifts'),
+    ('api.shifts_enhanced', 'shifts_enhanced_bp', '/api', 'Shifts Enhanced'),
+    ('api.invoices', 'invoices_bp', '/api', 'Invoices'),
+    ('api.admin', 'admin_bp', '/api', 'Admin'),
+    ('api.manufacturers', 'manufacturers_bp', '/api', 'Manufacturers'),
+    ('api.cenowki', 'cenowki_bp', '/api/cenowki', 'Cenowki'),
+    ('api.cenowki_advanced', 'cenowki_api_bp', '/api', 'Cenowki Advanced'),
+    ('api.sales_invoices', 'sales_invoices_api_bp', '/api', 'Sales Invoices'),
+    ('api.product_reports', 'product_reports_bp', '/api', 'Product Reports'),
+    ('api.kasa_bank', 'kasa_bank_bp', '/api', 'Kasa/Bank'),
+    ('api.locations', 'locations_bp', '/api', 'Locations'),
+    ('api.purchase_invoices', 'purchase_invoices_bp', '/api', 'Purchase invoices'),
+    ('api.warehouses', 'warehouses_bp', '/api', 'Warehouses'),
+    ('api.custom_templates', 'custom_templates_bp', '/api', 'Custom Templates'),
+    ('api.messenger', 'messenger_bp', '/api/messenger', 'Messenger'),
+    ('api.rabaty', 'rabaty_bp', '/api', 'Rabaty'),
+    ('api.orders', 'orders_bp', '/api', 'Orders'),
+    ('api.warehouse_operations', 'warehouse_operations_bp', '/api', 'Warehouse operations'),
+    ('api.warehouse_pricing', 'warehouse_pricing_bp', '/api', 'Location pricing'),
+    ('api.announcements', 'announcements_bp', '/api', 'Announcements'),
+    ('api.document_prefixes', 'document_prefixes_bp', '/api', 'Document Prefixes'),
+    ('api.fiscal', 'fiscal_bp', '/api', 'Fiscal Printer'),
+    ('api.margins', 'margins_bp', '/api', 'Margins'),
+    ('api.marze', 'marze_bp', '/api/marze', 'Marze'),
+    ('api.quick_products', 'quick_products_bp', '/api', 'Quick Products'),
+    ('api.fifo_api', 'fifo_bp', '/api', 'FIFO'),
+]
+
 def create_app():
     # Konfiguracja ścieżek dla frontendu
     frontend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend', 'build'))
@@ -44,6 +82,15 @@ def create_app():
     app.config['SECRET_KEY'] = app_config.SECRET_KEY
     app.config['DEBUG'] = app_config.DEBUG
     app.config['DATABASE_PATH'] = app_config.DATABASE_PATH
+    app.config['BACKUP_COMPRESSION'] = app_config.BACKUP_COMPRESSION
+    app.config['BACKUP_INCREMENTAL'] = app_config.BACKUP_INCREMENTAL
+    app.config['BACKUP_RETENTION'] = app_config.BACKUP_RETENTION
+    
+    # Logowanie z poziomami (LOG_LEVEL / LOG_FORMAT) i metryki żądań/zapytań SQL
+    from utils.structured_logging import configure_logging
+    from utils.metrics import metrics
+    configure_logging(app_config.LOG_LEVEL, app_config.LOG_FORMAT)
+    metrics.init_app(app)
     
     # Konfiguracja CORS - dodajemy obsługę Heroku i localhost
     cors_origins = app_config.CORS_ORIGINS
@@ -72,250 +119,12 @@ def create_app():
          origins=cors_origins,
          allow_headers=['Content-Type', 'Authorization', 'Access-Control-Allow-Headers', 'Origin', 'Accept', 'X-Requested-With'],
          methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
+         expose_headers=['X-Next-Cursor'],
          supports_credentials=True)
     
-    # Rejestracja blueprintów API
-    blueprint_errors = []
-    
-    # 1. Najpierw blueprint kuponów!
-    try:
-        from api.coupons import coupons_bp
-        app.register_blueprint(coupons_bp, url_prefix='/api')
-        print("✅ Coupons blueprint OK")
-    except Exception as e:
-        error_msg = f"❌ Błąd coupons blueprint: {e}"
-        print(error_msg)
-        app.blueprint_errors.append(error_msg)
-
-    # 2. Podstawowe blueprinty
-    try:
-        from api.customers import customers_bp
-        from api.products import products_bp  
-        from api.pos import pos_bp
-        from api.categories import categories_bp
-        print("✅ Podstawowe blueprinty załadowane")
-        app.register_blueprint(customers_bp, url_prefix='/api')
-        app.register_blueprint(products_bp, url_prefix='/api')
-        app.register_blueprint(pos_bp, url_prefix='/api')
-        app.register_blueprint(categories_bp, url_prefix='/api')
-        print("✅ Podstawowe blueprinty zarejestrowane")
-    except Exception as e:
-        error_msg = f"❌ Błąd podstawowych blueprintów: {e}"
-        print(error_msg)
-        app.blueprint_errors.append(error_msg)
-
-    # 3. Blueprint autoryzacji - KRYTYCZNY!
-    try:
-        from api.auth import auth_bp
-        app.register_blueprint(auth_bp, url_prefix='/api')
-        print("✅ Auth blueprint OK")
-    except Exception as e:
-        error_msg = f"❌ Błąd auth blueprint: {e}"
-        print(error_msg)
-        app.blueprint_errors.append(error_msg)
-
-    # 4. Dodatkowe blueprinty z obsługą błędów
-    try:
-        from api.transactions import transactions_bp
-        app.register_blueprint(transactions_bp, url_prefix='/api')
-        print("✅ Transactions blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd transactions blueprint: {e}")
-    try:
-        from api.shifts import shifts_bp
-        app.register_blueprint(shifts_bp, url_prefix='/api')
-        print("✅ Shifts blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd shifts blueprint: {e}")
-        
-    try:
-        from api.shifts_enhanced import shifts_enhanced_bp
-        app.register_blueprint(shifts_enhanced_bp, url_prefix='/api')
-        print("✅ Shifts Enhanced blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd shifts enhanced blueprint: {e}")
-    
-    # Dodaj blueprint faktur
-    try:
-        from api.invoices import invoices_bp
-        app.register_blueprint(invoices_bp, url_prefix='/api')
-        print("✅ Invoices blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd invoices blueprint: {e}")
-    
-    # Dodaj blueprint administracji
-    try:
-        from api.admin import admin_bp
-        app.register_blueprint(admin_bp, url_prefix='/api')
-        print("✅ Admin blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd admin blueprint: {e}")
-    
-    # Dodaj blueprint producentów
-    try:
-        from api.manufacturers import manufacturers_bp
-        app.register_blueprint(manufacturers_bp, url_prefix='/api')
-        print("✅ Manufacturers blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd manufacturers blueprint: {e}")
-        
-    # Dodaj blueprint cenówek (stary)
-    try:
-        from api.cenowki import cenowki_bp
-        app.register_blueprint(cenowki_bp, url_prefix='/api/cenowki')
-        print("✅ Cenowki blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd cenowki blueprint: {e}")
-        
-    # Dodaj blueprint cenówek z uproszczonymi nazwami (nowy)
-    try:
-        from api.cenowki_advanced import cenowki_api_bp
-        app.register_blueprint(cenowki_api_bp, url_prefix='/api')
-        print("✅ Cenowki Advanced blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd cenowki_advanced blueprint: {e}")
-        
-    # Dodaj blueprint faktur sprzedaży
-    try:
-        from api.sales_invoices import sales_invoices_api_bp
-        app.register_blueprint(sales_invoices_api_bp, url_prefix='/api')
-        print("✅ Sales Invoices blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd sales_invoices blueprint: {e}")
-        
-    # Dodaj blueprint raportów produktowych
-    try:
-        from api.product_reports import product_reports_bp
-        app.register_blueprint(product_reports_bp, url_prefix='/api')
-        print("✅ Product Reports blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd product_reports blueprint: {e}")
-        
-    # Dodaj blueprint kasa/bank
-    try:
-        from api.kasa_bank import kasa_bank_bp
-        app.register_blueprint(kasa_bank_bp, url_prefix='/api')
-        print("✅ Kasa/Bank blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd kasa_bank blueprint: {e}")
-        
-    # Dodaj blueprint lokalizacji
-    try:
-        from api.locations import locations_bp
-        app.register_blueprint(locations_bp, url_prefix='/api')
-        print("✅ Locations blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd locations blueprint: {e}")
-            
-    # Dodaj blueprint faktur zakupowych
-    try:
-        from api.purchase_invoices import purchase_invoices_bp
-        app.register_blueprint(purchase_invoices_bp, url_prefix='/api')
-        print("✅ Purchase invoices blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd purchase_invoices blueprint: {e}")
-        
-    # Dodaj blueprint magazynów wielomagazynowych
-    try:
-        from api.warehouses import warehouses_bp
-        app.register_blueprint(warehouses_bp, url_prefix='/api')
-        print("✅ Warehouses blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd warehouses blueprint: {e}")
-        
-    # Dodaj blueprint customowych szablonów faktur
-    try:
-        from api.custom_templates import custom_templates_bp
-        app.register_blueprint(custom_templates_bp, url_prefix='/api')
-        print("✅ Custom Templates blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd custom_templates blueprint: {e}")
-        
-    # Dodaj blueprint komunikatora/czatu pracowników
-    try:
-        from api.messenger import messenger_bp
-        app.register_blueprint(messenger_bp, url_prefix='/api/messenger')
-        print("✅ Messenger blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd messenger blueprint: {e}")
-        
-    # Dodaj blueprint rabatów POS
-    try:
-        from api.rabaty import rabaty_bp
-        app.register_blueprint(rabaty_bp, url_prefix='/api')
-        print("✅ Rabaty blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd rabaty blueprint: {e}")
-    except Exception as e:
-        print(f"❌ Błąd messenger blueprint: {e}")
-        
-    # Dodaj blueprint zamówień od klientów
-    try:
-        from api.orders import orders_bp
-        app.register_blueprint(orders_bp, url_prefix='/api')
-        print("✅ Orders blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd orders blueprint: {e}")
-
-    try:
-        from api.warehouse_operations import warehouse_operations_bp
-        app.register_blueprint(warehouse_operations_bp, url_prefix='/api')
-        print("✅ Warehouse operations blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd warehouse operations blueprint: {e}")
-        
-    # Dodaj blueprint cennika lokalizacyjnego
-    try:
-        from api.warehouse_pricing import warehouse_pricing_bp
-        app.register_blueprint(warehouse_pricing_bp, url_prefix='/api')
-        print("✅ Location pricing blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd location pricing blueprint: {e}")
-        
-    # Dodaj blueprint ogłoszeń
-    try:
-        from api.announcements import announcements_bp
-        app.register_blueprint(announcements_bp, url_prefix='/api')
-        print("✅ Announcements blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd announcements blueprint: {e}")
-        
-    # Dodaj blueprint prefiksów dokumentów
-    try:
-        from api.document_prefixes import document_prefixes_bp
-        app.register_blueprint(document_prefixes_bp, url_prefix='/api')
-        print("✅ Document Prefixes blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd document prefixes blueprint: {e}")
-        
-    # Dodaj blueprint drukarki fiskalnej
-    try:
-        from api.fiscal import fiscal_bp
-        app.register_blueprint(fiscal_bp, url_prefix='/api')
-        print("✅ Fiscal Printer blueprint OK")
-    except Exception as e:
-        pass
-    # Dodaj blueprint marży
-    try:
-        from api.margins import margins_bp
-        app.register_blueprint(margins_bp, url_prefix="/api")
-        print("✅ Margins blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd margins blueprint: {e}")
-        print(f"❌ Błąd fiscal printer blueprint: {e}")
-        
-    # Dodaj blueprint szybkich produktów POS
-    try:
-        from api.quick_products import quick_products_bp
-        app.register_blueprint(quick_products_bp, url_prefix='/api')
-        print("✅ Quick Products blueprint OK")
-    except Exception as e:
-        print(f"❌ Błąd quick_products blueprint: {e}")
-
-        # Kontynuuj dalej - nie zwracaj app tutaj!
-    
-    except ImportError as e:
-        print(f"Błąd importu blueprintów: {e}")
+    # Rejestracja blueprintów API (leniwie przy LAZY_BLUEPRINTS=1 - import modułu przy pierwszym żądaniu)
+    from utils.lazy_blueprints import BlueprintRegistry
+    BlueprintRegistry(BLUEPRINTS).register_all(app, lazy=app_config.LAZY_BLUEPRINTS)
     
     # Endpoint zdrowia API
     @app.route('/api/health')
@@ -495,6 +304,11 @@ def create_app():
             'python_path': sys.path
         })
 
+    @app.route('/api/debug/startup')
+    def debug_startup():
+        """Czas startu aplikacji i stan leniwego ładowania blueprintów"""
+        return jsonify(app.blueprint_registry.get_status())
+
     @app.route('/api/debug/blueprints')
     def debug_blueprints():
         """Debug info o zarejestrowanych blueprintach"""
@@ -7,6 +7,24 @@ class Config:
     """Bazowa konfiguracja"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-2024'
     DATABASE_PATH = os.environ.get('DATABASE_PATH') or os.path.abspath(os.path.join(os.path.dirname(__file__), 'kupony.db'))
+    
+    # Import modułów API przy pierwszym żądaniu (CGI / serverless) - utils/lazy_blueprints.py
+    LAZY_BLUEPRINTS = os.environ.get('LAZY_BLUEPRINTS', '0') == '1'
+    
+    # Logowanie (utils/structured_logging.py): DEBUG | INFO | WARNING, format text | json
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    
+    # Kopie zapasowe (utils/backup_engine.py)
+    BACKUP_COMPRESSION = os.environ.get('BACKUP_COMPRESSION', 'gzip')  # none | gzip | zstd
+    BACKUP_INCREMENTAL = os.environ.get('BACKUP_INCREMENTAL', 'true').lower() == 'true'
+    BACKUP_RETENTION = {
+        'keep_last': 7,
+        'keep_daily': 14,
+        'keep_weekly': 8,
+        'keep_monthly': 12,
+        'max_age_days': 400
+    }
 
 class DevelopmentConfig(Config):
     """Konfiguracja dla środowiska deweloperskiego"""
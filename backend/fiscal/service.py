@@ -28,6 +28,7 @@ class FiscalService:
     
     def __init__(self):
         self.printer = None
+        self.printer_owner_pid = None  # PID procesu trzymającego port, gdy nie ten
         self.is_enabled = FISCAL_PRINTER_CONFIG.get('enabled', True)
         
         # Załaduj status trybu testowego z pliku konfiguracyjnego
@@ -75,6 +76,15 @@ class FiscalService:
             
             # Utworzenie nowej instancji drukarki tylko jeśli nie ma globalnej
             if _fiscal_printer is None:
+                # Port szeregowy może otworzyć tylko jeden proces - przy wielu workerach
+                # właściciel drukarki jest wybierany blokadą pliku
+                from utils.process_lock import singleton_election
+                if not singleton_election.elect('fiscal_printer'):
+                    owner = singleton_election.owner('fiscal_printer') or {}
+                    self.printer_owner_pid = owner.get('pid')
+                    logger.warning(f"🔒 Drukarkę fiskalną obsługuje proces {self.printer_owner_pid} - ten proces nie otwiera portu")
+                    return False
+                
                 _fiscal_printer = get_fiscal_printer(
                     port=port,
                     baudrate=FISCAL_PRINTER_CONFIG.get('baudrate', 9600),
@@ -90,6 +100,9 @@ class FiscalService:
                     logger.warning(MESSAGES['connection_failed'])
                     logger.info("🎭 Switching to simulation mode due to connection failure")
                     
+                    # Port nie jest używany - inne procesy mogą spróbować same
+                    singleton_election.resign('fiscal_printer')
+                    
                     # Switch to simulation mode
                     _fiscal_printer = get_fiscal_printer(
                         port=port,
@@ -159,6 +172,15 @@ class FiscalService:
                 'daily_counter': 42
             }
             
+        if not self.printer and self.printer_owner_pid:
+            return {
+                'available': False,
+                'status': 'owned_by_other_process',
+                'message': f'Drukarkę obsługuje inny proces serwera (PID {self.printer_owner_pid})',
+                'owner_pid': self.printer_owner_pid,
+                'test_mode': False
+            }
+        
         if not self.printer:
             return {
                 'available': False,
@@ -0,0 +1,82 @@
+"""
+Konfiguracja gunicorna - profil produkcyjny z wieloma workerami
+    cd backend && gunicorn -c gunicorn.conf.py app:app
+
+Workery są forkowane z mastera bez wstępnego ładowania aplikacji (preload_app=False),
+więc każdy ma własne połączenia SQLite i własne wątki. Baza działa w trybie WAL
+z busy_timeout i ponawianiem (utils/database.py), a zasoby jednoinstancyjne
+(scheduler, port drukarki fiskalnej) wybierają właściciela blokadą pliku
+(utils/process_lock.py).
+
+Zmienne środowiskowe:
+    PORT              - port nasłuchu (domyślnie 8000)
+    WEB_CONCURRENCY   - liczba procesów workerów (domyślnie 2 x CPU, max 8)
+    GUNICORN_WORKER   - gthread (domyślnie) lub gevent (wymaga pakietu gevent)
+    GUNICORN_THREADS  - wątki na worker gthread (domyślnie 4)
+    GUNICORN_TIMEOUT  - limit czasu żądania w sekundach (domyślnie 120)
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# SQLite ma jednego pisarza naraz - więcej procesów niż ~8 tylko wydłuża kolejkę do blokady
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2, 8)))
+worker_class = os.environ.get('GUNICORN_WORKER', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '100'))  # gevent
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+# Okresowy restart workerów ogranicza wycieki pamięci; jitter rozkłada restarty w czasie
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = 200
+
+preload_app = False
+
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """Przed forkiem workerów: jednorazowo przełącz bazę w tryb WAL"""
+    import sqlite3
+
+    db_path = os.environ.get('DATABASE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kupony.db')
+    try:
+        conn = sqlite3.connect(db_path, timeout=30)
+        mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        conn.close()
+        server.log.info(f"SQLite {db_path}: journal_mode={mode}")
+    except sqlite3.Error as e:
+        server.log.warning(f"Nie można włączyć trybu WAL: {e}")
+
+    if worker_class == 'gevent':
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            raise RuntimeError("GUNICORN_WORKER=gevent wymaga pakietu gevent (pip install gevent)")
+
+
+def post_worker_init(worker):
+    """Każdy worker startuje scheduler - działa tylko w tym, który wygra wybory"""
+    try:
+        from utils.scheduler import auto_backup_scheduler
+        auto_backup_scheduler.init_app(worker.wsgi)
+        auto_backup_scheduler.start_scheduler()
+    except Exception as e:
+        worker.log.error(f"Błąd uruchamiania schedulera: {e}")
+
+
+def worker_exit(server, worker):
+    """Zwolnij role, żeby workery rezerwowe przejęły je bez czekania na koniec procesu"""
+    try:
+        from utils.scheduler import auto_backup_scheduler
+        if auto_backup_scheduler.is_running:
+            auto_backup_scheduler.stop_scheduler()
+    except Exception as e:
+        server.log.warning(f"Błąd zatrzymywania schedulera: {e}")
@@ -0,0 +1,433 @@
+"""
+Silnik kopii zapasowych bazy SQLite
+Kopia jest robiona online przez sqlite3.Connection.backup (API backupu SQLite) w
+krokach po kilkaset stron z przerwami, więc kasa może sprzedawać w trakcie backupu,
+a kopia uwzględnia zawartość pliku -wal. Obsługuje:
+- pełne kopie (opcjonalnie kompresowane gzip / zstd - zstd wymaga pakietu zstandard),
+- kopie przyrostowe: strony bazy są hashowane i zapisywane raz w magazynie stron
+  (backup/pages), a migawka to manifest z listą hashy,
+- weryfikację (PRAGMA integrity_check) po utworzeniu i przy odtwarzaniu,
+- polityki retencji (ostatnie N, dzienne, tygodniowe, miesięczne, maksymalny wiek).
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+FULL_EXTENSIONS = {
+    'none': '.db',
+    'gzip': '.db.gz',
+    'zstd': '.db.zst'
+}
+SNAPSHOT_EXTENSION = '.snapshot.json'
+TIMESTAMP_PATTERN = re.compile(r'_(\d{8}_\d{6})(?:\.db|\.snapshot\.json)')
+
+
+class BackupEngine:
+
+    def __init__(self):
+        self.PAGES_PER_STEP = 256  # Stron kopiowanych w jednym kroku API backupu
+        self.STEP_PAUSE = 0.005  # Przerwa między krokami (s) - oddaje dysk i blokady kasie
+        self.COPY_CHUNK = 1024 * 1024  # Bufor kompresji pełnej kopii
+        self._lock = threading.Lock()
+
+    # ---------- Kompresja ----------
+
+    def resolve_compression(self, compression):
+        compression = (compression or 'none').lower()
+        if compression not in FULL_EXTENSIONS:
+            raise ValueError(f'Nieznany typ kompresji: {compression}')
+        if compression == 'zstd' and not ZSTD_AVAILABLE:
+            print("⚠️ Pakiet zstandard niedostępny - używam kompresji gzip")
+            return 'gzip'
+        return compression
+
+    def _compress_page(self, data, compression):
+        if compression == 'zstd':
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        if compression == 'gzip':
+            return zlib.compress(data, 6)
+        return data
+
+    def _decompress_page(self, data, compression):
+        if compression == 'zstd':
+            return zstandard.ZstdDecompressor().decompress(data)
+        if compression == 'gzip':
+            return zlib.decompress(data)
+        return data
+
+    def _compress_file(self, source_path, target_path, compression):
+        with open(source_path, 'rb') as source:
+            if compression == 'zstd':
+                with open(target_path, 'wb') as target:
+                    zstandard.ZstdCompressor(level=3).copy_stream(source, target)
+            elif compression == 'gzip':
+                with gzip.open(target_path, 'wb', compresslevel=6) as target:
+                    shutil.copyfileobj(source, target, self.COPY_CHUNK)
+            else:
+                with open(target_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, self.COPY_CHUNK)
+
+    def _decompress_file(self, source_path, target_path):
+        if source_path.endswith('.zst'):
+            if not ZSTD_AVAILABLE:
+                raise RuntimeError('Kopia zstd wymaga pakietu zstandard')
+            with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+                zstandard.ZstdDecompressor().copy_stream(source, target)
+        elif source_path.endswith('.gz'):
+            with gzip.open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+                shutil.copyfileobj(source, target, self.COPY_CHUNK)
+        else:
+            shutil.copyfile(source_path, target_path)
+
+    # ---------- Kopia online ----------
+
+    def _pace(self, status, remaining, total):
+        """Callback kroków backupu - krótka przerwa, żeby nie zagłodzić zapisów kasy"""
+        if remaining:
+            time.sleep(self.STEP_PAUSE)
+
+    def online_copy(self, source_path, target_path):
+        """
+        Kopia spójnej migawki bazy przez API backupu SQLite, krokami po PAGES_PER_STEP
+        stron. Zwraca czas kopiowania w ms.
+        """
+        started = time.time()
+        source = sqlite3.connect(source_path, timeout=30, isolation_level=None)
+        target = sqlite3.connect(target_path)
+        try:
+            wal_mode = source.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+            if wal_mode:
+                # W trybie WAL otwarta transakcja odczytu przypina migawkę: zapisy kasy
+                # idą dalej do -wal, a backup nie restartuje się po każdym zapisie
+                source.execute('BEGIN')
+                source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=self.PAGES_PER_STEP, progress=self._pace)
+            if wal_mode:
+                source.execute('COMMIT')
+            # Kopia jako samodzielny plik (bez WAL) - łatwiej ją przenosić i hashować
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            target.close()
+            source.close()
+        return round((time.time() - started) * 1000, 1)
+
+    def integrity_check(self, db_path):
+        """PRAGMA integrity_check; zwraca (ok, lista komunikatów)"""
+        conn = sqlite3.connect(db_path)
+        try:
+            messages = [row[0] for row in conn.execute('PRAGMA integrity_check').fetchall()]
+        finally:
+            conn.close()
+        return messages == ['ok'], messages
+
+    def create_backup(self, db_path, backup_dir, prefix='kupony_backup', compression='gzip',
+                      incremental=False, verify=True):
+        """
+        Tworzy kopię zapasową: pełny plik (opcjonalnie skompresowany)
+        albo migawkę przyrostową w magazynie stron.
+        """
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f'Nie znaleziono pliku bazy danych: {db_path}')
+        compression = self.resolve_compression(compression)
+        os.makedirs(backup_dir, exist_ok=True)
+
+        with self._lock:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            temp_path = os.path.join(backup_dir, f'.{prefix}_{timestamp}.tmp')
+            try:
+                copy_ms = self.online_copy(db_path, temp_path)
+
+                integrity = None
+                if verify:
+                    ok, messages = self.integrity_check(temp_path)
+                    integrity = 'ok' if ok else '; '.join(messages[:5])
+                    if not ok:
+                        raise RuntimeError(f'Kopia nie przeszła integrity_check: {integrity}')
+
+                if incremental:
+                    result = self._store_snapshot(temp_path, backup_dir, prefix, timestamp, compression)
+                else:
+                    filename = f'{prefix}_{timestamp}{FULL_EXTENSIONS[compression]}'
+                    target_path = os.path.join(backup_dir, filename)
+                    if compression == 'none':
+                        os.replace(temp_path, target_path)
+                    else:
+                        self._compress_file(temp_path, target_path, compression)
+                    result = {
+                        'backup_filename': filename,
+                        'backup_path': target_path,
+                        'file_size': os.path.getsize(target_path),
+                        'type': 'full'
+                    }
+
+                result.update({
+                    'success': True,
+                    'timestamp': timestamp,
+                    'compression': compression,
+                    'integrity': integrity,
+                    'copy_ms': copy_ms,
+                    'database_size': os.path.getsize(db_path)
+                })
+                return result
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    # ---------- Migawki przyrostowe ----------
+
+    def _pages_dir(self, backup_dir):
+        return os.path.join(backup_dir, 'pages')
+
+    def _page_path(self, backup_dir, digest):
+        return os.path.join(self._pages_dir(backup_dir), digest[:2], digest)
+
+    def _store_snapshot(self, copy_path, backup_dir, prefix, timestamp, compression):
+        """
+        Dzieli kopię na strony, zapisuje tylko strony, których hash nie występuje
+        w magazynie, i zapisuje manifest migawki.
+        """
+        conn = sqlite3.connect(copy_path)
+        try:
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        finally:
+            conn.close()
+
+        hashes = []
+        new_pages = 0
+        new_bytes = 0
+        with open(copy_path, 'rb') as source:
+            while True:
+                page = source.read(page_size)
+                if not page:
+                    break
+                digest = hashlib.blake2b(page, digest_size=16).hexdigest()
+                hashes.append(digest)
+                page_path = self._page_path(backup_dir, digest)
+                if not os.path.exists(page_path):
+                    os.makedirs(os.path.dirname(page_path), exist_ok=True)
+                    data = self._compress_page(page, compression)
+                    with open(page_path + '.tmp', 'wb') as f:
+                        f.write(data)
+                    os.replace(page_path + '.tmp', page_path)
+                    new_pages += 1
+                    new_bytes += len(data)
+
+        filename = f'{prefix}_{timestamp}{SNAPSHOT_EXTENSION}'
+        manifest = {
+            'type': 'incremental',
+            'created_at': datetime.now().isoformat(),
+            'page_size': page_size,
+            'page_count': len(hashes),
+            'size': os.path.getsize(copy_path),
+            'compression': compression,
+            'new_pages': new_pages,
+            'pages': hashes
+        }
+        manifest_path = os.path.join(backup_dir, filename)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+        return {
+            'backup_filename': filename,
+            'backup_path': manifest_path,
+            'file_size': new_bytes + os.path.getsize(manifest_path),
+            'type': 'incremental',
+            'page_count': len(hashes),
+            'new_pages': new_pages,
+            'reused_pages': len(hashes) - new_pages
+        }
+
+    # ---------- Odtwarzanie ----------
+
+    def _backup_path(self, backup_dir, filename):
+        if os.path.basename(filename) != filename or not (
+            filename.endswith(SNAPSHOT_EXTENSION) or any(filename.endswith(ext) for ext in FULL_EXTENSIONS.values())
+        ):
+            raise ValueError('Nieprawidłowa nazwa kopii zapasowej')
+        path = os.path.join(backup_dir, filename)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'Nie znaleziono kopii: {filename}')
+        return path
+
+    def materialize(self, backup_dir, filename, target_path):
+        """Odtwarza plik bazy z kopii (pełnej lub migawki) do target_path"""
+        path = self._backup_path(backup_dir, filename)
+        if filename.endswith(SNAPSHOT_EXTENSION):
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            with open(target_path, 'wb') as target:
+                for digest in manifest['pages']:
+                    with open(self._page_path(backup_dir, digest), 'rb') as page_file:
+                        target.write(self._decompress_page(page_file.read(), manifest['compression']))
+        else:
+            self._decompress_file(path, target_path)
+
+    def verify_backup(self, backup_dir, filename):
+        """Odtwarza kopię do pliku tymczasowego i sprawdza PRAGMA integrity_check"""
+        temp_path = os.path.join(backup_dir, f'.verify_{os.getpid()}_{int(time.time() * 1000)}.db')
+        started = time.time()
+        try:
+            self.materialize(backup_dir, filename, temp_path)
+            ok, messages = self.integrity_check(temp_path)
+            return {
+                'backup_filename': filename,
+                'integrity_ok': ok,
+                'messages': messages[:20],
+                'restored_size': os.path.getsize(temp_path),
+                'duration_ms': round((time.time() - started) * 1000, 1)
+            }
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def restore_backup(self, backup_dir, filename, db_path, apply=False):
+        """
+        Odtwarza kopię do backup/restored_<nazwa>.db i weryfikuje integralność.
+        Z apply=True zweryfikowana kopia jest wgrywana do bazy roboczej przez API
+        backupu SQLite (krokami, z blokadą tylko na czas kroku).
+        """
+        restored_name = 'restored_' + re.sub(r'(\.snapshot\.json|\.db(\.gz|\.zst)?)$', '', filename) + '.db'
+        restored_path = os.path.join(backup_dir, restored_name)
+        self.materialize(backup_dir, filename, restored_path)
+
+        ok, messages = self.integrity_check(restored_path)
+        if not ok:
+            os.remove(restored_path)
+            raise RuntimeError(f"Kopia {filename} jest uszkodzona: {'; '.join(messages[:5])}")
+
+        result = {
+            'backup_filename': filename,
+            'restored_path': restored_path,
+            'integrity_ok': True,
+            'applied': False
+        }
+
+        if apply:
+            # Zabezpieczenie bieżącego stanu bazy przed nadpisaniem
+            safety = self.create_backup(db_path, backup_dir, prefix='kupony_pre_restore', compression='gzip')
+            result['pre_restore_backup'] = safety['backup_filename']
+
+            with self._lock:
+                source = sqlite3.connect(restored_path)
+                target = sqlite3.connect(db_path, timeout=30)
+                try:
+                    source.backup(target, pages=self.PAGES_PER_STEP, progress=self._pace)
+                finally:
+                    target.close()
+                    source.close()
+            result['applied'] = True
+
+        return result
+
+    # ---------- Katalog i retencja ----------
+
+    def list_backups(self, backup_dir):
+        """Kopie w katalogu (pełne i migawki) z datą utworzenia z nazwy pliku"""
+        backups = []
+        if not os.path.isdir(backup_dir):
+            return backups
+        for filename in os.listdir(backup_dir):
+            match = TIMESTAMP_PATTERN.search(filename)
+            if not match or filename.startswith('.') or filename.startswith('restored_'):
+                continue
+            path = os.path.join(backup_dir, filename)
+            info = {
+                'filename': filename,
+                'size': os.path.getsize(path),
+                'created': datetime.strptime(match.group(1), '%Y%m%d_%H%M%S').isoformat(),
+                'modified': datetime.fromtimestamp(os.path.getmtime(path)).isoformat(),
+                'is_automatic': 'auto_backup' in filename,
+                'type': 'incremental' if filename.endswith(SNAPSHOT_EXTENSION) else 'full'
+            }
+            if info['type'] == 'incremental':
+                with open(path, encoding='utf-8') as f:
+                    manifest = json.load(f)
+                info['database_size'] = manifest.get('size')
+                info['new_pages'] = manifest.get('new_pages')
+                info['page_count'] = manifest.get('page_count')
+            backups.append(info)
+        backups.sort(key=lambda b: b['created'], reverse=True)
+        return backups
+
+    def apply_retention(self, backup_dir, prefix='kupony_auto_backup', keep_last=7, keep_daily=14,
+                        keep_weekly=8, keep_monthly=12, max_age_days=None):
+        """
+        Retencja dziadek-ojciec-syn dla kopii z danym prefiksem: zachowuje `keep_last`
+        najnowszych oraz najnowszą kopię z każdego z ostatnich `keep_daily` dni,
+        `keep_weekly` tygodni i `keep_monthly` miesięcy. Kopie starsze niż
+        `max_age_days` są usuwane zawsze. Na końcu usuwa nieużywane strony migawek.
+        """
+        backups = [b for b in self.list_backups(backup_dir) if b['filename'].startswith(prefix + '_')]
+        keep = set(b['filename'] for b in backups[:keep_last])
+
+        for count, period_key in (
+            (keep_daily, lambda d: d.date()),
+            (keep_weekly, lambda d: d.isocalendar()[:2]),
+            (keep_monthly, lambda d: (d.year, d.month))
+        ):
+            seen = set()
+            for backup in backups:
+                key = period_key(datetime.fromisoformat(backup['created']))
+                if key not in seen and len(seen) < count:
+                    seen.add(key)
+                    keep.add(backup['filename'])
+
+        cutoff = datetime.now() - timedelta(days=max_age_days) if max_age_days else None
+        removed = []
+        for backup in backups:
+            expired = cutoff and datetime.fromisoformat(backup['created']) < cutoff
+            if backup['filename'] not in keep or expired:
+                os.remove(os.path.join(backup_dir, backup['filename']))
+                removed.append(backup['filename'])
+                print(f"🗑️  Usunięto stary backup: {backup['filename']}")
+
+        removed_pages = self.collect_garbage(backup_dir) if removed else 0
+        return {
+            'kept': len(backups) - len(removed),
+            'removed': removed,
+            'removed_pages': removed_pages
+        }
+
+    def collect_garbage(self, backup_dir):
+        """Usuwa z magazynu strony, do których nie odwołuje się żadna migawka"""
+        pages_dir = self._pages_dir(backup_dir)
+        if not os.path.isdir(pages_dir):
+            return 0
+
+        # Zbiór odwołań i usuwanie pod tą samą blokadą co create_backup - migawka zapisywana
+        # w trakcie nie straci stron, których jeszcze nie ma w żadnym manifeście
+        removed = 0
+        with self._lock:
+            referenced = set()
+            for filename in os.listdir(backup_dir):
+                if filename.endswith(SNAPSHOT_EXTENSION):
+                    with open(os.path.join(backup_dir, filename), encoding='utf-8') as f:
+                        referenced.update(json.load(f)['pages'])
+
+            for bucket in os.listdir(pages_dir):
+                bucket_path = os.path.join(pages_dir, bucket)
+                for digest in os.listdir(bucket_path):
+                    if digest not in referenced:
+                        os.remove(os.path.join(bucket_path, digest))
+                        removed += 1
+        return removed
+
+
+# Globalna instancja silnika kopii zapasowych
+backup_engine = BackupEngine()
@@ -0,0 +1,615 @@
+"""
+Benchmark opóźnień API POS z syntetycznymi danymi i odtwarzaniem sesji kasowych
+Generator danych zasila produkty, stany (pos_magazyn, inventory_locations),
+historię sprzedaży (pos_transakcje/pos_pozycje) i operacje kasowe w skali
+10x/100x/1000x jednostki bazowej. Następnie odtwarzane są typowe sesje kasy:
+skanowanie (wyszukiwanie po EAN), nowy koszyk, dodawanie pozycji, rabat,
+zakończenie sprzedaży i fiskalizacja w trybie testowym, plus odczyty list.
+Dla każdego endpointu raportowane są p50/p95/p99, a wynik można zapisać jako
+linię bazową (benchmarks/baselines) i porównywać z nią kolejne przebiegi.
+
+    cd backend && python -m utils.benchmark --scale 10 --sessions 200
+    cd backend && python -m utils.benchmark --scale 100 --save-baseline
+    cd backend && python -m utils.benchmark --scale 10 --http --workers 2 --tills 4
+
+Całość działa na kopii katalogu backend w katalogu tymczasowym - baza
+produkcyjna nie jest modyfikowana.
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BASELINE_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'baselines')
+
+# Jednostka bazowa danych syntetycznych - skala mnoży wszystkie liczności
+BASE_UNIT = {
+    'produkty': 100,
+    'pos_transakcje': 200,
+    'kasa_operacje': 50
+}
+SCALES = (10, 100, 1000)
+
+ITEMS_PER_TRANSACTION = (1, 8)  # Zakres liczby pozycji paragonu
+HISTORY_DAYS = 365
+INSERT_BATCH = 5000
+SYNTHETIC_SOURCE = 'benchmark'
+
+# Regresja: p95 gorsze o więcej niż 25% i co najmniej 2 ms od linii bazowej
+REGRESSION_RATIO = 1.25
+REGRESSION_MIN_DELTA_MS = 2.0
+
+SANDBOX_IGNORE = shutil.ignore_patterns('__pycache__', 'backup', 'exports', 'static', '.locks', 'benchmarks', '*.tar.gz')
+
+CATEGORIES = ['Suplementy', 'Żywność', 'Napoje', 'Kosmetyki', 'Zioła', 'Herbaty', 'Przyprawy', 'Bakalie']
+NAME_PARTS = ['Bio', 'Eko', 'Natural', 'Vita', 'Green', 'Premium', 'Classic', 'Max', 'Plus', 'Fit']
+PRODUCT_WORDS = ['Herbata', 'Kawa', 'Miód', 'Olej', 'Mąka', 'Kasza', 'Sok', 'Syrop', 'Krem', 'Baton', 'Musli', 'Tabletki']
+VAT_RATES = [5, 8, 23, 23]
+PAYMENT_METHODS = ['gotowka', 'gotowka', 'karta', 'karta', 'blik']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class SyntheticDataGenerator:
+    """Deterministyczny (ziarno) generator danych syntetycznych dopisywanych do bazy"""
+
+    def __init__(self, db_path, scale, seed=42):
+        self.db_path = db_path
+        self.scale = scale
+        self.rng = random.Random(seed)
+
+    def generate(self):
+        """Zasila bazę danymi w skali `scale`; zwraca liczności i czas trwania"""
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.cursor()
+            locations = self._load_locations(cursor)
+            counts = {}
+            products = self._products(cursor, BASE_UNIT['produkty'] * self.scale)
+            counts['produkty'] = len(products)
+            counts['pos_magazyn'], counts['inventory_locations'] = self._stock(cursor, products, locations)
+            counts['pos_transakcje'], counts['pos_pozycje'] = self._transactions(
+                cursor, products, locations, BASE_UNIT['pos_transakcje'] * self.scale
+            )
+            counts['kasa_operacje'] = self._cash_operations(cursor, locations, BASE_UNIT['kasa_operacje'] * self.scale)
+            rabat_id = self._discount(cursor)
+            conn.commit()
+            cursor.execute("ANALYZE")
+        finally:
+            conn.close()
+
+        return {
+            'scale': self.scale,
+            'counts': counts,
+            'rabat_id': rabat_id,
+            'locations': [location_id for location_id, _ in locations],
+            'duration_s': round(time.perf_counter() - started, 2)
+        }
+
+    def _load_locations(self, cursor):
+        """Aktywne lokalizacje z przypisanym (pierwszym) magazynem"""
+        cursor.execute("""
+            SELECT l.id, MIN(w.id) as warehouse_id
+            FROM locations l
+            LEFT JOIN warehouses w ON w.location_id = l.id AND w.aktywny = 1
+            WHERE l.aktywny = 1
+            GROUP BY l.id
+        """)
+        locations = [(row['id'], row['warehouse_id']) for row in cursor.fetchall()]
+        return locations or [(5, None)]
+
+    def _executemany(self, cursor, sql, rows):
+        for start in range(0, len(rows), INSERT_BATCH):
+            cursor.executemany(sql, rows[start:start + INSERT_BATCH])
+
+    def _products(self, cursor, count):
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM produkty")
+        first_id = cursor.fetchone()[0] + 1
+        today = date.today().isoformat()
+        rows = []
+        for n in range(count):
+            vat = self.rng.choice(VAT_RATES)
+            purchase_net = round(self.rng.uniform(1, 120), 2)
+            margin = self.rng.choice([20, 25, 30, 35, 40, 50])
+            sale_net = round(purchase_net * (1 + margin / 100), 2)
+            sale_gross = round(sale_net * (1 + vat / 100), 2)
+            ean = f"29{self.scale:04d}{first_id + n:07d}"
+            name = f"{self.rng.choice(NAME_PARTS)} {self.rng.choice(PRODUCT_WORDS)} {first_id + n}"
+            rows.append((
+                name, sale_gross, self.rng.choice(CATEGORIES), f"BENCH-{first_id + n}", 'szt', 1, today,
+                ean, purchase_net, margin, vat, SYNTHETIC_SOURCE, sale_net, sale_gross,
+                purchase_net, round(purchase_net * (1 + vat / 100), 2)
+            ))
+        self._executemany(cursor, """
+            INSERT INTO produkty (
+                nazwa, cena, kategoria, kod_produktu, jednostka, aktywny, data_utworzenia,
+                ean, cena_zakupu, marza_procent, stawka_vat, zrodlo_importu,
+                cena_sprzedazy_netto, cena_sprzedazy_brutto, cena_zakupu_netto, cena_zakupu_brutto
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        cursor.execute("""
+            SELECT id, nazwa, kod_produktu, ean, cena_sprzedazy_brutto, stawka_vat, cena_zakupu_netto
+            FROM produkty WHERE id >= ? AND zrodlo_importu = ?
+        """, (first_id, SYNTHETIC_SOURCE))
+        return [dict(row) for row in cursor.fetchall()]
+
+    def _stock(self, cursor, products, locations):
+        """Stany w każdej lokalizacji - zapas tak duży, by sesje kasy nie generowały braków"""
+        magazyn_rows = []
+        inventory_rows = []
+        for product in products:
+            for location_id, warehouse_id in locations:
+                quantity = self.rng.randint(500, 5000)
+                magazyn_rows.append((product['id'], quantity, self.rng.randint(5, 50), str(location_id)))
+                if warehouse_id:
+                    inventory_rows.append((product['id'], warehouse_id, quantity))
+        self._executemany(cursor, """
+            INSERT INTO pos_magazyn (produkt_id, stan_aktualny, stan_minimalny, lokalizacja)
+            VALUES (?, ?, ?, ?)
+        """, magazyn_rows)
+        self._executemany(cursor, """
+            INSERT OR IGNORE INTO inventory_locations (product_id, warehouse_id, ilosc_dostepna)
+            VALUES (?, ?, ?)
+        """, inventory_rows)
+        return len(magazyn_rows), len(inventory_rows)
+
+    def _transactions(self, cursor, products, locations, count):
+        """Historia zakończonych paragonów z ostatniego roku"""
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM pos_transakcje")
+        next_id = cursor.fetchone()[0] + 1
+        start_day = date.today() - timedelta(days=HISTORY_DAYS)
+        transaction_rows = []
+        item_rows = []
+        for n in range(count):
+            transaction_id = next_id + n
+            location_id = self.rng.choice(locations)[0]
+            day = start_day + timedelta(days=self.rng.randrange(HISTORY_DAYS))
+            clock = f"{self.rng.randint(8, 20):02d}:{self.rng.randint(0, 59):02d}:{self.rng.randint(0, 59):02d}"
+            total_net = total_vat = total_gross = 0.0
+            chosen = self.rng.sample(products, min(len(products), self.rng.randint(*ITEMS_PER_TRANSACTION)))
+            for lp, product in enumerate(chosen, start=1):
+                quantity = self.rng.choice([1, 1, 1, 2, 3])
+                price = product['cena_sprzedazy_brutto']
+                vat = product['stawka_vat']
+                gross = round(price * quantity, 2)
+                net = round(gross / (1 + vat / 100), 2)
+                item_rows.append((
+                    transaction_id, product['id'], product['nazwa'], product['kod_produktu'],
+                    price, quantity, 'szt', price, net, vat, round(gross - net, 2), gross, lp,
+                    product['cena_zakupu_netto']
+                ))
+                total_net += net
+                total_gross += gross
+                total_vat += gross - net
+            payment = self.rng.choice(PAYMENT_METHODS)
+            transaction_rows.append((
+                transaction_id, f"BENCH{self.scale}-{transaction_id}", day.isoformat(), clock, 'benchmark',
+                'zakonczony', round(total_gross, 2), round(total_net, 2), round(total_vat, 2),
+                payment, round(total_gross, 2), location_id, f"{day.isoformat()} {clock}"
+            ))
+        self._executemany(cursor, """
+            INSERT INTO pos_transakcje (
+                id, numer_transakcji, data_transakcji, czas_transakcji, kasjer_login, status,
+                suma_brutto, suma_netto, suma_vat, forma_platnosci, kwota_otrzymana, location_id, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, transaction_rows)
+        self._executemany(cursor, """
+            INSERT INTO pos_pozycje (
+                transakcja_id, produkt_id, nazwa_produktu, kod_produktu, cena_jednostkowa, ilosc,
+                jednostka, cena_po_rabacie, wartosc_netto, stawka_vat, kwota_vat, wartosc_brutto, lp,
+                cena_zakupu_fifo
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, item_rows)
+        return len(transaction_rows), len(item_rows)
+
+    def _cash_operations(self, cursor, locations, count):
+        start_day = date.today() - timedelta(days=HISTORY_DAYS)
+        rows = []
+        for n in range(count):
+            day = start_day + timedelta(days=self.rng.randrange(HISTORY_DAYS))
+            kind = 'KP' if self.rng.random() < 0.7 else 'KW'
+            rows.append((
+                kind, self.rng.choice(['gotowka', 'karta', 'przelew']), round(self.rng.uniform(5, 2000), 2),
+                f"Operacja testowa {n + 1}", 'benchmark', f"BENCH-{kind}/{self.scale}/{n + 1}",
+                day.isoformat(), f"{day.isoformat()} 12:00:00", 'benchmark', self.rng.choice(locations)[0]
+            ))
+        self._executemany(cursor, """
+            INSERT INTO kasa_operacje (
+                typ_operacji, typ_platnosci, kwota, opis, kategoria, numer_dokumentu,
+                data_operacji, data_utworzenia, utworzyl, location_id
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        return len(rows)
+
+    def _discount(self, cursor):
+        """Rabat procentowy bez limitów używany w części sesji"""
+        cursor.execute("""
+            INSERT INTO rabaty (nazwa, typ_rabatu, wartosc, opis, aktywny, minimum_koszyka, created_by)
+            VALUES ('Benchmark 5%', 'procentowy', 5, 'Rabat testowy benchmarku', 1, 0, 'benchmark')
+        """)
+        return cursor.lastrowid
+
+
+class TestClientTransport:
+    """Żądania przez Flask test client (bez sieci, w tym samym procesie)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, payload=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=payload)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpTransport:
+    """Żądania HTTP (keep-alive) do uruchomionego serwera"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method, path, payload=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+class LatencyRecorder:
+    """Czasy odpowiedzi zbierane per nazwa endpointu (szablon ścieżki)"""
+
+    def __init__(self):
+        self._samples = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def call(self, transport, name, method, path, payload=None):
+        started = time.perf_counter()
+        try:
+            status, body = transport.request(method, path, payload)
+        except (OSError, http.client.HTTPException):
+            status, body = 599, None
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._samples.setdefault(name, []).append(elapsed)
+            if status >= 400:
+                self._errors[name] = self._errors.get(name, 0) + 1
+        return status, body
+
+    def summary(self):
+        result = {}
+        for name, samples in sorted(self._samples.items()):
+            ordered = sorted(samples)
+            result[name] = {
+                'count': len(ordered),
+                'errors': self._errors.get(name, 0),
+                'mean_ms': round(sum(ordered) / len(ordered), 2),
+                'p50_ms': round(percentile(ordered, 0.50), 2),
+                'p95_ms': round(percentile(ordered, 0.95), 2),
+                'p99_ms': round(percentile(ordered, 0.99), 2),
+                'max_ms': round(ordered[-1], 2)
+            }
+        return result
+
+
+class TillSessionReplay:
+    """Odtwarza sesje kasowe: skan -> koszyk -> pozycje -> (rabat) -> zakończenie -> fiskalizacja"""
+
+    DISCOUNT_SHARE = 0.3  # Część sesji z rabatem
+    LIST_EVERY = 10  # Co która sesja kasjer odświeża listę transakcji i statystyki
+
+    def __init__(self, transport, recorder, products, locations, rabat_id, seed=7):
+        self.transport = transport
+        self.recorder = recorder
+        self.products = products
+        self.locations = locations
+        self.rabat_id = rabat_id
+        self.seed = seed
+
+    def run(self, sessions, tills=1):
+        """Wykonuje `sessions` sesji rozdzielonych na `tills` równoległych kas"""
+        per_till = [sessions // tills + (1 if n < sessions % tills else 0) for n in range(tills)]
+        threads = [
+            threading.Thread(target=self._till, args=(n, count), daemon=True)
+            for n, count in enumerate(per_till)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def _till(self, till_number, sessions):
+        rng = random.Random(self.seed + till_number)
+        location_id = self.locations[till_number % len(self.locations)]
+        for n in range(sessions):
+            self._session(rng, location_id)
+            if n % self.LIST_EVERY == 0:
+                self._reads(location_id)
+
+    def _session(self, rng, location_id):
+        call = self.recorder.call
+        transport = self.transport
+        basket = rng.sample(self.products, min(len(self.products), rng.randint(1, 6)))
+
+        status, body = call(transport, 'POST /api/pos/cart/new', 'POST', '/api/pos/cart/new', {
+            'kasjer_id': 'benchmark', 'location_id': location_id
+        })
+        cart_id = self._payload_value(body, 'transakcja_id')
+        if status >= 400 or not cart_id:
+            return
+
+        for product in basket:
+            call(transport, 'GET /api/products/search', 'GET',
+                 f"/api/products/search?query={product['ean']}&location_id={location_id}&limit=5")
+            call(transport, 'POST /api/pos/cart/<id>/items', 'POST', f'/api/pos/cart/{cart_id}/items', {
+                'product_id': product['id'], 'ilosc': rng.choice([1, 1, 2])
+            })
+
+        call(transport, 'GET /api/pos/cart/<id>', 'GET', f'/api/pos/cart/{cart_id}')
+
+        if self.rabat_id and rng.random() < self.DISCOUNT_SHARE:
+            call(transport, 'POST /api/pos/cart/<id>/discount', 'POST', f'/api/pos/cart/{cart_id}/discount', {
+                'rabat_id': self.rabat_id, 'user_id': 'benchmark'
+            })
+
+        payment = rng.choice(PAYMENT_METHODS)
+        status, _ = call(transport, 'POST /api/pos/cart/<id>/complete', 'POST', f'/api/pos/cart/{cart_id}/complete', {
+            'payment_method': payment, 'kwota_otrzymana': 1000 if payment == 'gotowka' else None
+        })
+        if status < 400:
+            call(transport, 'POST /api/fiscal/test-fiscalize/<id>', 'POST', f'/api/fiscal/test-fiscalize/{cart_id}')
+
+    def _reads(self, location_id):
+        call = self.recorder.call
+        call(self.transport, 'GET /api/pos/transactions', 'GET', f'/api/pos/transactions?limit=20&location_id={location_id}')
+        call(self.transport, 'GET /api/pos/stats', 'GET', f'/api/pos/stats?location_id={location_id}')
+        call(self.transport, 'GET /api/products', 'GET', '/api/products?limit=50')
+
+    @staticmethod
+    def _payload_value(body, key):
+        """Wartość z odpowiedzi niezależnie od kolejności pól success_response"""
+        if not isinstance(body, dict):
+            return None
+        for container in (body.get('data'), body.get('message'), body):
+            if isinstance(container, dict) and key in container:
+                return container[key]
+        return None
+
+
+def load_products_sample(db_path, limit=2000, seed=3):
+    """Próbka syntetycznych produktów do skanowania (EAN) w sesjach"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(
+            "SELECT id, ean FROM produkty WHERE zrodlo_importu = ? AND aktywny = 1", (SYNTHETIC_SOURCE,)
+        ).fetchall()
+    finally:
+        conn.close()
+    products = [dict(row) for row in rows]
+    random.Random(seed).shuffle(products)
+    return products[:limit]
+
+
+def baseline_path(scale, mode):
+    return os.path.join(BASELINE_DIR, f"scale_{scale}_{mode}.json")
+
+
+def load_baseline(scale, mode):
+    try:
+        with open(baseline_path(scale, mode), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_baseline(result):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(result['scale'], result['mode'])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write('\n')
+    return path
+
+
+def compare_with_baseline(endpoints, baseline):
+    """Porównanie p95 per endpoint; zwraca listę regresji i pełne zestawienie"""
+    rows = []
+    regressions = []
+    base_endpoints = (baseline or {}).get('endpoints', {})
+    for name, stats in endpoints.items():
+        base = base_endpoints.get(name)
+        row = {'endpoint': name, 'p95_ms': stats['p95_ms'], 'baseline_p95_ms': base['p95_ms'] if base else None}
+        if base and base['p95_ms']:
+            row['ratio'] = round(stats['p95_ms'] / base['p95_ms'], 2)
+            row['regression'] = (
+                row['ratio'] > REGRESSION_RATIO
+                and stats['p95_ms'] - base['p95_ms'] > REGRESSION_MIN_DELTA_MS
+            )
+            if row['regression']:
+                regressions.append(row)
+        rows.append(row)
+    return regressions, rows
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_in_sandbox(args):
+    """
+    Wykonywane w kopii katalogu backend: generuje dane, odtwarza sesje i zwraca wynik.
+    Wydruki diagnostyczne aplikacji trafiają do os.devnull, żeby nie zaśmiecać raportu.
+    """
+    logging.disable(logging.INFO)
+    db_path = os.path.join(BACKEND_DIR, 'kupony.db')
+    seeded = SyntheticDataGenerator(db_path, args.scale, seed=args.seed).generate()
+    products = load_products_sample(db_path)
+    recorder = LatencyRecorder()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if args.http:
+            from utils.load_test import GunicornServer
+            with GunicornServer(BACKEND_DIR, args.workers, args.threads, 'gthread') as server:
+                transport = HttpTransport('127.0.0.1', server.port)
+                TillSessionReplay(transport, recorder, products, seeded['locations'], seeded['rabat_id'],
+                                  seed=args.seed).run(args.warmup, tills=args.tills)
+                recorder = LatencyRecorder()
+                replay = TillSessionReplay(transport, recorder, products, seeded['locations'],
+                                           seeded['rabat_id'], seed=args.seed + 1)
+                duration = replay.run(args.sessions, tills=args.tills)
+        else:
+            sys.path.insert(0, BACKEND_DIR)
+            from app import app
+            transport = TestClientTransport(app)
+            TillSessionReplay(transport, recorder, products, seeded['locations'], seeded['rabat_id'],
+                              seed=args.seed).run(args.warmup, tills=args.tills)
+            recorder = LatencyRecorder()
+            replay = TillSessionReplay(transport, recorder, products, seeded['locations'],
+                                       seeded['rabat_id'], seed=args.seed + 1)
+            duration = replay.run(args.sessions, tills=args.tills)
+
+    return {
+        'scale': args.scale,
+        'mode': 'http' if args.http else 'testclient',
+        'sessions': args.sessions,
+        'tills': args.tills,
+        'workers': args.workers if args.http else None,
+        'seed': args.seed,
+        'seeded': seeded,
+        'replay_duration_s': round(duration, 2),
+        'sessions_per_s': round(args.sessions / duration, 2) if duration else None,
+        'endpoints': recorder.summary()
+    }
+
+
+def print_report(result, comparison):
+    seeded = result['seeded']
+    print(f"\n📊 Benchmark POS - skala {result['scale']}x ({result['mode']}), "
+          f"{result['sessions']} sesji / {result['tills']} kas, {result['sessions_per_s']} sesji/s")
+    print("   Dane: " + ", ".join(f"{table}={count}" for table, count in seeded['counts'].items())
+          + f" (generowanie {seeded['duration_s']} s)")
+    print(f"\n{'endpoint':<40} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5} {'bazowe p95':>11} {'x':>6}")
+    rows = {row['endpoint']: row for row in comparison}
+    for name, stats in result['endpoints'].items():
+        row = rows.get(name, {})
+        base = row.get('baseline_p95_ms')
+        marker = ' ⚠️' if row.get('regression') else ''
+        print(f"{name:<40} {stats['count']:>6} {stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8} "
+              f"{stats['errors']:>5} {base if base is not None else '-':>11} {row.get('ratio', '-'):>6}{marker}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark opóźnień API POS na danych syntetycznych')
+    parser.add_argument('--scale', type=int, default=10, choices=SCALES, help='mnożnik jednostki bazowej danych')
+    parser.add_argument('--sessions', type=int, default=200, help='liczba mierzonych sesji kasowych')
+    parser.add_argument('--warmup', type=int, default=10, help='sesje rozgrzewkowe (niemierzone)')
+    parser.add_argument('--tills', type=int, default=1, help='równoległe kasy (wątki)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--http', action='store_true', help='odtwarzaj przez HTTP na gunicornie zamiast test clienta')
+    parser.add_argument('--workers', type=int, default=2, help='workery gunicorna w trybie --http')
+    parser.add_argument('--threads', type=int, default=4, help='wątki na worker w trybie --http')
+    parser.add_argument('--save-baseline', action='store_true', help='zapisz wynik jako linię bazową')
+    parser.add_argument('--fail-on-regression', action='store_true', help='kod wyjścia 1 przy regresji p95')
+    parser.add_argument('--json', action='store_true', help='wynik jako JSON')
+    parser.add_argument('--in-sandbox', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.in_sandbox:
+        result = run_in_sandbox(args)
+        with open(args.in_sandbox, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return 0
+
+    temp_dir = tempfile.mkdtemp(prefix='pos_benchmark_')
+    try:
+        sandbox = os.path.join(temp_dir, 'backend')
+        shutil.copytree(BACKEND_DIR, sandbox, ignore=SANDBOX_IGNORE)
+        result_file = os.path.join(temp_dir, 'result.json')
+        forwarded = [arg for arg in (argv if argv is not None else sys.argv[1:])]
+        completed = subprocess.run(
+            [sys.executable, '-m', 'utils.benchmark', *forwarded, '--in-sandbox', result_file],
+            cwd=sandbox
+        )
+        if completed.returncode != 0 or not os.path.exists(result_file):
+            print(f"❌ Benchmark zakończony błędem (kod {completed.returncode})")
+            return completed.returncode or 1
+        with open(result_file, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    result['recorded_at'] = datetime.now().isoformat(timespec='seconds')
+    result['revision'] = git_revision()
+    result['host'] = {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+    baseline = load_baseline(result['scale'], result['mode'])
+    regressions, comparison = compare_with_baseline(result['endpoints'], baseline)
+    result['regressions'] = regressions
+
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        print_report(result, comparison)
+        if baseline:
+            print(f"\nLinia bazowa: {baseline.get('recorded_at')} (rewizja {baseline.get('revision')})")
+        if regressions:
+            print(f"⚠️ Regresje p95 (> {REGRESSION_RATIO}x i > {REGRESSION_MIN_DELTA_MS} ms): "
+                  + ", ".join(row['endpoint'] for row in regressions))
+
+    if args.save_baseline:
+        result.pop('regressions', None)
+        print(f"💾 Zapisano linię bazową: {save_baseline(result)}")
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Cache zwalidowanych kuponów - powtórne skanowanie tego samego kodu na kasie nie sięga do bazy
+Trzyma wiersze kuponów (kod, wartość, status, data ważności) w pamięci procesu z limitem
+wielkości (LRU) i czasem życia wpisu. Ważność (status, data) jest liczona przy każdym
+odczycie z wiersza, a każde wykorzystanie kuponu unieważnia jego wpis.
+
+Przy wielu workerach wpis z innego procesu może być nieaktualny najwyżej przez
+COUPON_CACHE_TTL sekund - dotyczy to tylko podglądu walidacji; przeliczenie koszyka
+(api.rabaty.przelicz_koszyk) i wykorzystanie kuponu zawsze czytają wiersz z bazy.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+COUPON_CACHE_TTL = float(os.environ.get('COUPON_CACHE_TTL', '30'))
+COUPON_CACHE_SIZE = int(os.environ.get('COUPON_CACHE_SIZE', '20000'))
+
+
+class CouponCache:
+
+    def __init__(self, ttl=COUPON_CACHE_TTL, max_size=COUPON_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # kod -> (wygasa, wiersz)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, code, loader):
+        """
+        Wiersz kuponu z cache lub z loader(code); kody nieistniejące nie są zapamiętywane,
+        żeby kupon wydany w innym procesie był widoczny od razu.
+        """
+        code = code.upper()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(code)
+                self.hits += 1
+                return dict(entry[1])
+            if entry:
+                del self._entries[code]
+            self.misses += 1
+
+        row = loader(code)
+        if row:
+            self.put(row)
+        return dict(row) if row else None
+
+    def put(self, row):
+        code = str(row['kod']).upper()
+        with self._lock:
+            self._entries[code] = (time.monotonic() + self.ttl, dict(row))
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, code=None):
+        """Usuwa wpis kuponu (lub cały cache) - wywoływane po każdej zmianie statusu/wartości"""
+        with self._lock:
+            if code is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(str(code).upper(), None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'invalidations': self.invalidations
+            }
+
+
+# Globalna instancja
+coupon_cache = CouponCache()
@@ -0,0 +1,524 @@
+"""
+Indeks wyszukiwania klientów (pos_klienci) - szybka ścieżka dla kasy i importów
+Telefon, NIP i e-mail są zapisywane jako znormalizowane klucze (same cyfry / małe litery)
+z indeksami B-drzewa, więc "+48 123-456-789" i "123456789" trafiają w ten sam wpis.
+Słowa z imienia, nazwiska, nazwy firmy i miasta (bez polskich znaków) trafiają do tabeli
+tokenów pod wyszukiwanie prefiksowe, a tabela FTS5 z tokenizerem trigram obsługuje
+wyszukiwanie fragmentu w środku słowa (np. "owals" -> Kowalski).
+
+Indeks jest utrzymywany przez triggery na pos_klienci, które odkładają rowid zmienionego
+klienta do kolejki; kolejka jest przetwarzana przed wyszukiwaniem, więc zapisy z dowolnego
+miejsca (API, importy, skrypty) są widoczne bez ręcznej synchronizacji.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+from utils.database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Docelowy czas odpowiedzi podpowiedzi (type-ahead) - przekroczenia są logowane
+TYPEAHEAD_TARGET_MS = float(os.environ.get('CUSTOMER_SEARCH_TARGET_MS', '30'))
+
+RESOLVE_CHUNK = 500  # Limit parametrów w jednym zapytaniu IN (...)
+LATENCY_SAMPLES = 500
+
+POLISH_FOLD = str.maketrans('ąćęłńóśźżĄĆĘŁŃÓŚŹŻ', 'acelnoszzACELNOSZZ')
+NON_ALNUM = re.compile(r'[^0-9a-z]+')
+NON_DIGIT = re.compile(r'\D+')
+PHONE_LIKE = re.compile(r'^[\d\s+\-()./]+$')
+
+# Kolumny pos_klienci, których zmiana wymaga przeindeksowania klienta
+INDEXED_COLUMNS = ('id', 'imie', 'nazwisko', 'nazwa_firmy', 'miasto', 'telefon', 'nip', 'email')
+
+# Zapytania krótsze niż trigram - LIKE '%...%' na kolumnach jak dawne wyszukiwanie
+SHORT_QUERY_COLUMNS = ('imie', 'nazwisko', 'nazwa_firmy', 'telefon', 'email', 'miasto')
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS pos_klienci_search (
+        klient_rowid INTEGER PRIMARY KEY,
+        phone_key TEXT,
+        nip_key TEXT,
+        email_key TEXT,
+        name_text TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_pos_klienci_search_phone ON pos_klienci_search(phone_key)",
+    "CREATE INDEX IF NOT EXISTS idx_pos_klienci_search_nip ON pos_klienci_search(nip_key)",
+    "CREATE INDEX IF NOT EXISTS idx_pos_klienci_search_email ON pos_klienci_search(email_key)",
+    """
+    CREATE TABLE IF NOT EXISTS pos_klienci_search_tokens (
+        token TEXT NOT NULL,
+        klient_rowid INTEGER NOT NULL,
+        PRIMARY KEY (token, klient_rowid)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_pos_klienci_search_tokens_rowid ON pos_klienci_search_tokens(klient_rowid)",
+    "CREATE TABLE IF NOT EXISTS pos_klienci_search_dirty (klient_rowid INTEGER PRIMARY KEY)",
+    # Indeks nie nadaje id klientom (MAX(id) + 1 w triggerze nie jest bezpieczne przy równoległych zapisach)
+    "DROP TRIGGER IF EXISTS pos_klienci_assign_id",
+    # Kolejka przez ON CONFLICT DO NOTHING - INSERT OR IGNORE w triggerze ustępuje polityce
+    # UPSERT-u instrukcji zewnętrznej i przerywał go błędem UNIQUE na pos_klienci_search_dirty
+    "DROP TRIGGER IF EXISTS pos_klienci_search_after_insert",
+    "DROP TRIGGER IF EXISTS pos_klienci_search_after_update",
+    "DROP TRIGGER IF EXISTS pos_klienci_search_after_delete",
+    """
+    CREATE TRIGGER IF NOT EXISTS pos_klienci_search_queue_insert
+    AFTER INSERT ON pos_klienci
+    BEGIN
+        INSERT INTO pos_klienci_search_dirty (klient_rowid) VALUES (NEW.rowid) ON CONFLICT DO NOTHING;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS pos_klienci_search_queue_update
+    AFTER UPDATE OF {', '.join(INDEXED_COLUMNS)} ON pos_klienci
+    BEGIN
+        INSERT INTO pos_klienci_search_dirty (klient_rowid)
+        SELECT OLD.rowid WHERE OLD.rowid IS NOT NEW.rowid
+        ON CONFLICT DO NOTHING;
+        INSERT INTO pos_klienci_search_dirty (klient_rowid) VALUES (NEW.rowid) ON CONFLICT DO NOTHING;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pos_klienci_search_queue_delete
+    AFTER DELETE ON pos_klienci
+    BEGIN
+        INSERT INTO pos_klienci_search_dirty (klient_rowid) VALUES (OLD.rowid) ON CONFLICT DO NOTHING;
+    END
+    """
+]
+
+FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS pos_klienci_search_fts
+    USING fts5(name_text, tokenize='trigram')
+"""
+
+
+def fold_text(value):
+    """Małe litery bez polskich znaków i diakrytyków, słowa oddzielone pojedynczą spacją"""
+    if not value:
+        return ''
+    text = str(value).translate(POLISH_FOLD)
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return NON_ALNUM.sub(' ', text).strip()
+
+
+def normalize_phone(value):
+    """Same cyfry, bez prefiksu kraju +48/0048 - '+48 123 456 789' -> '123456789'"""
+    digits = NON_DIGIT.sub('', str(value or ''))
+    if digits.startswith('0048'):
+        digits = digits[4:]
+    elif digits.startswith('48') and len(digits) == 11:
+        digits = digits[2:]
+    return digits if len(digits) >= 6 else None
+
+
+def normalize_nip(value):
+    """NIP jako 10 cyfr - myślniki, spacje i prefiks 'PL' są pomijane"""
+    digits = NON_DIGIT.sub('', str(value or ''))
+    return digits if len(digits) == 10 else None
+
+
+def normalize_email(value):
+    email = str(value or '').strip().lower()
+    return email if '@' in email else None
+
+
+def _prefix_range(prefix):
+    """Zakres [prefix, prefix + U+FFFF) - wyszukiwanie prefiksowe przez indeks zamiast LIKE"""
+    return prefix, prefix + '\uffff'
+
+
+class CustomerSearchIndex:
+
+    def __init__(self):
+        self._schema_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._schema_ready = False
+        self.fts_enabled = False
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._over_target = 0
+
+    def invalidate(self):
+        """Po podmianie bazy (odtworzenie kopii) - schemat i kolejka indeksu sprawdzane od nowa"""
+        with self._schema_lock:
+            self._schema_ready = False
+
+    # ------------------------------------------------------------------ schemat
+
+    def ensure_schema(self):
+        """
+        Jednorazowo (per proces) tworzy tabele indeksu i triggery i przy pierwszym
+        uruchomieniu kolejkuje wszystkich klientów do indeksu.
+        """
+        if self._schema_ready:
+            return True
+
+        with self._schema_lock:
+            if self._schema_ready:
+                return True
+
+            conn = get_db_connection()
+            if not conn:
+                return False
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pos_klienci'")
+                if not cursor.fetchone():
+                    return False
+
+                cursor.execute("""
+                    SELECT name FROM sqlite_master
+                    WHERE type = 'table' AND name IN ('pos_klienci_search', 'pos_klienci_search_fts')
+                """)
+                existing = {row[0] for row in cursor.fetchall()}
+
+                for statement in SCHEMA:
+                    cursor.execute(statement)
+
+                try:
+                    cursor.execute(FTS_SCHEMA)
+                    self.fts_enabled = True
+                except Exception as e:
+                    # SQLite bez FTS5/trigram (< 3.34) - fragmenty słów przez LIKE na name_text
+                    logger.warning("Indeks trigramowy klientów niedostępny, używam LIKE: %s", e)
+                    self.fts_enabled = False
+
+                # Pierwsze uruchomienie (lub nowo dostępny FTS5) - zaindeksuj wszystkich klientów
+                expected = {'pos_klienci_search', 'pos_klienci_search_fts'} if self.fts_enabled else {'pos_klienci_search'}
+                if not expected <= existing:
+                    cursor.execute("INSERT OR IGNORE INTO pos_klienci_search_dirty (klient_rowid) SELECT rowid FROM pos_klienci")
+
+                conn.commit()
+                self._schema_ready = True
+                return True
+            except Exception as e:
+                conn.rollback()
+                logger.error("Błąd przygotowania indeksu klientów: %s", e)
+                return False
+            finally:
+                conn.close()
+
+    # --------------------------------------------------------------- utrzymanie
+
+    @staticmethod
+    def build_entry(row):
+        """Klucze indeksu dla wiersza pos_klienci -> (phone, nip, email, name_text, tokeny)"""
+        name_parts = [fold_text(row['imie']), fold_text(row['nazwisko']),
+                      fold_text(row['nazwa_firmy']), fold_text(row['miasto'])]
+        name_text = ' '.join(part for part in name_parts if part)
+        tokens = sorted(set(name_text.split()))
+        return (
+            normalize_phone(row['telefon']),
+            normalize_nip(row['nip']),
+            normalize_email(row['email']),
+            name_text,
+            tokens
+        )
+
+    def _reindex(self, cursor, rowids):
+        placeholders = ','.join('?' * len(rowids))
+        cursor.execute(f"DELETE FROM pos_klienci_search WHERE klient_rowid IN ({placeholders})", rowids)
+        cursor.execute(f"DELETE FROM pos_klienci_search_tokens WHERE klient_rowid IN ({placeholders})", rowids)
+        if self.fts_enabled:
+            cursor.execute(f"DELETE FROM pos_klienci_search_fts WHERE rowid IN ({placeholders})", rowids)
+
+        cursor.execute(f"""
+            SELECT rowid AS klient_rowid, imie, nazwisko, nazwa_firmy, miasto, telefon, nip, email
+            FROM pos_klienci WHERE rowid IN ({placeholders})
+        """, rowids)
+        entries, tokens, texts = [], [], []
+        for row in cursor.fetchall():
+            phone, nip, email, name_text, row_tokens = self.build_entry(row)
+            entries.append((row['klient_rowid'], phone, nip, email, name_text))
+            tokens.extend((token, row['klient_rowid']) for token in row_tokens)
+            texts.append((row['klient_rowid'], name_text))
+
+        cursor.executemany("""
+            INSERT INTO pos_klienci_search (klient_rowid, phone_key, nip_key, email_key, name_text)
+            VALUES (?, ?, ?, ?, ?)
+        """, entries)
+        cursor.executemany("INSERT OR IGNORE INTO pos_klienci_search_tokens (token, klient_rowid) VALUES (?, ?)", tokens)
+        if self.fts_enabled:
+            cursor.executemany("INSERT INTO pos_klienci_search_fts (rowid, name_text) VALUES (?, ?)", texts)
+        return len(entries)
+
+    def refresh(self, conn=None):
+        """Przetwarza kolejkę zmienionych klientów. Zwraca liczbę przeindeksowanych wpisów."""
+        if not self.ensure_schema():
+            return 0
+
+        own_connection = conn is None
+        conn = conn or get_db_connection()
+        if not conn:
+            return 0
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT klient_rowid FROM pos_klienci_search_dirty LIMIT 1")
+            if not cursor.fetchone():
+                return 0
+
+            with self._refresh_lock:
+                cursor.execute("SELECT klient_rowid FROM pos_klienci_search_dirty")
+                dirty = [row[0] for row in cursor.fetchall()]
+                indexed = 0
+                for start in range(0, len(dirty), RESOLVE_CHUNK):
+                    chunk = dirty[start:start + RESOLVE_CHUNK]
+                    indexed += self._reindex(cursor, chunk)
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(f"DELETE FROM pos_klienci_search_dirty WHERE klient_rowid IN ({placeholders})", chunk)
+                conn.commit()
+                logger.debug("Przeindeksowano klientów: %s (w kolejce %s)", indexed, len(dirty))
+                return indexed
+        except Exception as e:
+            conn.rollback()
+            logger.error("Błąd odświeżania indeksu klientów: %s", e)
+            return 0
+        finally:
+            if own_connection:
+                conn.close()
+
+    def rebuild(self):
+        """Pełna przebudowa indeksu - kolejkuje wszystkich klientów i przetwarza kolejkę"""
+        if not self.ensure_schema():
+            return 0
+        conn = get_db_connection()
+        if not conn:
+            return 0
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM pos_klienci_search")
+            cursor.execute("DELETE FROM pos_klienci_search_tokens")
+            if self.fts_enabled:
+                cursor.execute("DELETE FROM pos_klienci_search_fts")
+            cursor.execute("INSERT OR IGNORE INTO pos_klienci_search_dirty (klient_rowid) SELECT rowid FROM pos_klienci")
+            conn.commit()
+            return self.refresh(conn)
+        finally:
+            conn.close()
+
+    # --------------------------------------------------------------- wyszukiwanie
+
+    def match_clause(self, query):
+        """
+        Podzapytanie zwracające rowid pasujących klientów -> (sql, params, rodzaj dopasowania).
+        Telefon/NIP i e-mail idą po znormalizowanych kluczach, tekst po prefiksach tokenów.
+        """
+        query = (query or '').strip()
+
+        if '@' in query:
+            email = query.lower()
+            low, high = _prefix_range(email)
+            return ("SELECT klient_rowid FROM pos_klienci_search WHERE email_key >= ? AND email_key < ?",
+                    [low, high], 'email')
+
+        digits = NON_DIGIT.sub('', query)
+        if PHONE_LIKE.match(query) and len(digits) >= 3:
+            phone = digits
+            if phone.startswith('0048'):
+                phone = phone[4:]
+            elif phone.startswith('48') and (query.lstrip().startswith('+') or len(phone) > 9):
+                phone = phone[2:]
+            phone_low, phone_high = _prefix_range(phone or digits)
+            nip_low, nip_high = _prefix_range(digits)
+            return ("""
+                SELECT klient_rowid FROM pos_klienci_search WHERE phone_key >= ? AND phone_key < ?
+                UNION
+                SELECT klient_rowid FROM pos_klienci_search WHERE nip_key >= ? AND nip_key < ?
+            """, [phone_low, phone_high, nip_low, nip_high], 'phone_nip')
+
+        words = fold_text(query).split()
+        if not words:
+            return "SELECT klient_rowid FROM pos_klienci_search WHERE 0", [], 'none'
+
+        # Każde słowo zapytania musi być prefiksem któregoś tokenu klienta
+        parts, params = [], []
+        for word in words[:5]:
+            low, high = _prefix_range(word)
+            parts.append("SELECT klient_rowid FROM pos_klienci_search_tokens WHERE token >= ? AND token < ?")
+            params.extend([low, high])
+        return ' INTERSECT '.join(parts), params, 'prefix'
+
+    def substring_clause(self, query, match_type='prefix'):
+        """
+        Dopasowanie fragmentu (jak dawne LIKE '%...%') - gdy szybka ścieżka nic nie dała.
+        Nazwy przez trigramy FTS5 (lub LIKE na name_text), klucze przez LIKE na wąskiej tabeli indeksu
+        (e-mail także dla zapytań tekstowych); zapytania 1-2 znakowe przez LIKE na pos_klienci.
+        """
+        query = (query or '').strip()
+        if match_type == 'phone_nip':
+            digits = NON_DIGIT.sub('', query)
+            return ("SELECT klient_rowid FROM pos_klienci_search WHERE phone_key LIKE ? OR nip_key LIKE ?",
+                    [f"%{digits}%"] * 2, 'substring')
+        if match_type == 'email':
+            return ("SELECT klient_rowid FROM pos_klienci_search WHERE email_key LIKE ?",
+                    [f"%{query.strip().lower()}%"], 'substring')
+
+        text = fold_text(query)
+        if len(text) < 3:
+            if not query:
+                return None
+            condition = ' OR '.join(f"{column} LIKE ?" for column in SHORT_QUERY_COLUMNS)
+            return (f"SELECT rowid FROM pos_klienci WHERE {condition}",
+                    [f"%{query}%"] * len(SHORT_QUERY_COLUMNS), 'like')
+
+        if self.fts_enabled:
+            phrase = '"' + text.replace('"', '""') + '"'
+            parts = ["SELECT rowid FROM pos_klienci_search_fts WHERE pos_klienci_search_fts MATCH ?"]
+            params = [phrase]
+        else:
+            parts = ["SELECT klient_rowid FROM pos_klienci_search WHERE name_text LIKE ?"]
+            params = [f"%{text}%"]
+        parts.append("SELECT klient_rowid FROM pos_klienci_search WHERE email_key LIKE ?")
+        params.append(f"%{query.lower()}%")
+        return ' UNION '.join(parts), params, 'substring'
+
+    def search(self, query, limit=10):
+        """Podpowiedzi klientów dla wyszukiwarki -> (lista klientów, rodzaj dopasowania, czas ms)"""
+        started = time.perf_counter()
+        conn = get_db_connection()
+        if not conn:
+            return None, None, 0
+        try:
+            self.refresh(conn)
+            cursor = conn.cursor()
+
+            customer_sql = """
+                SELECT
+                    id,
+                    (imie || ' ' || nazwisko) as name,
+                    telefon as phone,
+                    email,
+                    (ulica || ' ' || miasto) as address,
+                    data_rejestracji as created_at,
+                    data_ostatniej_edycji as updated_at
+                FROM pos_klienci
+                WHERE rowid IN ({match})
+                ORDER BY nazwisko ASC
+                LIMIT ?
+            """
+            match_sql, params, match_type = self.match_clause(query)
+            cursor.execute(customer_sql.format(match=match_sql), params + [limit])
+            rows = cursor.fetchall()
+
+            if not rows and match_type != 'none':
+                substring = self.substring_clause(query, match_type)
+                if substring:
+                    match_sql, params, match_type = substring
+                    cursor.execute(customer_sql.format(match=match_sql), params + [limit])
+                    rows = cursor.fetchall()
+
+            results = [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+        took_ms = (time.perf_counter() - started) * 1000
+        self._latencies.append(took_ms)
+        if took_ms > TYPEAHEAD_TARGET_MS:
+            self._over_target += 1
+            logger.warning("Wyszukiwanie klientów '%s' trwało %.1f ms (cel %.0f ms)", query, took_ms, TYPEAHEAD_TARGET_MS)
+        return results, match_type, round(took_ms, 2)
+
+    def resolve(self, records):
+        """
+        Dopasowanie wsadowe rekordów importu do istniejących klientów.
+        Kolejność kluczy: NIP, telefon, e-mail. Każdy klucz to jedno zapytanie IN na paczkę
+        rekordów zamiast zapytania na rekord. Zwraca listę w kolejności wejścia.
+        """
+        keys = {'nip': {}, 'phone': {}, 'email': {}}
+        normalized = []
+        for record in records:
+            record = record or {}
+            entry = {
+                'nip': normalize_nip(record.get('nip')),
+                'phone': normalize_phone(record.get('telefon') or record.get('phone')),
+                'email': normalize_email(record.get('email'))
+            }
+            normalized.append(entry)
+            for kind, value in entry.items():
+                if value:
+                    keys[kind][value] = []
+
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            self.refresh(conn)
+            cursor = conn.cursor()
+            columns = {'nip': 'nip_key', 'phone': 'phone_key', 'email': 'email_key'}
+            for kind, column in columns.items():
+                values = list(keys[kind])
+                for start in range(0, len(values), RESOLVE_CHUNK):
+                    chunk = values[start:start + RESOLVE_CHUNK]
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(f"""
+                        SELECT s.{column} AS key, k.id, k.numer_klienta
+                        FROM pos_klienci_search s
+                        JOIN pos_klienci k ON k.rowid = s.klient_rowid
+                        WHERE s.{column} IN ({placeholders})
+                        ORDER BY k.id
+                    """, chunk)
+                    for row in cursor.fetchall():
+                        keys[kind][row['key']].append((row['id'], row['numer_klienta']))
+        finally:
+            conn.close()
+
+        results = []
+        for index, entry in enumerate(normalized):
+            result = {'index': index, 'customer_id': None, 'numer_klienta': None, 'matched_by': None, 'candidates': 0}
+            for kind in ('nip', 'phone', 'email'):
+                matches = keys[kind].get(entry[kind]) if entry[kind] else None
+                if matches:
+                    result.update({
+                        'customer_id': matches[0][0],
+                        'numer_klienta': matches[0][1],
+                        'matched_by': kind,
+                        'candidates': len(matches)
+                    })
+                    break
+            results.append(result)
+        return results
+
+    def status(self):
+        conn = get_db_connection()
+        counts = {'indexed': None, 'pending': None}
+        if conn and self.ensure_schema():
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*) FROM pos_klienci_search")
+                counts['indexed'] = cursor.fetchone()[0]
+                cursor.execute("SELECT COUNT(*) FROM pos_klienci_search_dirty")
+                counts['pending'] = cursor.fetchone()[0]
+            finally:
+                conn.close()
+        elif conn:
+            conn.close()
+
+        samples = sorted(self._latencies)
+
+        def pick(fraction):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(fraction * (len(samples) - 1)))], 2)
+
+        return {
+            **counts,
+            'trigram': self.fts_enabled,
+            'target_ms': TYPEAHEAD_TARGET_MS,
+            'samples': len(samples),
+            'p50_ms': pick(0.50),
+            'p95_ms': pick(0.95),
+            'over_target': self._over_target
+        }
+
+
+# Globalna instancja
+customer_search_index = CustomerSearchIndex()
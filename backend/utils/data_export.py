@@ -0,0 +1,448 @@
+"""
+Strumieniowy eksport i import danych bazy
+Eksport czyta tabele kursorem partiami (fetchmany) i od razu zapisuje je jako
+NDJSON lub CSV - do odpowiedzi HTTP albo do katalogu jako pliki porcjowane
+(chunk'i .ndjson.gz + manifest.json). Pamięć nie rośnie z rozmiarem tabel.
+Import wczytuje ten sam format i zapisuje wiersze paczkami przez executemany.
+"""
+
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import re
+from datetime import datetime
+
+from utils.database import get_db_connection
+from utils.pagination import ITEM_COUNTERS
+
+EXPORT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'exports'))
+
+# Kolumny dat sprawdzane (w tej kolejności) przy filtrowaniu eksportu po zakresie
+DATE_COLUMNS = [
+    'data_transakcji', 'data_operacji', 'data_faktury', 'data_wystawienia',
+    'receipt_date', 'issue_date', 'data_utworzenia', 'created_at'
+]
+
+IMPORT_MODES = {
+    'insert': 'INSERT',
+    'ignore': 'INSERT OR IGNORE',
+    'replace': 'INSERT OR REPLACE'
+}
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'$b64': base64.b64encode(bytes(value)).decode('ascii')}
+    return str(value)
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and '$b64' in value:
+        return base64.b64decode(value['$b64'])
+    return value
+
+
+class DataExporter:
+
+    def __init__(self):
+        self.BATCH_SIZE = 2000  # Wierszy pobieranych z kursora naraz
+        self.CHUNK_ROWS = 100000  # Wierszy w jednym pliku eksportu na dysk
+        self.IMPORT_BATCH_SIZE = 5000  # Wierszy w jednym executemany
+
+    # ---------- Metadane tabel ----------
+
+    def list_tables(self, cursor):
+        """Tabele użytkownika (bez wewnętrznych tabel SQLite)"""
+        cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+            ORDER BY name
+        """)
+        return [row[0] for row in cursor.fetchall()]
+
+    def table_columns(self, cursor, table):
+        cursor.execute(f'PRAGMA table_info("{table}")')
+        return [row[1] for row in cursor.fetchall()]
+
+    def date_column(self, columns):
+        for column in DATE_COLUMNS:
+            if column in columns:
+                return column
+        return None
+
+    def describe_tables(self):
+        """Lista tabel z liczbą wierszy i kolumną używaną do filtrowania dat"""
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            cursor = conn.cursor()
+            tables = []
+            for table in self.list_tables(cursor):
+                columns = self.table_columns(cursor, table)
+                cursor.execute(f'SELECT COUNT(*) FROM "{table}"')
+                tables.append({
+                    'table': table,
+                    'rows': cursor.fetchone()[0],
+                    'columns': len(columns),
+                    'date_column': self.date_column(columns)
+                })
+            return tables
+        finally:
+            conn.close()
+
+    def resolve_tables(self, cursor, requested):
+        """
+        Zwraca listę tabel do eksportu. Nazwy są weryfikowane z sqlite_master,
+        więc można je bezpiecznie wstawiać do zapytań.
+        """
+        existing = self.list_tables(cursor)
+        if not requested:
+            return existing, []
+        if isinstance(requested, str):
+            requested = [t.strip() for t in requested.split(',') if t.strip()]
+        missing = [t for t in requested if t not in existing]
+        return [t for t in requested if t in existing], missing
+
+    # ---------- Odczyt ----------
+
+    def _table_query(self, cursor, table, date_from, date_to):
+        columns = self.table_columns(cursor, table)
+        query = f'SELECT * FROM "{table}"'
+        params = []
+        date_column = self.date_column(columns) if (date_from or date_to) else None
+        if date_column:
+            conditions = []
+            if date_from:
+                conditions.append(f'"{date_column}" >= ?')
+                params.append(date_from)
+            if date_to:
+                conditions.append(f'"{date_column}" < date(?, \'+1 day\')')
+                params.append(date_to)
+            query += ' WHERE ' + ' AND '.join(conditions)
+        # Tabele bez kolumny daty (słowniki, konfiguracja) są eksportowane w całości
+        query += ' ORDER BY rowid' if self._has_rowid(cursor, table) else ''
+        return query, params, columns, date_column
+
+    def _has_rowid(self, cursor, table):
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        row = cursor.fetchone()
+        return not (row and row[0] and 'WITHOUT ROWID' in row[0].upper())
+
+    def iter_batches(self, table, date_from=None, date_to=None, conn=None):
+        """
+        Generator (kolumny, paczka wierszy) dla tabeli. Kursor SQLite jest krokowy,
+        więc w pamięci jest tylko bieżąca paczka BATCH_SIZE wierszy.
+        """
+        own_connection = conn is None
+        if own_connection:
+            conn = get_db_connection()
+            if not conn:
+                raise RuntimeError('Brak połączenia z bazą danych')
+        try:
+            cursor = conn.cursor()
+            query, params, columns, _ = self._table_query(cursor, table, date_from, date_to)
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(self.BATCH_SIZE)
+                if not rows:
+                    break
+                yield columns, [tuple(row) for row in rows]
+        finally:
+            if own_connection:
+                conn.close()
+
+    # ---------- Formaty ----------
+
+    def stream_ndjson(self, tables, date_from=None, date_to=None):
+        """
+        Strumień NDJSON: dla każdej tabeli linia nagłówka z kolumnami,
+        następnie linie z wartościami wierszy, na końcu podsumowanie.
+        """
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('Brak połączenia z bazą danych')
+        try:
+            counts = {}
+            yield json.dumps({
+                'type': 'export',
+                'exported_at': datetime.now().isoformat(),
+                'date_from': date_from,
+                'date_to': date_to
+            }) + '\n'
+            for table in tables:
+                cursor = conn.cursor()
+                columns = self.table_columns(cursor, table)
+                yield json.dumps({'type': 'table', 'table': table, 'columns': columns}) + '\n'
+                counts[table] = 0
+                for _, rows in self.iter_batches(table, date_from, date_to, conn=conn):
+                    counts[table] += len(rows)
+                    yield ''.join(
+                        json.dumps({'t': table, 'v': list(row)}, default=_json_default, ensure_ascii=False) + '\n'
+                        for row in rows
+                    )
+            yield json.dumps({'type': 'end', 'tables': counts}) + '\n'
+        finally:
+            conn.close()
+
+    def stream_csv(self, table, date_from=None, date_to=None):
+        """Strumień CSV jednej tabeli (nagłówek + wiersze)"""
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('Brak połączenia z bazą danych')
+        try:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(self.table_columns(conn.cursor(), table))
+            for _, rows in self.iter_batches(table, date_from, date_to, conn=conn):
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        finally:
+            conn.close()
+
+    def export_to_directory(self, tables, date_from=None, date_to=None, chunk_rows=None, name=None):
+        """
+        Eksport do katalogu exports/<nazwa>/ jako porcjowane pliki <tabela>.<nr>.ndjson.gz
+        oraz manifest.json (kolumny, liczba wierszy i lista plików per tabela).
+        """
+        chunk_rows = chunk_rows or self.CHUNK_ROWS
+        name = name or f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        if not re.match(r'^[A-Za-z0-9_.-]+$', name):
+            raise ValueError('Nieprawidłowa nazwa eksportu')
+        target = os.path.join(EXPORT_DIR, name)
+        os.makedirs(target, exist_ok=True)
+
+        started = datetime.now()
+        manifest = {
+            'name': name,
+            'exported_at': started.isoformat(),
+            'date_from': date_from,
+            'date_to': date_to,
+            'format': 'ndjson.gz',
+            'tables': {}
+        }
+
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('Brak połączenia z bazą danych')
+        try:
+            for table in tables:
+                columns = self.table_columns(conn.cursor(), table)
+                info = {'columns': columns, 'rows': 0, 'files': []}
+                manifest['tables'][table] = info
+                chunk_file = None
+                chunk_count = 0
+                try:
+                    for _, rows in self.iter_batches(table, date_from, date_to, conn=conn):
+                        for row in rows:
+                            if chunk_file is None or chunk_count >= chunk_rows:
+                                if chunk_file:
+                                    chunk_file.close()
+                                file_name = f"{table}.{len(info['files']) + 1:05d}.ndjson.gz"
+                                info['files'].append(file_name)
+                                chunk_file = gzip.open(os.path.join(target, file_name), 'wt', encoding='utf-8')
+                                chunk_file.write(json.dumps({'type': 'table', 'table': table, 'columns': columns}) + '\n')
+                                chunk_count = 0
+                            chunk_file.write(json.dumps({'t': table, 'v': list(row)}, default=_json_default, ensure_ascii=False) + '\n')
+                            chunk_count += 1
+                            info['rows'] += 1
+                finally:
+                    if chunk_file:
+                        chunk_file.close()
+        finally:
+            conn.close()
+
+        manifest['duration_ms'] = round((datetime.now() - started).total_seconds() * 1000, 1)
+        with open(os.path.join(target, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        manifest['path'] = target
+        return manifest
+
+    # ---------- Import ----------
+
+    def import_ndjson(self, lines, mode='insert', tables=None):
+        """
+        Import strumienia NDJSON (format eksportu) paczkami executemany w jednej transakcji.
+        `lines` to dowolny iterator linii (plik, gzip, odpowiedź HTTP). Zwraca liczniki per tabela.
+        """
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('Brak połączenia z bazą danych')
+        try:
+            cursor = conn.cursor()
+            writer = _BatchWriter(self, cursor, mode, tables)
+            for line in lines:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if 't' in record:
+                    writer.add(record['t'], record['v'])
+                elif record.get('type') == 'table':
+                    writer.declare(record['table'], record['columns'])
+            writer.flush_all()
+            writer.recount()
+            conn.commit()
+            return writer.result()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def import_csv(self, lines, table, mode='insert'):
+        """Import CSV jednej tabeli (pierwszy wiersz = nazwy kolumn)"""
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('Brak połączenia z bazą danych')
+        try:
+            cursor = conn.cursor()
+            writer = _BatchWriter(self, cursor, mode, [table])
+            reader = csv.reader(line.decode('utf-8') if isinstance(line, bytes) else line for line in lines)
+            header = next(reader, None)
+            if not header:
+                return writer.result()
+            writer.declare(table, header)
+            for values in reader:
+                # CSV nie rozróżnia NULL od pustego tekstu - puste pola importujemy jako NULL
+                writer.add(table, [v if v != '' else None for v in values])
+            writer.flush_all()
+            writer.recount()
+            conn.commit()
+            return writer.result()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def import_directory(self, name, mode='insert', tables=None):
+        """Import eksportu zapisanego na dysku (wg manifest.json)"""
+        if not re.match(r'^[A-Za-z0-9_.-]+$', name or ''):
+            raise ValueError('Nieprawidłowa nazwa eksportu')
+        source = os.path.join(EXPORT_DIR, name)
+        with open(os.path.join(source, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        def lines():
+            for table, info in manifest['tables'].items():
+                if tables and table not in tables:
+                    continue
+                for file_name in info['files']:
+                    with gzip.open(os.path.join(source, file_name), 'rt', encoding='utf-8') as chunk:
+                        yield from chunk
+
+        return self.import_ndjson(lines(), mode=mode, tables=tables)
+
+    def list_exports(self):
+        """Eksporty zapisane w katalogu exports/"""
+        if not os.path.isdir(EXPORT_DIR):
+            return []
+        exports = []
+        for name in sorted(os.listdir(EXPORT_DIR), reverse=True):
+            manifest_path = os.path.join(EXPORT_DIR, name, 'manifest.json')
+            if not os.path.exists(manifest_path):
+                continue
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            exports.append({
+                'name': name,
+                'exported_at': manifest.get('exported_at'),
+                'tables': len(manifest.get('tables', {})),
+                'rows': sum(t['rows'] for t in manifest.get('tables', {}).values())
+            })
+        return exports
+
+
+class _BatchWriter:
+    """Bufor wierszy importu per tabela, zapisywany paczkami przez executemany"""
+
+    def __init__(self, exporter, cursor, mode, tables):
+        if mode not in IMPORT_MODES:
+            raise ValueError(f'Nieznany tryb importu: {mode}')
+        self.exporter = exporter
+        self.cursor = cursor
+        self.verb = IMPORT_MODES[mode]
+        self.allowed = set(tables) if tables else None
+        self.existing = set(exporter.list_tables(cursor))
+        self.statements = {}
+        self.buffers = {}
+        self.counts = {}
+        self.skipped = {}
+        self.recounted = {}
+
+    def declare(self, table, columns):
+        # Kolejny nagłówek tej samej tabeli (następny chunk) - zapisz bufor starym poleceniem
+        if self.statements.get(table):
+            self.flush(table)
+        if table not in self.existing or (self.allowed and table not in self.allowed):
+            self.statements[table] = None
+            return
+        target_columns = set(self.exporter.table_columns(self.cursor, table))
+        unknown = [c for c in columns if c not in target_columns]
+        if unknown:
+            raise ValueError(f'Tabela {table} nie ma kolumn: {", ".join(unknown)}')
+        column_list = ', '.join(f'"{c}"' for c in columns)
+        placeholders = ', '.join('?' * len(columns))
+        self.statements[table] = f'{self.verb} INTO "{table}" ({column_list}) VALUES ({placeholders})'
+        self.buffers.setdefault(table, [])
+        self.counts.setdefault(table, 0)
+
+    def add(self, table, values):
+        statement = self.statements.get(table)
+        if statement is None:
+            self.skipped[table] = self.skipped.get(table, 0) + 1
+            return
+        buffer = self.buffers[table]
+        buffer.append([_decode_value(v) for v in values])
+        if len(buffer) >= self.exporter.IMPORT_BATCH_SIZE:
+            self.flush(table)
+
+    def flush(self, table):
+        buffer = self.buffers.get(table)
+        if buffer:
+            self.cursor.executemany(self.statements[table], buffer)
+            # rowcount = faktycznie zapisane wiersze (w trybie ignore pominięte duplikaty się nie liczą)
+            self.counts[table] += max(self.cursor.rowcount, 0)
+            buffer.clear()
+
+    def flush_all(self):
+        for table in list(self.buffers):
+            self.flush(table)
+
+    def recount(self):
+        """
+        Przelicza liczniki pozycji nagłówków (ITEM_COUNTERS) z tabel pozycji. Triggery doliczają
+        importowane pozycje do licznika przyniesionego w wierszu nagłówka (podwojenie), a REPLACE
+        usuwa wiersze bez triggerów - po imporcie wartość jest więc liczona od nowa.
+        """
+        for table, column, items_table, foreign_key in ITEM_COUNTERS:
+            if not (self.counts.get(table) or self.counts.get(items_table)):
+                continue
+            if items_table not in self.existing or column not in self.exporter.table_columns(self.cursor, table):
+                continue
+            count = f"(SELECT COUNT(*) FROM {items_table} WHERE {items_table}.{foreign_key} = {table}.id)"
+            self.cursor.execute(f"UPDATE {table} SET {column} = {count} WHERE {column} IS NOT {count}")
+            self.recounted[table] = max(self.cursor.rowcount, 0)
+
+    def result(self):
+        return {
+            'imported': self.counts,
+            'skipped': self.skipped,
+            'recounted': self.recounted,
+            'total_imported': sum(self.counts.values())
+        }
+
+
+# Globalna instancja eksportera danych
+data_exporter = DataExporter()
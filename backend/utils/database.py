@@ -3,10 +3,78 @@ Moduł obsługi bazy danych SQLite dla POS System V3
 Zawiera funkcje do łączenia z bazą i standardowe odpowiedzi API
 """
 
+import logging
 import sqlite3
 import os
+import random
+import threading
+import time
+from functools import wraps
 from flask import jsonify
 
+from utils.metrics import metrics, InstrumentedConnection
+
+logger = logging.getLogger(__name__)
+
+# Przy wielu workerach kilka procesów pisze do jednego pliku bazy: połączenie czeka
+# na blokadę zapisu do BUSY_TIMEOUT sekund, a operacje, którym mimo to trafi się
+# "database is locked", są ponawiane z wykładniczym odstępem (LOCK_RETRIES razy)
+BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', '15'))
+LOCK_RETRIES = int(os.environ.get('SQLITE_LOCK_RETRIES', '5'))
+LOCK_RETRY_BASE_DELAY = 0.05
+
+_wal_lock = threading.Lock()
+_wal_ready = set()
+
+
+def _ensure_wal(conn, db_path):
+    """Jednorazowo (per proces i plik) przełącza bazę w tryb WAL - czytelnicy nie blokują pisarza"""
+    if db_path in _wal_ready:
+        return
+    with _wal_lock:
+        if db_path in _wal_ready:
+            return
+        try:
+            mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            if str(mode).lower() != 'wal':
+                logger.warning("Baza %s działa w trybie %s zamiast WAL", db_path, mode)
+            _wal_ready.add(db_path)
+        except sqlite3.OperationalError as e:
+            # Inny proces trzyma blokadę - spróbujemy przy następnym połączeniu
+            logger.warning("Nie można włączyć trybu WAL: %s", e)
+
+
+def is_locked_error(error):
+    """Czy wyjątek to chwilowa blokada bazy (SQLITE_BUSY / SQLITE_LOCKED)"""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and (
+        'database is locked' in message or 'database is busy' in message or 'database table is locked' in message
+    )
+
+
+def retry_on_locked(func=None, retries=None):
+    """
+    Dekorator ponawiający operację na bazie, gdy SQLite zgłosi blokadę.
+    Odstęp rośnie wykładniczo (z losowym rozrzutem), żeby workery się nie synchronizowały.
+    Dekorowana funkcja musi obejmować całą transakcję i wycofać ją przy błędzie - jest powtarzana od początku.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            attempts = LOCK_RETRIES if retries is None else retries
+            for attempt in range(attempts + 1):
+                try:
+                    return f(*args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    if not is_locked_error(e) or attempt == attempts:
+                        raise
+                    delay = LOCK_RETRY_BASE_DELAY * (2 ** attempt)
+                    time.sleep(delay + random.uniform(0, delay))
+        return wrapper
+
+    return decorator(func) if func else decorator
+
+
 def get_db_connection():
     """
     Utwórz połączenie z bazą danych SQLite
@@ -21,17 +89,29 @@ def get_db_connection():
         if not os.path.exists(db_path):
             raise FileNotFoundError(f"Nie znaleziono pliku bazy danych: {db_path}")
         
-        print(f"🔍 DATABASE: Using database at: {db_path}")
+        logger.debug("Łączę z bazą danych: %s", db_path)
         
-        # ...existing code...
-        print(f"🔌 Łączę z bazą danych: {db_path}")
-        conn = sqlite3.connect(db_path)
+        # Połączenie mierzone (utils/metrics.py) - liczba i czas zapytań per żądanie
+        factory = InstrumentedConnection if metrics.enabled else sqlite3.Connection
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, factory=factory)
         conn.row_factory = sqlite3.Row  # Pozwala na dostęp do kolumn po nazwie
+        _ensure_wal(conn, db_path)
+        # W trybie WAL NORMAL jest bezpieczne i nie wymusza fsync przy każdym commit
+        conn.execute("PRAGMA synchronous=NORMAL")
         return conn
     except Exception as e:
-        print(f"Błąd połączenia z bazą danych: {e}")
+        logger.error("Błąd połączenia z bazą danych: %s", e)
         return None
 
+@retry_on_locked
+def _run_query(conn, query, params):
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(query, params)
+    else:
+        cursor.execute(query)
+    return cursor.fetchall()
+
 def execute_query(query, params=None):
     """
     Wykonaj zapytanie SELECT i zwróć wyniki
@@ -41,23 +121,31 @@ def execute_query(query, params=None):
         return None
         
     try:
-        cursor = conn.cursor()
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        
-        results = cursor.fetchall()
+        results = _run_query(conn, query, params)
         
         # Konwertuj sqlite3.Row na słowniki
         return [dict(row) for row in results]
         
     except Exception as e:
-        print(f"Błąd wykonania zapytania: {e}")
+        logger.error("Błąd wykonania zapytania: %s", e)
         return None
     finally:
         conn.close()
 
+@retry_on_locked
+def _run_write(conn, query, params):
+    try:
+        cursor = conn.cursor()
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        conn.commit()
+        return cursor.lastrowid
+    except sqlite3.OperationalError:
+        conn.rollback()
+        raise
+
 def execute_insert(query, params=None):
     """
     Wykonaj zapytanie INSERT/UPDATE/DELETE
@@ -68,17 +156,11 @@ def execute_insert(query, params=None):
         return False
         
     try:
-        cursor = conn.cursor()
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-            
-        conn.commit()
-        return cursor.lastrowid if cursor.lastrowid else True
+        lastrowid = _run_write(conn, query, params)
+        return lastrowid if lastrowid else True
         
     except Exception as e:
-        print(f"Błąd wykonania zapytania INSERT: {e}")
+        logger.error("Błąd wykonania zapytania INSERT: %s", e)
         return False
     finally:
         conn.close()
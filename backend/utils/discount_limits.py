@@ -0,0 +1,447 @@
+"""
+Liczniki limitów rabatów (dzienne i miesięczne) w pamięci procesu
+Sprawdzenie limitu i zarezerwowanie kwoty to jedna operacja pod blokadą, więc dwóch kasjerów
+stosujących ten sam rabat pracowniczy nie przekroczy limitu, a obliczenie rabatu nie czeka na SQLite.
+
+Źródłem prawdy jest tabela rabaty_uzycie:
+- przy starcie liczniki bieżącego miesiąca są odbudowywane z jej sumy,
+- wątek w tle co DISCOUNT_FLUSH_INTERVAL sekund doczytuje użycia zapisane przez inne procesy
+  (po id) i zapisuje zmienione liczniki partią do rabaty_limity_dzienne / rabaty_limity_miesieczne.
+Tabele limitów są więc utrzymywane przez silnik (dawne triggery AFTER INSERT zostają usunięte),
+a usunięcie użycia zmniejsza liczniki zamiast zostawiać je zawyżone.
+
+Liczniki w pamięci są szybkim wstępnym sprawdzeniem. Limit rozstrzyga zapis użycia: suma
+z rabaty_uzycie jest liczona w tej samej transakcji BEGIN IMMEDIATE co INSERT, więc zapisy
+z różnych workerów są szeregowane blokadą zapisu SQLite i nie mogą razem przekroczyć limitu,
+nawet zanim użycia z innych procesów trafią do liczników (najpóźniej po cyklu synchronizacji).
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from utils.database import get_db_connection, retry_on_locked
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.environ.get('DISCOUNT_FLUSH_INTERVAL', '2'))
+REBUILD_INTERVAL = float(os.environ.get('DISCOUNT_REBUILD_INTERVAL', '300'))
+RABAT_CACHE_TTL = 60
+
+LIMIT_TRIGGERS = ('update_rabaty_limity_miesieczne', 'update_rabaty_limity_dzienne')
+
+USAGE_COLUMNS = ('transakcja_id', 'user_id', 'kwota_przed_rabatem', 'kwota_rabatu', 'kwota_po_rabacie', 'notatka', 'ip_address')
+
+# Suma użyć rabatu przez użytkownika w bieżącym miesiącu i dniu - sprawdzenie limitu przy zapisie
+USAGE_INDEX = "CREATE INDEX IF NOT EXISTS idx_rabaty_uzycie_rabat_miesiac ON rabaty_uzycie(rabat_id, miesiac_rok, dzien)"
+
+
+def current_periods():
+    """(dzień, miesiąc) w UTC - tak jak domyślne wartości kolumn dzien/miesiac_rok w rabaty_uzycie"""
+    now = datetime.now(timezone.utc)
+    return now.strftime('%Y-%m-%d'), now.strftime('%Y-%m')
+
+
+def _limit_error(rabat, used_day, used_month):
+    """Komunikat przekroczonego limitu lub None - te same reguły co wcześniej w rabaty.py (wykorzystane >= limit)"""
+    if rabat.get('limit_miesieczny_aktywny'):
+        if (rabat.get('limit_miesieczny_kwota') or 0) > 0 and used_month[0] >= rabat['limit_miesieczny_kwota']:
+            return "Przekroczony miesięczny limit kwotowy"
+        if (rabat.get('limit_miesieczny_ilosc') or 0) > 0 and used_month[1] >= rabat['limit_miesieczny_ilosc']:
+            return "Przekroczony miesięczny limit ilościowy"
+    if rabat.get('limit_dzienny_aktywny'):
+        if (rabat.get('limit_dzienny_kwota') or 0) > 0 and used_day[0] >= rabat['limit_dzienny_kwota']:
+            return "Przekroczony dzienny limit kwotowy"
+        if (rabat.get('limit_dzienny_ilosc') or 0) > 0 and used_day[1] >= rabat['limit_dzienny_ilosc']:
+            return "Przekroczony dzienny limit ilościowy"
+    return None
+
+
+def _has_limits(rabat):
+    return bool(rabat.get('limit_dzienny_aktywny') or rabat.get('limit_miesieczny_aktywny'))
+
+
+class DiscountLimitEngine:
+
+    def __init__(self):
+        self._lock = threading.Lock()        # liczniki
+        self._sync_lock = threading.Lock()   # zapis użycia vs doczytywanie cudzych użyć
+        self._load_lock = threading.Lock()
+        self._daily = {}    # (rabat_id, user_id, dzien) -> [kwota, ilosc]
+        self._monthly = {}  # (rabat_id, user_id, miesiac) -> [kwota, ilosc]
+        self._dirty_daily = set()
+        self._dirty_monthly = set()
+        self._own_ids = set()  # id użyć zapisanych przez ten proces, jeszcze nie minięte przez doczytywanie
+        self._last_id = 0
+        self._loaded = False
+        self._rebuild_requested = False
+        self._last_rebuild = 0.0
+        self._last_flush = None
+        self._flushed_rows = 0
+        self._rabaty = {}  # rabat_id -> (wygasa, wiersz)
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ----------------------------------------------------------- definicje rabatów
+
+    def get_rabat(self, rabat_id):
+        """Aktywny rabat z cache (TTL) - invalidate_rabat() po każdej zmianie definicji"""
+        now = time.monotonic()
+        cached = self._rabaty.get(rabat_id)
+        if cached and cached[0] > now:
+            return dict(cached[1]) if cached[1] else None
+
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            row = conn.execute("SELECT * FROM rabaty WHERE id = ? AND aktywny = 1", (rabat_id,)).fetchone()
+        finally:
+            conn.close()
+        rabat = dict(row) if row else None
+        self._rabaty[rabat_id] = (now + RABAT_CACHE_TTL, rabat)
+        return dict(rabat) if rabat else None
+
+    def invalidate_rabat(self, rabat_id=None):
+        if rabat_id is None:
+            self._rabaty.clear()
+        else:
+            self._rabaty.pop(int(rabat_id), None)
+
+    # ------------------------------------------------------------- odbudowa i start
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return True
+        with self._load_lock:
+            if self._loaded:
+                return True
+            if not self.rebuild(drop_triggers=True):
+                return False
+            self._loaded = True
+            self._start_thread()
+            return True
+
+    def rebuild(self, drop_triggers=False):
+        """Odbudowuje liczniki bieżącego miesiąca z rabaty_uzycie i oznacza je do zapisu"""
+        conn = get_db_connection()
+        if not conn:
+            return False
+        day, month = current_periods()
+        try:
+            with self._sync_lock:
+                if drop_triggers:
+                    # Tabele limitów utrzymuje od teraz silnik - trigger liczyłby użycie drugi raz
+                    for trigger in LIMIT_TRIGGERS:
+                        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                    conn.execute(USAGE_INDEX)
+                    conn.commit()
+
+                max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM rabaty_uzycie").fetchone()[0]
+                rows = conn.execute("""
+                    SELECT rabat_id, COALESCE(user_id, '') AS user_id, dzien, miesiac_rok,
+                           SUM(kwota_rabatu) AS kwota, COUNT(*) AS ilosc
+                    FROM rabaty_uzycie
+                    WHERE miesiac_rok >= ? AND id <= ?
+                    GROUP BY rabat_id, COALESCE(user_id, ''), dzien, miesiac_rok
+                """, (month, max_id)).fetchall()
+
+                daily, monthly = {}, {}
+                for row in rows:
+                    day_key = (row['rabat_id'], row['user_id'], row['dzien'])
+                    month_key = (row['rabat_id'], row['user_id'], row['miesiac_rok'])
+                    counter = daily.setdefault(day_key, [0.0, 0])
+                    counter[0] += row['kwota'] or 0
+                    counter[1] += row['ilosc']
+                    counter = monthly.setdefault(month_key, [0.0, 0])
+                    counter[0] += row['kwota'] or 0
+                    counter[1] += row['ilosc']
+
+                with self._lock:
+                    # Klucze bieżącego miesiąca, które znikły (usunięte użycia), zapisujemy jako zera
+                    stale_daily = {k for k in self._daily if k[2][:7] >= month and k not in daily}
+                    stale_monthly = {k for k in self._monthly if k[2] >= month and k not in monthly}
+                    for key in stale_daily:
+                        daily[key] = [0.0, 0]
+                    for key in stale_monthly:
+                        monthly[key] = [0.0, 0]
+                    self._daily = daily
+                    self._monthly = monthly
+                    self._dirty_daily = set(daily)
+                    self._dirty_monthly = set(monthly)
+                    self._own_ids.clear()
+                    self._last_id = max_id
+                    self._rebuild_requested = False
+                    self._last_rebuild = time.monotonic()
+
+            logger.debug("Liczniki limitów rabatów odbudowane: %s dziennych, %s miesięcznych", len(daily), len(monthly))
+            self.flush()
+            self._prune(day, month)
+            return True
+        except Exception as e:
+            logger.error("Błąd odbudowy liczników limitów rabatów: %s", e)
+            return False
+        finally:
+            conn.close()
+
+    def request_rebuild(self):
+        """Oznacz liczniki do odbudowy w najbliższym cyklu (np. po hurtowym usunięciu użyć)"""
+        self._rebuild_requested = True
+
+    def _prune(self, day, month):
+        """Usuń z pamięci zapisane liczniki minionych dni i miesięcy"""
+        with self._lock:
+            for key in [k for k in self._daily if k[2] < day and k not in self._dirty_daily]:
+                del self._daily[key]
+            for key in [k for k in self._monthly if k[2] < month and k not in self._dirty_monthly]:
+                del self._monthly[key]
+
+    # ----------------------------------------------------------------- sprawdzanie
+
+    def usage(self, rabat_id, user_id):
+        """Wykorzystanie (kwota, ilość) dziś i w bieżącym miesiącu - bez dostępu do bazy"""
+        self.ensure_loaded()
+        day, month = current_periods()
+        user_id = user_id or ''
+        with self._lock:
+            used_day = tuple(self._daily.get((rabat_id, user_id, day), (0.0, 0)))
+            used_month = tuple(self._monthly.get((rabat_id, user_id, month), (0.0, 0)))
+        return used_day, used_month
+
+    def check(self, rabat, user_id):
+        """Komunikat przekroczonego limitu lub None (bez rezerwacji)"""
+        used_day, used_month = self.usage(rabat['id'], user_id)
+        return _limit_error(rabat, used_day, used_month)
+
+    def _apply(self, rabat_id, user_id, day, month, amount, count):
+        """Zmiana liczników - wywoływać pod self._lock"""
+        day_key = (rabat_id, user_id, day)
+        month_key = (rabat_id, user_id, month)
+        counter = self._daily.setdefault(day_key, [0.0, 0])
+        counter[0] += amount
+        counter[1] += count
+        counter = self._monthly.setdefault(month_key, [0.0, 0])
+        counter[0] += amount
+        counter[1] += count
+        self._dirty_daily.add(day_key)
+        self._dirty_monthly.add(month_key)
+
+    def record_usage(self, rabat, user_id, usage):
+        """
+        Sprawdź limity i zapisz użycie (usage: kolumny USAGE_COLUMNS tabeli rabaty_uzycie).
+        Liczniki w pamięci odrzucają przekroczenia bez dostępu do bazy; o zapisie decyduje suma
+        użyć liczona w transakcji INSERT-u. Zwraca (id użycia, None), (None, komunikat limitu)
+        albo (None, None) gdy zapis się nie powiódł.
+        """
+        self.ensure_loaded()
+        rabat_id = rabat['id']
+        user_id = user_id or ''
+        day, month = current_periods()
+
+        error = self.check(rabat, user_id)
+        if error:
+            return None, error
+
+        conn = get_db_connection()
+        if not conn:
+            return None, None
+        conn.isolation_level = None
+        try:
+            # _sync_lock: doczytywanie nie może zobaczyć naszego id, zanim trafi do _own_ids
+            with self._sync_lock:
+                uzycie_id, error = self._insert_usage(conn, rabat, user_id, usage, day, month)
+                if uzycie_id:
+                    with self._lock:
+                        self._apply(rabat_id, user_id, day, month, float(usage.get('kwota_rabatu') or 0), 1)
+                        self._own_ids.add(uzycie_id)
+        except Exception as e:
+            logger.error("Błąd zapisu użycia rabatu %s: %s", rabat_id, e)
+            return None, None
+        finally:
+            conn.close()
+
+        if error:
+            # Limit wykorzystany przez inny proces - doczytaj jego użycia do liczników
+            self.catch_up()
+        return uzycie_id, error
+
+    @retry_on_locked
+    def _insert_usage(self, conn, rabat, user_id, usage, day, month):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            if _has_limits(rabat):
+                row = cursor.execute("""
+                    SELECT COALESCE(SUM(CASE WHEN dzien = :day THEN kwota_rabatu END), 0),
+                           COUNT(CASE WHEN dzien = :day THEN 1 END),
+                           COALESCE(SUM(kwota_rabatu), 0),
+                           COUNT(*)
+                    FROM rabaty_uzycie
+                    WHERE rabat_id = :rabat_id AND miesiac_rok = :month AND COALESCE(user_id, '') = :user_id
+                """, {'rabat_id': rabat['id'], 'user_id': user_id, 'day': day, 'month': month}).fetchone()
+                error = _limit_error(rabat, (row[0], row[1]), (row[2], row[3]))
+                if error:
+                    cursor.execute("ROLLBACK")
+                    return None, error
+
+            cursor.execute(f"""
+                INSERT INTO rabaty_uzycie (rabat_id, dzien, miesiac_rok, {', '.join(USAGE_COLUMNS)})
+                VALUES (?, ?, ?, {', '.join('?' * len(USAGE_COLUMNS))})
+            """, [rabat['id'], day, month] + [usage.get(column) for column in USAGE_COLUMNS])
+            uzycie_id = cursor.lastrowid
+            cursor.execute("COMMIT")
+            return uzycie_id, None
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def release(self, usage_row):
+        """Zwolnij limit po usunięciu użycia (wiersz rabaty_uzycie: rabat_id, user_id, kwota_rabatu, dzien, miesiac_rok)"""
+        if not self._loaded:
+            return
+        rabat_id, user_id = usage_row['rabat_id'], usage_row.get('user_id') or ''
+        day_key = (rabat_id, user_id, usage_row['dzien'])
+        month_key = (rabat_id, user_id, usage_row['miesiac_rok'])
+        with self._lock:
+            if day_key in self._daily and month_key in self._monthly:
+                self._apply(rabat_id, user_id, usage_row['dzien'], usage_row['miesiac_rok'],
+                            -(usage_row['kwota_rabatu'] or 0), -1)
+                return
+        # Licznik spoza pamięci (np. miniony dzień) - przelicz z rabaty_uzycie
+        self.request_rebuild()
+
+    # ---------------------------------------------------------- synchronizacja w tle
+
+    def catch_up(self):
+        """Doczytaj użycia zapisane przez inne procesy (id > ostatnio widziane)"""
+        conn = get_db_connection()
+        if not conn:
+            return 0
+        try:
+            with self._sync_lock:
+                rows = conn.execute("""
+                    SELECT id, rabat_id, COALESCE(user_id, '') AS user_id, kwota_rabatu, dzien, miesiac_rok
+                    FROM rabaty_uzycie WHERE id > ? ORDER BY id
+                """, (self._last_id,)).fetchall()
+                applied = 0
+                with self._lock:
+                    for row in rows:
+                        if row['id'] in self._own_ids:
+                            self._own_ids.discard(row['id'])
+                        else:
+                            self._apply(row['rabat_id'], row['user_id'], row['dzien'], row['miesiac_rok'],
+                                        row['kwota_rabatu'] or 0, 1)
+                            applied += 1
+                    if rows:
+                        self._last_id = rows[-1]['id']
+                    # Własne id poniżej ostatniego widzianego zostały usunięte, zanim je doczytano
+                    self._own_ids = {i for i in self._own_ids if i > self._last_id}
+                return applied
+        finally:
+            conn.close()
+
+    @retry_on_locked
+    def _write_counters(self, conn, daily, monthly):
+        try:
+            conn.executemany("""
+                INSERT INTO rabaty_limity_dzienne (rabat_id, user_id, dzien, wykorzystana_kwota, wykorzystana_ilosc, updated_at)
+                VALUES (?, ?, ?, ?, ?, datetime('now'))
+                ON CONFLICT(rabat_id, user_id, dzien) DO UPDATE SET
+                    wykorzystana_kwota = excluded.wykorzystana_kwota,
+                    wykorzystana_ilosc = excluded.wykorzystana_ilosc,
+                    updated_at = excluded.updated_at
+            """, daily)
+            conn.executemany("""
+                INSERT INTO rabaty_limity_miesieczne (rabat_id, user_id, miesiac_rok, wykorzystana_kwota, wykorzystana_ilosc, updated_at)
+                VALUES (?, ?, ?, ?, ?, datetime('now'))
+                ON CONFLICT(rabat_id, user_id, miesiac_rok) DO UPDATE SET
+                    wykorzystana_kwota = excluded.wykorzystana_kwota,
+                    wykorzystana_ilosc = excluded.wykorzystana_ilosc,
+                    updated_at = excluded.updated_at
+            """, monthly)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def flush(self):
+        """Zapisz zmienione liczniki partią (wartości bezwzględne - zapis jest idempotentny)"""
+        with self._lock:
+            if not self._dirty_daily and not self._dirty_monthly:
+                return 0
+            daily = [(k[0], k[1], k[2], max(round(self._daily[k][0], 2), 0), max(self._daily[k][1], 0))
+                     for k in self._dirty_daily if k in self._daily]
+            monthly = [(k[0], k[1], k[2], max(round(self._monthly[k][0], 2), 0), max(self._monthly[k][1], 0))
+                       for k in self._dirty_monthly if k in self._monthly]
+            dirty_daily, dirty_monthly = self._dirty_daily, self._dirty_monthly
+            self._dirty_daily, self._dirty_monthly = set(), set()
+
+        conn = get_db_connection()
+        try:
+            if not conn:
+                raise RuntimeError("brak połączenia z bazą")
+            self._write_counters(conn, daily, monthly)
+        except Exception as e:
+            with self._lock:
+                self._dirty_daily |= dirty_daily
+                self._dirty_monthly |= dirty_monthly
+            logger.warning("Nie zapisano liczników limitów rabatów (ponowię): %s", e)
+            return 0
+        finally:
+            if conn:
+                conn.close()
+
+        self._last_flush = datetime.now().isoformat(timespec='seconds')
+        self._flushed_rows += len(daily) + len(monthly)
+        return len(daily) + len(monthly)
+
+    def sync(self):
+        """Jeden cykl: odbudowa (gdy zlecona/okresowa) albo doczytanie cudzych użyć, potem zapis"""
+        if self._rebuild_requested or time.monotonic() - self._last_rebuild > REBUILD_INTERVAL:
+            self.rebuild()
+            return
+        self.catch_up()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(FLUSH_INTERVAL):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error("Błąd synchronizacji liczników limitów rabatów: %s", e)
+
+    def _start_thread(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='discount-limits', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """Zatrzymaj wątek i zapisz niezapisane liczniki"""
+        self._stop.set()
+        if self._loaded:
+            self.flush()
+
+    def status(self):
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'daily_counters': len(self._daily),
+                'monthly_counters': len(self._monthly),
+                'pending_flush': len(self._dirty_daily) + len(self._dirty_monthly),
+                'last_usage_id': self._last_id,
+                'last_flush': self._last_flush,
+                'flushed_rows': self._flushed_rows,
+                'flush_interval_seconds': FLUSH_INTERVAL,
+                'rebuild_interval_seconds': REBUILD_INTERVAL
+            }
+
+
+# Globalna instancja
+discount_limits = DiscountLimitEngine()
+atexit.register(discount_limits.shutdown)
@@ -0,0 +1,247 @@
+"""
+Monitor dat ważności partii (product_batches)
+Zadanie dzienne (scheduler, tuż po północy) dzieli aktywne partie na przedziały ważności:
+przeterminowane, do 7 dni, 8-30 dni i 31-90 dni. Wynik trafia do dwóch tabel:
+- batch_expiry_summary - per magazyn i przedział: liczba partii i produktów, ilość oraz
+  wartość zagrożona (po cenie zakupu partii),
+- batch_expiry_alerts - partie z przedziałów, posortowane po dacie ważności w magazynie.
+Raporty alertów i pulpity czytają gotowe wiersze zamiast skanować partie. Przeliczenie
+jest ważne na dany dzień; pierwszy odczyt po zmianie daty (np. gdy scheduler nie działa)
+przelicza je sam.
+"""
+
+from datetime import date, datetime
+
+from utils.database import get_db_connection
+
+# (przedział, od dnia, do dnia) - dni do końca ważności; przedziały rozłączne
+BUCKETS = (
+    ('expired', None, -1),
+    ('7_days', 0, 7),
+    ('30_days', 8, 30),
+    ('90_days', 31, 90),
+)
+HORIZON_DAYS = BUCKETS[-1][2]
+
+# Progi raportu alertów (narastająco, jak dotychczas w /fifo/reports/expiry-alert)
+ALERT_LEVELS = (
+    ('expired', ('expired',)),
+    ('expiring_7_days', ('7_days',)),
+    ('expiring_30_days', ('7_days', '30_days')),
+    ('expiring_90_days', ('7_days', '30_days', '90_days')),
+)
+
+
+class ExpiryMonitor:
+
+    def ensure_tables(self, cursor):
+        """Utwórz tabele podsumowania i alertów jeśli nie istnieją"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS batch_expiry_summary (
+                warehouse_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                batches INTEGER NOT NULL DEFAULT 0,
+                products INTEGER NOT NULL DEFAULT 0,
+                quantity REAL NOT NULL DEFAULT 0,
+                value_net REAL NOT NULL DEFAULT 0,
+                value_gross REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (warehouse_id, bucket)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS batch_expiry_alerts (
+                warehouse_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                expiry_date TEXT NOT NULL,
+                batch_id INTEGER NOT NULL,
+                batch_number TEXT,
+                product_id INTEGER NOT NULL,
+                product_name TEXT,
+                current_quantity REAL NOT NULL,
+                reserved_quantity REAL NOT NULL,
+                value_net REAL NOT NULL,
+                days_to_expiry INTEGER NOT NULL,
+                PRIMARY KEY (warehouse_id, bucket, expiry_date, batch_id)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS batch_expiry_runs (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                computed_for TEXT NOT NULL,
+                computed_at TEXT NOT NULL,
+                batches INTEGER NOT NULL DEFAULT 0,
+                duration_ms REAL
+            )
+        """)
+
+    def run(self, today=None):
+        """
+        Przelicza przedziały ważności na dzień `today` (domyślnie dziś) w jednej transakcji
+        """
+        started = datetime.now()
+        today = (today or date.today()).isoformat()
+
+        conn = get_db_connection()
+        if not conn:
+            return {'success': False, 'error': 'Brak połączenia z bazą danych'}
+        try:
+            cursor = conn.cursor()
+            self.ensure_tables(cursor)
+            cursor.execute("DELETE FROM batch_expiry_alerts")
+            cursor.execute("DELETE FROM batch_expiry_summary")
+
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_batches'")
+            if cursor.fetchone():
+                bucket_case = " ".join(
+                    f"WHEN days <= {upper} THEN '{name}'" for name, _, upper in BUCKETS
+                )
+                # Zakres po indeksie idx_product_batches_expiry_active (aktywne partie z datą ważności)
+                cursor.execute(f"""
+                    INSERT INTO batch_expiry_alerts
+                    (warehouse_id, bucket, expiry_date, batch_id, batch_number, product_id, product_name,
+                     current_quantity, reserved_quantity, value_net, days_to_expiry)
+                    SELECT warehouse_id, CASE {bucket_case} END, expiry_date, id, batch_number, product_id,
+                           product_name, current_quantity, reserved_quantity, value_net, days
+                    FROM (
+                        SELECT pb.*, p.nazwa AS product_name,
+                               ROUND(pb.current_quantity * pb.purchase_price_net, 2) AS value_net,
+                               CAST(julianday(substr(pb.expiry_date, 1, 10)) - julianday(?) AS INTEGER) AS days
+                        FROM product_batches pb
+                        LEFT JOIN produkty p ON p.id = pb.product_id
+                        WHERE pb.status = 'active' AND pb.current_quantity > 0 AND pb.expiry_date IS NOT NULL
+                          AND pb.expiry_date < date(?, '+{HORIZON_DAYS + 1} days')
+                    )
+                """, (today, today))
+                cursor.execute("""
+                    INSERT INTO batch_expiry_summary
+                    (warehouse_id, bucket, batches, products, quantity, value_net, value_gross)
+                    SELECT a.warehouse_id, a.bucket, COUNT(*), COUNT(DISTINCT a.product_id),
+                           SUM(a.current_quantity), ROUND(SUM(a.value_net), 2),
+                           ROUND(SUM(a.current_quantity * pb.purchase_price_gross), 2)
+                    FROM batch_expiry_alerts a
+                    JOIN product_batches pb ON pb.id = a.batch_id
+                    GROUP BY a.warehouse_id, a.bucket
+                """)
+
+            cursor.execute("SELECT COUNT(*) FROM batch_expiry_alerts")
+            batches = cursor.fetchone()[0]
+            duration_ms = round((datetime.now() - started).total_seconds() * 1000, 1)
+            computed_at = started.isoformat()
+            cursor.execute("""
+                INSERT INTO batch_expiry_runs (id, computed_for, computed_at, batches, duration_ms)
+                VALUES (1, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET computed_for = excluded.computed_for,
+                    computed_at = excluded.computed_at, batches = excluded.batches,
+                    duration_ms = excluded.duration_ms
+            """, (today, computed_at, batches, duration_ms))
+            conn.commit()
+
+            return {
+                'success': True,
+                'computed_for': today,
+                'batches': batches,
+                'duration_ms': duration_ms,
+                'computed_at': computed_at
+            }
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Błąd przeliczania dat ważności: {e}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            conn.close()
+
+    def _current_run(self, conn):
+        """Przeliczenie na dziś - jeśli brak albo z poprzedniego dnia, liczy je teraz"""
+        try:
+            row = conn.execute("SELECT computed_for, computed_at FROM batch_expiry_runs WHERE id = 1").fetchone()
+        except Exception:
+            row = None
+        if row and row['computed_for'] == date.today().isoformat():
+            return dict(row)
+        result = self.run()
+        if not result.get('success'):
+            raise RuntimeError(result.get('error'))
+        return {'computed_for': result['computed_for'], 'computed_at': result['computed_at']}
+
+    def summary(self, warehouse_id=None):
+        """Przedziały ważności z wartością zagrożoną - per magazyn i łącznie"""
+        conn = get_db_connection()
+        try:
+            run = self._current_run(conn)
+            where, params = '', []
+            if warehouse_id:
+                where, params = 'WHERE s.warehouse_id = ?', [int(warehouse_id)]
+            rows = [dict(row) for row in conn.execute(f"""
+                SELECT s.*, w.nazwa AS warehouse_name
+                FROM batch_expiry_summary s
+                LEFT JOIN warehouses w ON w.id = s.warehouse_id
+                {where}
+                ORDER BY s.warehouse_id
+            """, params)]
+        finally:
+            conn.close()
+
+        empty = {'batches': 0, 'products': 0, 'quantity': 0, 'value_net': 0, 'value_gross': 0}
+        totals = {name: dict(empty) for name, _, _ in BUCKETS}
+        warehouses = {}
+        for row in rows:
+            entry = warehouses.setdefault(row['warehouse_id'], {
+                'warehouse_id': row['warehouse_id'],
+                'warehouse_name': row['warehouse_name'],
+                'buckets': {name: dict(empty) for name, _, _ in BUCKETS}
+            })
+            entry['buckets'][row['bucket']] = {key: row[key] for key in empty}
+            for key in empty:
+                totals[row['bucket']][key] += row[key]
+        for bucket in totals.values():
+            bucket['value_net'] = round(bucket['value_net'], 2)
+            bucket['value_gross'] = round(bucket['value_gross'], 2)
+
+        return {
+            'warehouse_id': warehouse_id,
+            'buckets': totals,
+            'value_at_risk_net': round(sum(b['value_net'] for b in totals.values()), 2),
+            'warehouses': list(warehouses.values()),
+            'computed_for': run['computed_for'],
+            'computed_at': run['computed_at']
+        }
+
+    def alerts(self, warehouse_id=None, limit=200):
+        """
+        Raport alertów: partie per próg (narastająco) z gotowej tabeli, najbliższa data ważności
+        pierwsza; liczności z podsumowania
+        """
+        conn = get_db_connection()
+        try:
+            run = self._current_run(conn)
+            warehouse_filter, params = '', []
+            if warehouse_id:
+                warehouse_filter, params = 'AND warehouse_id = ?', [int(warehouse_id)]
+            counts = {row['bucket']: row['batches'] for row in conn.execute(f"""
+                SELECT bucket, SUM(batches) AS batches FROM batch_expiry_summary
+                WHERE 1 = 1 {warehouse_filter} GROUP BY bucket
+            """, params)}
+            levels = {}
+            for level, buckets in ALERT_LEVELS:
+                levels[level] = [dict(row) for row in conn.execute(f"""
+                    SELECT batch_id AS id, batch_number, product_id, product_name, warehouse_id, expiry_date,
+                           current_quantity, reserved_quantity, value_net, days_to_expiry
+                    FROM batch_expiry_alerts
+                    WHERE bucket IN ({','.join('?' * len(buckets))}) {warehouse_filter}
+                    ORDER BY expiry_date, batch_id
+                    LIMIT ?
+                """, list(buckets) + params + [int(limit)])]
+        finally:
+            conn.close()
+
+        statistics = {f"total_{level}": sum(counts.get(b, 0) for b in buckets) for level, buckets in ALERT_LEVELS}
+        return {
+            'alerts': levels,
+            'statistics': statistics,
+            'computed_for': run['computed_for'],
+            'computed_at': run['computed_at']
+        }
+
+
+# Globalna instancja
+expiry_monitor = ExpiryMonitor()
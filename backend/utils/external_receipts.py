@@ -0,0 +1,269 @@
+"""
+Księgowanie PZ (przyjęcie zewnętrzne) z faktury zakupu jako potok zbiorowy w jednej transakcji
+1. pozycje faktury (zmapowane na produkty) trafiają do tabeli tymczasowej pz_lines,
+2. pozycje PZ, ruchy 'pz' w księdze magazynowej (jeden na produkt) i wpisy warehouse_history
+   powstają poleceniami INSERT ... SELECT z pz_lines,
+3. braki magazynowe produktów z dostawy rozlicza utils.stock_shortages (jeden przebieg, od
+   najstarszego) w tej samej transakcji,
+4. ruchoma średnia ceny zakupu (utils.moving_average) ujmuje pozycje faktury przed ruchem
+   w księdze - stan przed dostawą to bieżący stock_on_hand.
+Czas każdej fazy jest zwracany w podsumowaniu.
+
+Benchmark (na kopii katalogu backend - baza produkcyjna nie jest modyfikowana):
+
+    cd backend && python -m utils.external_receipts --lines 5000
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from utils.database import get_db_connection, retry_on_locked
+from utils.moving_average import moving_average
+from utils.stock_ledger import stock_ledger
+from utils.stock_shortages import stock_shortages
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptError(ValueError):
+    """Faktura nie nadaje się do PZ (brak faktury, PZ już wygenerowane)"""
+
+
+class ExternalReceiptService:
+
+    def _connect(self):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        # Transakcje otwierane ręcznie (BEGIN IMMEDIATE)
+        conn.isolation_level = None
+        return conn
+
+    @retry_on_locked
+    def _generate(self, conn, invoice_id, warehouse_id, location_id):
+        cursor = conn.cursor()
+        timings = {}
+
+        def lap(phase, started):
+            timings[phase] = round((time.perf_counter() - started) * 1000, 2)
+            return time.perf_counter()
+
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT id FROM warehouse_receipts WHERE source_invoice_id = ? AND type = 'external'",
+                           (invoice_id,))
+            if cursor.fetchone():
+                raise ReceiptError("PZ dla tej faktury już zostało wygenerowane")
+
+            cursor.execute("SELECT * FROM faktury_zakupowe WHERE id = ?", (invoice_id,))
+            invoice = cursor.fetchone()
+            if not invoice:
+                raise ReceiptError("Nie znaleziono faktury zakupowej")
+
+            now = datetime.now().isoformat()
+            document_number = f"PZ-{invoice_id}-{datetime.now().strftime('%Y%m%d')}"
+            reason = f"PZ na podstawie faktury {invoice['numer_faktury']}"
+            cursor.execute("""
+                INSERT INTO warehouse_receipts
+                (type, source_invoice_id, document_number, supplier_name, receipt_date, total_amount, status, created_at, location_id)
+                VALUES ('external', ?, ?, ?, ?, ?, 'completed', ?, ?)
+            """, (invoice_id, document_number, invoice['dostawca_nazwa'], now, invoice['suma_brutto'], now, location_id))
+            receipt_id = cursor.lastrowid
+
+            started = time.perf_counter()
+            cursor.execute("DROP TABLE IF EXISTS temp.pz_lines")
+            cursor.execute("""
+                CREATE TEMP TABLE pz_lines AS
+                SELECT id AS line_id, produkt_id AS product_id, ilosc AS quantity,
+                       cena_netto AS unit_price, wartosc_brutto AS total_price
+                FROM faktury_zakupowe_pozycje
+                WHERE faktura_id = ? AND status_mapowania = 'zmapowany' AND produkt_id IS NOT NULL
+                ORDER BY id
+            """, (invoice_id,))
+            cursor.execute("SELECT COUNT(*), COUNT(DISTINCT product_id) FROM temp.pz_lines")
+            lines, products = cursor.fetchone()
+            # Pominięte są wszystkie pozycje bez produktu w magazynie, także nigdy niezmapowane
+            cursor.execute("SELECT COUNT(*) FROM faktury_zakupowe_pozycje WHERE faktura_id = ?", (invoice_id,))
+            skipped = cursor.fetchone()[0] - lines
+            started = lap('stage', started)
+
+            cursor.execute("""
+                INSERT INTO warehouse_receipt_items (receipt_id, product_id, quantity, unit_price, total_price)
+                SELECT ?, product_id, quantity, unit_price, total_price FROM temp.pz_lines ORDER BY line_id
+            """, (receipt_id,))
+            started = lap('receipt_items', started)
+
+            average = moving_average.apply_invoice(cursor, invoice_id, warehouse_id, location_id)
+            started = lap('moving_average', started)
+
+            # Jeden ruch na produkt - triggery księgi aktualizują stock_on_hand, pos_magazyn i inventory_locations
+            stock_ledger.record_select(cursor, """
+                SELECT product_id, ?, SUM(quantity), 0, 'pz', 'PZ', ?, ?, ?, 'system'
+                FROM temp.pz_lines GROUP BY product_id HAVING SUM(quantity) != 0
+            """, (location_id, receipt_id, document_number, reason))
+            started = lap('stock', started)
+
+            cursor.execute("""
+                INSERT INTO warehouse_history
+                (product_id, operation_type, quantity_change, reason, document_number, reference_id, created_at)
+                SELECT product_id, 'receipt_external', quantity, ?, ?, ?, ? FROM temp.pz_lines ORDER BY line_id
+            """, (reason, document_number, receipt_id, now))
+            started = lap('history', started)
+
+            shortages = stock_shortages.allocate(cursor, invoice_id)
+            lap('shortages', started)
+
+            cursor.execute("DROP TABLE temp.pz_lines")
+            cursor.execute("COMMIT")
+            return {
+                'receipt_id': receipt_id,
+                'document_number': document_number,
+                'location_id': location_id,
+                'processed_items': lines,
+                'products': products,
+                'skipped_unmapped': skipped,
+                'resolved_shortages': shortages['resolved'],
+                'cleared_transactions': shortages['cleared_transactions'],
+                'moving_average_products': average['products'],
+                'timings_ms': timings
+            }
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def generate(self, invoice_id, warehouse_id=5, location_id=None):
+        """
+        PZ z faktury zakupu; stany księgowane w location_id albo w lokalizacji magazynu warehouse_id
+        """
+        location_id = int(location_id or stock_ledger.location_for_warehouse(warehouse_id))
+        stock_shortages.ensure_schema()
+        moving_average.ensure_schema()
+        started = time.perf_counter()
+        conn = self._connect()
+        try:
+            summary = self._generate(conn, invoice_id, warehouse_id, location_id)
+        finally:
+            conn.close()
+        summary['took_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("PZ %s: %s pozycji, %s produktów w %s ms", summary['document_number'],
+                    summary['processed_items'], summary['products'], summary['took_ms'])
+        return summary
+
+
+# ---------------------------------------------------------------------- benchmark
+
+def seed_delivery(lines, shortages, seed=42):
+    """Syntetyczna faktura z `lines` pozycjami (osobne produkty) i brakami dla części z nich"""
+    rnd = random.Random(seed)
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM produkty")
+        first = cursor.fetchone()[0] + 1
+        cursor.executemany("INSERT INTO produkty (id, nazwa, cena) VALUES (?, ?, 1)",
+                           [(first + n, f"Benchmark PZ {n}") for n in range(lines)])
+        cursor.execute("""
+            INSERT INTO faktury_zakupowe (numer_faktury, data_faktury, dostawca_nazwa, suma_brutto)
+            VALUES (?, date('now'), 'Benchmark', 0)
+        """, (f"BENCH-PZ/{lines}/{seed}",))
+        invoice_id = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO faktury_zakupowe_pozycje
+            (faktura_id, nazwa_produktu, ilosc, cena_netto, kwota_vat, wartosc_brutto, lp, produkt_id, status_mapowania)
+            VALUES (?, ?, ?, 1, 0.23, ?, ?, ?, 'zmapowany')
+        """, [(invoice_id, f"Benchmark PZ {n}", q, q * 1.23, n + 1, first + n)
+              for n, q in ((n, rnd.randint(1, 50)) for n in range(lines))])
+        cursor.execute("SELECT id FROM pos_transakcje ORDER BY id DESC LIMIT 1")
+        row = cursor.fetchone()
+        if row and shortages:
+            cursor.executemany("""
+                INSERT INTO pos_stock_shortages
+                (transakcja_id, produkt_id, nazwa_produktu, ilosc_sprzedana, ilosc_dostepna, ilosc_brakujaca)
+                VALUES (?, ?, 'Benchmark', 1, 0, 1)
+            """, [(row[0], first + rnd.randrange(lines)) for _ in range(shortages)])
+        conn.commit()
+        return invoice_id
+    finally:
+        conn.close()
+
+
+def run_benchmark(lines=5000, shortages=500, deliveries=3, seed=42):
+    runs = []
+    for n in range(deliveries):
+        invoice_id = seed_delivery(lines, shortages, seed + n)
+        runs.append(external_receipts.generate(invoice_id, warehouse_id=5))
+    took = sorted(run['took_ms'] for run in runs)
+    return {
+        'lines': lines,
+        'deliveries': deliveries,
+        'took_ms': took,
+        'median_ms': took[len(took) // 2],
+        'per_line_us': round(took[len(took) // 2] * 1000 / max(lines, 1), 1),
+        'phases_ms': runs[-1]['timings_ms'],
+        'resolved_shortages': runs[-1]['resolved_shortages']
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark księgowania PZ z faktury zakupu')
+    parser.add_argument('--lines', type=int, default=5000, help='pozycje na fakturze')
+    parser.add_argument('--shortages', type=int, default=500, help='oczekujące braki dla produktów z dostawy')
+    parser.add_argument('--deliveries', type=int, default=3, help='liczba mierzonych dostaw')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help='wynik jako JSON')
+    parser.add_argument('--in-sandbox', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.in_sandbox:
+        result = run_benchmark(args.lines, args.shortages, args.deliveries, args.seed)
+        with open(args.in_sandbox, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return 0
+
+    from utils.benchmark import BACKEND_DIR, SANDBOX_IGNORE
+
+    temp_dir = tempfile.mkdtemp(prefix='pz_benchmark_')
+    try:
+        sandbox = os.path.join(temp_dir, 'backend')
+        shutil.copytree(BACKEND_DIR, sandbox, ignore=SANDBOX_IGNORE)
+        result_file = os.path.join(temp_dir, 'result.json')
+        forwarded = [arg for arg in (argv if argv is not None else sys.argv[1:])]
+        completed = subprocess.run(
+            [sys.executable, '-m', 'utils.external_receipts', *forwarded, '--in-sandbox', result_file],
+            cwd=sandbox
+        )
+        if completed.returncode != 0 or not os.path.exists(result_file):
+            print(f"❌ Benchmark zakończony błędem (kod {completed.returncode})")
+            return completed.returncode or 1
+        with open(result_file, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"PZ: {result['lines']} pozycji, {result['deliveries']} dostaw")
+        print(f"Czas księgowania: mediana {result['median_ms']} ms ({result['per_line_us']} µs/pozycję), "
+              f"przebiegi {result['took_ms']}")
+        print("Fazy (ostatnia dostawa): " + ", ".join(f"{k} {v} ms" for k, v in result['phases_ms'].items()))
+        print(f"Zamknięte braki: {result['resolved_shortages']}")
+    return 0
+
+
+# Globalna instancja
+external_receipts = ExternalReceiptService()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,492 @@
+"""
+Sesje inwentaryzacji operowane zbiorami wierszy zamiast pętli po produktach
+- otwarcie sesji: jeden INSERT ... SELECT ze stanem systemowym z pos_magazyn danej lokalizacji,
+- liczenie: partie pozycji z kolektorów (po id produktu, EAN lub kodzie) zapisywane jednym
+  executemany z UPSERT-em po UNIQUE(session_id, product_id),
+- zamknięcie: różnice trafiają do księgi ruchów (stock_ledger), inventory_locations i warehouse_history kilkoma
+  poleceniami INSERT/UPDATE ... SELECT w jednej transakcji, z postępem odczytywanym w trakcie.
+Stan zamykania jest w tabeli inventory_finalize_progress (widoczny dla każdego workera i po restarcie):
+'running' zapisywany przed transakcją, wynik 'completed' w tej samej transakcji co korekty, 'failed'
+po jej wycofaniu; bieżąca faza transakcji jest znana tylko workerowi, który ją wykonuje.
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from utils.database import get_db_connection, retry_on_locked
+from utils.stock_ledger import stock_ledger, DEFAULT_LOCATION_ID
+from utils.stock_shortages import stock_shortages
+
+logger = logging.getLogger(__name__)
+
+COUNT_BATCH_MAX = 10000
+LOOKUP_CHUNK = 500
+
+FINALIZE_PHASES = ('differences', 'stock_ledger', 'inventory_locations', 'warehouse_history', 'session')
+FINALIZE_STALE_MINUTES = 10  # 'running' starszy niż to (worker zatrzymany w trakcie) można przejąć
+
+PROGRESS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS inventory_finalize_progress (
+        session_id INTEGER PRIMARY KEY,
+        status TEXT NOT NULL,
+        phase TEXT,
+        changed INTEGER,
+        summary TEXT,
+        error TEXT,
+        started_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+"""
+
+
+class InventorySessionService:
+
+    def __init__(self):
+        self._progress = {}   # session_id -> bieżąca faza zamykania wykonywanego w tym procesie
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        # Transakcje otwierane ręcznie (BEGIN IMMEDIATE)
+        conn.isolation_level = None
+        return conn
+
+    @staticmethod
+    def _warehouse_for_location(cursor, location_id):
+        cursor.execute("SELECT id FROM warehouses WHERE location_id = ? ORDER BY id LIMIT 1", (location_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _session(cursor, session_id):
+        cursor.execute("SELECT id, status, location_id, category_id FROM inventory_sessions WHERE id = ?",
+                       (session_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def active_session(self, location_id=None):
+        """Aktywna sesja lokalizacji (None - dowolna aktywna)"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            if location_id is None:
+                cursor.execute("SELECT id, location_id FROM inventory_sessions WHERE status = 'active' ORDER BY id DESC LIMIT 1")
+            else:
+                cursor.execute("""
+                    SELECT id, location_id FROM inventory_sessions
+                    WHERE status = 'active' AND COALESCE(location_id, ?) = ?
+                    ORDER BY id DESC LIMIT 1
+                """, (DEFAULT_LOCATION_ID, location_id))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------ otwarcie
+
+    @retry_on_locked
+    def _start(self, conn, location_id, category_id):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                SELECT id FROM inventory_sessions
+                WHERE status = 'active' AND COALESCE(location_id, ?) = ?
+            """, (DEFAULT_LOCATION_ID, location_id))
+            if cursor.fetchone():
+                cursor.execute("ROLLBACK")
+                raise ValueError("Istnieje już aktywna inwentaryzacja w tej lokalizacji")
+
+            now = datetime.now().isoformat()
+            cursor.execute("""
+                INSERT INTO inventory_sessions (start_date, category_id, status, created_at, location_id)
+                VALUES (?, ?, 'active', ?, ?)
+            """, (now, category_id, now, location_id))
+            session_id = cursor.lastrowid
+
+            # pos_magazyn ma UNIQUE(produkt_id, lokalizacja), więc złączenie daje najwyżej jeden wiersz na produkt
+            cursor.execute("""
+                INSERT INTO inventory_items (session_id, product_id, system_count)
+                SELECT ?, p.id, COALESCE(sm.stan_aktualny, 0)
+                FROM produkty p
+                LEFT JOIN pos_magazyn sm ON sm.produkt_id = p.id AND sm.lokalizacja = ?
+                WHERE (? IS NULL OR p.category_id = ?)
+            """, (session_id, str(location_id), category_id, category_id))
+            item_count = cursor.rowcount
+            cursor.execute("COMMIT")
+            return session_id, item_count
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def start(self, location_id=None, category_id=None):
+        """Otwiera sesję; ValueError, gdy w lokalizacji trwa już inwentaryzacja"""
+        location_id = int(location_id) if location_id else DEFAULT_LOCATION_ID
+        started = time.perf_counter()
+        conn = self._connect()
+        try:
+            session_id, item_count = self._start(conn, location_id, category_id or None)
+        finally:
+            conn.close()
+        took_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("Inwentaryzacja %s (lokalizacja %s): %s pozycji w %s ms", session_id, location_id, item_count, took_ms)
+        return {'session_id': session_id, 'location_id': location_id, 'items': item_count, 'took_ms': took_ms}
+
+    def session_items(self, session_id):
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT i.product_id, p.nazwa AS product_name, p.kod_produktu AS product_code,
+                       p.ean, p.opis AS description, p.jednostka AS unit,
+                       i.system_count, i.actual_count, i.difference
+                FROM inventory_items i
+                LEFT JOIN produkty p ON p.id = i.product_id
+                WHERE i.session_id = ?
+                ORDER BY p.nazwa
+            """, (session_id,))
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------ liczenie
+
+    @staticmethod
+    def _resolve_codes(cursor, codes):
+        """Kod (EAN lub kod produktu) -> id produktu, zapytaniami po LOOKUP_CHUNK kodów"""
+        resolved = {}
+        codes = list(codes)
+        for start in range(0, len(codes), LOOKUP_CHUNK):
+            chunk = codes[start:start + LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"""
+                SELECT id, ean, kod_produktu FROM produkty
+                WHERE ean IN ({placeholders}) OR kod_produktu IN ({placeholders})
+            """, chunk + chunk)
+            for row in cursor.fetchall():
+                # EAN ma pierwszeństwo przed kodem wewnętrznym
+                if row['kod_produktu'] and row['kod_produktu'] not in resolved:
+                    resolved[row['kod_produktu']] = row['id']
+                if row['ean']:
+                    resolved[row['ean']] = row['id']
+        return resolved
+
+    @retry_on_locked
+    def _submit(self, conn, session_id, rows, add):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            session = self._session(cursor, session_id)
+            if not session or session['status'] != 'active':
+                cursor.execute("ROLLBACK")
+                raise ValueError("Sesja inwentaryzacji nie jest aktywna")
+            location = str(session['location_id'] or DEFAULT_LOCATION_ID)
+
+            cursor.execute("SELECT COUNT(*) FROM inventory_items WHERE session_id = ?", (session_id,))
+            before = cursor.fetchone()[0]
+
+            # Produkty spoza sesji (np. dopisane po jej otwarciu) dostają stan systemowy przy pierwszym skanie
+            new_count = "COALESCE(inventory_items.actual_count, 0) + excluded.actual_count" if add else "excluded.actual_count"
+            cursor.executemany(f"""
+                INSERT INTO inventory_items (session_id, product_id, system_count, actual_count, difference, updated_at)
+                SELECT ?, ?, COALESCE(sm.stan_aktualny, 0), ?, ? - COALESCE(sm.stan_aktualny, 0), CURRENT_TIMESTAMP
+                FROM (SELECT 1) LEFT JOIN pos_magazyn sm ON sm.produkt_id = ? AND sm.lokalizacja = ?
+                WHERE true
+                ON CONFLICT(session_id, product_id) DO UPDATE SET
+                    actual_count = {new_count},
+                    difference = {new_count} - inventory_items.system_count,
+                    updated_at = CURRENT_TIMESTAMP
+            """, [(session_id, product_id, count, count, product_id, location) for product_id, count in rows])
+
+            cursor.execute("SELECT COUNT(*) FROM inventory_items WHERE session_id = ?", (session_id,))
+            added = cursor.fetchone()[0] - before
+            cursor.execute("COMMIT")
+            return added
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def submit_counts(self, session_id, items, mode='set'):
+        """
+        Zapis partii policzonych pozycji: [{product_id | ean | code, actual_count | quantity}]
+        mode='set' nadpisuje ilość, 'add' dolicza (kolejne skany tego samego towaru).
+        Pozycje powtórzone w partii są sumowane przy 'add', przy 'set' wygrywa ostatnia.
+        """
+        if mode not in ('set', 'add'):
+            raise ValueError("mode musi być 'set' lub 'add'")
+        if len(items) > COUNT_BATCH_MAX:
+            raise ValueError(f"Maksymalnie {COUNT_BATCH_MAX} pozycji w partii")
+
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            codes = {str(item.get('ean') or item.get('code')) for item in items
+                     if not item.get('product_id') and (item.get('ean') or item.get('code'))}
+            resolved = self._resolve_codes(cursor, codes) if codes else {}
+
+            counts = {}
+            unknown = []
+            for item in items:
+                product_id = item.get('product_id')
+                if not product_id:
+                    code = item.get('ean') or item.get('code')
+                    product_id = resolved.get(str(code)) if code else None
+                if not product_id:
+                    unknown.append(item)
+                    continue
+                try:
+                    count = float(item.get('actual_count', item.get('quantity', 1)))
+                except (TypeError, ValueError):
+                    unknown.append(item)
+                    continue
+                if mode == 'add':
+                    counts[int(product_id)] = counts.get(int(product_id), 0) + count
+                else:
+                    counts[int(product_id)] = count
+
+            added = self._submit(conn, session_id, list(counts.items()), mode == 'add') if counts else 0
+        finally:
+            conn.close()
+
+        return {
+            'session_id': session_id,
+            'accepted': len(counts),
+            'added_to_session': added,
+            'unknown': unknown
+        }
+
+    # ------------------------------------------------------------------ zamknięcie
+
+    def ensure_schema(self):
+        if self._schema_ready:
+            return
+        conn = get_db_connection()
+        try:
+            conn.execute(PROGRESS_SCHEMA)
+            conn.commit()
+            self._schema_ready = True
+        finally:
+            conn.close()
+
+    def _report(self, session_id, phase, **values):
+        with self._lock:
+            state = self._progress.setdefault(session_id, {})
+            state.update(values)
+            state['phase'] = phase
+            state['updated_at'] = datetime.now().isoformat()
+
+    @retry_on_locked
+    def _claim(self, conn, session_id):
+        """Zapisuje 'running' przed zamknięciem aktywnej sesji; False - zamykanie tej sesji już trwa"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            session = self._session(cursor, session_id)
+            if not session or session['status'] != 'active':
+                cursor.execute("ROLLBACK")
+                raise ValueError("Sesja inwentaryzacji nie jest aktywna")
+            now = datetime.now().isoformat()
+            cursor.execute("""
+                INSERT INTO inventory_finalize_progress (session_id, status, phase, started_at, updated_at)
+                VALUES (?, 'running', 'queued', ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    status = 'running', phase = 'queued', changed = NULL, summary = NULL, error = NULL,
+                    started_at = excluded.started_at, updated_at = excluded.updated_at
+                WHERE status != 'running' OR updated_at < ?
+            """, (session_id, now, now,
+                  (datetime.now() - timedelta(minutes=FINALIZE_STALE_MINUTES)).isoformat()))
+            claimed = cursor.rowcount > 0
+            cursor.execute("COMMIT")
+            return claimed
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    @retry_on_locked
+    def _fail(self, conn, session_id, error):
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            UPDATE inventory_finalize_progress SET status = 'failed', phase = 'failed', error = ?, updated_at = ?
+            WHERE session_id = ?
+        """, (error, datetime.now().isoformat(), session_id))
+        conn.execute("COMMIT")
+
+    def progress(self, session_id):
+        self.ensure_schema()
+        conn = get_db_connection()
+        try:
+            row = conn.execute("SELECT * FROM inventory_finalize_progress WHERE session_id = ?",
+                               (session_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        state = dict(row)
+        state['summary'] = json.loads(state['summary']) if state['summary'] else None
+        if state['status'] == 'running':
+            with self._lock:
+                state.update(self._progress.get(session_id) or {})
+        state['phase_index'] = FINALIZE_PHASES.index(state['phase']) + 1 if state['phase'] in FINALIZE_PHASES else None
+        state['phases'] = len(FINALIZE_PHASES)
+        return state
+
+    @retry_on_locked
+    def _finalize(self, conn, session_id, zero_uncounted, started):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            session = self._session(cursor, session_id)
+            if not session or session['status'] != 'active':
+                cursor.execute("ROLLBACK")
+                raise ValueError("Sesja inwentaryzacji nie jest aktywna")
+            location_id = session['location_id'] or DEFAULT_LOCATION_ID
+            location = str(location_id)
+            warehouse_id = self._warehouse_for_location(cursor, location_id)
+            now = datetime.now().isoformat()
+            document_number = f"INV-{session_id}"
+
+            # Różnice liczone względem stanu w chwili zamknięcia - sprzedaż w trakcie liczenia
+            # nie jest korygowana dwa razy
+            self._report(session_id, 'differences')
+            actual = "COALESCE(i.actual_count, 0)" if zero_uncounted else "i.actual_count"
+            cursor.execute("DROP TABLE IF EXISTS temp.inventory_apply")
+            cursor.execute(f"""
+                CREATE TEMP TABLE inventory_apply AS
+                SELECT i.product_id, {actual} AS actual_count,
+                       COALESCE(sm.stan_aktualny, 0) AS stock_before
+                FROM inventory_items i
+                LEFT JOIN pos_magazyn sm ON sm.produkt_id = i.product_id AND sm.lokalizacja = ?
+                WHERE i.session_id = ? AND {actual} IS NOT NULL
+                  AND {actual} != COALESCE(sm.stan_aktualny, 0)
+            """, (location, session_id))
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(actual_count > stock_before), 0) FROM temp.inventory_apply")
+            changed, increases = cursor.fetchone()
+            self._report(session_id, 'differences', changed=changed)
+
+            cursor.execute(f"""
+                UPDATE inventory_items AS i SET difference = {actual} - i.system_count, updated_at = CURRENT_TIMESTAMP
+                WHERE i.session_id = ? AND {actual} IS NOT NULL
+            """, (session_id,))
+            if zero_uncounted:
+                cursor.execute("UPDATE inventory_items SET actual_count = 0 WHERE session_id = ? AND actual_count IS NULL",
+                               (session_id,))
+
+            # Różnice jako ruchy 'inventory' w księdze - trigger dopisuje je do stock_on_hand i pos_magazyn
+            self._report(session_id, 'stock_ledger')
+            stock_ledger.record_select(cursor, """
+                SELECT product_id, ?, actual_count - stock_before, 0, 'inventory', 'INV', ?, ?,
+                       'Korekta inwentaryzacyjna', 'system'
+                FROM temp.inventory_apply
+            """, (location_id, session_id, document_number))
+            # Nadwyżki spisu pokrywają oczekujące braki POS
+            stock_shortages.allocate(cursor)
+
+            self._report(session_id, 'inventory_locations')
+            if warehouse_id:
+                cursor.execute("""
+                    INSERT INTO inventory_locations (product_id, warehouse_id, ilosc_dostepna, ostatnia_aktualizacja)
+                    SELECT product_id, ?, actual_count, CURRENT_TIMESTAMP FROM temp.inventory_apply WHERE true
+                    ON CONFLICT(product_id, warehouse_id) DO UPDATE SET
+                        ilosc_dostepna = excluded.ilosc_dostepna,
+                        ostatnia_aktualizacja = excluded.ostatnia_aktualizacja
+                """, (warehouse_id,))
+
+            self._report(session_id, 'warehouse_history')
+            cursor.execute("""
+                INSERT INTO warehouse_history
+                    (product_id, operation_type, quantity_change, quantity_before, quantity_after,
+                     reason, document_number, reference_id, created_at)
+                SELECT product_id,
+                       CASE WHEN actual_count > stock_before THEN 'inventory_increase' ELSE 'inventory_decrease' END,
+                       actual_count - stock_before, stock_before, actual_count,
+                       'Korekta inwentaryzacyjna - różnica: ' || (actual_count - stock_before),
+                       ?, ?, ?
+                FROM temp.inventory_apply
+            """, (document_number, session_id, now))
+
+            self._report(session_id, 'session')
+            cursor.execute("""
+                UPDATE inventory_sessions SET status = 'completed', end_date = ?, location_id = ?, updated_at = ?
+                WHERE id = ?
+            """, (now, location_id, now, session_id))
+            cursor.execute("DROP TABLE temp.inventory_apply")
+            summary = {
+                'session_id': session_id,
+                'location_id': location_id,
+                'warehouse_id': warehouse_id,
+                'document_number': document_number,
+                'changed': changed,
+                'increases': increases,
+                'decreases': changed - increases,
+                'took_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+            # Wynik zamknięcia w tej samej transakcji co korekty
+            cursor.execute("""
+                UPDATE inventory_finalize_progress
+                SET status = 'completed', phase = 'done', changed = ?, summary = ?, updated_at = ?
+                WHERE session_id = ?
+            """, (changed, json.dumps(summary), datetime.now().isoformat(), session_id))
+            cursor.execute("COMMIT")
+            return summary
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def _begin_finalize(self, session_id):
+        self.ensure_schema()
+        stock_shortages.ensure_schema()
+        conn = self._connect()
+        try:
+            if not self._claim(conn, session_id):
+                raise ValueError("Zamykanie tej inwentaryzacji już trwa")
+        finally:
+            conn.close()
+
+    def _run_finalize(self, session_id, zero_uncounted):
+        started = time.perf_counter()
+        conn = self._connect()
+        try:
+            summary = self._finalize(conn, session_id, zero_uncounted, started)
+        except Exception as e:
+            self._fail(conn, session_id, str(e))
+            raise
+        finally:
+            conn.close()
+            with self._lock:
+                self._progress.pop(session_id, None)
+
+        logger.info("Zamknięto inwentaryzację %s: %s korekt w %s ms", session_id, summary['changed'], summary['took_ms'])
+        return summary
+
+    def finalize(self, session_id, zero_uncounted=False):
+        """
+        Zamyka sesję jedną transakcją; zero_uncounted=True traktuje niepoliczone pozycje jako 0.
+        Stan zamykania jest dostępny przez progress(session_id).
+        """
+        self._begin_finalize(session_id)
+        return self._run_finalize(session_id, zero_uncounted)
+
+    def finalize_async(self, session_id, zero_uncounted=False):
+        """Zamknięcie w wątku w tle - postęp przez progress(session_id) z dowolnego workera"""
+        def run():
+            try:
+                self._run_finalize(session_id, zero_uncounted)
+            except Exception as e:
+                logger.error("Błąd zamykania inwentaryzacji %s: %s", session_id, e)
+
+        self._begin_finalize(session_id)
+        threading.Thread(target=run, name=f'inventory-finalize-{session_id}', daemon=True).start()
+
+
+# Globalna instancja
+inventory_sessions = InventorySessionService()
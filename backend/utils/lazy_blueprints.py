@@ -0,0 +1,348 @@
+"""
+Leniwa rejestracja blueprintów i profil czasu startu aplikacji
+W trybie leniwym (LAZY_BLUEPRINTS=1) reguły URL wszystkich blueprintów są
+rejestrowane od razu z manifestu tras (blueprint_routes.json), ale moduł API
+jest importowany dopiero przy pierwszym żądaniu do jednej z jego tras. Dzięki
+temu start procesu (CGI, serverless, restart workera) nie płaci za import
+reportlab, sterowników fiskalnych czy managerów dotykających bazy.
+Manifest jest odświeżany automatycznie dla modułów, których plik się zmienił.
+
+Profil importów: python -m utils.lazy_blueprints profile
+Budowa manifestu: python -m utils.lazy_blueprints build
+"""
+
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from flask import Flask
+from werkzeug.routing import Rule
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+MANIFEST_PATH = os.path.join(BACKEND_DIR, 'blueprint_routes.json')
+
+# Słowniki aplikacji Flask kluczowane nazwą blueprintu - przenoszone po leniwym imporcie
+BLUEPRINT_HOOKS = [
+    'before_request_funcs',
+    'after_request_funcs',
+    'teardown_request_funcs',
+    'url_value_preprocessors',
+    'url_default_functions',
+    'template_context_processors',
+    'error_handler_spec'
+]
+
+COLD_START_TARGET_MS = int(os.environ.get('COLD_START_TARGET_MS', 150))
+
+
+def module_path(module):
+    return os.path.join(BACKEND_DIR, *module.split('.')) + '.py'
+
+
+def module_signature(module):
+    """(mtime, rozmiar) pliku modułu - zmiana oznacza nieaktualny manifest"""
+    try:
+        stat = os.stat(module_path(module))
+        return [int(stat.st_mtime), stat.st_size]
+    except OSError:
+        return None
+
+
+class DeferredBuilderRule(Rule):
+    """
+    Reguła URL kompilująca funkcję budowania adresu (url_for) dopiero przy pierwszym
+    użyciu. Werkzeug generuje ją przez AST dla każdej reguły przy rejestracji, co przy
+    ~350 trasach jest największym kosztem startu, a większość tras nigdy nie jest budowana.
+    """
+
+    def _compile_builder(self, append_unknown=True):
+        def build(rule, **values):
+            compiled = Rule._compile_builder(rule, append_unknown).__get__(rule, None)
+            setattr(rule, '_build_unknown' if append_unknown else '_build', compiled)
+            return compiled(**values)
+        return build
+
+
+class BlueprintRegistry:
+
+    def __init__(self, blueprints):
+        # (moduł, atrybut blueprintu, url_prefix, etykieta do logów)
+        self.blueprints = blueprints
+        self.app = None
+        self.lazy = False
+        self.load_times = {}  # moduł -> czas importu (ms)
+        self.pending = {}  # moduł -> wpis rejestru (jeszcze nie zaimportowany)
+        self.startup_ms = None
+        self._lock = threading.Lock()
+
+    # ---------- Rejestracja ----------
+
+    def register_all(self, app, lazy=False):
+        """Rejestruje wszystkie blueprinty z rejestru (od razu albo leniwie)"""
+        started = time.time()
+        self.app = app
+        self.lazy = lazy
+        app.blueprint_registry = self
+        if lazy:
+            app.url_rule_class = DeferredBuilderRule
+
+        manifest = self._read_manifest() if lazy else {}
+        manifest_changed = False
+
+        for entry in self.blueprints:
+            module, attribute, url_prefix, label = entry
+            cached = manifest.get(module)
+            if lazy and cached and cached.get('signature') == module_signature(module) \
+                    and cached.get('url_prefix') == url_prefix:
+                self._register_lazy(entry, cached['routes'])
+                continue
+
+            blueprint = self._import_blueprint(entry)
+            if blueprint is None:
+                continue
+            app.register_blueprint(blueprint, url_prefix=url_prefix)
+            print(f"✅ {label} blueprint OK")
+            if lazy:
+                manifest[module] = self._describe(entry, blueprint)
+                manifest_changed = True
+
+        if manifest_changed:
+            self._write_manifest(manifest)
+
+        self.startup_ms = round((time.time() - started) * 1000, 1)
+        if lazy:
+            print(f"✅ Blueprinty zarejestrowane leniwie: {len(self.pending)} modułów do załadowania przy pierwszym żądaniu ({self.startup_ms} ms)")
+
+    def _import_blueprint(self, entry):
+        module, attribute, url_prefix, label = entry
+        started = time.time()
+        try:
+            blueprint = getattr(importlib.import_module(module), attribute)
+        except Exception as e:
+            error_msg = f"❌ Błąd {label} blueprint: {e}"
+            print(error_msg)
+            self.app.blueprint_errors.append(error_msg)
+            return None
+        self.load_times[module] = round((time.time() - started) * 1000, 1)
+        return blueprint
+
+    def _describe(self, entry, blueprint):
+        """Trasy blueprintu odczytane przez rejestrację na tymczasowej aplikacji"""
+        module, attribute, url_prefix, label = entry
+        scratch = Flask(f'manifest_{attribute}')
+        scratch.register_blueprint(blueprint, url_prefix=url_prefix)
+        routes = []
+        for rule in scratch.url_map.iter_rules():
+            if rule.endpoint == 'static':
+                continue
+            routes.append({
+                'rule': rule.rule,
+                'endpoint': rule.endpoint,
+                'methods': sorted(rule.methods or []),
+                'defaults': rule.defaults,
+                'strict_slashes': rule.strict_slashes,
+                # Automatyczna odpowiedź na OPTIONS (CORS preflight) jak przy zwykłej rejestracji
+                'provide_automatic_options': getattr(rule, 'provide_automatic_options', False)
+            })
+        return {
+            'signature': module_signature(module),
+            'url_prefix': url_prefix,
+            'blueprint': blueprint.name,
+            'routes': routes
+        }
+
+    def _register_lazy(self, entry, routes):
+        module = entry[0]
+        self.pending[module] = entry
+        views = {}  # Jeden widok na endpoint - endpoint może mieć kilka reguł URL
+        for route in routes:
+            endpoint = route['endpoint']
+            if endpoint not in views:
+                views[endpoint] = self._lazy_view(module, endpoint)
+            self.app.add_url_rule(
+                route['rule'],
+                endpoint=endpoint,
+                view_func=views[endpoint],
+                methods=route['methods'],
+                defaults=route['defaults'],
+                strict_slashes=route['strict_slashes'],
+                provide_automatic_options=route['provide_automatic_options']
+            )
+
+    def _lazy_view(self, module, endpoint):
+        def view(**kwargs):
+            real_view = self.load(module, endpoint)
+            return real_view(**kwargs)
+        view.__name__ = endpoint.rsplit('.', 1)[-1]
+        view.lazy_module = module
+        return view
+
+    def load(self, module, endpoint=None):
+        """
+        Importuje moduł blueprintu, podmienia leniwe widoki na właściwe
+        i przenosi hooki blueprintu (after_request itd.) do aplikacji
+        """
+        with self._lock:
+            entry = self.pending.get(module)
+            if entry is not None:
+                blueprint = self._import_blueprint(entry)
+                if blueprint is None:
+                    raise RuntimeError(f'Nie udało się załadować modułu {module}')
+
+                scratch = Flask(f'lazy_{entry[1]}')
+                scratch.register_blueprint(blueprint, url_prefix=entry[2])
+                for name, view_func in scratch.view_functions.items():
+                    if name != 'static':
+                        self.app.view_functions[name] = view_func
+                for hook in BLUEPRINT_HOOKS:
+                    for key, value in getattr(scratch, hook).items():
+                        if key is not None:
+                            getattr(self.app, hook)[key] = value
+                self.app.blueprints.setdefault(blueprint.name, blueprint)
+
+                del self.pending[module]
+                print(f"✅ {entry[3]} blueprint załadowany leniwie ({self.load_times[module]} ms)")
+
+        return self.app.view_functions[endpoint] if endpoint else None
+
+    def warm_up(self, background=True):
+        """
+        Ładuje wszystkie oczekujące moduły - dla trwałego procesu (FastCGI/WSGI),
+        który startuje leniwie, a moduły doczytuje w tle zanim przyjdą żądania
+        """
+        def load_all():
+            for module in list(self.pending):
+                try:
+                    self.load(module)
+                except Exception as e:
+                    print(f"❌ Błąd wczytywania {module}: {e}")
+
+        if not background:
+            load_all()
+            return None
+        thread = threading.Thread(target=load_all, name='blueprint-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    # ---------- Manifest ----------
+
+    def _read_manifest(self):
+        try:
+            with open(MANIFEST_PATH, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest):
+        try:
+            temp_path = MANIFEST_PATH + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=1)
+            os.replace(temp_path, MANIFEST_PATH)
+        except OSError as e:
+            # Katalog tylko do odczytu (np. serverless) - tryb leniwy zadziała od następnego builda
+            print(f"⚠️ Nie można zapisać manifestu tras: {e}")
+
+    def build_manifest(self):
+        """Importuje wszystkie moduły i zapisuje pełny manifest tras (krok builda/deployu)"""
+        self.app = Flask('manifest')
+        self.app.blueprint_errors = []
+        manifest = {}
+        for entry in self.blueprints:
+            blueprint = self._import_blueprint(entry)
+            if blueprint is not None:
+                manifest[entry[0]] = self._describe(entry, blueprint)
+        self._write_manifest(manifest)
+        return manifest
+
+    # ---------- Diagnostyka ----------
+
+    def get_status(self):
+        return {
+            'lazy': self.lazy,
+            'startup_ms': self.startup_ms,
+            'cold_start_target_ms': COLD_START_TARGET_MS,
+            'loaded': self.load_times,
+            'pending': sorted(self.pending),
+            'manifest_path': MANIFEST_PATH
+        }
+
+
+def profile_imports(modules, top=10):
+    """
+    Profil czasu importu modułów (python -X importtime w osobnym procesie per moduł),
+    bez kosztu importu samego Flaska. Zwraca listę {module, total_ms, heaviest} od najwolniejszego.
+    """
+    line_pattern = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+    report = []
+    for module in modules:
+        # Flask jest wspólny dla wszystkich modułów - importowany wcześniej, żeby nie zaciemniał wyników
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import flask, flask_cors; import {module}'],
+            cwd=BACKEND_DIR, capture_output=True, text=True
+        )
+        imports = []
+        for line in result.stderr.splitlines():
+            match = line_pattern.match(line)
+            if match:
+                imports.append((match.group(4), int(match.group(2)) / 1000, len(match.group(3))))
+        # importtime wypisuje moduł po całym jego poddrzewie - poddrzewo to linie od
+        # poprzedniego importu na tym samym poziomie do linii modułu
+        index = next((i for i, (name, _, _) in enumerate(imports) if name == module), None)
+        total = imports[index][1] if index is not None else None
+        subtree = []
+        if index is not None:
+            depth = imports[index][2]
+            start = index
+            while start > 0 and imports[start - 1][2] > depth:
+                start -= 1
+            subtree = [(name, ms) for name, ms, d in imports[start:index] if d <= depth + 4]
+        heaviest = sorted(((name, round(ms, 1)) for name, ms in subtree), key=lambda item: -item[1])[:top]
+        report.append({
+            'module': module,
+            'total_ms': round(total, 1) if total is not None else None,
+            'ok': result.returncode == 0,
+            'heaviest': heaviest
+        })
+    report.sort(key=lambda r: -(r['total_ms'] or 0))
+    return report
+
+
+def measure_cold_start(lazy=True):
+    """
+    Zimny start w świeżym procesie: czas `import app` (moduł + create_app) w ms,
+    po wcześniejszym imporcie Flaska - jego koszt jest stały i nie zależy od aplikacji
+    """
+    env = dict(os.environ, LAZY_BLUEPRINTS='1' if lazy else '0')
+    code = ('import flask, flask_cors, time; t = time.time(); import app; '
+            'print("COLD_START_MS", round((time.time() - t) * 1000, 1))')
+    result = subprocess.run([sys.executable, '-c', code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    match = re.search(r'COLD_START_MS ([\d.]+)', result.stdout)
+    return float(match.group(1)) if match else None
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, BACKEND_DIR)
+    from app import BLUEPRINTS
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'profile'
+    if command == 'build':
+        manifest = BlueprintRegistry(BLUEPRINTS).build_manifest()
+        print(f"Manifest tras zapisany: {MANIFEST_PATH} ({sum(len(m['routes']) for m in manifest.values())} tras)")
+    elif command == 'profile':
+        print('Czas importu modułów API (od najwolniejszego):')
+        for row in profile_imports(sorted({entry[0] for entry in BLUEPRINTS})):
+            heaviest = ', '.join(f'{name} {ms}ms' for name, ms in row['heaviest'][:4])
+            print(f"  {row['module']:<32} {row['total_ms'] or 0:>8.1f} ms  {heaviest}")
+        eager = measure_cold_start(lazy=False)
+        lazy = measure_cold_start(lazy=True)
+        print(f'Zimny start: eager {eager} ms, lazy {lazy} ms (cel: {COLD_START_TARGET_MS} ms)')
+        sys.exit(0 if lazy is not None and lazy <= COLD_START_TARGET_MS else 1)
+    else:
+        print('Użycie: python -m utils.lazy_blueprints [build|profile]')
+        sys.exit(2)
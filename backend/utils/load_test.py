@@ -0,0 +1,234 @@
+"""
+Test obciążeniowy profilu wieloprocesowego - skalowanie przepustowości z liczbą workerów
+Dla każdej liczby workerów uruchamia gunicorna (gunicorn.conf.py), rozgrzewa go,
+a następnie przez zadany czas wysyła żądania z wielu wątków klienta (keep-alive)
+i raportuje przepustowość oraz percentyle czasu odpowiedzi.
+
+    cd backend && python -m utils.load_test --workers 1,2,4 --duration 15 --concurrency 32
+
+Domyślnie serwer działa na kopii katalogu backend w katalogu tymczasowym
+(--no-sandbox wyłącza kopię), więc endpointy zapisujące nie zmieniają bazy produkcyjnej.
+Endpointy: --endpoint "GET:/api/products?limit=50" (można podać wiele razy),
+dla POST: --endpoint 'POST:/api/sciezka:{"pole": 1}'.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+DEFAULT_ENDPOINTS = [
+    'GET:/api/health',
+    'GET:/api/products?limit=50',
+    'GET:/api/products/search?q=a',
+    'GET:/api/pos/stats',
+    'GET:/api/pos/transactions?limit=20'
+]
+
+SANDBOX_IGNORE = shutil.ignore_patterns('__pycache__', 'backup', 'exports', 'static', '.locks', '*.tar.gz')
+
+
+def parse_endpoint(spec):
+    """'METODA:ścieżka[:json]' -> (metoda, ścieżka, body)"""
+    method, _, rest = spec.partition(':')
+    if not rest:
+        method, rest = 'GET', spec
+    path, body = rest, None
+    if method.upper() != 'GET' and ':{' in rest:
+        path, _, body = rest.partition(':')
+    return method.upper(), path, body.encode('utf-8') if body else None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class GunicornServer:
+    """Proces gunicorna z zadaną liczbą workerów uruchomiony z katalogu app_dir"""
+
+    def __init__(self, app_dir, workers, threads, worker_class):
+        self.app_dir = app_dir
+        self.workers = workers
+        self.port = free_port()
+        self.env = dict(os.environ)
+        self.env.update({
+            'WEB_CONCURRENCY': str(workers),
+            'GUNICORN_THREADS': str(threads),
+            'GUNICORN_WORKER': worker_class,
+            'GUNICORN_LOG_LEVEL': 'warning',
+            'GUNICORN_MAX_REQUESTS': '0',
+            'DATABASE_PATH': os.path.join(app_dir, 'kupony.db'),
+            'PYTHONUNBUFFERED': '1'
+        })
+        self.process = None
+        self.log = tempfile.TemporaryFile()
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+             '--bind', f'127.0.0.1:{self.port}', '--access-logfile', os.devnull, 'app:app'],
+            cwd=self.app_dir, env=self.env,
+            stdout=subprocess.DEVNULL, stderr=self.log
+        )
+        self._wait_ready()
+        return self
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+
+    def _wait_ready(self, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                raise RuntimeError(f"gunicorn zakończył się: {self.log.read().decode(errors='replace')[-2000:]}")
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+                conn.request('GET', '/api/health')
+                if conn.getresponse().status == 200:
+                    conn.close()
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("gunicorn nie odpowiada na /api/health")
+
+
+def run_load(port, endpoints, concurrency, duration, warmup):
+    """Zwraca (liczba żądań, błędy, posortowane czasy w ms, czas trwania) dla fazy pomiaru"""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    start_barrier = threading.Barrier(concurrency + 1)
+    timing = {}
+
+    def client(index):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        start_barrier.wait()
+        i = index
+        while True:
+            now = time.perf_counter()
+            if now >= timing['end']:
+                break
+            method, path, body = endpoints[i % len(endpoints)]
+            i += 1
+            headers = {'Content-Type': 'application/json'} if body else {}
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                failed = response.status >= 500
+            except (OSError, http.client.HTTPException):
+                failed = True
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            elapsed = time.perf_counter() - now
+            if now >= timing['measure_from']:
+                latencies[index].append(elapsed * 1000)
+                if failed:
+                    errors[index] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    timing['measure_from'] = started + warmup
+    timing['end'] = started + warmup + duration
+    start_barrier.wait()
+    for thread in threads:
+        thread.join()
+
+    merged = sorted(value for values in latencies for value in values)
+    return len(merged), sum(errors), merged, duration
+
+
+def benchmark(worker_counts, endpoints, concurrency, duration, warmup, threads, worker_class, sandbox):
+    app_dir = BACKEND_DIR
+    temp_dir = None
+    if sandbox:
+        temp_dir = tempfile.mkdtemp(prefix='pos_load_test_')
+        app_dir = os.path.join(temp_dir, 'backend')
+        shutil.copytree(BACKEND_DIR, app_dir, ignore=SANDBOX_IGNORE)
+
+    results = []
+    try:
+        for workers in worker_counts:
+            with GunicornServer(app_dir, workers, threads, worker_class) as server:
+                count, errors, merged, seconds = run_load(server.port, endpoints, concurrency, duration, warmup)
+            results.append({
+                'workers': workers,
+                'requests': count,
+                'errors': errors,
+                'rps': round(count / seconds, 1),
+                'p50_ms': round(percentile(merged, 0.50), 2) if merged else None,
+                'p95_ms': round(percentile(merged, 0.95), 2) if merged else None,
+                'p99_ms': round(percentile(merged, 0.99), 2) if merged else None
+            })
+            print(f"🏁 workers={workers}: {results[-1]['rps']} req/s, p95 {results[-1]['p95_ms']} ms, błędy {errors}")
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    base = results[0]['rps'] if results and results[0]['rps'] else None
+    for result in results:
+        result['speedup'] = round(result['rps'] / base, 2) if base else None
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Test skalowania przepustowości z liczbą workerów gunicorna')
+    parser.add_argument('--workers', default='1,2,4', help='liczby workerów oddzielone przecinkami')
+    parser.add_argument('--threads', type=int, default=4, help='wątki na worker (gthread)')
+    parser.add_argument('--worker-class', default='gthread', choices=['gthread', 'gevent', 'sync'])
+    parser.add_argument('--concurrency', type=int, default=32, help='równoległe połączenia klienta')
+    parser.add_argument('--duration', type=float, default=15, help='czas pomiaru w sekundach')
+    parser.add_argument('--warmup', type=float, default=3, help='rozgrzewka przed pomiarem w sekundach')
+    parser.add_argument('--endpoint', action='append', help='METODA:ścieżka[:json] (domyślnie zestaw odczytów POS)')
+    parser.add_argument('--no-sandbox', action='store_true', help='uruchom na bieżącym katalogu backend i jego bazie')
+    parser.add_argument('--json', action='store_true', help='wynik jako JSON')
+    args = parser.parse_args(argv)
+
+    endpoints = [parse_endpoint(spec) for spec in (args.endpoint or DEFAULT_ENDPOINTS)]
+    worker_counts = [int(value) for value in args.workers.split(',') if value.strip()]
+
+    results = benchmark(
+        worker_counts, endpoints, args.concurrency, args.duration, args.warmup,
+        args.threads, args.worker_class, not args.no_sandbox
+    )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"\n{'workers':>8} {'req/s':>10} {'x':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'błędy':>7}")
+    for r in results:
+        print(f"{r['workers']:>8} {r['rps']:>10} {r['speedup']:>6} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
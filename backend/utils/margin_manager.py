@@ -6,10 +6,14 @@ Inteligentny system zarządzania marżami z uwzględnieniem:
 - Raportowania zmian marż
 """
 
-from utils.database import get_db_connection
+from utils.database import get_db_connection, retry_on_locked
 from datetime import datetime
 import json
 
+import numpy as np
+
+LOOKUP_CHUNK = 300
+
 class SmartMarginManager:
     
     def __init__(self):
@@ -19,71 +23,262 @@ class SmartMarginManager:
     
     def update_product_prices_with_margin_control(self, product_id, new_purchase_netto, new_purchase_brutto, created_by='system'):
         """
-        Główna funkcja aktualizacji cen z kontrolą marż
+        Główna funkcja aktualizacji cen z kontrolą marż (jeden produkt - tryb zbiorczy z jedną pozycją)
+        """
+        result = self.update_prices_with_margin_control_bulk(
+            [(product_id, new_purchase_netto, new_purchase_brutto)], created_by
+        )
+        if not result['success']:
+            return result
+        if not result['products']:
+            return {'success': False, 'error': f'Produkt {product_id} nie istnieje'}
+
+        product = result['products'][0]
+        return {
+            'success': True,
+            'product_id': product_id,
+            'margin_analysis': product['margin_analysis'],
+            'corrections_applied': product['corrections_applied'],
+            'report_id': product['report_id'],
+            'warnings': product['warnings']
+        }
+
+    def update_prices_with_margin_control_bulk(self, updates, created_by='system', cursor=None):
+        """
+        Kontrola marż dla wielu produktów naraz (np. wszystkie pozycje faktury zakupu)
+        updates: [(product_id, nowa_cena_zakupu_netto, nowa_cena_zakupu_brutto)] - przy powtórzeniach
+        produktu obowiązuje ostatnia pozycja
+        Produkty i ceny lokalizacji wczytywane są dwoma zapytaniami, marże i korekty liczone
+        tablicami numpy, a ceny i raporty zapisywane przez executemany w jednej transakcji.
+        cursor - zapis w transakcji wywołującego (bez własnego BEGIN/COMMIT)
         """
+        latest = {}
+        for product_id, netto, brutto in updates:
+            latest[int(product_id)] = (float(netto or 0), float(brutto or 0))
+        if not latest:
+            return {'success': True, 'products': [], 'corrections': 0, 'reports': 0}
+
+        if cursor is not None:
+            self.ensure_tables(cursor)
+            return self._bulk(cursor, latest, created_by)
+
         conn = get_db_connection()
         try:
-            cursor = conn.cursor()
-            
-            # 1. Pobierz obecne dane produktu
-            current_data = self._get_current_product_data(cursor, product_id)
-            if not current_data:
-                return {'success': False, 'error': f'Produkt {product_id} nie istnieje'}
-            
-            # 2. Aktualizuj ceny zakupu
-            self._update_purchase_prices(cursor, product_id, new_purchase_netto, new_purchase_brutto)
-            
-            # 3. Analizuj marże we wszystkich lokalizacjach
-            margin_analysis = self._analyze_margins_all_locations(cursor, product_id, new_purchase_brutto, current_data)
-            
-            # 4. Automatyczne korekty (tylko dla cen domyślnych, NIE dla specjalnych)
-            corrections = self._apply_automatic_corrections(cursor, product_id, new_purchase_brutto, current_data, margin_analysis)
-            
-            # 5. Zapisz raport zmian
-            report_id = self._save_margin_report(cursor, product_id, margin_analysis, corrections, created_by)
-            
+            self.ensure_tables(conn.cursor())
             conn.commit()
-            
-            return {
-                'success': True,
-                'product_id': product_id,
-                'margin_analysis': margin_analysis,
-                'corrections_applied': corrections,
-                'report_id': report_id,
-                'warnings': self._generate_warnings(margin_analysis)
-            }
-            
+            # Transakcja otwierana ręcznie (BEGIN IMMEDIATE)
+            conn.isolation_level = None
+            return self._run_bulk(conn, latest, created_by)
         except Exception as e:
-            conn.rollback()
             return {'success': False, 'error': str(e)}
         finally:
             conn.close()
-    
-    def _get_current_product_data(self, cursor, product_id):
-        """Pobierz obecne dane produktu"""
-        cursor.execute("""
-            SELECT 
-                id, nazwa, stawka_vat,
-                cena_zakupu_netto, cena_zakupu_brutto,
-                cena_sprzedazy_netto, cena_sprzedazy_brutto,
-                marza_procent
-            FROM produkty 
-            WHERE id = ?
-        """, (product_id,))
-        return cursor.fetchone()
-    
-    def _update_purchase_prices(self, cursor, product_id, new_netto, new_brutto):
-        """Aktualizuj ceny zakupu"""
+
+    @retry_on_locked
+    def _run_bulk(self, conn, latest, created_by):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            result = self._bulk(cursor, latest, created_by)
+            cursor.execute("COMMIT")
+            return result
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def ensure_tables(self, cursor):
+        """Tabela raportów marż"""
         cursor.execute("""
-            UPDATE produkty 
-            SET 
+            CREATE TABLE IF NOT EXISTS margin_reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL,
+                report_data TEXT NOT NULL,
+                corrections_applied TEXT,
+                created_by TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (product_id) REFERENCES produkty(id)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_margin_reports_product ON margin_reports(product_id, created_at)")
+
+    @staticmethod
+    def _load_products(cursor, product_ids):
+        """Zapytanie 1: dane produktów (klucze w CTE)"""
+        rows = []
+        for start in range(0, len(product_ids), LOOKUP_CHUNK):
+            chunk = product_ids[start:start + LOOKUP_CHUNK]
+            cursor.execute(f"""
+                WITH keys (product_id) AS (VALUES {','.join(['(?)'] * len(chunk))})
+                SELECT p.id, p.nazwa, COALESCE(p.stawka_vat, 23) AS stawka_vat,
+                       p.cena_sprzedazy_brutto, p.marza_procent
+                FROM keys JOIN produkty p ON p.id = keys.product_id
+            """, chunk)
+            rows.extend(dict(row) for row in cursor.fetchall())
+        return rows
+
+    @staticmethod
+    def _load_location_prices(cursor, product_ids):
+        """Zapytanie 2: aktywne ceny specjalne lokalizacji wszystkich produktów"""
+        rows = []
+        for start in range(0, len(product_ids), LOOKUP_CHUNK):
+            chunk = product_ids[start:start + LOOKUP_CHUNK]
+            cursor.execute(f"""
+                WITH keys (product_id) AS (VALUES {','.join(['(?)'] * len(chunk))})
+                SELECT
+                    lpp.product_id,
+                    lpp.id as price_id,
+                    lpp.location_id,
+                    l.nazwa as location_name,
+                    l.kod_lokalizacji,
+                    lpp.cena_sprzedazy_brutto,
+                    lpp.data_od,
+                    lpp.data_do,
+                    lpp.uwagi,
+                    lpp.created_by
+                FROM keys
+                JOIN location_product_prices lpp ON lpp.product_id = keys.product_id
+                JOIN locations l ON lpp.location_id = l.id
+                WHERE lpp.aktywny = 1
+                    AND (lpp.data_do IS NULL OR lpp.data_do >= date('now'))
+                ORDER BY lpp.product_id, l.nazwa
+            """, chunk)
+            rows.extend(dict(row) for row in cursor.fetchall())
+        return rows
+
+    @staticmethod
+    def _margins(purchase, sale):
+        """Wektorowo to samo co _calculate_margin: 0 bez ceny zakupu, -100 bez ceny sprzedaży"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margin = np.round((sale - purchase) / purchase * 100, 2)
+        return np.where(purchase == 0, 0.0, np.where(sale == 0, -100.0, margin))
+
+    def _bulk(self, cursor, latest, created_by):
+        products = self._load_products(cursor, list(latest))
+        if not products:
+            return {'success': True, 'products': [], 'corrections': 0, 'reports': 0}
+        locations = self._load_location_prices(cursor, [p['id'] for p in products])
+        now = datetime.now().isoformat()
+
+        # Cena domyślna - marże i korekty dla wszystkich produktów naraz
+        ids = np.array([p['id'] for p in products], dtype=np.int64)
+        purchase_netto = np.array([latest[p['id']][0] for p in products], dtype=np.float64)
+        purchase_brutto = np.array([latest[p['id']][1] for p in products], dtype=np.float64)
+        sale_brutto = np.array([p['cena_sprzedazy_brutto'] or 0 for p in products], dtype=np.float64)
+        vat_factor = 1 + np.array([p['stawka_vat'] for p in products], dtype=np.float64) / 100
+
+        default_margin = self._margins(purchase_brutto, sale_brutto)
+        needs_correction = default_margin <= self.MIN_MARGIN_THRESHOLD
+        corrected_netto = np.round(purchase_brutto / vat_factor * (1 + self.DEFAULT_MARGIN / 100), 2)
+        corrected_brutto = np.round(corrected_netto * vat_factor, 2)
+
+        # Ceny specjalne - marże wszystkich wierszy jednym przebiegiem
+        index = {int(product_id): i for i, product_id in enumerate(ids)}
+        owner = np.array([index[row['product_id']] for row in locations], dtype=np.int64)
+        location_sale = np.array([row['cena_sprzedazy_brutto'] or 0 for row in locations], dtype=np.float64)
+        location_margin = self._margins(purchase_brutto[owner], location_sale) if locations else np.zeros(0)
+
+        analyses = [{
+            'default_price': {
+                'sale_price_brutto': products[i]['cena_sprzedazy_brutto'] or 0,
+                'purchase_price_brutto': float(purchase_brutto[i]),
+                'margin_percent': float(default_margin[i]),
+                'needs_correction': bool(needs_correction[i]),
+                'price_type': 'default'
+            },
+            'location_prices': [],
+            'problematic_locations': []
+        } for i in range(len(products))]
+
+        for row, i, margin in zip(locations, owner.tolist(), location_margin.tolist()):
+            analysis = analyses[i]
+            analysis['location_prices'].append({
+                'price_id': row['price_id'],
+                'location_id': row['location_id'],
+                'location_name': row['location_name'],
+                'location_code': row['kod_lokalizacji'],
+                'sale_price_brutto': row['cena_sprzedazy_brutto'],
+                'purchase_price_brutto': float(purchase_brutto[i]),
+                'margin_percent': margin,
+                'needs_attention': margin <= self.MIN_MARGIN_THRESHOLD,
+                'is_promotion': margin < self.PROMOTION_MARGIN_THRESHOLD,
+                'price_type': 'location_special',
+                'valid_from': row['data_od'],
+                'valid_to': row['data_do'],
+                'notes': row['uwagi'],
+                'created_by': row['created_by']
+            })
+            if margin <= self.MIN_MARGIN_THRESHOLD:
+                notes = (row['uwagi'] or '').lower()
+                analysis['problematic_locations'].append({
+                    'location_name': row['location_name'],
+                    'margin': margin,
+                    'is_likely_promotion': 'promocja' in notes or 'przecena' in notes
+                })
+
+        corrections = [[] for _ in products]
+        for i in np.flatnonzero(needs_correction).tolist():
+            corrections[i].append({
+                'type': 'default_price_correction',
+                'old_price_brutto': analyses[i]['default_price']['sale_price_brutto'],
+                'new_price_brutto': float(corrected_brutto[i]),
+                'old_margin': float(default_margin[i]),
+                'new_margin': self.DEFAULT_MARGIN,
+                'reason': f'Marża była {float(default_margin[i])}%, skorygowano na {self.DEFAULT_MARGIN}%'
+            })
+
+        # Zapis: ceny zakupu, korekty cen domyślnych i raporty - executemany
+        cursor.executemany("""
+            UPDATE produkty
+            SET
                 cena_zakupu_netto = ?,
                 cena_zakupu_brutto = ?,
-                cena_zakupu = ?,  -- stara kolumna dla kompatybilności
-                updated_at = ?
+                cena_zakupu = ?,  -- stara kolumna (brutto, jak w api/products.py)
+                data_modyfikacji = ?
             WHERE id = ?
-        """, (new_netto, new_brutto, new_netto, datetime.now().isoformat(), product_id))
-    
+        """, zip(purchase_netto.tolist(), purchase_brutto.tolist(), purchase_brutto.tolist(),
+                 [now] * len(products), ids.tolist()))
+        corrected = np.flatnonzero(needs_correction)
+        cursor.executemany("""
+            UPDATE produkty
+            SET
+                cena_sprzedazy_netto = ?,
+                cena_sprzedazy_brutto = ?,
+                cena = ?,  -- stara kolumna
+                marza_procent = ?,
+                data_modyfikacji = ?
+            WHERE id = ?
+        """, zip(corrected_netto[corrected].tolist(), corrected_brutto[corrected].tolist(),
+                 corrected_brutto[corrected].tolist(), [self.DEFAULT_MARGIN] * len(corrected),
+                 [now] * len(corrected), ids[corrected].tolist()))
+
+        # Identyfikatory raportów: w transakcji zapisu nowe wiersze mają id większe od dotychczasowego maksimum
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM margin_reports")
+        last_report_id = cursor.fetchone()[0]
+        cursor.executemany("""
+            INSERT INTO margin_reports (product_id, report_data, corrections_applied, created_by)
+            VALUES (?, ?, ?, ?)
+        """, [(int(ids[i]), json.dumps(analyses[i], default=str), json.dumps(corrections[i], default=str), created_by)
+              for i in range(len(products))])
+        cursor.execute("SELECT id, product_id FROM margin_reports WHERE id > ? ORDER BY id", (last_report_id,))
+        report_ids = {row[1]: row[0] for row in cursor.fetchall()}
+
+        results = [{
+            'product_id': int(ids[i]),
+            'margin_analysis': analyses[i],
+            'corrections_applied': corrections[i],
+            'report_id': report_ids.get(int(ids[i])),
+            'warnings': self._generate_warnings(analyses[i])
+        } for i in range(len(products))]
+
+        return {
+            'success': True,
+            'products': results,
+            'missing_products': sorted(set(latest) - set(index)),
+            'corrections': int(needs_correction.sum()),
+            'reports': len(report_ids)
+        }
+
     def _analyze_margins_all_locations(self, cursor, product_id, new_purchase_brutto, current_data):
         """
         Analizuj marże we wszystkich lokalizacjach gdzie produkt ma cenę
@@ -172,82 +367,6 @@ class SmartMarginManager:
         
         return round(((sale_price - purchase_price) / purchase_price) * 100, 2)
     
-    def _apply_automatic_corrections(self, cursor, product_id, new_purchase_brutto, current_data, margin_analysis):
-        """
-        Automatyczne korekty - TYLKO dla ceny domyślnej, NIE dla cen specjalnych
-        """
-        corrections = []
-        
-        # Korekta tylko dla ceny domyślnej jeśli marża <= 0%
-        default_analysis = margin_analysis['default_price']
-        
-        if default_analysis['needs_correction']:
-            # Oblicz nową cenę z marżą DEFAULT_MARGIN%
-            new_sale_price_netto = round(new_purchase_brutto / (1 + current_data['stawka_vat'] / 100) * (1 + self.DEFAULT_MARGIN / 100), 2)
-            new_sale_price_brutto = round(new_sale_price_netto * (1 + current_data['stawka_vat'] / 100), 2)
-            
-            # Aktualizuj cenę domyślną
-            cursor.execute("""
-                UPDATE produkty 
-                SET 
-                    cena_sprzedazy_netto = ?,
-                    cena_sprzedazy_brutto = ?,
-                    cena = ?,  -- stara kolumna
-                    marza_procent = ?,
-                    updated_at = ?
-                WHERE id = ?
-            """, (
-                new_sale_price_netto,
-                new_sale_price_brutto, 
-                new_sale_price_brutto,
-                self.DEFAULT_MARGIN,
-                datetime.now().isoformat(),
-                product_id
-            ))
-            
-            corrections.append({
-                'type': 'default_price_correction',
-                'old_price_brutto': default_analysis['sale_price_brutto'],
-                'new_price_brutto': new_sale_price_brutto,
-                'old_margin': default_analysis['margin_percent'],
-                'new_margin': self.DEFAULT_MARGIN,
-                'reason': f'Marża była {default_analysis["margin_percent"]}%, skorygowano na {self.DEFAULT_MARGIN}%'
-            })
-        
-        return corrections
-    
-    def _save_margin_report(self, cursor, product_id, analysis, corrections, created_by):
-        """Zapisz raport zmian marż do tabeli logów"""
-        try:
-            # Utwórz tabelę raportów jeśli nie istnieje
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS margin_reports (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    product_id INTEGER NOT NULL,
-                    report_data TEXT NOT NULL,
-                    corrections_applied TEXT,
-                    created_by TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (product_id) REFERENCES produkty(id)
-                )
-            """)
-            
-            # Zapisz raport
-            cursor.execute("""
-                INSERT INTO margin_reports (product_id, report_data, corrections_applied, created_by)
-                VALUES (?, ?, ?, ?)
-            """, (
-                product_id,
-                json.dumps(analysis, default=str),
-                json.dumps(corrections, default=str),
-                created_by
-            ))
-            
-            return cursor.lastrowid
-        except Exception as e:
-            print(f"Błąd zapisu raportu marż: {e}")
-            return None
-    
     def _generate_warnings(self, analysis):
         """Generuj ostrzeżenia dla problematycznych marż"""
         warnings = []
@@ -306,3 +425,7 @@ class SmartMarginManager:
             return reports
         finally:
             conn.close()
+
+
+# Globalna instancja
+margin_manager = SmartMarginManager()
@@ -0,0 +1,374 @@
+"""
+Instrumentacja żądań i zapytań SQL - histogramy w pamięci w formacie Prometheus
+Hooki Flask mierzą czas każdego żądania oraz liczbę i łączny czas zapytań SQL
+wykonanych w jego trakcie. Połączenia z get_db_connection używają kursora
+mierzącego każde execute/fetch; zapytania są normalizowane (literały -> ?,
+listy IN zwinięte), więc jedna pozycja histogramu odpowiada jednemu kształtowi
+zapytania. Wolne zapytania trafiają do bufora próbek.
+
+Metryki są per proces - przy wielu workerach gunicorna każdy odpowiada za swoje
+(etykieta pid w pos_process_start_time_seconds).
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SQL_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+MAX_QUERY_SERIES = 300  # Powyżej - nowe kształty zapytań liczone zbiorczo jako "other"
+MAX_LABEL_LENGTH = 200
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# Statystyki SQL bieżącego żądania (osobne dla każdego wątku/kontekstu)
+_request_stats = ContextVar('request_sql_stats', default=None)
+
+
+@lru_cache(maxsize=4096)
+def normalize_sql(sql):
+    """Kształt zapytania bez literałów: WHERE id = 5 AND kod IN ('a','b') -> WHERE id = ? AND kod IN (?+)"""
+    normalized = _STRING_LITERAL.sub('?', sql)
+    normalized = _NUMBER_LITERAL.sub('?', normalized)
+    normalized = _PLACEHOLDER_LIST.sub('(?+)', normalized)
+    return _WHITESPACE.sub(' ', normalized).strip()
+
+
+class Histogram:
+    """Histogram o stałych kubełkach (wartości niekumulowane, kumulacja przy eksporcie)"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        """Przybliżony kwantyl (górna granica kubełka)"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        running = 0
+        for index, bucket_count in enumerate(self.counts):
+            running += bucket_count
+            if running >= target:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+class RequestStats:
+    __slots__ = ('sql_count', 'sql_time')
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.enabled = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+        self.slow_query_seconds = float(os.environ.get('SLOW_QUERY_MS', '100')) / 1000
+        self.slow_request_seconds = float(os.environ.get('SLOW_REQUEST_MS', '1000')) / 1000
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.request_latency = {}  # (metoda, endpoint, status) -> Histogram [s]
+            self.request_sql_count = {}  # (metoda, endpoint) -> Histogram
+            self.request_sql_time = {}  # (metoda, endpoint) -> Histogram [s]
+            self.query_time = {}  # zapytanie znormalizowane -> Histogram [s]
+            self.query_errors = {}
+            self.slow_queries = deque(maxlen=100)
+
+    # --- zapytania SQL ---
+
+    def record_query(self, sql, seconds, executed=True, failed=False):
+        """Rejestruje wykonanie (executed=True) lub pobranie wyników zapytania"""
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.sql_time += seconds
+            if executed:
+                stats.sql_count += 1
+
+        key = normalize_sql(sql)
+        with self._lock:
+            histogram = self.query_time.get(key)
+            if histogram is None:
+                if len(self.query_time) >= MAX_QUERY_SERIES:
+                    key = 'other'
+                    histogram = self.query_time.get(key)
+                if histogram is None:
+                    histogram = self.query_time[key] = Histogram(QUERY_BUCKETS)
+            if executed:
+                histogram.observe(seconds)
+            else:
+                # Czas pobierania wyników doliczany do ostatniego wykonania (bez zwiększania licznika)
+                histogram.sum += seconds
+            if failed:
+                self.query_errors[key] = self.query_errors.get(key, 0) + 1
+
+        if seconds >= self.slow_query_seconds:
+            self._sample_slow_query(key, seconds, 'execute' if executed else 'fetch')
+
+    def _sample_slow_query(self, normalized, seconds, phase):
+        from flask import has_request_context, request
+        sample = {
+            'sql': normalized,
+            'duration_ms': round(seconds * 1000, 2),
+            'phase': phase,
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'endpoint': None,
+            'method': None
+        }
+        if has_request_context():
+            sample['endpoint'] = request.url_rule.rule if request.url_rule else request.path
+            sample['method'] = request.method
+        with self._lock:
+            self.slow_queries.append(sample)
+        logger.warning("Wolne zapytanie SQL (%.1f ms): %s", seconds * 1000, normalized[:MAX_LABEL_LENGTH],
+                       extra={'fields': {'event': 'slow_query', **sample}})
+
+    # --- żądania HTTP ---
+
+    def init_app(self, app):
+        """Rejestruje hooki mierzące żądania"""
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        from flask import g, request
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:12]
+        g._metrics_started = time.perf_counter()
+        g._metrics_token = _request_stats.set(RequestStats())
+
+    def _after_request(self, response):
+        from flask import g, request
+        started = g.get('_metrics_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        stats = _request_stats.get() or RequestStats()
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        method = request.method
+        status = f"{response.status_code // 100}xx"
+
+        with self._lock:
+            key = (method, endpoint, status)
+            histogram = self.request_latency.get(key)
+            if histogram is None:
+                histogram = self.request_latency[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(elapsed)
+            key = (method, endpoint)
+            if key not in self.request_sql_count:
+                self.request_sql_count[key] = Histogram(SQL_COUNT_BUCKETS)
+                self.request_sql_time[key] = Histogram(LATENCY_BUCKETS)
+            self.request_sql_count[key].observe(stats.sql_count)
+            self.request_sql_time[key].observe(stats.sql_time)
+
+        response.headers['X-Request-ID'] = g.request_id
+        response.headers['Server-Timing'] = f"app;dur={elapsed * 1000:.1f}, sql;dur={stats.sql_time * 1000:.1f}"
+
+        fields = {
+            'event': 'request', 'endpoint': endpoint, 'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2), 'sql_count': stats.sql_count,
+            'sql_ms': round(stats.sql_time * 1000, 2)
+        }
+        if elapsed >= self.slow_request_seconds:
+            logger.warning("Wolne żądanie %s %s: %.0f ms, %d zapytań SQL", method, endpoint,
+                           elapsed * 1000, stats.sql_count, extra={'fields': fields})
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s %s %s %.1f ms (SQL: %d / %.1f ms)", method, endpoint, response.status_code,
+                         elapsed * 1000, stats.sql_count, stats.sql_time * 1000, extra={'fields': fields})
+        return response
+
+    def _teardown_request(self, exc):
+        from flask import g
+        token = g.pop('_metrics_token', None)
+        if token is not None:
+            _request_stats.reset(token)
+
+    # --- eksport ---
+
+    def slow_query_samples(self):
+        with self._lock:
+            return list(reversed(self.slow_queries))
+
+    def summary(self, limit=20):
+        """Najwolniejsze endpointy i zapytania (JSON dla panelu administracyjnego)"""
+        with self._lock:
+            endpoints = [
+                {
+                    'method': method, 'endpoint': endpoint, 'status': status, 'count': h.count,
+                    'mean_ms': round(h.sum / h.count * 1000, 2) if h.count else None,
+                    'p95_ms_le': round(h.quantile(0.95) * 1000, 1) if h.count else None
+                }
+                for (method, endpoint, status), h in self.request_latency.items()
+            ]
+            queries = [
+                {
+                    'sql': sql, 'count': h.count, 'total_ms': round(h.sum * 1000, 2),
+                    'mean_ms': round(h.sum / h.count * 1000, 3) if h.count else None,
+                    'errors': self.query_errors.get(sql, 0)
+                }
+                for sql, h in self.query_time.items()
+            ]
+        endpoints.sort(key=lambda e: (e['mean_ms'] or 0) * e['count'], reverse=True)
+        queries.sort(key=lambda q: q['total_ms'], reverse=True)
+        return {'endpoints': endpoints[:limit], 'queries': queries[:limit]}
+
+    def render_prometheus(self):
+        lines = []
+
+        def escape(value):
+            value = str(value)[:MAX_LABEL_LENGTH]
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+        def labels_text(labels):
+            return ','.join(f'{name}="{escape(value)}"' for name, value in labels)
+
+        def histogram_lines(name, labels, histogram):
+            running = 0
+            for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                running += bucket_count
+                lines.append(f'{name}_bucket{{{labels_text(labels + [("le", repr(float(bound)))])}}} {running}')
+            lines.append(f'{name}_bucket{{{labels_text(labels + [("le", "+Inf")])}}} {histogram.count}')
+            label_part = f'{{{labels_text(labels)}}}' if labels else ''
+            lines.append(f'{name}_sum{label_part} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{label_part} {histogram.count}')
+
+        with self._lock:
+            lines.append('# HELP pos_process_start_time_seconds Czas startu procesu (unix)')
+            lines.append('# TYPE pos_process_start_time_seconds gauge')
+            lines.append(f'pos_process_start_time_seconds{{pid="{os.getpid()}"}} {self.started_at:.3f}')
+
+            lines.append('# HELP pos_http_request_duration_seconds Czas obsługi żądania HTTP')
+            lines.append('# TYPE pos_http_request_duration_seconds histogram')
+            for (method, endpoint, status), histogram in sorted(self.request_latency.items()):
+                histogram_lines('pos_http_request_duration_seconds',
+                                [('method', method), ('endpoint', endpoint), ('status', status)], histogram)
+
+            lines.append('# HELP pos_http_request_sql_queries Liczba zapytań SQL na żądanie')
+            lines.append('# TYPE pos_http_request_sql_queries histogram')
+            for (method, endpoint), histogram in sorted(self.request_sql_count.items()):
+                histogram_lines('pos_http_request_sql_queries', [('method', method), ('endpoint', endpoint)], histogram)
+
+            lines.append('# HELP pos_http_request_sql_duration_seconds Łączny czas SQL na żądanie')
+            lines.append('# TYPE pos_http_request_sql_duration_seconds histogram')
+            for (method, endpoint), histogram in sorted(self.request_sql_time.items()):
+                histogram_lines('pos_http_request_sql_duration_seconds', [('method', method), ('endpoint', endpoint)], histogram)
+
+            lines.append('# HELP pos_sql_query_duration_seconds Czas wykonania zapytania (znormalizowanego)')
+            lines.append('# TYPE pos_sql_query_duration_seconds histogram')
+            for sql, histogram in sorted(self.query_time.items()):
+                histogram_lines('pos_sql_query_duration_seconds', [('query', sql)], histogram)
+
+            lines.append('# HELP pos_sql_query_errors_total Błędy zapytań SQL')
+            lines.append('# TYPE pos_sql_query_errors_total counter')
+            for sql, count in sorted(self.query_errors.items()):
+                lines.append(f'pos_sql_query_errors_total{{{labels_text([("query", sql)])}}} {count}')
+
+            lines.append('# HELP pos_sql_slow_queries_sampled Próbki wolnych zapytań w buforze')
+            lines.append('# TYPE pos_sql_slow_queries_sampled gauge')
+            lines.append(f'pos_sql_slow_queries_sampled {len(self.slow_queries)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Kursor mierzący execute*/fetchall/fetchmany"""
+
+    _last_sql = ''
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.Error:
+            failed = True
+            raise
+        finally:
+            self._last_sql = sql
+            metrics.record_query(sql, time.perf_counter() - started, failed=failed)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error:
+            failed = True
+            raise
+        finally:
+            self._last_sql = sql
+            metrics.record_query(sql, time.perf_counter() - started, failed=failed)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            metrics.record_query('-- executescript', time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.record_query(self._last_sql, time.perf_counter() - started, executed=False)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+        finally:
+            metrics.record_query(self._last_sql, time.perf_counter() - started, executed=False)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Połączenie, którego kursory (także conn.execute) są mierzone"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# Globalny rejestr metryk
+metrics = MetricsRegistry()
@@ -0,0 +1,320 @@
+"""
+Ruchoma średnia ważona ceny zakupu per (produkt, magazyn)
+Średnia jest aktualizowana przyrostowo w transakcji dokumentu:
+- księgowanie PZ z faktury (utils.external_receipts) - nowe pozycje faktury,
+- aktualizacja cen zakupu z faktury (update-purchase-prices) - tylko przecena pozycji ujętych
+  wcześniej po innej cenie, w magazynie ich ujęcia (nowe pozycje ujmuje PZ, które zna magazyn).
+Nowa średnia = (stan przed × średnia + ilość × cena) / (stan przed + ilość), gdzie stan to
+stock_on_hand lokalizacji magazynu. Przecena zmienia wartość pozostałego towaru:
+średnia += (nowa cena - stara cena) × ilość pozycji / max(stan, ilość pozycji).
+Ujęte pozycje faktur są w moving_average_sources - ta sama pozycja nie liczy się dwa razy.
+Odczyt średniej to wyszukiwanie po kluczu głównym.
+
+    cd backend && python -m utils.moving_average --rebuild
+    cd backend && python -m utils.moving_average --product 123 [--warehouse 5]
+"""
+
+import argparse
+import json
+from datetime import datetime
+
+from utils.database import get_db_connection
+
+DEFAULT_WAREHOUSE_ID = 5
+LOOKUP_CHUNK = 400
+EPSILON = 1e-9
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS moving_average_cost (
+        product_id INTEGER NOT NULL,
+        warehouse_id INTEGER NOT NULL,
+        avg_cost_net REAL NOT NULL,
+        last_invoice_id INTEGER,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (product_id, warehouse_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS moving_average_sources (
+        invoice_line_id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        warehouse_id INTEGER NOT NULL,
+        quantity REAL NOT NULL,
+        unit_cost_net REAL NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    """,
+]
+
+
+def updated_average(average, basis, quantity, price):
+    """Średnia po przyjęciu `quantity` po cenie `price` przy stanie `basis` (bez ujemnych stanów)"""
+    basis = max(basis, 0.0)
+    if average is None or basis + quantity <= EPSILON:
+        return price
+    return (basis * average + quantity * price) / (basis + quantity)
+
+
+class MovingAverageCost:
+
+    def __init__(self):
+        self._schema_ready = False
+
+    def ensure_schema(self, cursor=None):
+        if self._schema_ready:
+            return
+        conn = None
+        if cursor is None:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+        try:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            if conn:
+                conn.commit()
+            self._schema_ready = True
+        finally:
+            if conn:
+                conn.close()
+
+    @staticmethod
+    def _location_for_warehouse(cursor, warehouse_id):
+        cursor.execute("SELECT location_id FROM warehouses WHERE id = ?", (warehouse_id,))
+        row = cursor.fetchone()
+        return int(row[0]) if row and row[0] else int(warehouse_id)
+
+    @staticmethod
+    def _current(cursor, keys):
+        """{(produkt, magazyn): średnia} dla kluczy (CTE z VALUES - wyszukiwanie po kluczu)"""
+        averages = {}
+        keys = list(keys)
+        for start in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[start:start + LOOKUP_CHUNK]
+            cursor.execute(f"""
+                WITH keys (product_id, warehouse_id) AS (VALUES {','.join(['(?, ?)'] * len(chunk))})
+                SELECT m.product_id, m.warehouse_id, m.avg_cost_net
+                FROM keys JOIN moving_average_cost m
+                  ON m.product_id = keys.product_id AND m.warehouse_id = keys.warehouse_id
+            """, [value for key in chunk for value in key])
+            averages.update(((row[0], row[1]), row[2]) for row in cursor.fetchall())
+        return averages
+
+    def apply_invoice(self, cursor, invoice_id, warehouse_id=DEFAULT_WAREHOUSE_ID, location_id=None,
+                      reprice_only=False):
+        """
+        Ujmuje pozycje faktury w średnich w transakcji wywołującego
+        Wołane przed zaksięgowaniem przyjęcia w księdze - stock_on_hand to stan przed dostawą
+        reprice_only - tylko przecena pozycji już ujętych (magazyn z moving_average_sources)
+        Zwraca {'applied': nowe pozycje, 'repriced': przecenione, 'products': zmienione średnie}
+        """
+        self.ensure_schema(cursor)
+        warehouse_id = int(warehouse_id)
+        location_id = int(location_id or self._location_for_warehouse(cursor, warehouse_id))
+
+        cursor.execute("""
+            SELECT l.id, l.produkt_id, l.ilosc, l.cena_netto,
+                   s.warehouse_id AS source_warehouse_id, s.quantity AS source_quantity,
+                   s.unit_cost_net AS source_cost,
+                   COALESCE(soh.on_hand, 0) AS on_hand
+            FROM faktury_zakupowe_pozycje l
+            LEFT JOIN moving_average_sources s ON s.invoice_line_id = l.id
+            LEFT JOIN stock_on_hand soh
+              ON soh.product_id = l.produkt_id AND soh.location_id = ?
+            WHERE l.faktura_id = ? AND l.status_mapowania = 'zmapowany' AND l.produkt_id IS NOT NULL
+              AND l.ilosc > 0 AND l.cena_netto > 0
+              AND (s.invoice_line_id IS NULL OR ABS(s.unit_cost_net - l.cena_netto) > 1e-6)
+              AND (? = 0 OR s.invoice_line_id IS NOT NULL)
+            ORDER BY l.id
+        """, (location_id, invoice_id, int(bool(reprice_only))))
+        lines = cursor.fetchall()
+        if not lines:
+            return {'applied': 0, 'repriced': 0, 'products': 0}
+
+        # Przecena trafia do magazynu, w którym pozycja została ujęta
+        keys = {(line['produkt_id'], line['source_warehouse_id'] or warehouse_id) for line in lines}
+        averages = self._current(cursor, keys)
+        basis = {} if reprice_only else {
+            (line['produkt_id'], warehouse_id): float(line['on_hand']) for line in lines}
+        for key in keys - set(basis):
+            cursor.execute("SELECT COALESCE(on_hand, 0) FROM stock_on_hand WHERE product_id = ? AND location_id = ?",
+                           (key[0], self._location_for_warehouse(cursor, key[1])))
+            row = cursor.fetchone()
+            basis[key] = float(row[0]) if row else 0.0
+
+        now = datetime.now().isoformat()
+        sources, applied, repriced = [], 0, 0
+        for line in lines:
+            quantity, price = float(line['ilosc']), float(line['cena_netto'])
+            if line['source_cost'] is None:
+                key = (line['produkt_id'], warehouse_id)
+                averages[key] = updated_average(averages.get(key), basis[key], quantity, price)
+                basis[key] = max(basis[key], 0.0) + quantity
+                applied += 1
+            else:
+                key = (line['produkt_id'], line['source_warehouse_id'])
+                source_quantity = float(line['source_quantity'])
+                delta = (price - float(line['source_cost'])) * source_quantity
+                average = averages.get(key)
+                averages[key] = price if average is None else max(
+                    average + delta / max(basis[key], source_quantity), 0.0)
+                quantity = source_quantity
+                repriced += 1
+            sources.append((line['id'], key[0], key[1], quantity, price, now))
+
+        changed = {(line['produkt_id'], line['source_warehouse_id'] or warehouse_id) for line in lines}
+        cursor.executemany("""
+            INSERT INTO moving_average_cost (product_id, warehouse_id, avg_cost_net, last_invoice_id, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(product_id, warehouse_id) DO UPDATE SET
+                avg_cost_net = excluded.avg_cost_net,
+                last_invoice_id = excluded.last_invoice_id,
+                updated_at = excluded.updated_at
+        """, [(key[0], key[1], round(averages[key], 6), invoice_id, now) for key in changed])
+        cursor.executemany("""
+            INSERT OR REPLACE INTO moving_average_sources
+            (invoice_line_id, product_id, warehouse_id, quantity, unit_cost_net, applied_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, sources)
+        return {'applied': applied, 'repriced': repriced, 'products': len(changed)}
+
+    def cost(self, product_id, warehouse_id=DEFAULT_WAREHOUSE_ID, cursor=None):
+        """Średnia ruchoma (None - produkt bez przyjęć w magazynie); jedno wyszukiwanie po kluczu"""
+        conn = None
+        if cursor is None:
+            self.ensure_schema()
+            conn = get_db_connection()
+            cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT avg_cost_net FROM moving_average_cost WHERE product_id = ? AND warehouse_id = ?
+            """, (int(product_id), int(warehouse_id)))
+            row = cursor.fetchone()
+            return float(row[0]) if row else None
+        finally:
+            if conn:
+                conn.close()
+
+    def costs(self, cursor, product_ids, warehouse_id=DEFAULT_WAREHOUSE_ID):
+        """{produkt_id: średnia} dla listy produktów jednego magazynu"""
+        self.ensure_schema(cursor)
+        return {key[0]: value for key, value in
+                self._current(cursor, {(int(pid), int(warehouse_id)) for pid in product_ids}).items()}
+
+    def rebuild(self):
+        """
+        Odtwarza średnie z historii PZ w jednym przebiegu:
+        stan przed każdym przyjęciem to suma narastająca księgi (funkcja okna) do ruchu 'pz';
+        PZ sprzed księgi (bez ruchu) liczone są najpierw, ze stanem równym sumie wcześniejszych przyjęć
+        """
+        started = datetime.now()
+        conn = get_db_connection()
+        if not conn:
+            return {'success': False, 'error': 'Brak połączenia z bazą danych'}
+        try:
+            cursor = conn.cursor()
+            self.ensure_schema(cursor)
+
+            cursor.execute("SELECT location_id, MIN(id) FROM warehouses GROUP BY location_id")
+            warehouse_for_location = {row[0]: row[1] for row in cursor.fetchall()}
+
+            cursor.execute("""
+                SELECT document_id, product_id, location_id, id, before
+                FROM (
+                    SELECT id, product_id, location_id, movement_type, document_type, document_id,
+                           SUM(quantity) OVER (PARTITION BY product_id, location_id ORDER BY id) - quantity AS before
+                    FROM stock_ledger
+                )
+                WHERE movement_type = 'pz' AND document_type = 'PZ'
+            """)
+            ledger = {(row[0], row[1]): (row[3], float(row[4])) for row in cursor.fetchall()}
+
+            cursor.execute("""
+                SELECT wr.id AS receipt_id, wr.source_invoice_id, COALESCE(wr.location_id, 5) AS location_id,
+                       l.id AS line_id, l.produkt_id, l.ilosc, l.cena_netto
+                FROM warehouse_receipts wr
+                JOIN faktury_zakupowe_pozycje l ON l.faktura_id = wr.source_invoice_id
+                WHERE wr.type = 'external' AND l.status_mapowania = 'zmapowany' AND l.produkt_id IS NOT NULL
+                  AND l.ilosc > 0 AND l.cena_netto > 0
+                ORDER BY wr.id, l.id
+            """)
+            events = []
+            for row in cursor.fetchall():
+                movement_id, before = ledger.get((row['receipt_id'], row['produkt_id']), (0, None))
+                events.append((movement_id, row['receipt_id'], row['line_id'], row, before))
+            events.sort(key=lambda event: event[:3])
+
+            averages, received, last_invoice, sources, seen = {}, {}, {}, [], set()
+            receipt_basis = {}
+            now = started.isoformat()
+            for movement_id, receipt_id, line_id, row, before in events:
+                if line_id in seen:
+                    continue
+                seen.add(line_id)
+                warehouse_id = warehouse_for_location.get(row['location_id'], row['location_id'])
+                key = (row['produkt_id'], warehouse_id)
+                quantity, price = float(row['ilosc']), float(row['cena_netto'])
+                # Kilka pozycji produktu w jednym PZ - stan rośnie o pozycje już ujęte w tym przyjęciu
+                receipt_key = (receipt_id, key)
+                if before is None:
+                    basis = received.get(key, 0.0)
+                else:
+                    basis = before + receipt_basis.get(receipt_key, 0.0)
+                averages[key] = updated_average(averages.get(key), basis, quantity, price)
+                receipt_basis[receipt_key] = receipt_basis.get(receipt_key, 0.0) + quantity
+                received[key] = received.get(key, 0.0) + quantity
+                last_invoice[key] = row['source_invoice_id']
+                sources.append((line_id, key[0], key[1], quantity, price, now))
+
+            cursor.execute("DELETE FROM moving_average_cost")
+            cursor.execute("DELETE FROM moving_average_sources")
+            cursor.executemany("""
+                INSERT INTO moving_average_cost (product_id, warehouse_id, avg_cost_net, last_invoice_id, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(key[0], key[1], round(value, 6), last_invoice[key], now) for key, value in averages.items()])
+            cursor.executemany("""
+                INSERT INTO moving_average_sources
+                (invoice_line_id, product_id, warehouse_id, quantity, unit_cost_net, applied_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, sources)
+            conn.commit()
+
+            return {
+                'success': True,
+                'products': len(averages),
+                'lines': len(sources),
+                'duration_ms': round((datetime.now() - started).total_seconds() * 1000, 1),
+                'computed_at': now
+            }
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Błąd odtwarzania średnich ruchomych: {e}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            conn.close()
+
+
+# Globalna instancja
+moving_average = MovingAverageCost()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ruchoma średnia ważona ceny zakupu")
+    parser.add_argument('--rebuild', action='store_true', help="odtwórz średnie z historii PZ")
+    parser.add_argument('--product', type=int, help="pokaż średnią produktu")
+    parser.add_argument('--warehouse', type=int, default=DEFAULT_WAREHOUSE_ID)
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        result = moving_average.rebuild()
+    elif args.product:
+        result = {'product_id': args.product, 'warehouse_id': args.warehouse,
+                  'avg_cost_net': moving_average.cost(args.product, args.warehouse)}
+    else:
+        parser.print_help()
+        return
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
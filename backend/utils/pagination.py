@@ -0,0 +1,194 @@
+"""
+Stronicowanie kursorowe (keyset) i cache liczników dla list dokumentów
+Zamiast LIMIT/OFFSET (koszt rośnie z numerem strony) kolejna strona zaczyna się
+od klucza ostatniego wiersza poprzedniej, np. (data_transakcji, id) - każda strona
+kosztuje tyle samo co pierwsza. Liczba pozycji dokumentów jest przechowywana
+w kolumnach utrzymywanych przez triggery, a sumy rekordów są cache'owane.
+"""
+
+import base64
+import json
+import threading
+import time
+
+from utils.database import get_db_connection
+
+# Tabele dokumentów z przechowywaną liczbą pozycji: (tabela, kolumna licznika, tabela pozycji, klucz obcy)
+ITEM_COUNTERS = [
+    ('pos_transakcje', 'liczba_pozycji', 'pos_pozycje', 'transakcja_id'),
+    ('warehouse_receipts', 'items_count', 'warehouse_receipt_items', 'receipt_id'),
+    ('warehouse_issues', 'items_count', 'warehouse_issue_items', 'issue_id')
+]
+
+# Kolumny pokazywane na listach, których brakuje w starszych bazach: (tabela, kolumna, definicja)
+LIST_COLUMNS = [
+    ('warehouse_issues', 'created_by', 'TEXT')
+]
+
+# Indeksy pod sortowanie kursorowe list
+KEYSET_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_pos_transakcje_status_data_id ON pos_transakcje(status, data_transakcji, id)",
+    "CREATE INDEX IF NOT EXISTS idx_pos_transakcje_data_id ON pos_transakcje(data_transakcji, id)",
+    "CREATE INDEX IF NOT EXISTS idx_kasa_operacje_data_id ON kasa_operacje(data_operacji, id)",
+    "CREATE INDEX IF NOT EXISTS idx_warehouse_receipts_type_created ON warehouse_receipts(type, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_warehouse_issues_created ON warehouse_issues(created_at, id)"
+]
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def ensure_list_schema():
+    """
+    Jednorazowo (per proces) dodaje kolumny liczników pozycji, triggery je utrzymujące,
+    wypełnia je istniejącymi danymi, dodaje brakujące kolumny list (LIST_COLUMNS)
+    i tworzy indeksy pod stronicowanie kursorowe.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return True
+
+    with _schema_lock:
+        if _schema_ready:
+            return True
+
+        conn = get_db_connection()
+        if not conn:
+            return False
+        try:
+            cursor = conn.cursor()
+            for table, column, items_table, foreign_key in ITEM_COUNTERS:
+                cursor.execute(f"PRAGMA table_info({table})")
+                columns = [row[1] for row in cursor.fetchall()]
+                if not columns:
+                    continue
+
+                if column not in columns:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER DEFAULT 0")
+                    cursor.execute(f"""
+                        UPDATE {table} SET {column} = (
+                            SELECT COUNT(*) FROM {items_table} WHERE {items_table}.{foreign_key} = {table}.id
+                        )
+                    """)
+
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {items_table}_count_after_insert
+                    AFTER INSERT ON {items_table}
+                    BEGIN
+                        UPDATE {table} SET {column} = COALESCE({column}, 0) + 1 WHERE id = NEW.{foreign_key};
+                    END
+                """)
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {items_table}_count_after_delete
+                    AFTER DELETE ON {items_table}
+                    BEGIN
+                        UPDATE {table} SET {column} = COALESCE({column}, 0) - 1 WHERE id = OLD.{foreign_key};
+                    END
+                """)
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {items_table}_count_after_move
+                    AFTER UPDATE OF {foreign_key} ON {items_table}
+                    WHEN OLD.{foreign_key} IS NOT NEW.{foreign_key}
+                    BEGIN
+                        UPDATE {table} SET {column} = COALESCE({column}, 0) - 1 WHERE id = OLD.{foreign_key};
+                        UPDATE {table} SET {column} = COALESCE({column}, 0) + 1 WHERE id = NEW.{foreign_key};
+                    END
+                """)
+
+            for table, column, definition in LIST_COLUMNS:
+                cursor.execute(f"PRAGMA table_info({table})")
+                columns = [row[1] for row in cursor.fetchall()]
+                if columns and column not in columns:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+            for index_sql in KEYSET_INDEXES:
+                try:
+                    cursor.execute(index_sql)
+                except Exception as e:
+                    print(f"⚠️ Nie można utworzyć indeksu ({index_sql}): {e}")
+
+            conn.commit()
+            _schema_ready = True
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Błąd przygotowania schematu list: {e}")
+            return False
+        finally:
+            conn.close()
+
+
+def encode_cursor(values):
+    """Koduje klucz ostatniego wiersza strony do nieprzezroczystego tokena"""
+    raw = json.dumps(list(values), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Dekoduje token kursora; zwraca listę wartości klucza lub None"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        return values if isinstance(values, list) else None
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_condition(columns, values, descending=True):
+    """
+    Warunek "wiersze po kursorze" dla sortowania po kolumnach `columns`.
+    Porównanie wartości wierszowych (a, b) < (?, ?) SQLite realizuje zakresem indeksu.
+    """
+    operator = '<' if descending else '>'
+    return f"({', '.join(columns)}) {operator} ({', '.join('?' * len(columns))})", list(values)
+
+
+def page_result(rows, limit, key_fn):
+    """
+    Przycina wynik pobrany z LIMIT limit+1 i wylicza kursor następnej strony.
+    Zwraca (wiersze, next_cursor, has_more).
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(key_fn(rows[-1])) if has_more and rows else None
+    return rows, next_cursor, has_more
+
+
+class CountCache:
+    """Przybliżone liczniki rekordów list cache'owane przez `ttl` sekund per zestaw filtrów"""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        now = time.time()
+        with self._lock:
+            cached = self._values.get(key)
+            if cached and now - cached[1] < self.ttl:
+                return cached[0]
+
+        value = compute()
+
+        with self._lock:
+            self._values[key] = (value, now)
+            if len(self._values) > 1000:
+                # Proste ograniczenie pamięci - usuń najstarsze wpisy
+                for old_key, _ in sorted(self._values.items(), key=lambda kv: kv[1][1])[:500]:
+                    del self._values[old_key]
+        return value
+
+    def invalidate(self, prefix=None):
+        with self._lock:
+            if prefix is None:
+                self._values.clear()
+            else:
+                for key in [k for k in self._values if k and k[0] == prefix]:
+                    del self._values[key]
+
+
+# Globalny cache liczników list
+count_cache = CountCache()
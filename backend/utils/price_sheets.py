@@ -0,0 +1,441 @@
+"""
+Arkusze cen magazynów (GET /warehouses/<id>/prices)
+Dla każdego magazynu utrzymywana jest gotowa tabela warehouse_price_sheet: cena standardowa
+i magazynowa (brutto/netto), cena zakupu, marża i stan - jeden wiersz na aktywny produkt.
+Triggery na warehouse_product_prices, produkty, inventory_locations i pozycjach faktur
+zakupowych dopisują zmienione pary (magazyn, produkt) do kolejki warehouse_price_sheet_dirty;
+odczyt arkusza najpierw przelicza tylko te wiersze i podbija wersję magazynu (ETag).
+Cena zakupu i marża liczone są jak domyślna strategia margin_service ('latest'):
+najnowsza cena z faktury zakupowej, a gdy jej brak - cena zakupu netto z karty produktu.
+"""
+
+import json
+import threading
+from datetime import datetime
+
+from utils.database import get_db_connection, retry_on_locked
+from utils.pagination import decode_cursor, keyset_condition, page_result
+
+SHEET_COLUMNS = [
+    'product_id', 'product_name', 'barcode', 'standard_price', 'purchase_price', 'price_net',
+    'vat_rate', 'warehouse_price', 'warehouse_price_net', 'special_price', 'margin',
+    'margin_method', 'price_updated', 'stock_quantity', 'stock_reserved'
+]
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS warehouse_price_sheet (
+        warehouse_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        product_name TEXT NOT NULL DEFAULT '',
+        barcode TEXT,
+        standard_price REAL NOT NULL DEFAULT 0,
+        purchase_price REAL NOT NULL DEFAULT 0,
+        price_net REAL NOT NULL DEFAULT 0,
+        vat_rate REAL NOT NULL DEFAULT 23,
+        warehouse_price REAL NOT NULL DEFAULT 0,
+        warehouse_price_net REAL NOT NULL DEFAULT 0,
+        special_price REAL,
+        margin REAL NOT NULL DEFAULT 0,
+        margin_method TEXT,
+        price_updated TEXT,
+        stock_quantity REAL NOT NULL DEFAULT 0,
+        stock_reserved REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (warehouse_id, product_id)
+    ) WITHOUT ROWID
+    """,
+    # Kolejność arkusza (nazwa, id) - stronicowanie kursorowe po indeksie
+    "CREATE INDEX IF NOT EXISTS idx_warehouse_price_sheet_name ON warehouse_price_sheet(warehouse_id, product_name, product_id)",
+    """
+    CREATE TABLE IF NOT EXISTS warehouse_price_sheet_dirty (
+        warehouse_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        PRIMARY KEY (warehouse_id, product_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS warehouse_price_sheet_versions (
+        warehouse_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        products INTEGER NOT NULL DEFAULT 0,
+        refreshed_at TEXT
+    )
+    """,
+    # Najnowsza cena z faktury per produkt
+    "CREATE INDEX IF NOT EXISTS idx_faktury_zakupowe_pozycje_produkt ON faktury_zakupowe_pozycje(produkt_id)",
+]
+
+# Zmiany w obrębie jednego magazynu: (tabela, kolumny UPDATE OF)
+WAREHOUSE_SOURCES = [
+    ('warehouse_product_prices', 'warehouse_id, product_id, cena_sprzedazy_brutto, data_od, aktywny, updated_at'),
+    ('inventory_locations', 'warehouse_id, product_id, ilosc_dostepna, ilosc_zarezerwowana'),
+]
+
+# Zmiany karty produktu i cen zakupu dotyczą wszystkich zbudowanych arkuszy
+# ON CONFLICT DO NOTHING zamiast INSERT OR IGNORE - polityka OR z triggera ustępuje UPSERT-owi
+# instrukcji zewnętrznej (np. INSERT ... ON CONFLICT DO UPDATE na inventory_locations)
+MARK_ALL = """
+    INSERT INTO warehouse_price_sheet_dirty (warehouse_id, product_id)
+    SELECT warehouse_id, {product} FROM warehouse_price_sheet_versions WHERE {product} IS NOT NULL {extra}
+    ON CONFLICT DO NOTHING;
+"""
+MARK = """
+    INSERT INTO warehouse_price_sheet_dirty (warehouse_id, product_id)
+    SELECT {row}.warehouse_id, {row}.product_id WHERE true {extra}
+    ON CONFLICT DO NOTHING;
+"""
+
+PRODUCT_COLUMNS = 'nazwa, ean, cena_sprzedazy_brutto, cena_sprzedazy_netto, cena_zakupu_netto, stawka_vat, aktywny'
+INVOICE_LINE_COLUMNS = 'faktura_id, produkt_id, cena_netto'
+
+# Wcześniejsze triggery kolejki (INSERT OR IGNORE) - usuwane przy tworzeniu schematu
+LEGACY_TRIGGERS = [
+    f"{table}_price_sheet_{event}"
+    for table in ('warehouse_product_prices', 'inventory_locations', 'produkty', 'faktury_zakupowe_pozycje')
+    for event in ('insert', 'update', 'delete')
+] + ['faktury_zakupowe_price_sheet_update', 'faktury_zakupowe_price_sheet_delete']
+
+
+def _trigger(name, event, table, body):
+    return f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN {body} END"
+
+
+def _triggers():
+    triggers = [f"DROP TRIGGER IF EXISTS {name}" for name in LEGACY_TRIGGERS]
+    for table, columns in WAREHOUSE_SOURCES:
+        # Stary klucz tylko gdy UPDATE przeniósł wiersz na inny magazyn/produkt
+        moved = "AND (OLD.warehouse_id IS NOT NEW.warehouse_id OR OLD.product_id IS NOT NEW.product_id)"
+        triggers += [
+            _trigger(f"{table}_price_sheet_dirty_insert", 'INSERT', table, MARK.format(row='NEW', extra='')),
+            _trigger(f"{table}_price_sheet_dirty_update", f'UPDATE OF {columns}', table,
+                     MARK.format(row='OLD', extra=moved) + MARK.format(row='NEW', extra='')),
+            _trigger(f"{table}_price_sheet_dirty_delete", 'DELETE', table, MARK.format(row='OLD', extra='')),
+        ]
+    triggers += [
+        _trigger('produkty_price_sheet_dirty_insert', 'INSERT', 'produkty', MARK_ALL.format(product='NEW.id', extra='')),
+        _trigger('produkty_price_sheet_dirty_update', f'UPDATE OF {PRODUCT_COLUMNS}', 'produkty',
+                 MARK_ALL.format(product='NEW.id', extra='')),
+        _trigger('produkty_price_sheet_dirty_delete', 'DELETE', 'produkty', MARK_ALL.format(product='OLD.id', extra='')),
+        _trigger('faktury_zakupowe_pozycje_price_sheet_dirty_insert', 'INSERT', 'faktury_zakupowe_pozycje',
+                 MARK_ALL.format(product='NEW.produkt_id', extra='')),
+        _trigger('faktury_zakupowe_pozycje_price_sheet_dirty_update', f'UPDATE OF {INVOICE_LINE_COLUMNS}',
+                 'faktury_zakupowe_pozycje',
+                 MARK_ALL.format(product='OLD.produkt_id', extra='AND OLD.produkt_id IS NOT NEW.produkt_id')
+                 + MARK_ALL.format(product='NEW.produkt_id', extra='')),
+        _trigger('faktury_zakupowe_pozycje_price_sheet_dirty_delete', 'DELETE', 'faktury_zakupowe_pozycje',
+                 MARK_ALL.format(product='OLD.produkt_id', extra='')),
+    ]
+    # Data faktury decyduje, która cena jest najnowsza
+    for event, row in (('UPDATE OF data_faktury', 'NEW'), ('DELETE', 'OLD')):
+        triggers.append(_trigger(f"faktury_zakupowe_price_sheet_dirty_{event.split()[0].lower()}", event,
+                                 'faktury_zakupowe', f"""
+            INSERT INTO warehouse_price_sheet_dirty (warehouse_id, product_id)
+            SELECT v.warehouse_id, fzp.produkt_id
+            FROM faktury_zakupowe_pozycje fzp, warehouse_price_sheet_versions v
+            WHERE fzp.faktura_id = {row}.id AND fzp.produkt_id IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        """))
+    return triggers
+
+
+# Wiersze arkusza dla produktów z `scope` (zapytanie zwracające kolumnę id); parametr :warehouse_id
+BUILD_SQL = """
+    INSERT INTO warehouse_price_sheet
+    (warehouse_id, product_id, product_name, barcode, standard_price, purchase_price, price_net, vat_rate,
+     warehouse_price, warehouse_price_net, special_price, margin, margin_method, price_updated,
+     stock_quantity, stock_reserved)
+    WITH scope AS ({scope}),
+    special AS (
+        SELECT product_id, cena_sprzedazy_brutto, updated_at FROM (
+            SELECT wp.product_id, wp.cena_sprzedazy_brutto, wp.updated_at,
+                   ROW_NUMBER() OVER (PARTITION BY wp.product_id ORDER BY wp.data_od DESC, wp.id DESC) AS rn
+            FROM warehouse_product_prices wp
+            JOIN scope s ON s.id = wp.product_id
+            WHERE wp.warehouse_id = :warehouse_id AND wp.aktywny = 1
+        ) WHERE rn = 1
+    ),
+    latest AS (
+        SELECT produkt_id, cena_netto, data_faktury FROM (
+            SELECT fzp.produkt_id, fzp.cena_netto, fz.data_faktury,
+                   ROW_NUMBER() OVER (PARTITION BY fzp.produkt_id ORDER BY fz.data_faktury DESC, fz.id DESC) AS rn
+            FROM faktury_zakupowe_pozycje fzp
+            JOIN scope s ON s.id = fzp.produkt_id
+            JOIN faktury_zakupowe fz ON fz.id = fzp.faktura_id
+        ) WHERE rn = 1
+    ),
+    base AS (
+        SELECT p.id, COALESCE(p.nazwa, '') AS product_name, p.ean AS barcode,
+               COALESCE(p.cena_sprzedazy_brutto, 0) AS standard_price,
+               COALESCE(p.cena_zakupu_netto, 0) AS card_purchase_price,
+               COALESCE(p.cena_sprzedazy_netto, 0) AS price_net,
+               COALESCE(NULLIF(p.stawka_vat, 0), 23) AS vat_rate,
+               sp.cena_sprzedazy_brutto AS special_price,
+               sp.updated_at AS price_updated,
+               COALESCE(CASE
+                   WHEN sp.cena_sprzedazy_brutto IS NOT NULL
+                       THEN sp.cena_sprzedazy_brutto / (1 + COALESCE(p.stawka_vat, 23) / 100.0)
+                   ELSE COALESCE(p.cena_sprzedazy_netto, p.cena_sprzedazy_brutto / (1 + COALESCE(p.stawka_vat, 23) / 100.0))
+               END, 0) AS warehouse_price_net,
+               CASE WHEN l.cena_netto > 0 THEN l.cena_netto
+                    WHEN p.cena_zakupu_netto > 0 THEN p.cena_zakupu_netto
+                    ELSE 0 END AS buy_price,
+               CASE WHEN l.cena_netto > 0 THEN 'Najnowsza z faktury (' || COALESCE(l.data_faktury, '') || ')'
+                    WHEN p.cena_zakupu_netto > 0 THEN 'Domyślna cena zakupu'
+                    ELSE 'Brak ceny zakupu' END AS buy_method,
+               COALESCE(il.ilosc_dostepna, 0) AS stock_quantity,
+               COALESCE(il.ilosc_zarezerwowana, 0) AS stock_reserved
+        FROM scope s
+        JOIN produkty p ON p.id = s.id AND p.aktywny = 1
+        LEFT JOIN special sp ON sp.product_id = p.id
+        LEFT JOIN latest l ON l.produkt_id = p.id
+        LEFT JOIN inventory_locations il ON il.product_id = p.id AND il.warehouse_id = :warehouse_id
+    )
+    SELECT :warehouse_id, id, product_name, barcode, standard_price,
+           CASE WHEN warehouse_price_net > 0 THEN buy_price ELSE card_purchase_price END,
+           price_net, vat_rate,
+           COALESCE(NULLIF(special_price, 0), standard_price),
+           warehouse_price_net, special_price,
+           CASE WHEN warehouse_price_net > 0 AND buy_price > 0
+                THEN ROUND((warehouse_price_net - buy_price) / warehouse_price_net * 100, 2)
+                ELSE 0 END,
+           CASE WHEN warehouse_price_net > 0 THEN buy_method ELSE 'brak_ceny' END,
+           price_updated, stock_quantity, stock_reserved
+    FROM base
+"""
+
+FULL_SCOPE = "SELECT id FROM produkty WHERE aktywny = 1"
+DIRTY_SCOPE = "SELECT product_id AS id FROM warehouse_price_sheet_dirty WHERE warehouse_id = :warehouse_id"
+
+
+class WarehousePriceSheets:
+
+    def __init__(self):
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def ensure_schema(self, cursor=None):
+        """Tabele arkusza, kolejki i wersji oraz triggery - jednorazowo per proces"""
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            conn = None
+            if cursor is None:
+                conn = get_db_connection()
+                cursor = conn.cursor()
+            try:
+                for sql in SCHEMA + _triggers():
+                    cursor.execute(sql)
+                if conn:
+                    conn.commit()
+                self._schema_ready = True
+            finally:
+                if conn:
+                    conn.close()
+
+    def refresh(self, warehouse_id, full=False):
+        """
+        Przelicza arkusz magazynu: pełna przebudowa (pierwszy odczyt albo full=True)
+        lub tylko produkty z kolejki zmian. Zwraca wersję i liczbę przeliczonych produktów.
+        """
+        started = datetime.now()
+        self.ensure_schema()
+        conn = get_db_connection()
+        if not conn:
+            return {'success': False, 'error': 'Brak połączenia z bazą danych'}
+        conn.isolation_level = None
+        try:
+            result = self._run_refresh(conn, int(warehouse_id), full)
+        except Exception as e:
+            print(f"❌ Błąd odświeżania arkusza cen magazynu {warehouse_id}: {e}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            conn.close()
+        result['duration_ms'] = round((datetime.now() - started).total_seconds() * 1000, 1)
+        result['computed_at'] = started.isoformat()
+        return result
+
+    @retry_on_locked
+    def _run_refresh(self, conn, warehouse_id, full):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            result = self._refresh(cursor, warehouse_id, full)
+            cursor.execute("COMMIT")
+            return result
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def _refresh(self, cursor, warehouse_id, full):
+        params = {'warehouse_id': warehouse_id}
+        version = cursor.execute(
+            "SELECT version FROM warehouse_price_sheet_versions WHERE warehouse_id = ?", (warehouse_id,)
+        ).fetchone()
+        full = full or version is None
+
+        if full:
+            cursor.execute("DELETE FROM warehouse_price_sheet WHERE warehouse_id = ?", (warehouse_id,))
+            cursor.execute(BUILD_SQL.format(scope=FULL_SCOPE), params)
+            refreshed = cursor.rowcount
+        else:
+            pending = cursor.execute(
+                "SELECT COUNT(*) FROM warehouse_price_sheet_dirty WHERE warehouse_id = ?", (warehouse_id,)
+            ).fetchone()[0]
+            if not pending:
+                return {'success': True, 'warehouse_id': warehouse_id, 'version': version[0],
+                        'full': False, 'refreshed_products': 0}
+            cursor.execute(f"""
+                DELETE FROM warehouse_price_sheet
+                WHERE warehouse_id = :warehouse_id AND product_id IN ({DIRTY_SCOPE})
+            """, params)
+            cursor.execute(BUILD_SQL.format(scope=DIRTY_SCOPE), params)
+            refreshed = pending
+
+        cursor.execute("DELETE FROM warehouse_price_sheet_dirty WHERE warehouse_id = ?", (warehouse_id,))
+        cursor.execute("""
+            INSERT INTO warehouse_price_sheet_versions (warehouse_id, version, products, refreshed_at)
+            VALUES (:warehouse_id, 1, (SELECT COUNT(*) FROM warehouse_price_sheet WHERE warehouse_id = :warehouse_id),
+                    datetime('now'))
+            ON CONFLICT(warehouse_id) DO UPDATE SET version = version + 1, products = excluded.products,
+                refreshed_at = excluded.refreshed_at
+        """, params)
+        version = cursor.execute(
+            "SELECT version FROM warehouse_price_sheet_versions WHERE warehouse_id = ?", (warehouse_id,)
+        ).fetchone()[0]
+        return {'success': True, 'warehouse_id': warehouse_id, 'version': version,
+                'full': full, 'refreshed_products': refreshed}
+
+    def current(self, warehouse_id, conn=None):
+        """
+        Aktualna wersja arkusza; przelicza zaległe zmiany przed odczytem.
+        Zwraca {'version', 'products', 'refreshed_at', 'etag'}.
+        conn - wersja czytana w transakcji odczytu otwartej na tym połączeniu; dalsze odczyty
+        wierszy na nim (stream) pochodzą z tego samego snapshotu co ETag
+        """
+        self.ensure_schema()
+        check = get_db_connection()
+        try:
+            pending = check.execute("""
+                SELECT NOT EXISTS (SELECT 1 FROM warehouse_price_sheet_versions WHERE warehouse_id = :w)
+                    OR EXISTS (SELECT 1 FROM warehouse_price_sheet_dirty WHERE warehouse_id = :w)
+            """, {'w': warehouse_id}).fetchone()[0]
+        finally:
+            check.close()
+
+        if pending:
+            result = self.refresh(warehouse_id)
+            if not result.get('success'):
+                raise RuntimeError(result.get('error'))
+
+        own = conn is None
+        if own:
+            conn = get_db_connection()
+        else:
+            conn.execute("BEGIN")
+        try:
+            row = dict(conn.execute(
+                "SELECT version, products, refreshed_at FROM warehouse_price_sheet_versions WHERE warehouse_id = ?",
+                (warehouse_id,)
+            ).fetchone())
+        finally:
+            if own:
+                conn.close()
+        row['etag'] = f'W/"wps-{warehouse_id}-{row["version"]}"'
+        return row
+
+    @staticmethod
+    def _row(row):
+        item = dict(row)
+        item['has_special_price'] = item['special_price'] is not None
+        item['special_price'] = item['warehouse_price'] if item['has_special_price'] else None
+        item['stock'] = item['stock_quantity']
+        return item
+
+    def page(self, warehouse_id, limit=None, cursor_token=None):
+        """
+        Wiersze arkusza w kolejności nazwy. Bez `limit` - cały arkusz;
+        z `limit` - strona od kursora, zwraca (wiersze, next_cursor, has_more).
+        """
+        where, params = "warehouse_id = ?", [warehouse_id]
+        after = decode_cursor(cursor_token)
+        if after and len(after) == 2:
+            condition, values = keyset_condition(['product_name', 'product_id'], after, descending=False)
+            where += f" AND {condition}"
+            params += values
+        sql = f"""
+            SELECT {', '.join(SHEET_COLUMNS)} FROM warehouse_price_sheet
+            WHERE {where}
+            ORDER BY product_name, product_id
+        """
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit) + 1)
+
+        conn = get_db_connection()
+        try:
+            rows = [self._row(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+        if not limit:
+            return rows, None, False
+        return page_result(rows, int(limit), lambda row: (row['product_name'], row['product_id']))
+
+    def stream(self, warehouse_id, chunk_rows=500, conn=None):
+        """
+        Cały arkusz jako strumień tablicy JSON - wiersze pobierane porcjami z kursora bazy
+        conn - połączenie przekazane wcześniej do current() (zamyka je wywołujący)
+        """
+        own = conn is None
+        if own:
+            conn = get_db_connection()
+        try:
+            cursor = conn.execute(f"""
+                SELECT {', '.join(SHEET_COLUMNS)} FROM warehouse_price_sheet
+                WHERE warehouse_id = ?
+                ORDER BY product_name, product_id
+            """, (warehouse_id,))
+            yield '['
+            first = True
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                chunk = ','.join(json.dumps(self._row(row), ensure_ascii=False) for row in rows)
+                yield chunk if first else ',' + chunk
+                first = False
+            yield ']'
+        finally:
+            if own:
+                conn.close()
+
+
+# Globalna instancja
+price_sheets = WarehousePriceSheets()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Arkusze cen magazynów')
+    parser.add_argument('--warehouse', type=int, action='append', help='ID magazynu (domyślnie wszystkie aktywne)')
+    parser.add_argument('--full', action='store_true', help='Pełna przebudowa zamiast kolejki zmian')
+    args = parser.parse_args(argv)
+
+    warehouse_ids = args.warehouse
+    if not warehouse_ids:
+        conn = get_db_connection()
+        try:
+            warehouse_ids = [row[0] for row in conn.execute("SELECT id FROM warehouses WHERE aktywny = 1 ORDER BY id")]
+        finally:
+            conn.close()
+
+    for warehouse_id in warehouse_ids:
+        print(json.dumps(price_sheets.refresh(warehouse_id, full=args.full), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
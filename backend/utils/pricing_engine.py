@@ -0,0 +1,707 @@
+"""
+Skompilowany silnik cen i promocji koszyka
+Aktywne rabaty, ceny specjalne lokalizacji/magazynów i ceny bazowe produktów są raz
+kompilowane do planu w pamięci (indeksy po produkcie, kategorii i lokalizacji, reguły
+uporządkowane priorytetem i wartością), a każda zmiana koszyka jest przeliczana na tym planie bez zapytań do bazy.
+
+Kolejność ustalania ceny pozycji:
+    location_product_prices > warehouse_product_prices (przez warehouses.location_id) > produkty
+
+Rozstrzyganie konfliktów (deterministyczne):
+- na pozycję działa najwyżej jeden rabat pozycyjny (z zakresem produktów/kategorii),
+- na koszyk najwyżej jeden rabat koszykowy (bez zakresu), liczony od sumy po rabatach pozycyjnych,
+- rabat wskazany przez kasjera (id lub kod) wygrywa z automatycznym na tym samym poziomie,
+  dalej decyduje wyższy priorytet, większa kwota rabatu, a przy remisie niższe id,
+- kupony są odejmowane na końcu, od kwoty do zapłaty, w kolejności podania.
+
+Plan jest kluczowany wersją z pricing_plan_version: triggery na rabatach, cenach produktów,
+cenach specjalnych, kategoriach i magazynach podbijają ją przy każdej zmianie, a plan() porównuje
+ją z wersją skompilowanego planu - zmiana zapisana przez dowolny worker unieważnia plan we wszystkich.
+invalidate() podbija wersję ręcznie (np. po przywróceniu kopii bazy); PRICING_PLAN_TTL sekund
+to dodatkowa granica wieku planu.
+
+    cd backend && python -m utils.pricing_engine --rules 5000 --products 50000 --lines 40
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import date
+
+from utils.database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+PLAN_TTL = float(os.environ.get('PRICING_PLAN_TTL', '30'))
+
+# Kolumny rabatów potrzebne do automatycznych promocji (dodawane, jeśli ich brakuje)
+RABATY_EXTRA_COLUMNS = (
+    ('automatyczny', 'INTEGER DEFAULT 0'),
+    ('priorytet', 'INTEGER DEFAULT 0'),
+    ('zakres_produktow', 'TEXT'),   # lista id produktów (JSON)
+    ('zakres_kategorii', 'TEXT'),   # lista id kategorii (JSON), obejmuje podkategorie
+)
+
+PLAN_VERSION_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS pricing_plan_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT INTO pricing_plan_version (id, version) VALUES (1, 0) ON CONFLICT(id) DO NOTHING",
+)
+
+# Źródła planu: tabela -> kolumny, których zmiana unieważnia plan (None - każda zmiana wiersza)
+PLAN_SOURCES = (
+    ('rabaty', None),
+    ('produkty', ('cena_sprzedazy_brutto', 'cena', 'category_id')),
+    ('location_product_prices', None),
+    ('warehouse_product_prices', None),
+    ('kategorie_produktow', ('parent_id',)),
+    ('warehouses', ('location_id',)),
+)
+
+
+def plan_version_triggers(table, columns):
+    """Triggery podbijające pricing_plan_version po zmianie źródła planu"""
+    bump = "UPDATE pricing_plan_version SET version = version + 1 WHERE id = 1;"
+    update = f"UPDATE OF {', '.join(columns)}" if columns else "UPDATE"
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS pricing_plan_version_{table}_{event.split()[0].lower()}
+        AFTER {event} ON {table}
+        BEGIN
+            {bump}
+        END
+        """
+        for event in ('INSERT', update, 'DELETE')
+    ]
+
+
+def parse_scope(value):
+    """Zakres rabatu z kolumny TEXT (JSON lub lista po przecinku) -> frozenset id albo None"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = value
+    else:
+        try:
+            items = json.loads(value)
+        except (TypeError, ValueError):
+            items = str(value).split(',')
+        if not isinstance(items, list):
+            items = [items]
+    ids = set()
+    for item in items:
+        try:
+            ids.add(int(item))
+        except (TypeError, ValueError):
+            continue
+    return frozenset(ids) or None
+
+
+def serialize_scope(value):
+    """Zakres z żądania API -> wartość kolumny (JSON) albo None"""
+    scope = parse_scope(value)
+    return json.dumps(sorted(scope)) if scope else None
+
+
+class CompiledRule:
+    """Rabat przygotowany do oceny - bez słowników i parsowania w gorącej ścieżce"""
+
+    __slots__ = ('id', 'nazwa', 'percent', 'wartosc', 'kod', 'location_id', 'minimum', 'maksimum',
+                 'priorytet', 'automatic', 'products', 'categories', 'has_limits', 'row')
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.nazwa = row.get('nazwa')
+        self.percent = row.get('typ_rabatu') == 'procentowy'
+        self.wartosc = float(row.get('wartosc') or 0)
+        self.kod = (row.get('kod_rabatu') or '').strip().upper() or None
+        self.location_id = row.get('location_id')
+        self.minimum = float(row.get('minimum_koszyka') or 0)
+        self.maksimum = float(row['maksimum_koszyka']) if row.get('maksimum_koszyka') else None
+        self.priorytet = int(row.get('priorytet') or 0)
+        self.automatic = bool(row.get('automatyczny'))
+        self.products = parse_scope(row.get('zakres_produktow'))
+        self.categories = parse_scope(row.get('zakres_kategorii'))
+        self.has_limits = bool(row.get('limit_dzienny_aktywny') or row.get('limit_miesieczny_aktywny'))
+        self.row = row
+
+    @property
+    def scoped(self):
+        return self.products is not None or self.categories is not None
+
+    def applies_to(self, product_id, categories):
+        if self.products is not None and product_id in self.products:
+            return True
+        return self.categories is not None and not self.categories.isdisjoint(categories)
+
+    def threshold_error(self, basket_total):
+        if basket_total < self.minimum:
+            return f"Minimalna wartość koszyka: {self.minimum} zł"
+        if self.maksimum is not None and basket_total > self.maksimum:
+            return f"Maksymalna wartość koszyka: {self.maksimum} zł"
+        return None
+
+    def discount(self, amount, quantity=None):
+        """Kwota rabatu od wartości (najwyżej cała wartość); rabat kwotowy pozycyjny działa na sztukę"""
+        if self.percent:
+            raw = amount * self.wartosc / 100
+        elif quantity is not None:
+            raw = self.wartosc * quantity
+        else:
+            raw = self.wartosc
+        return raw if raw < amount else amount
+
+    def location_matches(self, location_id):
+        return self.location_id is None or location_id is None or self.location_id == location_id
+
+    def describe(self):
+        return {
+            'rabat_id': self.id,
+            'nazwa': self.nazwa,
+            'typ_rabatu': 'procentowy' if self.percent else 'kwotowy',
+            'wartosc': self.wartosc,
+            'priorytet': self.priorytet,
+            'automatyczny': self.automatic
+        }
+
+
+def _scan_key(rule):
+    """Kolejność przeglądania reguł: priorytet, wartość, id"""
+    return (-rule.priorytet, -rule.wartosc, rule.id)
+
+
+class PricingPlan:
+    """Niezmienny wynik kompilacji - współdzielony przez wątki bez blokad"""
+
+    def __init__(self, products, category_parents, special_prices, rules, today, version=None):
+        self.version = version                      # pricing_plan_version z chwili kompilacji
+        self.products = products                    # id -> (cena brutto, category_id)
+        self.special_prices = special_prices        # (location_id, product_id) -> cena brutto
+        self.today = today                          # ceny specjalne są ważne na ten dzień
+        self.rules = {rule.id: rule for rule in rules}
+        self.rules_by_code = {rule.kod: rule for rule in rules if rule.kod}
+
+        self.category_lineage = {}
+        for category_id in category_parents:
+            lineage, current = [], category_id
+            while current is not None and current not in lineage:
+                lineage.append(current)
+                current = category_parents.get(current)
+            self.category_lineage[category_id] = frozenset(lineage)
+
+        # Indeksy automatycznych promocji
+        self.by_product = {}
+        self.by_category = {}
+        self.basket_rules = []
+        for rule in rules:
+            if not rule.automatic:
+                continue
+            if not rule.scoped:
+                self.basket_rules.append(rule)
+                continue
+            for product_id in rule.products or ():
+                self.by_product.setdefault(product_id, []).append(rule)
+            for category_id in rule.categories or ():
+                self.by_category.setdefault(category_id, []).append(rule)
+        self.basket_rules.sort(key=_scan_key)
+
+        # Listy kandydatów dla (produkt, lokalizacja) i koszyka w lokalizacji - budowane przy
+        # pierwszym użyciu; wyścig wątków najwyżej zbuduje tę samą krotkę dwa razy
+        self._line_candidates = {}
+        self._basket_candidates = {}
+        self.compiled_at = time.time()
+
+    def categories_of(self, category_id):
+        if category_id is None:
+            return frozenset()
+        return self.category_lineage.get(category_id) or frozenset((category_id,))
+
+    def unit_price(self, product_id, location_id):
+        special = self.special_prices.get((location_id, product_id))
+        if special is not None:
+            return special, 'specjalna'
+        product = self.products.get(product_id)
+        if product is not None:
+            return product[0], 'bazowa'
+        return None, None
+
+    def line_candidates(self, product_id, location_id):
+        """Automatyczne rabaty pozycyjne produktu (także z kategorii nadrzędnych) w kolejności przeglądania"""
+        key = (product_id, location_id)
+        candidates = self._line_candidates.get(key)
+        if candidates is None:
+            matched = {rule.id: rule for rule in self.by_product.get(product_id, ())}
+            product = self.products.get(product_id)
+            for category_id in self.categories_of(product[1] if product else None):
+                for rule in self.by_category.get(category_id, ()):
+                    matched[rule.id] = rule
+            candidates = tuple(sorted(
+                (rule for rule in matched.values() if rule.location_matches(location_id)), key=_scan_key
+            ))
+            self._line_candidates[key] = candidates
+        return candidates
+
+    def basket_candidates(self, location_id):
+        candidates = self._basket_candidates.get(location_id)
+        if candidates is None:
+            candidates = tuple(rule for rule in self.basket_rules if rule.location_matches(location_id))
+            self._basket_candidates[location_id] = candidates
+        return candidates
+
+    def stats(self):
+        return {
+            'compiled_at': self.compiled_at,
+            'products': len(self.products),
+            'special_prices': len(self.special_prices),
+            'rules': len(self.rules),
+            'automatic_product_index': len(self.by_product),
+            'automatic_category_index': len(self.by_category),
+            'automatic_basket_rules': len(self.basket_rules),
+            'cached_line_candidates': len(self._line_candidates),
+            'prices_valid_on': self.today
+        }
+
+
+def pick_rule(candidates, amount, quantity, usable):
+    """
+    Najlepszy rabat z listy w kolejności _scan_key: pierwszy poziom priorytetu z regułą
+    spełniającą warunki, w nim największa kwota rabatu, przy remisie niższe id.
+    Dla każdego typu rabatu wystarcza pierwsza nieobcięta reguła - kolejne dają mniej.
+    """
+    best, best_amount = None, 0.0
+    found_percent = found_fixed = False
+    for rule in candidates:
+        if best is not None and rule.priorytet < best.priorytet:
+            break
+        if found_percent if rule.percent else found_fixed:
+            continue
+        if not usable(rule):
+            continue
+        value = rule.discount(amount, quantity)
+        if value < amount:
+            if rule.percent:
+                found_percent = True
+            else:
+                found_fixed = True
+        value = round(value, 2)
+        if best is None or value > best_amount or (value == best_amount and rule.id < best.id):
+            best, best_amount = rule, value
+        if found_percent and found_fixed:
+            break
+    return best, best_amount
+
+
+def evaluate_cart(plan, lines, location_id=None, rabat_ids=(), codes=(), coupons=(),
+                  user_id='', limit_checker=None, today=None):
+    """
+    Przelicz koszyk na skompilowanym planie
+
+    lines: [{'product_id', 'quantity', opcjonalnie 'unit_price'}] - cena podana w pozycji
+    ma pierwszeństwo (np. cena ręczna kasjera); coupons: wiersze kuponów (kod, wartosc, status,
+    data_waznosci); limit_checker(rabat_row, user_id) -> komunikat przekroczenia albo None.
+    """
+    started = time.perf_counter()
+    rejected = []
+
+    # Rabaty wskazane przez kasjera
+    selected = {}
+    for rabat_id in rabat_ids or ():
+        try:
+            rule = plan.rules.get(int(rabat_id))
+        except (TypeError, ValueError):
+            rule = None
+        if rule is None:
+            rejected.append({'rabat_id': rabat_id, 'powod': 'Rabat nie istnieje lub jest nieaktywny'})
+        else:
+            selected[rule.id] = rule
+    for code in codes or ():
+        rule = plan.rules_by_code.get(str(code).strip().upper())
+        if rule is None:
+            rejected.append({'kod_rabatu': code, 'powod': 'Nieznany kod rabatu'})
+        else:
+            selected[rule.id] = rule
+    for rule in list(selected.values()):
+        if not rule.location_matches(location_id):
+            rejected.append({'rabat_id': rule.id, 'powod': 'Rabat nie obowiązuje w tej lokalizacji'})
+            del selected[rule.id]
+        elif rule.has_limits and limit_checker:
+            limit_error = limit_checker(rule.row, user_id)
+            if limit_error:
+                rejected.append({'rabat_id': rule.id, 'powod': limit_error})
+                del selected[rule.id]
+    selected_scoped = sorted((rule for rule in selected.values() if rule.scoped), key=_scan_key)
+    selected_basket = sorted((rule for rule in selected.values() if not rule.scoped), key=_scan_key)
+
+    # 1. Ceny pozycji
+    priced = []
+    subtotal = 0.0
+    for line in lines:
+        product_id = line.get('product_id')
+        quantity = float(line.get('quantity') or 0)
+        if line.get('unit_price') is not None:
+            unit_price, source = float(line['unit_price']), 'pozycja'
+        else:
+            unit_price, source = plan.unit_price(product_id, location_id)
+            if unit_price is None:
+                rejected.append({'product_id': product_id, 'powod': 'Nieznany produkt'})
+                continue
+        gross = unit_price * quantity
+        subtotal += gross
+        priced.append((product_id, quantity, unit_price, source, gross))
+
+    def usable_for(basket_total):
+        def usable(rule):
+            if basket_total < rule.minimum or (rule.maksimum is not None and basket_total > rule.maksimum):
+                return False
+            if rule.has_limits and limit_checker and rule.id not in selected:
+                return limit_checker(rule.row, user_id) is None
+            return True
+        return usable
+
+    # 2. Rabaty pozycyjne (progi koszyka liczone od sumy przed rabatami)
+    usable = usable_for(subtotal)
+    result_lines = []
+    line_discounts = 0.0
+    used_ids = set()
+    for product_id, quantity, unit_price, source, gross in priced:
+        best, amount = None, 0.0
+        if selected_scoped:
+            product = plan.products.get(product_id)
+            categories = plan.categories_of(product[1] if product else None)
+            best, amount = pick_rule(
+                [rule for rule in selected_scoped if rule.applies_to(product_id, categories)],
+                gross, quantity, usable
+            )
+        if best is None:
+            best, amount = pick_rule(plan.line_candidates(product_id, location_id), gross, quantity, usable)
+        if best is not None:
+            used_ids.add(best.id)
+        line_discounts += amount
+        result_lines.append({
+            'product_id': product_id,
+            'quantity': quantity,
+            'unit_price': round(unit_price, 2),
+            'price_source': source,
+            'gross': round(gross, 2),
+            'discount': amount,
+            'rabat_id': best.id if best else None,
+            'total': round(gross - amount, 2)
+        })
+
+    # 3. Rabat koszykowy od sumy po rabatach pozycyjnych
+    after_lines = round(subtotal - line_discounts, 2)
+    usable = usable_for(after_lines)
+    basket_rule, basket_amount = pick_rule(selected_basket, after_lines, None, usable)
+    if basket_rule is None:
+        basket_rule, basket_amount = pick_rule(plan.basket_candidates(location_id), after_lines, None, usable)
+    if basket_rule is not None:
+        used_ids.add(basket_rule.id)
+    for rule in selected.values():
+        if rule.id in used_ids:
+            continue
+        reason = rule.threshold_error(subtotal if rule.scoped else after_lines)
+        rejected.append({'rabat_id': rule.id, 'powod': reason or 'Rabat nie obejmuje pozycji koszyka lub przegrał z innym rabatem'})
+    total = round(after_lines - basket_amount, 2)
+
+    # 4. Kupony od kwoty do zapłaty
+    today = today or date.today().isoformat()
+    to_pay = total
+    applied_coupons = []
+    for coupon in coupons or ():
+        code = coupon.get('kod')
+        if coupon.get('status') != 'aktywny':
+            rejected.append({'kupon': code, 'powod': f"Kupon ma status: {coupon.get('status')}"})
+            continue
+        if coupon.get('data_waznosci') and str(coupon['data_waznosci'])[:10] < today:
+            rejected.append({'kupon': code, 'powod': f"Kupon wygasł {coupon['data_waznosci']}"})
+            continue
+        amount = round(min(float(coupon.get('wartosc') or 0), to_pay), 2)
+        to_pay = round(to_pay - amount, 2)
+        applied_coupons.append({'kod': code, 'wartosc': coupon.get('wartosc'), 'wykorzystano': amount})
+
+    return {
+        'lines': result_lines,
+        'subtotal': round(subtotal, 2),
+        'line_discounts': round(line_discounts, 2),
+        'basket_rabat': dict(basket_rule.describe(), kwota_rabatu=basket_amount) if basket_rule else None,
+        'basket_discount': basket_amount,
+        'total': total,
+        'coupons': applied_coupons,
+        'to_pay': to_pay,
+        'rejected': rejected,
+        'took_us': round((time.perf_counter() - started) * 1_000_000, 1)
+    }
+
+
+class PricingEngine:
+
+    def __init__(self, ttl=PLAN_TTL):
+        self.ttl = ttl
+        self._plan = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self.compilations = 0
+        self.last_compile_ms = None
+
+    def ensure_schema(self, conn=None):
+        """Dodaje kolumny promocji automatycznych do rabaty i wersję planu z triggerami (idempotentnie)"""
+        if self._schema_ready:
+            return True
+        own = conn is None
+        conn = conn or get_db_connection()
+        if not conn:
+            return False
+        try:
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(rabaty)")}
+            for column, definition in RABATY_EXTRA_COLUMNS:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE rabaty ADD COLUMN {column} {definition}")
+            for statement in PLAN_VERSION_SCHEMA:
+                conn.execute(statement)
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table, columns in PLAN_SOURCES:
+                if table in tables:
+                    for statement in plan_version_triggers(table, columns):
+                        conn.execute(statement)
+            conn.commit()
+            self._schema_ready = True
+            return True
+        finally:
+            if own:
+                conn.close()
+
+    def compile(self):
+        """Buduje nowy plan z bazy; bieżący plan działa do momentu podmiany"""
+        started = time.perf_counter()
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        try:
+            self.ensure_schema(conn)
+            today = date.today().isoformat()
+            # Wersja przed odczytem danych - zmiana w trakcie kompilacji wymusi kolejną
+            version = self._read_version(conn)
+
+            products = {}
+            for row in conn.execute("""
+                SELECT id, COALESCE(cena_sprzedazy_brutto, cena, 0) AS cena, category_id FROM produkty
+            """):
+                products[row['id']] = (float(row['cena'] or 0), row['category_id'])
+
+            category_parents = {row['id']: row['parent_id'] for row in conn.execute(
+                "SELECT id, parent_id FROM kategorie_produktow"
+            )}
+
+            # Najpierw ceny magazynów, potem lokalizacji - późniejszy wpis nadpisuje wcześniejszy,
+            # a w obrębie źródła wygrywa cena z najpóźniejszą datą obowiązywania
+            special_prices = {}
+            sources = (
+                """SELECT w.location_id AS location_id, p.product_id, p.cena_sprzedazy_brutto AS cena
+                   FROM warehouse_product_prices p JOIN warehouses w ON w.id = p.warehouse_id""",
+                """SELECT p.location_id AS location_id, p.product_id, p.cena_sprzedazy_brutto AS cena
+                   FROM location_product_prices p"""
+            )
+            for source in sources:
+                try:
+                    rows = conn.execute(source + """
+                        WHERE p.aktywny = 1 AND p.cena_sprzedazy_brutto IS NOT NULL
+                          AND (p.data_od IS NULL OR DATE(p.data_od) <= DATE(?))
+                          AND (p.data_do IS NULL OR DATE(p.data_do) >= DATE(?))
+                        ORDER BY p.data_od, p.id
+                    """, (today, today)).fetchall()
+                except Exception as e:
+                    logger.warning("Pominięto źródło cen specjalnych: %s", e)
+                    continue
+                for row in rows:
+                    if row['location_id'] is not None:
+                        special_prices[(row['location_id'], row['product_id'])] = float(row['cena'])
+
+            rules = [CompiledRule(dict(row)) for row in conn.execute("SELECT * FROM rabaty WHERE aktywny = 1")]
+        finally:
+            conn.close()
+
+        plan = PricingPlan(products, category_parents, special_prices, rules, today, version)
+        self.compilations += 1
+        self.last_compile_ms = round((time.perf_counter() - started) * 1000, 2)
+        logger.info("Skompilowano plan cen: %s reguł, %s produktów, %s cen specjalnych (%.1f ms)",
+                    len(rules), len(products), len(special_prices), self.last_compile_ms)
+        return plan
+
+    @staticmethod
+    def _read_version(conn):
+        row = conn.execute("SELECT version FROM pricing_plan_version WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def version(self, conn=None):
+        """Bieżąca wersja planu w bazie; conn - połączenie wywołującego (także w trakcie jego transakcji)"""
+        if not self._schema_ready:
+            self.ensure_schema()
+        if conn is not None:
+            return self._read_version(conn)
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        try:
+            return self._read_version(conn)
+        finally:
+            conn.close()
+
+    def plan(self, conn=None):
+        """Plan zgodny z bieżącą wersją w bazie - kompilowany ponownie po jej zmianie, po TTL i o północy"""
+        version = self.version(conn)
+        plan = self._plan
+        if (plan is not None and plan.version == version and time.monotonic() < self._expires
+                and plan.today == date.today().isoformat()):
+            return plan
+        with self._lock:
+            if self._plan is plan or self._plan is None:
+                self._plan = self.compile()
+                self._expires = time.monotonic() + self.ttl
+            return self._plan
+
+    def invalidate(self):
+        """Unieważnia plan we wszystkich workerach (podbicie wersji w bazie) i lokalnie"""
+        self._expires = 0.0
+        if not self._schema_ready:
+            self.ensure_schema()
+        conn = get_db_connection()
+        if not conn:
+            return
+        try:
+            conn.execute("UPDATE pricing_plan_version SET version = version + 1 WHERE id = 1")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def evaluate(self, lines, location_id=None, rabat_ids=(), codes=(), coupons=(), user_id='', limit_checker=None):
+        return evaluate_cart(self.plan(), lines, location_id, rabat_ids, codes, coupons, user_id, limit_checker)
+
+    def status(self):
+        plan = self._plan
+        return {
+            'compiled': plan is not None,
+            'ttl_seconds': self.ttl,
+            'version': plan.version if plan else None,
+            'compilations': self.compilations,
+            'last_compile_ms': self.last_compile_ms,
+            'plan': plan.stats() if plan else None
+        }
+
+
+# ------------------------------------------------------------------ benchmark
+
+
+def synthetic_plan(rule_count, product_count, category_count, location_count, seed=42):
+    """Plan z losowymi produktami, kategoriami (3 poziomy), cenami specjalnymi i regułami"""
+    rnd = random.Random(seed)
+    category_parents = {}
+    for category_id in range(1, category_count + 1):
+        category_parents[category_id] = rnd.randint(1, category_id - 1) if category_id > 10 else None
+    products = {pid: (round(rnd.uniform(2, 400), 2), rnd.randint(1, category_count))
+                for pid in range(1, product_count + 1)}
+    special_prices = {(rnd.randint(1, location_count), rnd.randint(1, product_count)): round(rnd.uniform(2, 300), 2)
+                      for _ in range(product_count // 5)}
+    rules = []
+    for rule_id in range(1, rule_count + 1):
+        kind = rnd.random()
+        row = {
+            'id': rule_id,
+            'nazwa': f'Promocja {rule_id}',
+            'typ_rabatu': 'procentowy' if rnd.random() < 0.7 else 'kwotowy',
+            'wartosc': rnd.choice([5, 10, 15, 20, 25]) if rnd.random() < 0.7 else rnd.choice([1, 2, 5, 10]),
+            'kod_rabatu': f'PROMO{rule_id}' if rnd.random() < 0.2 else None,
+            'automatyczny': 1 if rnd.random() < 0.8 else 0,
+            'priorytet': rnd.randint(0, 5),
+            'minimum_koszyka': rnd.choice([0, 0, 50, 100, 200, 500]),
+            'maksimum_koszyka': None,
+            'location_id': rnd.randint(1, location_count) if rnd.random() < 0.3 else None
+        }
+        if kind < 0.6:
+            row['zakres_produktow'] = json.dumps(rnd.sample(range(1, product_count + 1), min(product_count, 20)))
+        elif kind < 0.9:
+            row['zakres_kategorii'] = json.dumps(rnd.sample(range(1, category_count + 1), min(category_count, 3)))
+        rules.append(CompiledRule(row))
+    return PricingPlan(products, category_parents, special_prices, rules, date.today().isoformat())
+
+
+def run_benchmark(rules=5000, products=50000, categories=500, locations=10, lines=40, iterations=2000, seed=42):
+    started = time.perf_counter()
+    plan = synthetic_plan(rules, products, categories, locations, seed)
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    rnd = random.Random(seed + 1)
+    codes = [rule.kod for rule in plan.rules.values() if rule.kod][:5]
+    carts = []
+    for _ in range(50):
+        cart = [{'product_id': rnd.randint(1, products), 'quantity': rnd.randint(1, 4)} for _ in range(lines)]
+        carts.append((cart, rnd.randint(1, locations), codes[:rnd.randint(0, len(codes))]))
+
+    # Pierwsze przeliczenie każdego koszyka buduje listy kandydatów (zimny plan)
+    cold = []
+    for cart, location_id, cart_codes in carts:
+        t0 = time.perf_counter()
+        evaluate_cart(plan, cart, location_id, codes=cart_codes)
+        cold.append((time.perf_counter() - t0) * 1_000_000)
+
+    timings = []
+    for i in range(iterations):
+        cart, location_id, cart_codes = carts[i % len(carts)]
+        t0 = time.perf_counter()
+        evaluate_cart(plan, cart, location_id, codes=cart_codes)
+        timings.append((time.perf_counter() - t0) * 1_000_000)
+    timings.sort()
+
+    def pct(p):
+        return round(timings[min(len(timings) - 1, int(len(timings) * p))], 1)
+
+    return {
+        'rules': rules, 'products': products, 'categories': categories, 'lines': lines,
+        'iterations': iterations, 'compile_ms': round(compile_ms, 1),
+        'cold_avg_us': round(sum(cold) / len(cold), 1),
+        'p50_us': pct(0.50), 'p95_us': pct(0.95), 'p99_us': pct(0.99),
+        'per_line_us': round(pct(0.50) / max(lines, 1), 2)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark przeliczania koszyka na skompilowanym planie promocji')
+    parser.add_argument('--rules', type=int, default=5000)
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--categories', type=int, default=500)
+    parser.add_argument('--locations', type=int, default=10)
+    parser.add_argument('--lines', type=int, default=40, help='pozycje w koszyku')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help='wynik jako JSON')
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args.rules, args.products, args.categories, args.locations,
+                           args.lines, args.iterations, args.seed)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"Reguły: {result['rules']}, produkty: {result['products']}, kategorie: {result['categories']}, "
+              f"pozycje w koszyku: {result['lines']}")
+        print(f"Kompilacja planu: {result['compile_ms']} ms, pierwsze przeliczenie koszyka: "
+              f"średnio {result['cold_avg_us']} µs")
+        print(f"Przeliczenie koszyka: p50 {result['p50_us']} µs, p95 {result['p95_us']} µs, "
+              f"p99 {result['p99_us']} µs ({result['per_line_us']} µs/pozycję)")
+    return 0
+
+
+# Globalna instancja
+pricing_engine = PricingEngine()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
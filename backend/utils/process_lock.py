@@ -0,0 +1,185 @@
+"""
+Wybór jedynej instancji (singleton) między procesami przez blokadę pliku
+Przy kilku workerach gunicorna niektóre zasoby muszą mieć dokładnie jednego
+właściciela: scheduler zadań nocnych (inaczej backup wykona się N razy) oraz
+port szeregowy drukarki fiskalnej. Właścicielem zostaje proces, który pierwszy
+założy wyłączną blokadę (flock) na pliku w katalogu .locks obok bazy danych.
+System zwalnia blokadę automatycznie, gdy proces się zakończy - także po
+awarii - więc kolejny worker może przejąć rolę.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _default_lock_dir():
+    db_path = os.environ.get('DATABASE_PATH') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'kupony.db'
+    )
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), '.locks')
+
+
+class ProcessLock:
+    """Wyłączna, nieblokująca blokada pliku trzymana do końca życia procesu (lub release)"""
+
+    def __init__(self, name, lock_dir=None):
+        self.name = name
+        self.lock_dir = lock_dir or _default_lock_dir()
+        self.path = os.path.join(self.lock_dir, f"{name}.lock")
+        self._handle = None
+        self.acquired_at = None
+
+    @property
+    def held(self):
+        return self._handle is not None
+
+    def acquire(self):
+        """Próbuje zostać właścicielem; zwraca True gdy się udało (nigdy nie czeka)"""
+        if self._handle is not None:
+            return True
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        handle = open(self.path, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            handle.close()
+            return False
+
+        self._handle = handle
+        self.acquired_at = datetime.now().isoformat()
+        # Zapisz dane właściciela dla pozostałych procesów (tylko informacyjnie)
+        handle.seek(0)
+        handle.truncate()
+        handle.write(json.dumps({
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'acquired_at': self.acquired_at
+        }))
+        handle.flush()
+        return True
+
+    def release(self):
+        if self._handle is None:
+            return
+        try:
+            self._handle.seek(0)
+            self._handle.truncate()
+            self._handle.flush()
+            if fcntl:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._handle.close()
+            self._handle = None
+            self.acquired_at = None
+
+    def owner(self):
+        """Dane aktualnego właściciela zapisane w pliku blokady (lub None)"""
+        try:
+            with open(self.path, 'r') as f:
+                content = f.read().strip()
+            return json.loads(content) if content else None
+        except (OSError, ValueError):
+            return None
+
+
+class SingletonElection:
+    """
+    Rejestr ról jednoinstancyjnych procesu. Proces, który przegrał wybory, może
+    czekać w tle (standby) i przejąć rolę po zakończeniu właściciela.
+    """
+
+    STANDBY_INTERVAL = 30  # Co ile sekund proces rezerwowy ponawia próbę
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir
+        self._locks = {}
+        self._standby = {}
+        self._lock = threading.Lock()
+
+    def _get_lock(self, name):
+        with self._lock:
+            if name not in self._locks:
+                self._locks[name] = ProcessLock(name, self.lock_dir)
+            return self._locks[name]
+
+    def elect(self, name):
+        """Zwraca True jeśli ten proces jest (lub właśnie został) właścicielem roli"""
+        lock = self._get_lock(name)
+        if lock.acquire():
+            print(f"👑 Proces {os.getpid()} jest właścicielem roli '{name}'")
+            return True
+        return False
+
+    def is_owner(self, name):
+        lock = self._locks.get(name)
+        return bool(lock and lock.held)
+
+    def owner(self, name):
+        return self._get_lock(name).owner()
+
+    def standby(self, name, on_elected, interval=None):
+        """
+        Uruchamia wątek, który co `interval` sekund próbuje przejąć rolę
+        i po sukcesie wywołuje on_elected()
+        """
+        with self._lock:
+            if name in self._standby:
+                return
+            self._standby[name] = True
+
+        interval = interval or self.STANDBY_INTERVAL
+
+        def wait_for_role():
+            while not self.elect(name):
+                time.sleep(interval)
+            with self._lock:
+                self._standby.pop(name, None)
+            try:
+                on_elected()
+            except Exception as e:
+                print(f"❌ Błąd przejęcia roli '{name}': {e}")
+
+        threading.Thread(target=wait_for_role, name=f"standby-{name}", daemon=True).start()
+
+    def resign(self, name):
+        lock = self._locks.get(name)
+        if lock:
+            lock.release()
+
+    def status(self, names=()):
+        """Stan ról (znanych procesowi oraz podanych w `names`) z punktu widzenia bieżącego procesu"""
+        with self._lock:
+            names = set(names) | set(self._locks) | set(self._standby)
+        return {
+            'pid': os.getpid(),
+            'roles': {
+                name: {
+                    'owned': self.is_owner(name),
+                    'standby': name in self._standby,
+                    'owner': self.owner(name)
+                }
+                for name in sorted(names)
+            }
+        }
+
+
+# Globalny rejestr ról jednoinstancyjnych
+singleton_election = SingletonElection()
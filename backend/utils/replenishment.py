@@ -0,0 +1,213 @@
+"""
+Planowanie uzupełnień magazynu - punkty ponownego zamówienia i prognoza braków
+Zadanie wsadowe liczy per produkt/lokalizacja: tempo sprzedaży, czas dostawy
+(z historii faktur zakupowych), zapas bezpieczeństwa, punkt zamówienia oraz
+przewidywaną liczbę dni do wyczerpania stanu. Wynik trafia do tabeli
+replenishment_plan, z której endpoint raportu czyta jednym indeksowanym zapytaniem.
+"""
+
+import math
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from utils.database import get_db_connection
+from utils.sales_facts import sales_fact_store
+
+
+class ReplenishmentPlanner:
+
+    def __init__(self):
+        self.ANALYSIS_DAYS = 56  # Okno analizy sprzedaży (8 tygodni)
+        self.DEFAULT_LEAD_TIME_DAYS = 7  # Czas dostawy gdy brak historii faktur
+        self.MAX_LEAD_TIME_DAYS = 60  # Odcięcie błędnych dat w fakturach
+        self.DEFAULT_REVIEW_PERIOD_DAYS = 7  # Cykl zamawiania gdy brak historii
+        self.SERVICE_LEVEL_Z = 1.65  # ~95% poziom obsługi
+
+    def ensure_tables(self, cursor):
+        """Utwórz tabelę planu uzupełnień jeśli nie istnieje"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS replenishment_plan (
+                product_id INTEGER NOT NULL,
+                location_id INTEGER NOT NULL,
+                warehouse_id INTEGER,
+                avg_daily_sales REAL DEFAULT 0,
+                sales_std REAL DEFAULT 0,
+                lead_time_days REAL DEFAULT 0,
+                review_period_days REAL DEFAULT 0,
+                safety_stock REAL DEFAULT 0,
+                reorder_point REAL DEFAULT 0,
+                order_up_to REAL DEFAULT 0,
+                stock_on_hand REAL DEFAULT 0,
+                days_to_stockout REAL,
+                predicted_stockout_date TEXT,
+                suggested_order_qty REAL DEFAULT 0,
+                needs_reorder INTEGER DEFAULT 0,
+                computed_at TEXT NOT NULL,
+                PRIMARY KEY (product_id, location_id),
+                FOREIGN KEY (product_id) REFERENCES produkty(id),
+                FOREIGN KEY (location_id) REFERENCES locations(id)
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_replenishment_location_reorder
+            ON replenishment_plan(location_id, needs_reorder, days_to_stockout)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_replenishment_warehouse_reorder
+            ON replenishment_plan(warehouse_id, needs_reorder, days_to_stockout)
+        """)
+
+    def run(self):
+        """
+        Przelicza cały plan uzupełnień i zapisuje go w jednej transakcji
+        """
+        started = datetime.now()
+        series_keys, daily = sales_fact_store.daily_matrix(self.ANALYSIS_DAYS)
+
+        conn = get_db_connection()
+        if not conn:
+            return {'success': False, 'error': 'Brak połączenia z bazą danych'}
+        try:
+            cursor = conn.cursor()
+            self.ensure_tables(cursor)
+
+            lead_times = self._load_lead_times(cursor)
+            stock = self._load_stock(cursor)
+            warehouses = self._load_warehouses(cursor)
+
+            velocity = daily.mean(axis=1) if len(series_keys) else np.zeros(0)
+            deviation = daily.std(axis=1) if len(series_keys) else np.zeros(0)
+            sales = {
+                (int(key[0]), int(key[1])): (float(velocity[i]), float(deviation[i]))
+                for i, key in enumerate(series_keys)
+                if key[1]  # Sprzedaż bez lokalizacji nie ma magazynu do uzupełnienia
+            }
+
+            today = date.today()
+            computed_at = started.isoformat()
+            rows = []
+            for key in set(sales) | set(stock):
+                product_id, location_id = key
+                avg_daily, std_daily = sales.get(key, (0.0, 0.0))
+                on_hand, min_level = stock.get(key, (0.0, 0.0))
+                lead_time, review_period = lead_times.get(
+                    product_id, (self.DEFAULT_LEAD_TIME_DAYS, self.DEFAULT_REVIEW_PERIOD_DAYS)
+                )
+
+                safety_stock = self.SERVICE_LEVEL_Z * std_daily * math.sqrt(lead_time)
+                reorder_point = max(avg_daily * lead_time + safety_stock, min_level)
+                order_up_to = reorder_point + avg_daily * review_period
+
+                if avg_daily > 0:
+                    days_to_stockout = max(on_hand, 0) / avg_daily
+                    stockout_date = (today + timedelta(days=int(days_to_stockout))).isoformat()
+                else:
+                    days_to_stockout = None
+                    stockout_date = None
+
+                needs_reorder = reorder_point > 0 and on_hand <= reorder_point
+                suggested = math.ceil(round(order_up_to - on_hand, 6)) if needs_reorder else 0
+
+                rows.append((
+                    product_id, location_id, warehouses.get(location_id),
+                    round(avg_daily, 4), round(std_daily, 4),
+                    round(lead_time, 2), round(review_period, 2),
+                    round(safety_stock, 2), round(reorder_point, 2), round(order_up_to, 2),
+                    on_hand,
+                    round(days_to_stockout, 1) if days_to_stockout is not None else None,
+                    stockout_date, max(suggested, 0), 1 if needs_reorder else 0,
+                    computed_at
+                ))
+
+            cursor.execute("DELETE FROM replenishment_plan")
+            cursor.executemany("""
+                INSERT INTO replenishment_plan (
+                    product_id, location_id, warehouse_id,
+                    avg_daily_sales, sales_std, lead_time_days, review_period_days,
+                    safety_stock, reorder_point, order_up_to, stock_on_hand,
+                    days_to_stockout, predicted_stockout_date, suggested_order_qty,
+                    needs_reorder, computed_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.commit()
+
+            return {
+                'success': True,
+                'rows': len(rows),
+                'needs_reorder': sum(1 for r in rows if r[14]),
+                'duration_ms': round((datetime.now() - started).total_seconds() * 1000, 1),
+                'computed_at': computed_at
+            }
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Błąd przeliczania planu uzupełnień: {e}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            conn.close()
+
+    def _load_lead_times(self, cursor):
+        """
+        Czas dostawy i cykl zamawiania per produkt z historii faktur zakupowych.
+        Czas dostawy = data przyjęcia PZ (lub data dostawy) - data faktury,
+        cykl = średni odstęp między kolejnymi fakturami z produktem.
+        """
+        cursor.execute("""
+            SELECT
+                fzp.produkt_id,
+                AVG(MAX(julianday(COALESCE(wr.receipt_date, fz.data_dostawy, fz.data_faktury))
+                        - julianday(fz.data_faktury), 0)) as lead_time,
+                COUNT(DISTINCT fz.id) as deliveries,
+                julianday(MAX(fz.data_faktury)) - julianday(MIN(fz.data_faktury)) as history_span
+            FROM faktury_zakupowe_pozycje fzp
+            JOIN faktury_zakupowe fz ON fzp.faktura_id = fz.id
+            LEFT JOIN warehouse_receipts wr ON wr.source_invoice_id = fz.id
+                AND wr.type = 'external' AND wr.status = 'completed'
+            WHERE fzp.produkt_id IS NOT NULL
+            GROUP BY fzp.produkt_id
+        """)
+
+        lead_times = {}
+        for row in cursor.fetchall():
+            lead_time = row['lead_time']
+            if lead_time is None or lead_time > self.MAX_LEAD_TIME_DAYS:
+                lead_time = self.DEFAULT_LEAD_TIME_DAYS
+            lead_time = max(lead_time, 1)
+
+            if row['deliveries'] > 1 and row['history_span']:
+                review_period = row['history_span'] / (row['deliveries'] - 1)
+            else:
+                review_period = self.DEFAULT_REVIEW_PERIOD_DAYS
+
+            lead_times[row['produkt_id']] = (lead_time, review_period)
+        return lead_times
+
+    def _load_stock(self, cursor):
+        """Stan i minimum per (produkt, lokalizacja) z pos_magazyn"""
+        cursor.execute("""
+            SELECT produkt_id, lokalizacja, stan_aktualny, stan_minimalny
+            FROM pos_magazyn
+            WHERE lokalizacja IS NOT NULL AND lokalizacja != ''
+        """)
+        stock = {}
+        for row in cursor.fetchall():
+            try:
+                location_id = int(row['lokalizacja'])
+            except (TypeError, ValueError):
+                continue
+            stock[(row['produkt_id'], location_id)] = (row['stan_aktualny'] or 0, row['stan_minimalny'] or 0)
+        return stock
+
+    def _load_warehouses(self, cursor):
+        """Mapowanie lokalizacja -> magazyn (pierwszy aktywny magazyn lokalizacji)"""
+        cursor.execute("""
+            SELECT location_id, MIN(id) as warehouse_id
+            FROM warehouses
+            WHERE aktywny = 1
+            GROUP BY location_id
+        """)
+        return {row['location_id']: row['warehouse_id'] for row in cursor.fetchall()}
+
+
+# Globalna instancja planera uzupełnień
+replenishment_planner = ReplenishmentPlanner()
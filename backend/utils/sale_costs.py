@@ -0,0 +1,290 @@
+"""
+Koszt sprzedaży (COGS) per pozycja paragonu
+Przy finalizacji sprzedaży koszt każdej pozycji jest pobierany z warstw kosztu: partie
+FIFO (product_batches) magazynu lokalizacji transakcji, a dla ilości bez partii - ruchoma
+średnia ceny zakupu magazynu (utils.moving_average), w ostateczności cena zakupu z kartoteki
+produktu. Wynik zapisywany jest w pos_pozycje:
+- koszt_netto - koszt całej pozycji (NULL = jeszcze nie wyliczony),
+- cena_zakupu_fifo - koszt jednostkowy, marza_procent_fifo - marża zrealizowana,
+- metoda_obliczania_marzy - 'fifo', 'mixed' (część z partii), 'average', 'last' albo 'none'.
+Odczyt pozycji bez kosztu, wydanie partii i zapis kosztów odbywają się w jednej transakcji.
+Raporty marż sumują gotowe koszty pozycji zamiast wyliczać ceny zakupu w chwili raportu;
+przychód pozycji to wartość netto po rabacie koszykowym (NET_REVENUE_SQL).
+"""
+
+import argparse
+import json
+from datetime import datetime
+
+from utils.database import get_db_connection
+from utils.moving_average import moving_average
+
+# Koszt jednostkowy z kartoteki produktu - ta sama kolejność co w MarginService._get_default_purchase_price
+FALLBACK_COST_SQL = """
+    COALESCE(NULLIF(p.cena_zakupu_netto, 0), NULLIF(p.cena_zakupu_brutto, 0) / 1.23,
+             NULLIF(p.cena_zakupu, 0), 0)
+"""
+
+# Przychód netto pozycji (pp) po rabacie koszykowym transakcji (t): rabat_kwota (brutto) nie jest
+# ujęty w wartościach pozycji - rozkładany proporcjonalnie do ich udziału w suma_brutto
+NET_REVENUE_SQL = """
+    (pp.wartosc_netto * CASE WHEN t.suma_brutto > 0 AND t.rabat_kwota > 0
+        THEN 1 - MIN(t.rabat_kwota, t.suma_brutto) / t.suma_brutto ELSE 1 END)
+"""
+
+EPSILON = 1e-9
+
+
+def line_margin(revenue_net, cost_net):
+    """MARŻA = (sprzedaż - koszt) / sprzedaż × 100% (jak w MarginService)"""
+    if not revenue_net or revenue_net <= 0:
+        return 0.0
+    return round((revenue_net - cost_net) / revenue_net * 100, 2)
+
+
+class SaleCostEngine:
+
+    def __init__(self):
+        self._schema_ready = False
+
+    def ensure_schema(self, cursor):
+        """Kolumna koszt_netto w pos_pozycje (pozostałe kolumny kosztu istnieją w schemacie)"""
+        if self._schema_ready:
+            return
+        cursor.execute("PRAGMA table_info(pos_pozycje)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if 'koszt_netto' not in columns:
+            cursor.execute("ALTER TABLE pos_pozycje ADD COLUMN koszt_netto REAL")
+        for name, definition in (('cena_zakupu_fifo', 'REAL DEFAULT 0'),
+                                 ('marza_procent_fifo', 'REAL DEFAULT 0'),
+                                 ('metoda_obliczania_marzy', "TEXT DEFAULT 'fifo'")):
+            if name not in columns:
+                cursor.execute(f"ALTER TABLE pos_pozycje ADD COLUMN {name} {definition}")
+        self._schema_ready = True
+
+    @staticmethod
+    def fallback_costs(cursor, product_ids):
+        """{produkt_id: koszt jednostkowy netto} z kartoteki produktów"""
+        product_ids = list({int(pid) for pid in product_ids})
+        if not product_ids:
+            return {}
+        cursor.execute(f"""
+            SELECT p.id, {FALLBACK_COST_SQL}
+            FROM produkty p
+            WHERE p.id IN ({','.join('?' * len(product_ids))})
+        """, product_ids)
+        return {row[0]: float(row[1] or 0) for row in cursor.fetchall()}
+
+    @staticmethod
+    def _warehouse_for_location(cursor, location_id):
+        cursor.execute("SELECT id FROM warehouses WHERE location_id = ? ORDER BY id LIMIT 1", (location_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _products_with_batches(cursor, warehouse_id, product_ids):
+        product_ids = list({int(pid) for pid in product_ids})
+        if warehouse_id is None or not product_ids:
+            return set()
+        cursor.execute(f"""
+            SELECT DISTINCT product_id FROM product_batches
+            WHERE warehouse_id = ? AND status = 'active' AND current_quantity > 0
+              AND product_id IN ({','.join('?' * len(product_ids))})
+        """, [warehouse_id] + product_ids)
+        return {row[0] for row in cursor.fetchall()}
+
+    def capture(self, transakcja_id, strategy='fifo', created_by='system'):
+        """
+        Wylicza i zapisuje koszt pozycji transakcji, które go jeszcze nie mają
+        Pozycje są czytane w transakcji wydania partii (fifo_service.sell), więc równoległe
+        wyliczenie tej samej transakcji (finalizacja i uzupełnianie) nie wyda partii drugi raz
+        """
+        from api.fifo_service import fifo_service
+
+        fifo_service.ensure_schema()
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        try:
+            cursor = conn.cursor()
+            self.ensure_schema(cursor)
+            conn.commit()
+            cursor.execute("SELECT location_id FROM pos_transakcje WHERE id = ?", (transakcja_id,))
+            row = cursor.fetchone()
+            if not row:
+                return {'lines': 0, 'cost_net': 0.0, 'fifo_lines': 0}
+            warehouse_id = self._warehouse_for_location(cursor, row[0] or 5)
+        finally:
+            conn.close()
+
+        state = {'lines': [], 'fifo_lines': [], 'fallback': {}}
+        summary = {'lines': 0, 'cost_net': 0.0, 'fifo_lines': 0}
+
+        def uncosted(cursor):
+            cursor.execute(f"""
+                SELECT pp.id, pp.produkt_id, pp.ilosc, {NET_REVENUE_SQL} AS przychod_netto
+                FROM pos_pozycje pp
+                JOIN pos_transakcje t ON t.id = pp.transakcja_id
+                WHERE pp.transakcja_id = ? AND pp.koszt_netto IS NULL
+                ORDER BY pp.id
+            """, (transakcja_id,))
+            lines = [dict(row) for row in cursor.fetchall()]
+            if not lines:
+                return []
+            product_ids = [line['produkt_id'] for line in lines]
+            fallback = {pid: (unit, 'last') for pid, unit in self.fallback_costs(cursor, product_ids).items()}
+            if warehouse_id is not None:
+                fallback.update((pid, (unit, 'average'))
+                                for pid, unit in moving_average.costs(cursor, product_ids, warehouse_id).items()
+                                if unit > 0)
+            batched = self._products_with_batches(cursor, warehouse_id, product_ids)
+            fifo_lines = [line for line in lines if line['produkt_id'] in batched and (line['ilosc'] or 0) > 0]
+            state.update(lines=lines, fifo_lines=fifo_lines, fallback=fallback)
+            return [(line['produkt_id'], line['ilosc']) for line in fifo_lines]
+
+        def write_costs(cursor, results):
+            lines, fallback = state['lines'], state['fallback']
+            if not lines:
+                return
+            allocated = {line['id']: result for line, result in zip(state['fifo_lines'], results)}
+            updates, total = [], 0.0
+            for line in lines:
+                quantity = float(line['ilosc'] or 0)
+                unit_fallback, fallback_method = fallback.get(line['produkt_id'], (0.0, 'none'))
+                result = allocated.get(line['id'])
+                if result and result.allocated_quantity > EPSILON:
+                    rest = quantity - result.allocated_quantity
+                    cost = result.cost_net + max(rest, 0) * unit_fallback
+                    method = 'fifo' if rest <= EPSILON else 'mixed'
+                else:
+                    cost = quantity * unit_fallback
+                    method = fallback_method if unit_fallback > 0 else 'none'
+                cost = round(cost, 4)
+                total += cost
+                unit = round(cost / quantity, 4) if quantity else unit_fallback
+                updates.append((cost, unit, line_margin(line['przychod_netto'], cost), method, line['id']))
+            cursor.executemany("""
+                UPDATE pos_pozycje
+                SET koszt_netto = ?, cena_zakupu_fifo = ?, marza_procent_fifo = ?, metoda_obliczania_marzy = ?
+                WHERE id = ? AND koszt_netto IS NULL
+            """, updates)
+            summary.update(lines=len(updates), cost_net=round(total, 2),
+                           fifo_lines=sum(1 for u in updates if u[3] in ('fifo', 'mixed')))
+
+        fifo_service.sell(warehouse_id, uncosted, strategy=strategy, document_type='pos_sale',
+                          document_id=transakcja_id, created_by=created_by, then=write_costs)
+        return summary
+
+    def backfill(self, date_from=None):
+        """
+        Koszt historycznych pozycji bez koszt_netto - z bieżącej średniej ruchomej magazynu ('average')
+        albo ceny zakupu produktu ('last'); partie nie są wydawane wstecz; jedno UPDATE ... FROM
+        """
+        started = datetime.now()
+        conn = get_db_connection()
+        if not conn:
+            return {'success': False, 'error': 'Brak połączenia z bazą danych'}
+        try:
+            cursor = conn.cursor()
+            self.ensure_schema(cursor)
+            moving_average.ensure_schema(cursor)
+            date_filter, params = '', []
+            if date_from:
+                date_filter, params = 'AND t.data_transakcji >= ?', [date_from]
+            cursor.execute(f"""
+                UPDATE pos_pozycje
+                SET koszt_netto = ROUND(src.unit * pos_pozycje.ilosc, 4),
+                    cena_zakupu_fifo = ROUND(src.unit, 4),
+                    marza_procent_fifo = CASE WHEN src.revenue > 0
+                        THEN ROUND((src.revenue - src.unit * pos_pozycje.ilosc) / src.revenue * 100, 2)
+                        ELSE 0 END,
+                    metoda_obliczania_marzy = CASE WHEN src.unit <= 0 THEN 'none'
+                        WHEN src.average > 0 THEN 'average' ELSE 'last' END
+                FROM (
+                    SELECT pp.id, m.avg_cost_net AS average, {NET_REVENUE_SQL} AS revenue,
+                           COALESCE(NULLIF(m.avg_cost_net, 0), {FALLBACK_COST_SQL}) AS unit
+                    FROM pos_pozycje pp
+                    JOIN pos_transakcje t ON t.id = pp.transakcja_id
+                    LEFT JOIN produkty p ON p.id = pp.produkt_id
+                    LEFT JOIN moving_average_cost m ON m.product_id = pp.produkt_id
+                         AND m.warehouse_id = (SELECT MIN(w.id) FROM warehouses w
+                                               WHERE w.location_id = COALESCE(t.location_id, 5))
+                    WHERE pp.koszt_netto IS NULL AND t.status = 'zakonczony' {date_filter}
+                ) AS src
+                WHERE pos_pozycje.id = src.id
+            """, params)
+            updated = cursor.rowcount
+            conn.commit()
+            return {
+                'success': True,
+                'updated': updated,
+                'duration_ms': round((datetime.now() - started).total_seconds() * 1000, 1),
+                'computed_at': started.isoformat()
+            }
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Błąd uzupełniania kosztów sprzedaży: {e}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            conn.close()
+
+    def unit_costs(self, product_ids, days=90, location_id=None):
+        """
+        {produkt_id: (koszt jednostkowy, metoda)} - średni zrealizowany koszt z pozycji sprzedaży
+        z ostatnich `days` dni; produkty bez sprzedaży - koszt z kartoteki ('last')
+        """
+        product_ids = list({int(pid) for pid in product_ids if pid})
+        if not product_ids:
+            return {}
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            self.ensure_schema(cursor)
+            placeholders = ','.join('?' * len(product_ids))
+            location_filter, params = '', [f'-{int(days)} days'] + product_ids
+            if location_id:
+                location_filter = 'AND t.location_id = ?'
+                params.append(int(location_id))
+            cursor.execute(f"""
+                SELECT pp.produkt_id, SUM(pp.koszt_netto) / SUM(pp.ilosc)
+                FROM pos_transakcje t
+                JOIN pos_pozycje pp ON pp.transakcja_id = t.id
+                WHERE t.status = 'zakonczony' AND t.data_transakcji >= date('now', ?)
+                  AND pp.produkt_id IN ({placeholders}) AND pp.koszt_netto IS NOT NULL
+                  AND pp.metoda_obliczania_marzy != 'none' {location_filter}
+                GROUP BY pp.produkt_id
+                HAVING SUM(pp.ilosc) > 0
+            """, params)
+            costs = {row[0]: (float(row[1]), 'realized') for row in cursor.fetchall()}
+            missing = [pid for pid in product_ids if pid not in costs]
+            for pid, unit in self.fallback_costs(cursor, missing).items():
+                costs[pid] = (unit, 'last')
+            return costs
+        finally:
+            conn.close()
+
+
+# Globalna instancja
+sale_costs = SaleCostEngine()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Koszt sprzedaży per pozycja paragonu")
+    parser.add_argument('--backfill', action='store_true',
+                        help="uzupełnij koszt pozycji historycznych (średnia ruchoma / cena zakupu)")
+    parser.add_argument('--from', dest='date_from', help="tylko transakcje od daty (YYYY-MM-DD)")
+    parser.add_argument('--transaction', type=int, help="wylicz koszt pozycji jednej transakcji")
+    args = parser.parse_args(argv)
+
+    if args.transaction:
+        result = sale_costs.capture(args.transaction)
+    elif args.backfill:
+        result = sale_costs.backfill(args.date_from)
+    else:
+        parser.print_help()
+        return
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
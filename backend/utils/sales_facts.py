@@ -0,0 +1,234 @@
+"""
+Kolumnowy cache faktów sprzedaży (pozycje paragonów) dla raportów produktowych
+Przechowuje w pamięci kolumny NumPy: produkt, lokalizacja, dzień, ilość, wartość, koszt.
+Cache jest doładowywany przyrostowo po id pozycji, więc raporty rotacji i bestsellerów
+to wektorowe group-by zamiast ponownych JOIN-ów przy każdym żądaniu.
+"""
+
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+from utils.database import get_db_connection
+
+COMPLETED_STATUS = 'zakonczony'
+
+COLUMNS = {
+    'line_id': np.int64,
+    'transaction_id': np.int64,
+    'product_id': np.int64,
+    'location_id': np.int64,
+    'day': np.int32,  # date.toordinal() dnia transakcji
+    'quantity': np.float64,
+    'unit_price': np.float64,
+    'revenue': np.float64,
+    'cost': np.float64
+}
+
+
+class SalesFactStore:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self._chunks = []  # Nowe partie przed scaleniem z kolumnami
+        self._last_line_id = 0
+        self._pending_transactions = set()  # Transakcje jeszcze niezakończone
+
+    def _fetch_lines(self, cursor, where, params):
+        cursor.execute(f"""
+            SELECT
+                pp.id,
+                pp.transakcja_id,
+                pp.produkt_id,
+                COALESCE(pt.location_id, 0),
+                pt.data_transakcji,
+                pp.ilosc,
+                pp.cena_jednostkowa,
+                pp.wartosc_brutto,
+                COALESCE(pp.cena_zakupu_fifo, 0) * pp.ilosc,
+                pt.status
+            FROM pos_pozycje pp
+            JOIN pos_transakcje pt ON pp.transakcja_id = pt.id
+            WHERE {where}
+            ORDER BY pp.id
+        """, params)
+        return cursor.fetchall()
+
+    def _append_rows(self, rows):
+        """Dodaje wiersze zakończonych transakcji jako nową partię kolumn"""
+        if not rows:
+            return
+        day_cache = {}
+        days = []
+        for row in rows:
+            raw_day = row[4]
+            if raw_day not in day_cache:
+                try:
+                    day_cache[raw_day] = date.fromisoformat(str(raw_day)[:10]).toordinal()
+                except ValueError:
+                    day_cache[raw_day] = 0
+            days.append(day_cache[raw_day])
+
+        chunk = {
+            'line_id': np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)),
+            'transaction_id': np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows)),
+            'product_id': np.fromiter((r[2] for r in rows), dtype=np.int64, count=len(rows)),
+            'location_id': np.fromiter((r[3] or 0 for r in rows), dtype=np.int64, count=len(rows)),
+            'day': np.array(days, dtype=np.int32),
+            'quantity': np.fromiter((r[5] or 0 for r in rows), dtype=np.float64, count=len(rows)),
+            'unit_price': np.fromiter((r[6] or 0 for r in rows), dtype=np.float64, count=len(rows)),
+            'revenue': np.fromiter((r[7] or 0 for r in rows), dtype=np.float64, count=len(rows)),
+            'cost': np.fromiter((r[8] or 0 for r in rows), dtype=np.float64, count=len(rows))
+        }
+        self._chunks.append(chunk)
+
+    def _consolidate(self):
+        if not self._chunks:
+            return
+        for name in COLUMNS:
+            self._columns[name] = np.concatenate([self._columns[name]] + [c[name] for c in self._chunks])
+        self._chunks = []
+
+    def refresh(self):
+        """
+        Doładowuje nowe pozycje (id > ostatnio wczytane) oraz pozycje transakcji,
+        które w międzyczasie zostały zakończone. Zwraca liczbę dodanych wierszy.
+        """
+        with self._lock:
+            conn = get_db_connection()
+            if not conn:
+                return 0
+            added = 0
+            try:
+                cursor = conn.cursor()
+
+                # 1. Transakcje oczekujące - po zakończeniu wczytaj ich pozycje w całości
+                if self._pending_transactions:
+                    pending = list(self._pending_transactions)
+                    placeholders = ','.join('?' * len(pending))
+                    cursor.execute(f"""
+                        SELECT id, status FROM pos_transakcje WHERE id IN ({placeholders})
+                    """, pending)
+                    statuses = {row[0]: row[1] for row in cursor.fetchall()}
+
+                    completed = [tid for tid in pending if statuses.get(tid) == COMPLETED_STATUS]
+                    for tid in pending:
+                        # Usunięte lub anulowane transakcje nie wrócą do sprzedaży
+                        if tid not in statuses or statuses[tid] not in (COMPLETED_STATUS, 'w_trakcie', 'draft'):
+                            self._pending_transactions.discard(tid)
+
+                    if completed:
+                        placeholders = ','.join('?' * len(completed))
+                        rows = self._fetch_lines(
+                            cursor, f"pp.transakcja_id IN ({placeholders}) AND pp.id <= ?",
+                            completed + [self._last_line_id]
+                        )
+                        self._append_rows(rows)
+                        added += len(rows)
+                        self._pending_transactions.difference_update(completed)
+
+                # 2. Nowe pozycje
+                rows = self._fetch_lines(cursor, "pp.id > ?", (self._last_line_id,))
+                if rows:
+                    self._last_line_id = rows[-1][0]
+                    completed_rows = [r for r in rows if r[9] == COMPLETED_STATUS]
+                    self._pending_transactions.update(r[1] for r in rows if r[9] != COMPLETED_STATUS)
+                    self._append_rows(completed_rows)
+                    added += len(completed_rows)
+            finally:
+                conn.close()
+
+            self._consolidate()
+            return added
+
+    def reset(self):
+        """Czyści cache - kolejny refresh wczyta wszystkie pozycje od nowa"""
+        with self._lock:
+            self._columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+            self._chunks = []
+            self._last_line_id = 0
+            self._pending_transactions = set()
+
+    def _window_mask(self, columns, days, location_id):
+        mask = columns['day'] >= (date.today() - timedelta(days=days)).toordinal()
+        if location_id:
+            mask &= columns['location_id'] == int(location_id)
+        return mask
+
+    def aggregate_by_product(self, days=30, location_id=None):
+        """
+        Agregacja sprzedaży per produkt w oknie ostatnich `days` dni.
+        Zwraca słownik {product_id: {quantity, revenue, cost, transactions_count, avg_price}}.
+        """
+        self.refresh()
+        with self._lock:
+            columns = dict(self._columns)
+
+        mask = self._window_mask(columns, days, location_id)
+        products = columns['product_id'][mask]
+        if products.size == 0:
+            return {}
+
+        product_ids, index = np.unique(products, return_inverse=True)
+        index = index.reshape(-1)
+        n = len(product_ids)
+
+        quantity = np.bincount(index, weights=columns['quantity'][mask], minlength=n)
+        revenue = np.bincount(index, weights=columns['revenue'][mask], minlength=n)
+        cost = np.bincount(index, weights=columns['cost'][mask], minlength=n)
+        line_count = np.bincount(index, minlength=n)
+        price_sum = np.bincount(index, weights=columns['unit_price'][mask], minlength=n)
+
+        # COUNT(DISTINCT transakcja) per produkt
+        pairs = np.unique(np.stack([index, columns['transaction_id'][mask]], axis=1), axis=0)
+        transactions = np.bincount(pairs[:, 0], minlength=n)
+
+        return {
+            int(pid): {
+                'quantity': float(quantity[i]),
+                'revenue': float(revenue[i]),
+                'cost': float(cost[i]),
+                'transactions_count': int(transactions[i]),
+                'avg_price': float(price_sum[i] / line_count[i])
+            }
+            for i, pid in enumerate(product_ids)
+        }
+
+    def daily_matrix(self, days=56, location_id=None):
+        """
+        Dzienna sprzedaż per (produkt, lokalizacja) w oknie ostatnich `days` dni (bez dnia bieżącego).
+        Zwraca (klucze serii [n, 2] = produkt, lokalizacja; macierz ilości [n, days]).
+        """
+        self.refresh()
+        with self._lock:
+            columns = dict(self._columns)
+
+        today = date.today().toordinal()
+        mask = (columns['day'] >= today - days) & (columns['day'] < today)
+        if location_id:
+            mask &= columns['location_id'] == int(location_id)
+
+        pairs = np.stack([columns['product_id'][mask], columns['location_id'][mask]], axis=1)
+        if pairs.shape[0] == 0:
+            return np.zeros((0, 2), dtype=np.int64), np.zeros((0, days))
+
+        series_keys, series_index = np.unique(pairs, axis=0, return_inverse=True)
+        matrix = np.zeros((len(series_keys), days))
+        np.add.at(matrix, (series_index.reshape(-1), columns['day'][mask] - (today - days)), columns['quantity'][mask])
+        return series_keys, matrix
+
+    def get_stats(self):
+        """Statystyki cache (diagnostyka)"""
+        with self._lock:
+            return {
+                'lines': int(self._columns['line_id'].size),
+                'last_line_id': self._last_line_id,
+                'pending_transactions': len(self._pending_transactions),
+                'memory_bytes': int(sum(col.nbytes for col in self._columns.values()))
+            }
+
+
+# Globalna instancja cache faktów sprzedaży
+sales_fact_store = SalesFactStore()
@@ -0,0 +1,290 @@
+"""
+Silnik prognozowania sprzedaży dla raportów produktowych
+Pobiera dzienną sprzedaż per produkt/lokalizacja jednym zapytaniem do macierzy NumPy
+i dopasowuje modele (średnia krocząca, wygładzanie wykładnicze z sezonowością tygodniową)
+dla całego katalogu naraz. Wyniki są cache'owane w pamięci na dany dzień.
+"""
+
+import threading
+from datetime import date
+
+import numpy as np
+
+from utils.database import get_db_connection
+
+
+class SalesForecastEngine:
+
+    def __init__(self):
+        self.SEASON_LENGTH = 7  # Sezonowość tygodniowa
+        self.MOVING_AVERAGE_WINDOW = 28  # Okno średniej kroczącej (dni)
+        self.HOLDOUT_DAYS = 14  # Ostatnie dni historii odkładane do oceny modeli
+        self.ALPHA = 0.1  # Współczynnik wygładzania poziomu
+        self.GAMMA = 0.05  # Współczynnik wygładzania sezonowości
+        self.SERVICE_LEVEL_Z = 1.65  # ~95% poziom obsługi dla zapasu bezpieczeństwa
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get_forecast(self, analysis_days=90, forecast_days=30, location_id=None, refresh=False):
+        """
+        Zwraca prognozę sprzedaży i sugerowane ilości zamówienia dla całego katalogu.
+        Wynik jest liczony raz dziennie dla danego zestawu parametrów.
+        """
+        today = date.today().isoformat()
+        key = (today, int(analysis_days), int(forecast_days), str(location_id) if location_id else None)
+
+        with self._lock:
+            if not refresh and key in self._cache:
+                return self._cache[key]
+
+        result = self._compute_forecast(int(analysis_days), int(forecast_days), location_id)
+
+        with self._lock:
+            # Usuń wpisy z poprzednich dni - dane historyczne się zmieniły
+            for stale_key in [k for k in self._cache if k[0] != today]:
+                del self._cache[stale_key]
+            self._cache[key] = result
+
+        return result
+
+    def invalidate(self):
+        """Czyści cache prognoz (np. po imporcie historycznej sprzedaży)"""
+        with self._lock:
+            self._cache.clear()
+
+    def _compute_forecast(self, analysis_days, forecast_days, location_id):
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            cursor = conn.cursor()
+            products = self._load_products(cursor)
+            product_ids, series_products, quantities, revenues = self._load_sales_matrix(cursor, analysis_days, location_id)
+            stock = self._load_stock(cursor, location_id)
+        finally:
+            conn.close()
+
+        n_series = len(series_products)
+        if n_series:
+            ma_forecast, ma_error = self._moving_average(quantities)
+            es_forecast, es_error = self._seasonal_exponential_smoothing(quantities, forecast_days)
+
+            # Wybór modelu per seria wg mniejszego MAE na wspólnym oknie testowym
+            use_es = es_error < ma_error
+            series_forecast = np.where(use_es, es_forecast, ma_forecast * forecast_days)
+            series_variance = quantities.var(axis=1)
+
+            # Agregacja serii lokalizacyjnych do poziomu produktu
+            n_products = len(product_ids)
+            product_forecast = np.bincount(series_products, weights=series_forecast, minlength=n_products)
+            product_variance = np.bincount(series_products, weights=series_variance, minlength=n_products)
+            product_quantity = np.bincount(series_products, weights=quantities.sum(axis=1), minlength=n_products)
+            product_revenue = np.bincount(series_products, weights=revenues, minlength=n_products)
+            product_es_series = np.bincount(series_products, weights=use_es.astype(float), minlength=n_products)
+            product_series = np.bincount(series_products, minlength=n_products)
+        else:
+            product_ids = np.array([], dtype=np.int64)
+
+        sales_index = {int(pid): i for i, pid in enumerate(product_ids)}
+        safety_factor = self.SERVICE_LEVEL_Z * np.sqrt(forecast_days)
+
+        results = []
+        for product in products:
+            i = sales_index.get(product['id'])
+            on_hand = float(stock.get(product['id'], 0) or 0)
+
+            if i is None:
+                forecast_quantity = 0.0
+                total_quantity = 0.0
+                total_revenue = 0.0
+                safety_stock = 0.0
+                method = 'brak_sprzedazy'
+            else:
+                forecast_quantity = max(float(product_forecast[i]), 0.0)
+                total_quantity = float(product_quantity[i])
+                total_revenue = float(product_revenue[i])
+                safety_stock = float(safety_factor * np.sqrt(product_variance[i]))
+                method = 'exponential_smoothing' if product_es_series[i] * 2 >= product_series[i] else 'moving_average'
+
+            avg_daily_quantity = total_quantity / analysis_days if analysis_days else 0.0
+            price = product['cena'] or 0
+            suggested_reorder = max(forecast_quantity + safety_stock - on_hand, 0.0)
+
+            results.append({
+                'id': product['id'],
+                'nazwa': product['nazwa'],
+                'kod_produktu': product['kod_produktu'],
+                'cena': price,
+                'kategoria_nazwa': product['kategoria_nazwa'] or 'Brak kategorii',
+                'avg_daily_sales': round(avg_daily_quantity, 3),
+                'avg_monthly_quantity': round(avg_daily_quantity * 30, 2),
+                'avg_monthly_revenue': round(total_revenue / analysis_days * 30, 2) if analysis_days else 0.0,
+                'forecast_quantity': round(forecast_quantity, 2),
+                'forecast_revenue': round(forecast_quantity * price, 2),
+                'forecast_method': method,
+                'stock_quantity': on_hand,
+                'safety_stock': round(safety_stock, 2),
+                'suggested_reorder_quantity': float(np.ceil(round(suggested_reorder, 6)))
+            })
+
+        results.sort(key=lambda r: (-r['forecast_quantity'], r['nazwa'] or ''))
+
+        return {
+            'products': results,
+            'analysis_days': analysis_days,
+            'forecast_days': forecast_days,
+            'location_id': location_id,
+            'series_count': n_series,
+            'generated_for': date.today().isoformat()
+        }
+
+    def _load_products(self, cursor):
+        """Aktywne produkty katalogu"""
+        cursor.execute("""
+            SELECT p.id, p.nazwa, p.kod_produktu, p.cena, k.nazwa as kategoria_nazwa
+            FROM produkty p
+            LEFT JOIN kategorie_produktow k ON p.category_id = k.id
+            WHERE p.aktywny = 1
+        """)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def _load_sales_matrix(self, cursor, analysis_days, location_id):
+        """
+        Jedno zapytanie -> macierz [seria (produkt, lokalizacja) x dzień].
+        Ostatnia kolumna to wczorajszy dzień (bieżący dzień jest niepełny).
+        """
+        query = """
+            SELECT
+                pp.produkt_id,
+                COALESCE(pt.location_id, 0) as location_id,
+                CAST(julianday(date('now')) - julianday(pt.data_transakcji) AS INTEGER) as days_ago,
+                SUM(pp.ilosc) as quantity,
+                SUM(pp.wartosc_brutto) as revenue
+            FROM pos_pozycje pp
+            JOIN pos_transakcje pt ON pp.transakcja_id = pt.id
+            WHERE pt.status = 'zakonczony'
+            AND pt.data_transakcji >= date('now', '-' || ? || ' days')
+            AND pt.data_transakcji < date('now')
+        """
+        params = [analysis_days]
+        if location_id:
+            query += " AND pt.location_id = ?"
+            params.append(location_id)
+        query += " GROUP BY pp.produkt_id, COALESCE(pt.location_id, 0), pt.data_transakcji"
+
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+        if not rows:
+            empty = np.zeros((0, analysis_days))
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), empty, np.zeros(0)
+
+        data = np.array([tuple(row) for row in rows], dtype=float)
+        pairs = data[:, :2].astype(np.int64)
+        days_ago = data[:, 2].astype(np.int64)
+        valid = (days_ago >= 1) & (days_ago <= analysis_days)
+        pairs, days_ago, data = pairs[valid], days_ago[valid], data[valid]
+
+        series_keys, series_index = np.unique(pairs, axis=0, return_inverse=True)
+        series_index = series_index.reshape(-1)
+        product_ids, series_products = np.unique(series_keys[:, 0], return_inverse=True)
+
+        quantities = np.zeros((len(series_keys), analysis_days))
+        np.add.at(quantities, (series_index, analysis_days - days_ago), data[:, 3])
+        revenues = np.bincount(series_index, weights=data[:, 4], minlength=len(series_keys))
+
+        return product_ids, series_products.reshape(-1), quantities, revenues
+
+    def _load_stock(self, cursor, location_id):
+        """Stan magazynowy per produkt (dla lokalizacji lub suma wszystkich)"""
+        if location_id:
+            cursor.execute("""
+                SELECT produkt_id, SUM(stan_aktualny) as stan
+                FROM pos_magazyn WHERE lokalizacja = ?
+                GROUP BY produkt_id
+            """, (str(location_id),))
+        else:
+            cursor.execute("""
+                SELECT produkt_id, SUM(stan_aktualny) as stan
+                FROM pos_magazyn
+                GROUP BY produkt_id
+            """)
+        return {row['produkt_id']: row['stan'] for row in cursor.fetchall()}
+
+    def _holdout_split(self, n_days):
+        """
+        Liczba dni treningowych - ostatnie dni historii (wspólne okno testowe
+        dla obu modeli) nie biorą udziału w dopasowaniu przy ocenie błędu.
+        """
+        return n_days - min(self.HOLDOUT_DAYS, n_days // 2)
+
+    def _moving_average(self, quantities):
+        """
+        Średnia krocząca dla wszystkich serii naraz.
+        Zwraca (prognoza dzienna, MAE na oknie testowym).
+        """
+        n_days = quantities.shape[1]
+        train_days = self._holdout_split(n_days)
+
+        daily_forecast = self._moving_average_level(quantities)
+
+        # Średnia z części treningowej jako stała prognoza na dni testowe
+        holdout_level = self._moving_average_level(quantities[:, :train_days])
+        error = np.abs(quantities[:, train_days:] - holdout_level[:, None]).mean(axis=1)
+
+        return daily_forecast, error
+
+    def _moving_average_level(self, quantities):
+        """Średnia z ostatnich MOVING_AVERAGE_WINDOW dni (lub całej historii, jeśli krótsza)"""
+        window = min(self.MOVING_AVERAGE_WINDOW, quantities.shape[1])
+        return quantities[:, -window:].mean(axis=1)
+
+    def _seasonal_exponential_smoothing(self, quantities, forecast_days):
+        """
+        Addytywne wygładzanie wykładnicze z sezonowością tygodniową (Holt-Winters bez trendu).
+        Zwraca (suma prognozy na horyzont, MAE na oknie testowym).
+        Błąd liczony jest dla modelu dopasowanego tylko do części treningowej.
+        """
+        n_series, n_days = quantities.shape
+        m = self.SEASON_LENGTH
+        train_days = self._holdout_split(n_days)
+        if train_days < 2 * m:
+            return np.zeros(n_series), np.full(n_series, np.inf)
+
+        level, season = self._fit_seasonal(quantities[:, :train_days])
+        holdout = self._seasonal_path(level, season, train_days, n_days - train_days)
+        error = np.abs(quantities[:, train_days:] - holdout).mean(axis=1)
+
+        level, season = self._fit_seasonal(quantities)
+        total = self._seasonal_path(level, season, n_days, forecast_days).sum(axis=1)
+
+        return np.clip(total, 0, None), error
+
+    def _fit_seasonal(self, quantities):
+        """
+        Dopasowanie poziomu i składników sezonowych.
+        Pętla po dniach, obliczenia wektorowe po wszystkich seriach.
+        """
+        m = self.SEASON_LENGTH
+        level = quantities[:, :m].mean(axis=1)
+        season = quantities[:, :m] - level[:, None]
+
+        for t in range(m, quantities.shape[1]):
+            s = t % m
+            y = quantities[:, t]
+            new_level = self.ALPHA * (y - season[:, s]) + (1 - self.ALPHA) * level
+            season[:, s] = self.GAMMA * (y - new_level) + (1 - self.GAMMA) * season[:, s]
+            level = new_level
+
+        # Składniki sezonowe sumują się do zera - ujemne dni nie są obcinane osobno,
+        # żeby nie zawyżać sumy prognozy przy sprzedaży sporadycznej
+        season_mean = season.mean(axis=1)
+        return level + season_mean, season - season_mean[:, None]
+
+    def _seasonal_path(self, level, season, start_day, days):
+        """Prognoza dzienna [seria x dzień] dla dni start_day .. start_day + days - 1"""
+        horizon = (start_day + np.arange(days)) % self.SEASON_LENGTH
+        return level[:, None] + season[:, horizon]
+
+# Globalna instancja silnika prognoz
+sales_forecast_engine = SalesForecastEngine()
@@ -1,13 +1,13 @@
 """
 Scheduler do automatycznych zadań systemowych
-Obsługuje automatyczne tworzenie kopii zapasowych bazy danych
+Obsługuje automatyczne tworzenie kopii zapasowych bazy danych,
+nocne przeliczanie planu uzupełnień magazynu i przedziałów dat ważności partii
 """
 
 import schedule
 import time
 import threading
 import os
-import shutil
 from datetime import datetime
 
 class AutoBackupScheduler:
@@ -21,38 +21,31 @@ class AutoBackupScheduler:
         self.app = app
         
     def create_automatic_backup(self):
-        """Tworzy automatyczną kopię zapasową bazy danych"""
+        """
+        Tworzy automatyczną kopię zapasową bazy danych online (API backupu SQLite),
+        domyślnie jako migawkę przyrostową, i stosuje politykę retencji
+        """
         try:
+            from utils.backup_engine import backup_engine
+            
             # Ścieżki
             db_path = self.app.config.get('DATABASE_PATH')
             backup_dir = os.path.join(os.path.dirname(db_path), 'backup')
             
-            # Upewnij się, że folder backup istnieje
-            os.makedirs(backup_dir, exist_ok=True)
-            
-            # Nazwa pliku backup z timestampem
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_filename = f"kupony_auto_backup_{timestamp}.db"
-            backup_path = os.path.join(backup_dir, backup_filename)
-            
-            # Kopiuj bazę danych
-            shutil.copy2(db_path, backup_path)
+            result = backup_engine.create_backup(
+                db_path,
+                backup_dir,
+                prefix='kupony_auto_backup',
+                compression=self.app.config.get('BACKUP_COMPRESSION', 'gzip'),
+                incremental=self.app.config.get('BACKUP_INCREMENTAL', True)
+            )
             
-            # Sprawdź rozmiar pliku
-            file_size = os.path.getsize(backup_path)
+            print(f"✅ Automatyczny backup utworzony: {result['backup_filename']} ({result['file_size']} bytes)")
             
-            print(f"✅ Automatyczny backup utworzony: {backup_filename} ({file_size} bytes)")
+            # Usuń stare backupy wg polityki retencji
+            self.cleanup_old_backups(backup_dir)
             
-            # Opcjonalne: usuń stare backupy (starsze niż 30 dni)
-            self.cleanup_old_backups(backup_dir, days=30)
-            
-            return {
-                'success': True,
-                'backup_filename': backup_filename,
-                'backup_path': backup_path,
-                'file_size': file_size,
-                'timestamp': timestamp
-            }
+            return result
             
         except Exception as e:
             print(f"❌ Błąd podczas tworzenia automatycznego backupu: {str(e)}")
@@ -61,36 +54,82 @@ class AutoBackupScheduler:
                 'error': str(e)
             }
     
-    def cleanup_old_backups(self, backup_dir, days=30):
-        """Usuwa stare backupy starsze niż określona liczba dni"""
+    def cleanup_old_backups(self, backup_dir, days=None):
+        """
+        Usuwa stare automatyczne backupy wg polityki retencji (BACKUP_RETENTION);
+        `days` nadpisuje maksymalny wiek kopii
+        """
         try:
-            current_time = time.time()
-            cutoff_time = current_time - (days * 24 * 60 * 60)  # dni w sekundach
+            from utils.backup_engine import backup_engine
+            
+            retention = dict(self.app.config.get('BACKUP_RETENTION') or {}) if self.app else {}
+            if days is not None:
+                retention['max_age_days'] = days
             
-            removed_count = 0
-            for filename in os.listdir(backup_dir):
-                if filename.startswith('kupony_auto_backup_') and filename.endswith('.db'):
-                    file_path = os.path.join(backup_dir, filename)
-                    if os.path.getmtime(file_path) < cutoff_time:
-                        os.remove(file_path)
-                        removed_count += 1
-                        print(f"🗑️  Usunięto stary backup: {filename}")
+            result = backup_engine.apply_retention(backup_dir, prefix='kupony_auto_backup', **retention)
             
-            if removed_count > 0:
-                print(f"✅ Usunięto {removed_count} starych backupów")
+            if result['removed']:
+                print(f"✅ Usunięto {len(result['removed'])} starych backupów ({result['removed_pages']} stron)")
+            return result
                 
         except Exception as e:
             print(f"❌ Błąd podczas czyszczenia starych backupów: {str(e)}")
     
-    def start_scheduler(self):
-        """Uruchamia scheduler w osobnym wątku"""
+    def run_replenishment_job(self):
+        """Przelicza plan uzupełnień (punkty zamówienia, dni do wyczerpania stanu)"""
+        try:
+            from utils.replenishment import replenishment_planner
+            result = replenishment_planner.run()
+            if result.get('success'):
+                print(f"✅ Plan uzupełnień przeliczony: {result['rows']} pozycji, {result['needs_reorder']} do zamówienia")
+            else:
+                print(f"❌ Błąd przeliczania planu uzupełnień: {result.get('error')}")
+            return result
+        except Exception as e:
+            print(f"❌ Błąd zadania planu uzupełnień: {str(e)}")
+            return {'success': False, 'error': str(e)}
+    
+    def run_expiry_job(self):
+        """Przelicza przedziały dat ważności partii (przeterminowane, do 7 i do 30 dni)"""
+        try:
+            from utils.expiry_monitor import expiry_monitor
+            result = expiry_monitor.run()
+            if result.get('success'):
+                print(f"✅ Daty ważności przeliczone: {result['batches']} partii w przedziałach alertów")
+            else:
+                print(f"❌ Błąd przeliczania dat ważności: {result.get('error')}")
+            return result
+        except Exception as e:
+            print(f"❌ Błąd zadania dat ważności: {str(e)}")
+            return {'success': False, 'error': str(e)}
+    
+    def start_scheduler(self, elect=True):
+        """
+        Uruchamia scheduler w osobnym wątku. Przy wielu workerach scheduler działa
+        tylko w procesie, który wygrał wybory (blokada pliku); pozostałe czekają
+        w rezerwie i przejmują rolę, gdy właściciel się zakończy.
+        """
         if self.is_running:
             print("⚠️  Scheduler już działa")
-            return
+            return True
+        
+        if elect:
+            from utils.process_lock import singleton_election
+            if not singleton_election.elect('scheduler'):
+                owner = singleton_election.owner('scheduler') or {}
+                print(f"⏸️  Scheduler działa w procesie {owner.get('pid', '?')} - proces {os.getpid()} czeka w rezerwie")
+                singleton_election.standby('scheduler', lambda: self.start_scheduler(elect=False))
+                return False
             
         # Zaplanuj automatyczny backup codziennie o 21:30
         schedule.every().day.at("21:30").do(self.create_automatic_backup)
         
+        # Przelicz plan uzupełnień po zamknięciu dnia
+        schedule.every().day.at("22:00").do(self.run_replenishment_job)
+        
+        # Przedziały dat ważności liczone na nowy dzień
+        schedule.every().day.at("00:05").do(self.run_expiry_job)
+        
         self.is_running = True
         
         def run_schedule():
@@ -103,11 +142,14 @@ class AutoBackupScheduler:
         self.scheduler_thread.start()
         
         print("✅ Scheduler automatycznych backupów uruchomiony")
+        return True
     
     def stop_scheduler(self):
-        """Zatrzymuje scheduler"""
+        """Zatrzymuje scheduler i oddaje rolę właściciela innym procesom"""
+        from utils.process_lock import singleton_election
         self.is_running = False
         schedule.clear()
+        singleton_election.resign('scheduler')
         print("🛑 Scheduler automatycznych backupów zatrzymany")
     
     def get_scheduler_status(self):
@@ -116,10 +158,15 @@ class AutoBackupScheduler:
         if schedule.jobs:
             next_run = schedule.next_run()
             
+        from utils.process_lock import singleton_election
+        owner = singleton_election.owner('scheduler') or {}
+        
         return {
             'is_running': self.is_running,
             'next_backup': str(next_run) if next_run else None,
-            'scheduled_jobs': len(schedule.jobs)
+            'scheduled_jobs': len(schedule.jobs),
+            'owner_pid': owner.get('pid'),
+            'this_pid': os.getpid()
         }
     
     def trigger_manual_backup(self):
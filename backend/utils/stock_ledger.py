@@ -0,0 +1,443 @@
+"""
+Jednolita księga ruchów magazynowych (tylko dopisywanie) ze stanami zmaterializowanymi
+Każda zmiana stanu - sprzedaż, zwrot/korekta, PZ/PW/RW, przesunięcie, inwentaryzacja,
+ręczna korekta - jest wierszem stock_ledger ze znakowaną ilością dla (produkt, lokalizacja).
+Triggery w tej samej transakcji:
+- dopisują ruch do stock_on_hand (stan i rezerwacja per produkt/lokalizacja - odczyt stanu
+  to jedno wyszukiwanie po kluczu głównym),
+- odzwierciedlają zmianę w pos_magazyn (lokalizacja jako tekst) i inventory_locations
+  (magazyn lokalizacji z warehouses), z których dalej czytają starsze moduły.
+UPDATE/DELETE na stock_ledger są blokowane - błędy koryguje się kolejnym ruchem.
+
+Przy pierwszym uruchomieniu księga dostaje ruchy 'opening' równe bieżącym stanom pos_magazyn.
+Ruchy 'opening' i 'reconcile' nie są odzwierciedlane w pos_magazyn (już tam są);
+reconcile() dopisuje je dla różnic powstałych przez zapis do pos_magazyn z pominięciem księgi.
+
+Stan na dzień: stan bieżący minus ruchy późniejsze niż zadana chwila.
+
+    cd backend && python -m utils.stock_ledger --verify
+    cd backend && python -m utils.stock_ledger --reconcile [--dry-run]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+
+from utils.database import get_db_connection, retry_on_locked
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCATION_ID = int(os.environ.get('DEFAULT_LOCATION_ID', '5'))
+LOOKUP_CHUNK = 500
+
+MOVEMENT_TYPES = (
+    'opening', 'sale', 'return', 'correction', 'pz', 'pw', 'rw',
+    'transfer_out', 'transfer_in', 'inventory', 'adjustment', 'reservation', 'reconcile'
+)
+
+LEDGER_COLUMNS = ('product_id', 'location_id', 'quantity', 'reserved', 'movement_type',
+                  'document_type', 'document_id', 'document_number', 'note', 'created_by')
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS stock_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        location_id INTEGER NOT NULL,
+        quantity REAL NOT NULL DEFAULT 0,      -- zmiana stanu (+ przyjęcie, - wydanie)
+        reserved REAL NOT NULL DEFAULT 0,      -- zmiana rezerwacji
+        movement_type TEXT NOT NULL,
+        document_type TEXT,
+        document_id INTEGER,
+        document_number TEXT,
+        note TEXT,
+        created_by TEXT DEFAULT 'system',
+        created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_ledger_product_location ON stock_ledger(product_id, location_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_stock_ledger_location_time ON stock_ledger(location_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_stock_ledger_document ON stock_ledger(document_type, document_id)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_on_hand (
+        product_id INTEGER NOT NULL,
+        location_id INTEGER NOT NULL,
+        on_hand REAL NOT NULL DEFAULT 0,
+        reserved REAL NOT NULL DEFAULT 0,
+        last_movement_id INTEGER,
+        updated_at TEXT,
+        PRIMARY KEY (product_id, location_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_on_hand_location ON stock_on_hand(location_id, product_id)",
+    # Cel ON CONFLICT(produkt_id, lokalizacja) w stock_ledger_mirror
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_magazyn_produkt_lokalizacja ON pos_magazyn(produkt_id, lokalizacja)",
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_ledger_no_update BEFORE UPDATE ON stock_ledger
+    BEGIN
+        SELECT RAISE(ABORT, 'stock_ledger: ruchy nie mogą być zmieniane');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_ledger_no_delete BEFORE DELETE ON stock_ledger
+    BEGIN
+        SELECT RAISE(ABORT, 'stock_ledger: ruchy nie mogą być usuwane');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_ledger_materialize AFTER INSERT ON stock_ledger
+    BEGIN
+        INSERT INTO stock_on_hand (product_id, location_id, on_hand, reserved, last_movement_id, updated_at)
+        VALUES (NEW.product_id, NEW.location_id, NEW.quantity, NEW.reserved, NEW.id, NEW.created_at)
+        ON CONFLICT(product_id, location_id) DO UPDATE SET
+            on_hand = on_hand + excluded.on_hand,
+            reserved = reserved + excluded.reserved,
+            last_movement_id = excluded.last_movement_id,
+            updated_at = excluded.updated_at;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_ledger_mirror AFTER INSERT ON stock_ledger
+    WHEN NEW.movement_type NOT IN ('opening', 'reconcile')
+    BEGIN
+        INSERT INTO pos_magazyn (produkt_id, stan_aktualny, lokalizacja, ostatnia_aktualizacja)
+        VALUES (NEW.product_id, NEW.quantity, CAST(NEW.location_id AS TEXT), datetime('now'))
+        ON CONFLICT(produkt_id, lokalizacja) DO UPDATE SET
+            stan_aktualny = COALESCE(stan_aktualny, 0) + excluded.stan_aktualny,
+            ostatnia_aktualizacja = excluded.ostatnia_aktualizacja;
+        -- nowy wiersz magazynu dostaje pełny stan lokalizacji (już po zmianie w pos_magazyn), istniejący - różnicę
+        INSERT INTO inventory_locations (product_id, warehouse_id, ilosc_dostepna, ilosc_zarezerwowana, ostatnia_aktualizacja)
+        SELECT NEW.product_id, w.id,
+               (SELECT stan_aktualny FROM pos_magazyn
+                WHERE produkt_id = NEW.product_id AND lokalizacja = CAST(NEW.location_id AS TEXT)),
+               NEW.reserved, CURRENT_TIMESTAMP
+        FROM warehouses w WHERE w.location_id = NEW.location_id
+        ORDER BY w.id LIMIT 1
+        ON CONFLICT(product_id, warehouse_id) DO UPDATE SET
+            ilosc_dostepna = COALESCE(ilosc_dostepna, 0) + NEW.quantity,
+            ilosc_zarezerwowana = COALESCE(ilosc_zarezerwowana, 0) + excluded.ilosc_zarezerwowana,
+            ostatnia_aktualizacja = excluded.ostatnia_aktualizacja;
+    END
+    """,
+]
+
+
+def movement(product_id, location_id, quantity, movement_type, document_type=None, document_id=None,
+             document_number=None, note=None, created_by='system', reserved=0):
+    """Wiersz ruchu w kolejności LEDGER_COLUMNS"""
+    if movement_type not in MOVEMENT_TYPES:
+        raise ValueError(f"Nieznany typ ruchu magazynowego: {movement_type}")
+    return (int(product_id), int(location_id), float(quantity or 0), float(reserved or 0), movement_type,
+            document_type, document_id, document_number, note, created_by or 'system')
+
+
+def end_of_day(at):
+    """'2026-01-31' -> koniec tego dnia; pełne znaczniki czasu bez zmian"""
+    at = str(at).replace('T', ' ')
+    return f"{at} 23:59:59.999" if len(at) == 10 else at
+
+
+class StockLedger:
+
+    def __init__(self):
+        self._schema_ready = False
+        self._lock = threading.Lock()
+        self._post_hooks = []
+
+    def add_post_hook(self, hook):
+        """hook(cursor) wołany w transakcji post() po zapisie ruchów (np. rozliczenie braków)"""
+        if hook not in self._post_hooks:
+            self._post_hooks.append(hook)
+
+    def ensure_schema(self, conn=None):
+        """Tabele, triggery i (raz) ruchy otwarcia z pos_magazyn"""
+        if self._schema_ready:
+            return True
+        with self._lock:
+            if self._schema_ready:
+                return True
+            own = conn is None
+            conn = conn or get_db_connection()
+            if not conn:
+                return False
+            try:
+                self._create(conn)
+                self._schema_ready = True
+                return True
+            finally:
+                if own:
+                    conn.close()
+
+    @staticmethod
+    def _apply_schema(cursor):
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        # Ruchy otwarcia tylko dla pustej księgi - w tej samej transakcji co DDL, więc równoległe
+        # workery nie dopiszą ich dwa razy
+        cursor.execute("""
+            INSERT INTO stock_ledger (product_id, location_id, quantity, movement_type, note)
+            SELECT produkt_id, CAST(lokalizacja AS INTEGER), stan_aktualny, 'opening', 'Stan otwarcia z pos_magazyn'
+            FROM pos_magazyn
+            WHERE lokalizacja GLOB '[0-9]*' AND COALESCE(stan_aktualny, 0) != 0
+              AND NOT EXISTS (SELECT 1 FROM stock_ledger)
+        """)
+        if cursor.rowcount > 0:
+            logger.info("Księga magazynowa: zapisano %s ruchów otwarcia", cursor.rowcount)
+
+    @retry_on_locked
+    def _create(self, conn):
+        previous = conn.isolation_level
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            self._apply_schema(cursor)
+            cursor.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.isolation_level = previous
+
+    def _ensure_for(self, cursor):
+        """
+        Schemat dla zapisu w transakcji wywołującego - drugie połączenie czekałoby na jej blokadę,
+        więc DDL idzie tym samym kursorem (najlepiej wołać ensure_schema() przed BEGIN)
+        """
+        if self._schema_ready:
+            return
+        if cursor.connection.in_transaction:
+            self._apply_schema(cursor)
+        else:
+            self.ensure_schema(cursor.connection)
+
+    # ------------------------------------------------------------------ zapis
+
+    def record(self, cursor, movements):
+        """
+        Dopisuje ruchy w transakcji wywołującego (jedno executemany)
+        movements: krotki z movement() albo słowniki z kluczami LEDGER_COLUMNS
+        """
+        rows = [m if isinstance(m, tuple) else movement(**m) for m in movements]
+        rows = [row for row in rows if row[2] != 0 or row[3] != 0]
+        if not rows:
+            return 0
+        self._ensure_for(cursor)
+        cursor.executemany(f"""
+            INSERT INTO stock_ledger ({', '.join(LEDGER_COLUMNS)})
+            VALUES ({', '.join('?' * len(LEDGER_COLUMNS))})
+        """, rows)
+        return len(rows)
+
+    def record_select(self, cursor, select_sql, params=()):
+        """
+        Ruchy z zapytania (zbiorowo) - select_sql zwraca kolumny w kolejności LEDGER_COLUMNS
+        """
+        self._ensure_for(cursor)
+        cursor.execute(f"INSERT INTO stock_ledger ({', '.join(LEDGER_COLUMNS)}) {select_sql}", params)
+        return cursor.rowcount
+
+    @retry_on_locked
+    def _post(self, conn, rows):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            count = self.record(cursor, rows)
+            for hook in self._post_hooks:
+                hook(cursor)
+            cursor.execute("COMMIT")
+            return count
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def post(self, movements):
+        """Dopisuje ruchy we własnej transakcji (dla kodu bez otwartego połączenia)"""
+        rows = [m if isinstance(m, tuple) else movement(**m) for m in movements]
+        if not rows:
+            return 0
+        self.ensure_schema()
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        conn.isolation_level = None
+        try:
+            return self._post(conn, rows)
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------ odczyt
+
+    def _query(self, sql, params=()):
+        self.ensure_schema()
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        try:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    def location_for_warehouse(self, warehouse_id):
+        """Lokalizacja magazynu z warehouses; id spoza tabeli traktowane jak location_id"""
+        rows = self._query("SELECT location_id FROM warehouses WHERE id = ?", (warehouse_id,))
+        if rows and rows[0]['location_id']:
+            return int(rows[0]['location_id'])
+        return int(warehouse_id)
+
+    def on_hand(self, product_id, location_id):
+        rows = self._query("""
+            SELECT on_hand, reserved, last_movement_id, updated_at FROM stock_on_hand
+            WHERE product_id = ? AND location_id = ?
+        """, (product_id, location_id))
+        row = rows[0] if rows else {'on_hand': 0.0, 'reserved': 0.0, 'last_movement_id': None, 'updated_at': None}
+        row['available'] = row['on_hand'] - row['reserved']
+        return row
+
+    def on_hand_many(self, product_ids, location_id):
+        """{product_id: on_hand} - produkty bez ruchów mają 0"""
+        product_ids = list(dict.fromkeys(int(pid) for pid in product_ids))
+        result = dict.fromkeys(product_ids, 0.0)
+        for start in range(0, len(product_ids), LOOKUP_CHUNK):
+            chunk = product_ids[start:start + LOOKUP_CHUNK]
+            for row in self._query(f"""
+                SELECT product_id, on_hand FROM stock_on_hand
+                WHERE location_id = ? AND product_id IN ({','.join('?' * len(chunk))})
+            """, [location_id] + chunk):
+                result[row['product_id']] = row['on_hand']
+        return result
+
+    def stock_at(self, location_id, at, product_ids=None):
+        """Stan na chwilę `at` (data lub znacznik czasu) = stan bieżący - ruchy późniejsze"""
+        at = end_of_day(at)
+        product_filter, params = '', [location_id]
+        if product_ids:
+            product_ids = [int(pid) for pid in product_ids]
+            product_filter = f" AND product_id IN ({','.join('?' * len(product_ids))})"
+            params += product_ids
+        current = {row['product_id']: row['on_hand'] for row in self._query(
+            f"SELECT product_id, on_hand FROM stock_on_hand WHERE location_id = ?{product_filter}", params
+        )}
+        later = self._query(f"""
+            SELECT product_id, SUM(quantity) AS quantity FROM stock_ledger
+            WHERE location_id = ? AND created_at > ?{product_filter}
+            GROUP BY product_id
+        """, [location_id, at] + params[1:])
+        for row in later:
+            current[row['product_id']] = current.get(row['product_id'], 0.0) - row['quantity']
+        if product_ids:
+            for pid in product_ids:
+                current.setdefault(pid, 0.0)
+        return {pid: round(qty, 6) for pid, qty in current.items()}
+
+    def movements(self, product_id=None, location_id=None, document_type=None, document_id=None,
+                  date_from=None, date_to=None, limit=100):
+        conditions, params = [], []
+        for column, value in (('product_id', product_id), ('location_id', location_id),
+                              ('document_type', document_type), ('document_id', document_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if date_from:
+            conditions.append("created_at >= ?")
+            params.append(str(date_from).replace('T', ' '))
+        if date_to:
+            conditions.append("created_at <= ?")
+            params.append(end_of_day(date_to))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return self._query(f"SELECT * FROM stock_ledger {where} ORDER BY id DESC LIMIT ?", params + [int(limit)])
+
+    # ------------------------------------------------------------------ kontrola
+
+    def verify(self):
+        """Różnice między sumą księgi a stock_on_hand (powinno być pusto)"""
+        return self._query("""
+            SELECT l.product_id, l.location_id, l.total, COALESCE(s.on_hand, 0) AS on_hand
+            FROM (SELECT product_id, location_id, SUM(quantity) AS total
+                  FROM stock_ledger GROUP BY product_id, location_id) l
+            LEFT JOIN stock_on_hand s ON s.product_id = l.product_id AND s.location_id = l.location_id
+            WHERE ABS(l.total - COALESCE(s.on_hand, 0)) > 1e-6
+        """)
+
+    @retry_on_locked
+    def _reconcile(self, conn, location_id, dry_run):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            location_filter = "AND CAST(m.lokalizacja AS INTEGER) = ?" if location_id is not None else ''
+            params = [location_id] if location_id is not None else []
+            cursor.execute(f"""
+                SELECT m.produkt_id AS product_id, CAST(m.lokalizacja AS INTEGER) AS location_id,
+                       COALESCE(m.stan_aktualny, 0) - COALESCE(s.on_hand, 0) AS quantity
+                FROM pos_magazyn m
+                LEFT JOIN stock_on_hand s
+                       ON s.product_id = m.produkt_id AND s.location_id = CAST(m.lokalizacja AS INTEGER)
+                WHERE m.lokalizacja GLOB '[0-9]*' {location_filter}
+                  AND ABS(COALESCE(m.stan_aktualny, 0) - COALESCE(s.on_hand, 0)) > 1e-6
+            """, params)
+            drift = [dict(row) for row in cursor.fetchall()]
+            if not dry_run and drift:
+                self.record(cursor, [
+                    movement(row['product_id'], row['location_id'], row['quantity'], 'reconcile',
+                             note='Wyrównanie do pos_magazyn')
+                    for row in drift
+                ])
+            cursor.execute("COMMIT")
+            return drift
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def reconcile(self, location_id=None, dry_run=False):
+        """Dopisuje ruchy 'reconcile' dla stanów pos_magazyn zmienionych poza księgą"""
+        self.ensure_schema()
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        conn.isolation_level = None
+        try:
+            drift = self._reconcile(conn, location_id, dry_run)
+        finally:
+            conn.close()
+        if drift and not dry_run:
+            logger.warning("Księga magazynowa: wyrównano %s stanów zmienionych poza księgą", len(drift))
+        return drift
+
+    def status(self):
+        rows = self._query("""
+            SELECT (SELECT COUNT(*) FROM stock_ledger) AS movements,
+                   (SELECT MAX(id) FROM stock_ledger) AS last_movement_id,
+                   (SELECT COUNT(*) FROM stock_on_hand) AS positions
+        """)
+        return rows[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Kontrola księgi ruchów magazynowych')
+    parser.add_argument('--verify', action='store_true', help='porównaj sumy księgi ze stock_on_hand')
+    parser.add_argument('--reconcile', action='store_true', help='wyrównaj księgę do pos_magazyn')
+    parser.add_argument('--location', type=int, help='tylko ta lokalizacja (reconcile)')
+    parser.add_argument('--dry-run', action='store_true', help='tylko pokaż różnice')
+    args = parser.parse_args(argv)
+
+    result = {'status': stock_ledger.status()}
+    if args.verify:
+        result['verify_mismatches'] = stock_ledger.verify()
+    if args.reconcile:
+        result['reconcile'] = stock_ledger.reconcile(args.location, args.dry_run)
+    print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
+    return 1 if result.get('verify_mismatches') else 0
+
+
+# Globalna instancja
+stock_ledger = StockLedger()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
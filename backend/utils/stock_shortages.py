@@ -0,0 +1,424 @@
+"""
+Braki magazynowe POS (pos_stock_shortages) rozliczane zbiorowo przy każdym przychodzie towaru
+- trigger na stock_ledger odkłada (produkt, lokalizacja) z dodatnim ruchem i oczekującymi brakami
+  do kolejki stock_shortage_queue - dowolny przychód (PZ, PW, MM, zwrot, korekta, inwentaryzacja)
+  trafia do kolejki bez zmian w kodzie, który go zapisuje,
+- allocate() w jednym przebiegu rozdziela stan wszystkich produktów z kolejki na braki od
+  najstarszego (suma narastająca w oknie produkt/lokalizacja): brak jest zamknięty, gdy razem
+  ze starszymi mieści się w tym, co już pokrył przychód (zaległość - niedobór stanu),
+- flaga has_stock_shortage zdejmowana jednym UPDATE z transakcji bez oczekujących braków,
+- stock_shortage_backlog to zaległość per produkt/lokalizacja utrzymywana triggerami na
+  pos_stock_shortages - podsumowanie nie skanuje tabeli braków.
+Lokalizacja braku to lokalizacja transakcji (pos_transakcje.location_id).
+
+Zaległości i ręczne rozliczenie wszystkiego, co pokrywa stan:
+
+    cd backend && python -m utils.stock_shortages [--allocate]
+"""
+
+import argparse
+import json
+import logging
+import threading
+
+from utils.database import get_db_connection, retry_on_locked
+from utils.stock_ledger import stock_ledger, DEFAULT_LOCATION_ID
+
+logger = logging.getLogger(__name__)
+
+# Lokalizacja braku - transakcje bez location_id sprzedają z lokalizacji domyślnej
+SHORTAGE_LOCATION = (
+    f"COALESCE((SELECT location_id FROM pos_transakcje WHERE id = {{row}}.transakcja_id), {DEFAULT_LOCATION_ID})"
+)
+
+# Tolerancja porównań ilości ułamkowych (sumy REAL)
+EPSILON = 1e-9
+
+SCHEMA = [
+    "CREATE INDEX IF NOT EXISTS idx_stock_shortages_pending ON pos_stock_shortages(produkt_id, status, created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_shortage_backlog (
+        product_id INTEGER NOT NULL,
+        location_id INTEGER NOT NULL,
+        pending_count INTEGER NOT NULL DEFAULT 0,
+        pending_quantity REAL NOT NULL DEFAULT 0,
+        oldest_at TEXT,
+        PRIMARY KEY (product_id, location_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_shortage_queue (
+        product_id INTEGER NOT NULL,
+        location_id INTEGER NOT NULL,
+        PRIMARY KEY (product_id, location_id)
+    ) WITHOUT ROWID
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS stock_shortage_backlog_insert
+    AFTER INSERT ON pos_stock_shortages
+    WHEN COALESCE(NEW.status, 'pending') = 'pending'
+    BEGIN
+        INSERT INTO stock_shortage_backlog (product_id, location_id, pending_count, pending_quantity, oldest_at)
+        VALUES (NEW.produkt_id, {SHORTAGE_LOCATION.format(row='NEW')}, 1, NEW.ilosc_brakujaca, NEW.created_at)
+        ON CONFLICT(product_id, location_id) DO UPDATE SET
+            pending_count = pending_count + 1,
+            pending_quantity = pending_quantity + excluded.pending_quantity,
+            oldest_at = MIN(COALESCE(oldest_at, excluded.oldest_at), excluded.oldest_at);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS stock_shortage_backlog_reopen
+    AFTER UPDATE OF status ON pos_stock_shortages
+    WHEN COALESCE(OLD.status, 'pending') != 'pending' AND COALESCE(NEW.status, 'pending') = 'pending'
+    BEGIN
+        INSERT INTO stock_shortage_backlog (product_id, location_id, pending_count, pending_quantity, oldest_at)
+        VALUES (NEW.produkt_id, {SHORTAGE_LOCATION.format(row='NEW')}, 1, NEW.ilosc_brakujaca, NEW.created_at)
+        ON CONFLICT(product_id, location_id) DO UPDATE SET
+            pending_count = pending_count + 1,
+            pending_quantity = pending_quantity + excluded.pending_quantity,
+            oldest_at = MIN(COALESCE(oldest_at, excluded.oldest_at), excluded.oldest_at);
+    END
+    """,
+    # Zamknięcie i usunięcie: zaległość pomniejszana, oldest_at z indeksu (produkt, status, created_at)
+    f"""
+    CREATE TRIGGER IF NOT EXISTS stock_shortage_backlog_resolve
+    AFTER UPDATE OF status ON pos_stock_shortages
+    WHEN COALESCE(OLD.status, 'pending') = 'pending' AND COALESCE(NEW.status, 'pending') != 'pending'
+    BEGIN
+        UPDATE stock_shortage_backlog SET
+            pending_count = pending_count - 1,
+            pending_quantity = pending_quantity - OLD.ilosc_brakujaca,
+            oldest_at = (SELECT MIN(s.created_at) FROM pos_stock_shortages s
+                         WHERE s.produkt_id = OLD.produkt_id AND s.status = 'pending'
+                           AND {SHORTAGE_LOCATION.format(row='s')} = stock_shortage_backlog.location_id)
+        WHERE product_id = OLD.produkt_id AND location_id = {SHORTAGE_LOCATION.format(row='OLD')};
+        DELETE FROM stock_shortage_backlog
+        WHERE product_id = OLD.produkt_id AND location_id = {SHORTAGE_LOCATION.format(row='OLD')}
+          AND pending_count <= 0;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS stock_shortage_backlog_delete
+    AFTER DELETE ON pos_stock_shortages
+    WHEN COALESCE(OLD.status, 'pending') = 'pending'
+    BEGIN
+        UPDATE stock_shortage_backlog SET
+            pending_count = pending_count - 1,
+            pending_quantity = pending_quantity - OLD.ilosc_brakujaca,
+            oldest_at = (SELECT MIN(s.created_at) FROM pos_stock_shortages s
+                         WHERE s.produkt_id = OLD.produkt_id AND s.status = 'pending'
+                           AND {SHORTAGE_LOCATION.format(row='s')} = stock_shortage_backlog.location_id)
+        WHERE product_id = OLD.produkt_id AND location_id = {SHORTAGE_LOCATION.format(row='OLD')};
+        DELETE FROM stock_shortage_backlog
+        WHERE product_id = OLD.produkt_id AND location_id = {SHORTAGE_LOCATION.format(row='OLD')}
+          AND pending_count <= 0;
+    END
+    """,
+    # Każdy przychód produktu z zaległością w lokalizacji - do kolejki rozliczenia
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_shortage_inflow
+    AFTER INSERT ON stock_ledger
+    WHEN NEW.quantity > 0 AND NEW.movement_type != 'opening'
+     AND EXISTS (SELECT 1 FROM stock_shortage_backlog
+                 WHERE product_id = NEW.product_id AND location_id = NEW.location_id)
+    BEGIN
+        INSERT OR IGNORE INTO stock_shortage_queue (product_id, location_id)
+        VALUES (NEW.product_id, NEW.location_id);
+    END
+    """,
+]
+
+
+class StockShortageEngine:
+
+    def __init__(self):
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        # Transakcje otwierane ręcznie (BEGIN IMMEDIATE)
+        conn.isolation_level = None
+        return conn
+
+    @staticmethod
+    def _apply_schema(cursor):
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        # Pusta zaległość przy istniejących brakach = pierwsze uruchomienie: zaległość z tabeli braków,
+        # a wszystkie jej pozycje do kolejki, żeby braki pokryte już stanem zostały rozliczone
+        cursor.execute(f"""
+            INSERT INTO stock_shortage_backlog (product_id, location_id, pending_count, pending_quantity, oldest_at)
+            SELECT s.produkt_id, COALESCE(t.location_id, {DEFAULT_LOCATION_ID}),
+                   COUNT(*), SUM(s.ilosc_brakujaca), MIN(s.created_at)
+            FROM pos_stock_shortages s
+            LEFT JOIN pos_transakcje t ON t.id = s.transakcja_id
+            WHERE s.status = 'pending' AND NOT EXISTS (SELECT 1 FROM stock_shortage_backlog)
+            GROUP BY 1, 2
+        """)
+        if cursor.rowcount > 0:
+            cursor.execute("""
+                INSERT OR IGNORE INTO stock_shortage_queue (product_id, location_id)
+                SELECT product_id, location_id FROM stock_shortage_backlog
+            """)
+            logger.info("Braki magazynowe: zaległość dla %s pozycji produkt/lokalizacja", cursor.rowcount)
+
+    @retry_on_locked
+    def _create(self, conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            self._apply_schema(cursor)
+            cursor.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def ensure_schema(self):
+        if self._schema_ready:
+            return
+        with self._lock:
+            if self._schema_ready:
+                return
+            stock_ledger.ensure_schema()
+            conn = self._connect()
+            try:
+                self._create(conn)
+                self._schema_ready = True
+            finally:
+                conn.close()
+
+    def _ensure_for(self, cursor):
+        """Schemat w transakcji wywołującego - DDL tym samym kursorem (jak w stock_ledger)"""
+        if self._schema_ready:
+            return
+        if cursor.connection.in_transaction:
+            self._apply_schema(cursor)
+        else:
+            self.ensure_schema()
+
+    # ------------------------------------------------------------------ zapis braków
+
+    def record(self, cursor, transakcja_id, shortages):
+        """
+        Braki sprzedaży w transakcji wywołującego (jedno executemany)
+        shortages: [{product_id, product_name, required, available, shortfall}]
+        """
+        if not shortages:
+            return 0
+        self._ensure_for(cursor)
+        cursor.executemany("""
+            INSERT INTO pos_stock_shortages
+            (transakcja_id, produkt_id, nazwa_produktu, ilosc_sprzedana, ilosc_dostepna, ilosc_brakujaca, status)
+            VALUES (?, ?, ?, ?, ?, ?, 'pending')
+        """, [(transakcja_id, s['product_id'], s['product_name'] or '', s['required'], s['available'],
+               s['shortfall']) for s in shortages])
+        return len(shortages)
+
+    @retry_on_locked
+    def _post(self, conn, transakcja_id, shortages):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            count = self.record(cursor, transakcja_id, shortages)
+            cursor.execute("COMMIT")
+            return count
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def post(self, transakcja_id, shortages):
+        """Braki sprzedaży we własnej transakcji"""
+        if not shortages:
+            return 0
+        self.ensure_schema()
+        conn = self._connect()
+        try:
+            return self._post(conn, transakcja_id, shortages)
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------ rozliczenie
+
+    def allocate(self, cursor, invoice_id=None, resolved_by='system_auto'):
+        """
+        Rozlicza kolejkę w transakcji wywołującego - jeden przebieg dla wszystkich produktów
+        Zwraca {'resolved': zamknięte braki, 'cleared_transactions': transakcje bez flagi braku}
+        """
+        self._ensure_for(cursor)
+        cursor.execute("SELECT 1 FROM stock_shortage_queue LIMIT 1")
+        if not cursor.fetchone():
+            return {'resolved': 0, 'cleared_transactions': 0}
+
+        # Braki pokryte przychodem: suma narastająca (od najstarszego) <= zaległość - niedobór stanu
+        cursor.execute("DROP TABLE IF EXISTS temp.shortage_allocation")
+        cursor.execute(f"""
+            CREATE TEMP TABLE shortage_allocation AS
+            WITH pending AS (
+                SELECT s.id, s.transakcja_id, s.produkt_id AS product_id,
+                       COALESCE(t.location_id, {DEFAULT_LOCATION_ID}) AS location_id,
+                       SUM(s.ilosc_brakujaca) OVER (
+                           PARTITION BY s.produkt_id, COALESCE(t.location_id, {DEFAULT_LOCATION_ID})
+                           ORDER BY s.created_at, s.id
+                       ) AS running
+                FROM pos_stock_shortages s
+                LEFT JOIN pos_transakcje t ON t.id = s.transakcja_id
+                WHERE s.status = 'pending'
+                  AND s.produkt_id IN (SELECT product_id FROM stock_shortage_queue)
+            )
+            SELECT p.id, p.transakcja_id
+            FROM pending p
+            JOIN stock_shortage_queue q ON q.product_id = p.product_id AND q.location_id = p.location_id
+            JOIN stock_shortage_backlog b ON b.product_id = p.product_id AND b.location_id = p.location_id
+            LEFT JOIN stock_on_hand soh ON soh.product_id = p.product_id AND soh.location_id = p.location_id
+            WHERE p.running <= b.pending_quantity + MIN(COALESCE(soh.on_hand, 0), 0) + {EPSILON}
+        """)
+        cursor.execute("""
+            UPDATE pos_stock_shortages
+            SET status = 'resolved', resolved_at = datetime('now'), resolved_by = ?,
+                faktura_zakupu_id = COALESCE(?, faktura_zakupu_id)
+            WHERE id IN (SELECT id FROM temp.shortage_allocation)
+        """, (resolved_by, invoice_id))
+        resolved = cursor.rowcount
+        cursor.execute("""
+            UPDATE pos_transakcje SET has_stock_shortage = 0
+            WHERE id IN (SELECT transakcja_id FROM temp.shortage_allocation)
+              AND NOT EXISTS (SELECT 1 FROM pos_stock_shortages s
+                              WHERE s.transakcja_id = pos_transakcje.id AND s.status = 'pending')
+        """)
+        cleared = cursor.rowcount
+        cursor.execute("DELETE FROM stock_shortage_queue")
+        cursor.execute("DROP TABLE temp.shortage_allocation")
+        if resolved:
+            logger.info("Braki magazynowe: zamknięto %s, flaga zdjęta z %s transakcji", resolved, cleared)
+        return {'resolved': resolved, 'cleared_transactions': cleared}
+
+    @retry_on_locked
+    def _run(self, conn, requeue, invoice_id, resolved_by):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            if requeue:
+                cursor.execute("""
+                    INSERT OR IGNORE INTO stock_shortage_queue (product_id, location_id)
+                    SELECT product_id, location_id FROM stock_shortage_backlog
+                """)
+            result = self.allocate(cursor, invoice_id, resolved_by)
+            cursor.execute("COMMIT")
+            return result
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def run(self, requeue=False, invoice_id=None, resolved_by='system_auto'):
+        """
+        Rozliczenie we własnej transakcji; requeue=True rozlicza całą zaległość
+        (np. po ręcznej korekcie stanu poza księgą)
+        """
+        self.ensure_schema()
+        conn = self._connect()
+        try:
+            return self._run(conn, requeue, invoice_id, resolved_by)
+        finally:
+            conn.close()
+
+    def _after_post(self, cursor):
+        """Hook księgi - ruchy zapisane przez stock_ledger.post() rozliczane w tej samej transakcji"""
+        self.allocate(cursor)
+
+    # ------------------------------------------------------------------ odczyt
+
+    def backlog(self, location_id=None, limit=50):
+        """Podsumowanie zaległości z stock_shortage_backlog (bez skanowania pos_stock_shortages)"""
+        self.ensure_schema()
+        where, params = '', []
+        if location_id:
+            where, params = 'WHERE b.location_id = ?', [int(location_id)]
+        conn = get_db_connection()
+        try:
+            totals = dict(conn.execute(f"""
+                SELECT COUNT(*) AS products, COALESCE(SUM(b.pending_count), 0) AS pending_count,
+                       COALESCE(SUM(b.pending_quantity), 0) AS pending_quantity, MIN(b.oldest_at) AS oldest_at
+                FROM stock_shortage_backlog b {where}
+            """, params).fetchone())
+            totals['pending_quantity'] = round(totals['pending_quantity'], 4)
+            locations = [dict(row) for row in conn.execute(f"""
+                SELECT b.location_id, COUNT(*) AS products, SUM(b.pending_count) AS pending_count,
+                       ROUND(SUM(b.pending_quantity), 4) AS pending_quantity, MIN(b.oldest_at) AS oldest_at
+                FROM stock_shortage_backlog b {where}
+                GROUP BY b.location_id ORDER BY b.location_id
+            """, params)]
+            items = [dict(row) for row in conn.execute(f"""
+                SELECT b.product_id, p.nazwa AS product_name, b.location_id, b.pending_count,
+                       ROUND(b.pending_quantity, 4) AS pending_quantity, b.oldest_at,
+                       COALESCE(soh.on_hand, 0) AS on_hand
+                FROM stock_shortage_backlog b
+                LEFT JOIN produkty p ON p.id = b.product_id
+                LEFT JOIN stock_on_hand soh ON soh.product_id = b.product_id AND soh.location_id = b.location_id
+                {where}
+                ORDER BY b.pending_quantity DESC, b.oldest_at
+                LIMIT ?
+            """, params + [int(limit)])]
+            queued = conn.execute("SELECT COUNT(*) FROM stock_shortage_queue").fetchone()[0]
+        finally:
+            conn.close()
+        return {**totals, 'queued': queued, 'locations': locations, 'items': items}
+
+    def verify(self):
+        """Rozbieżności zaległości względem pełnego przeliczenia z pos_stock_shortages (diagnostyka)"""
+        self.ensure_schema()
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(f"""
+                WITH actual AS (
+                    SELECT s.produkt_id AS product_id, COALESCE(t.location_id, {DEFAULT_LOCATION_ID}) AS location_id,
+                           COUNT(*) AS pending_count, SUM(s.ilosc_brakujaca) AS pending_quantity
+                    FROM pos_stock_shortages s
+                    LEFT JOIN pos_transakcje t ON t.id = s.transakcja_id
+                    WHERE s.status = 'pending'
+                    GROUP BY 1, 2
+                )
+                SELECT a.product_id, a.location_id, a.pending_count, b.pending_count AS backlog_count
+                FROM actual a
+                LEFT JOIN stock_shortage_backlog b ON b.product_id = a.product_id AND b.location_id = a.location_id
+                WHERE b.pending_count IS NOT a.pending_count
+                   OR ABS(a.pending_quantity - b.pending_quantity) > 1e-6
+                UNION ALL
+                SELECT b.product_id, b.location_id, 0, b.pending_count
+                FROM stock_shortage_backlog b
+                WHERE NOT EXISTS (SELECT 1 FROM actual a
+                                  WHERE a.product_id = b.product_id AND a.location_id = b.location_id)
+            """).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Zaległość braków magazynowych POS')
+    parser.add_argument('--allocate', action='store_true', help='rozlicz całą zaległość względem stanów')
+    parser.add_argument('--location', type=int, help='tylko lokalizacja')
+    args = parser.parse_args(argv)
+
+    if args.allocate:
+        print(json.dumps(stock_shortages.run(requeue=True), ensure_ascii=False))
+    summary = stock_shortages.backlog(args.location, limit=20)
+    print(json.dumps(summary, ensure_ascii=False, indent=2, default=str))
+    mismatches = stock_shortages.verify()
+    if mismatches:
+        print(f"Rozbieżności zaległości: {len(mismatches)}")
+        return 1
+    return 0
+
+
+# Globalna instancja
+stock_shortages = StockShortageEngine()
+stock_ledger.add_post_hook(stock_shortages._after_post)
+
+if __name__ == '__main__':
+    raise SystemExit(main())
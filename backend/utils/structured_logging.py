@@ -0,0 +1,79 @@
+"""
+Konfiguracja logowania aplikacji - poziomy zamiast printów diagnostycznych
+Poziom ustawia LOG_LEVEL (domyślnie INFO - komunikaty DEBUG nie są nawet formatowane),
+a LOG_FORMAT=json przełącza na jeden obiekt JSON na linię (dla agregatorów logów).
+Każdy wpis z kontekstu żądania dostaje request_id, metodę i ścieżkę.
+"""
+
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(name)s]%(request_tag)s %(message)s'
+
+
+class RequestContextFilter(logging.Filter):
+    """Dokleja do rekordu dane bieżącego żądania (jeśli jest)"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.path = request.path
+            record.request_tag = f" [{record.request_id}]" if record.request_id else ''
+        else:
+            record.request_id = record.method = record.path = None
+            record.request_tag = ''
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Jeden wpis = jeden obiekt JSON; pola z `extra={'fields': {...}}` trafiają do wpisu"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+            entry['method'] = record.method
+            entry['path'] = record.path
+        fields = getattr(record, 'fields', None)
+        if isinstance(fields, dict):
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None, log_format=None):
+    """
+    Ustawia główny logger raz dla procesu. Wywoływane w create_app przed importem
+    modułów API, więc późniejsze logging.basicConfig w modułach nie nadpisują ustawień.
+    """
+    level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    log_format = (log_format or os.environ.get('LOG_FORMAT', 'text')).lower()
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(RequestContextFilter())
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
+
+    # Logi dostępu werkzeug dublują metryki żądań
+    logging.getLogger('werkzeug').setLevel(max(root.level, logging.WARNING))
+    return root
@@ -0,0 +1,239 @@
+"""
+Przesunięcia międzymagazynowe (MM) wykonywane zbiorowo w jednej transakcji
+- utworzenie: numer z licznika dziennego (UPSERT w tej samej transakcji co nagłówek, więc dwa
+  równoległe transfery nie dostaną tego samego numeru) i pozycje jednym executemany,
+- wysyłka: ruchy 'transfer_out' w księdze jednym INSERT ... SELECT z transfer_items,
+- przyjęcie: ilości dostarczone jednym executemany, ruchy 'transfer_in' jednym INSERT ... SELECT,
+  braki POS pokryte przyjęciem rozliczane w tej samej transakcji (utils.stock_shortages).
+Każda operacja to jedna krótka blokada zapisu niezależnie od liczby pozycji.
+"""
+
+import json
+import logging
+from datetime import datetime
+
+from utils.database import get_db_connection, retry_on_locked
+from utils.stock_ledger import stock_ledger
+from utils.stock_shortages import stock_shortages
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_PREFIX = 'MM'
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS warehouse_transfer_counters (
+        day TEXT PRIMARY KEY,
+        last_number INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_transfer_items_transfer ON transfer_items(transfer_id, product_id)",
+]
+
+
+class TransferError(ValueError):
+    """Błąd stanu transferu (nieprawidłowy status)"""
+
+
+class TransferNotFound(TransferError):
+    """Brak transferu o podanym id"""
+
+
+class WarehouseTransferService:
+
+    def __init__(self):
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Brak połączenia z bazą danych")
+        # Transakcje otwierane ręcznie (BEGIN IMMEDIATE)
+        conn.isolation_level = None
+        return conn
+
+    def ensure_schema(self):
+        if self._schema_ready:
+            return
+        stock_shortages.ensure_schema()
+        conn = get_db_connection()
+        try:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._schema_ready = True
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _next_number(cursor):
+        """MM/RRRRMMDD/NNNN - licznik dnia zakładany od najwyższego istniejącego numeru"""
+        today = datetime.now().strftime('%Y%m%d')
+        prefix = f"{TRANSFER_PREFIX}/{today}/"
+        cursor.execute("""
+            INSERT INTO warehouse_transfer_counters (day, last_number)
+            SELECT ?, COALESCE(MAX(CAST(substr(numer_transferu, ?) AS INTEGER)), 0) + 1
+            FROM warehouse_transfers WHERE numer_transferu LIKE ?
+            ON CONFLICT(day) DO UPDATE SET last_number = last_number + 1
+        """, (today, len(prefix) + 1, prefix + '%'))
+        cursor.execute("SELECT last_number FROM warehouse_transfer_counters WHERE day = ?", (today,))
+        return f"{prefix}{cursor.fetchone()[0]:04d}"
+
+    @staticmethod
+    def _transfer(cursor, transfer_id):
+        cursor.execute("""
+            SELECT t.id, t.numer_transferu, t.status, t.warehouse_from_id, t.warehouse_to_id,
+                   wf.location_id AS location_from_id, wt.location_id AS location_to_id
+            FROM warehouse_transfers t
+            LEFT JOIN warehouses wf ON wf.id = t.warehouse_from_id
+            LEFT JOIN warehouses wt ON wt.id = t.warehouse_to_id
+            WHERE t.id = ?
+        """, (transfer_id,))
+        row = cursor.fetchone()
+        if not row:
+            raise TransferNotFound("Transfer nie został znaleziony")
+        return dict(row)
+
+    # ------------------------------------------------------------------ utworzenie
+
+    @retry_on_locked
+    def _create(self, conn, warehouse_from_id, warehouse_to_id, rows, requested_by, uwagi):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            numer_transferu = self._next_number(cursor)
+            cursor.execute("""
+                INSERT INTO warehouse_transfers
+                (numer_transferu, warehouse_from_id, warehouse_to_id, requested_by, status, data_zlozenia, uwagi)
+                VALUES (?, ?, ?, ?, 'oczekujacy', datetime('now'), ?)
+            """, (numer_transferu, warehouse_from_id, warehouse_to_id, requested_by, uwagi))
+            transfer_id = cursor.lastrowid
+            cursor.executemany("""
+                INSERT INTO transfer_items (transfer_id, product_id, ilosc_zlecona, jednostka)
+                VALUES (?, ?, ?, 'szt')
+            """, [(transfer_id, product_id, ilosc) for product_id, ilosc in rows])
+            cursor.execute("COMMIT")
+            return transfer_id, numer_transferu
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def create(self, warehouse_from_id, warehouse_to_id, items, requested_by='system', uwagi=''):
+        """
+        items: [{produkt_id, ilosc | ilosc_wyslana}] - pozycje bez produktu lub z ilością <= 0 są pomijane
+        Zwraca (transfer_id, numer_transferu, liczba_pozycji)
+        """
+        rows = []
+        for item in items:
+            product_id = item.get('produkt_id')
+            ilosc = float(item.get('ilosc_wyslana', item.get('ilosc', 1)))
+            if product_id and ilosc > 0:
+                rows.append((int(product_id), ilosc))
+
+        self.ensure_schema()
+        conn = self._connect()
+        try:
+            transfer_id, numer_transferu = self._create(conn, warehouse_from_id, warehouse_to_id,
+                                                        rows, requested_by, uwagi)
+        finally:
+            conn.close()
+        return transfer_id, numer_transferu, len(rows)
+
+    # ------------------------------------------------------------------ wysyłka / przyjęcie
+
+    @retry_on_locked
+    def _ship(self, conn, transfer_id, user):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            transfer = self._transfer(cursor, transfer_id)
+            if transfer['status'] not in ('oczekujacy', 'zatwierdzony'):
+                raise TransferError("Można wysłać tylko transfer oczekujący lub zatwierdzony")
+
+            moved = 0
+            if transfer['location_from_id']:
+                moved = stock_ledger.record_select(cursor, """
+                    SELECT product_id, ?, -SUM(ilosc_zlecona), 0, 'transfer_out', 'transfer', ?, ?, NULL, ?
+                    FROM transfer_items WHERE transfer_id = ?
+                    GROUP BY product_id HAVING SUM(ilosc_zlecona) != 0
+                """, (transfer['location_from_id'], transfer_id, transfer['numer_transferu'], user, transfer_id))
+
+            cursor.execute("""
+                UPDATE warehouse_transfers SET status = 'w_transporcie', data_wysylki = datetime('now') WHERE id = ?
+            """, (transfer_id,))
+            cursor.execute("COMMIT")
+            return {'location_id': transfer['location_from_id'], 'products': moved}
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def ship(self, transfer_id, user='system'):
+        """Wysyłka: odejmuje zlecone ilości z lokalizacji magazynu źródłowego"""
+        self.ensure_schema()
+        conn = self._connect()
+        try:
+            return self._ship(conn, transfer_id, user)
+        finally:
+            conn.close()
+
+    @retry_on_locked
+    def _receive(self, conn, transfer_id, delivered, user):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            transfer = self._transfer(cursor, transfer_id)
+            if transfer['status'] != 'w_transporcie':
+                raise TransferError("Można odebrać tylko transfer w transporcie")
+
+            if delivered:
+                cursor.executemany("""
+                    UPDATE transfer_items SET ilosc_dostarczona = ? WHERE id = ? AND transfer_id = ?
+                """, [(ilosc, item_id, transfer_id) for item_id, ilosc in delivered])
+            # Pozycje bez podanej ilości przyjmowane w ilości zleconej; podane 0 (np. zagubione
+            # w transporcie) zostaje zerem
+            cursor.execute("""
+                UPDATE transfer_items SET ilosc_dostarczona = ilosc_zlecona
+                WHERE transfer_id = ? AND COALESCE(ilosc_dostarczona, 0) = 0
+                  AND id NOT IN (SELECT value FROM json_each(?))
+            """, (transfer_id, json.dumps([item_id for item_id, _ in delivered])))
+
+            moved = 0
+            if transfer['location_to_id']:
+                moved = stock_ledger.record_select(cursor, """
+                    SELECT product_id, ?, SUM(ilosc_dostarczona), 0, 'transfer_in', 'transfer', ?, ?, NULL, ?
+                    FROM transfer_items WHERE transfer_id = ?
+                    GROUP BY product_id HAVING SUM(ilosc_dostarczona) != 0
+                """, (transfer['location_to_id'], transfer_id, transfer['numer_transferu'], user, transfer_id))
+            shortages = stock_shortages.allocate(cursor)
+
+            cursor.execute("""
+                UPDATE warehouse_transfers SET status = 'dostarczony', data_dostawy = datetime('now') WHERE id = ?
+            """, (transfer_id,))
+            cursor.execute("COMMIT")
+            return {'location_id': transfer['location_to_id'], 'products': moved,
+                    'resolved_shortages': shortages['resolved']}
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+
+    def receive(self, transfer_id, items=None, user='system'):
+        """
+        Przyjęcie: items [{id, ilosc_dostarczona}] nadpisuje ilości dostarczone pozycji;
+        na stan lokalizacji docelowej trafiają ilości dostarczone
+        """
+        delivered = [(int(item['id']), float(item['ilosc_dostarczona']))
+                     for item in (items or [])
+                     if item.get('id') and item.get('ilosc_dostarczona') is not None]
+        self.ensure_schema()
+        conn = self._connect()
+        try:
+            return self._receive(conn, transfer_id, delivered, user)
+        finally:
+            conn.close()
+
+
+# Globalna instancja
+warehouse_transfers = WarehouseTransferService()
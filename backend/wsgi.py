@@ -0,0 +1,16 @@
+"""
+Punkt wejścia WSGI dla serwerów z trwałym procesem
+(gunicorn, mod_wsgi, Passenger w DirectAdmin/CloudLinux "Setup Python App")
+    gunicorn wsgi:application
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app as application
+
+# Proces żyje długo - moduły API ładowane w tle, jeśli start był leniwy
+if application.blueprint_registry.pending:
+    application.blueprint_registry.warm_up()
@@ -21,6 +21,10 @@ mkdir -p $BUILD_DIR/cgi-bin/python3
 echo "📦 Kopiowanie frontendu..."
 cp -r $FRONTEND_BUILD_DIR/* $BUILD_DIR/public_html/
 
+# Manifest tras dla leniwego ładowania blueprintów (szybki start CGI/FastCGI)
+echo "🗺️  Budowanie manifestu tras..."
+(cd $BACKEND_DIR && python3 -m utils.lazy_blueprints build)
+
 # Kopiowanie backendu
 echo "📦 Kopiowanie backendu..."
 cp -r $BACKEND_DIR/* $BUILD_DIR/public_html/api/
@@ -50,6 +54,7 @@ echo "🔐 Ustawianie uprawnień..."
 find $BUILD_DIR -type d -exec chmod 755 {} \;
 find $BUILD_DIR -type f -exec chmod 644 {} \;
 chmod 755 $BUILD_DIR/cgi-bin/python3/app.cgi
+chmod 755 $BUILD_DIR/public_html/api/app.fcgi
 chmod 666 $BUILD_DIR/public_html/kupony.db
 
 # Tworzenie archiwum
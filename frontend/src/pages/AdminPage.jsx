@@ -463,35 +463,23 @@ const AdminPage = () => {
   const handleExportData = async () => {
     try {
       setLoading(true);
-      const response = await fetch(`${API_BASE}/admin/export`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        }
-      });
+      // Eksport jest strumieniowany (NDJSON) - zapisujemy odpowiedź bezpośrednio do pliku
+      const response = await fetch(`${API_BASE}/admin/export?format=ndjson`);
       
       if (response.ok) {
-        const data = await response.json();
-        if (data.success) {
-          // Pobierz dane jako JSON i zapisz jako plik
-          const exportData = data.data.export_data;
-          const jsonString = JSON.stringify(exportData, null, 2);
-          const blob = new Blob([jsonString], { type: 'application/json' });
-          const url = URL.createObjectURL(blob);
-          
-          // Utwórz link do pobrania
-          const a = document.createElement('a');
-          a.href = url;
-          a.download = `pos_system_export_${new Date().toISOString().split('T')[0]}.json`;
-          document.body.appendChild(a);
-          a.click();
-          document.body.removeChild(a);
-          URL.revokeObjectURL(url);
-          
-          alert(`✅ Dane wyeksportowane pomyślnie!\nTabele: ${data.data.tables_exported}\nRekordy: ${data.data.total_records}`);
-        } else {
-          alert(`❌ Błąd: ${data.message}`);
-        }
+        const blob = await response.blob();
+        const url = URL.createObjectURL(blob);
+        
+        // Utwórz link do pobrania
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = `pos_system_export_${new Date().toISOString().split('T')[0]}.ndjson`;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        URL.revokeObjectURL(url);
+        
+        alert(`✅ Dane wyeksportowane pomyślnie!\nRozmiar: ${(blob.size / 1024 / 1024).toFixed(2)} MB`);
       } else {
         alert('❌ Błąd podczas eksportu danych');
       }
@@ -397,9 +397,12 @@ export const warehouseService = {
       if (filters.location_id) params.append('location_id', filters.location_id);
       
       const response = await api.get(`warehouse/internal-receipt/list?${params}`);
+      const page = response.data.data || {};
       return {
         success: true,
-        data: response.data.data,
+        data: page.items || [],
+        nextCursor: page.next_cursor,
+        hasMore: page.has_more,
         message: response.data.message
       };
     } catch (error) {
@@ -440,9 +443,12 @@ export const warehouseService = {
       if (filters.location_id) params.append('location_id', filters.location_id);
       
       const response = await api.get(`warehouse/external-receipt/list?${params}`);
+      const page = response.data.data || {};
       return {
         success: true,
-        data: response.data.data,
+        data: page.items || [],
+        nextCursor: page.next_cursor,
+        hasMore: page.has_more,
         message: response.data.message
       };
     } catch (error) {
@@ -516,9 +522,12 @@ export const warehouseService = {
       if (filters.location_id) params.append('location_id', filters.location_id);
       
       const response = await api.get(`warehouse/internal-issue/list?${params}`);
+      const page = response.data.data || {};
       return {
         success: true,
-        data: response.data.data,
+        data: page.items || [],
+        nextCursor: page.next_cursor,
+        hasMore: page.has_more,
         message: response.data.message
       };
     } catch (error) {
@@ -10,14 +10,22 @@ os.environ['FLASK_ENV'] = 'production'
 os.environ['DATABASE_PATH'] = '/home/forboty/domains/panelv3.pl/public_html/api/kupony.db'
 os.environ['DOMAIN'] = 'panelv3.pl'
 
+# Import modułów API dopiero przy pierwszym żądaniu do nich (utils/lazy_blueprints.py)
+os.environ.setdefault('LAZY_BLUEPRINTS', '1')
+
+# stdout należy do odpowiedzi CGI - logi aplikacji (print) kierujemy do stderr
+cgi_stdout = sys.stdout.buffer
+sys.stdout = sys.stderr
+
 try:
-    from app import create_app
-    app = create_app()
+    from app import app
     
-    from wsgiref.handlers import CGIHandler
-    CGIHandler().run(app)
+    from wsgiref.handlers import BaseCGIHandler, read_environ
+    BaseCGIHandler(sys.stdin.buffer, cgi_stdout, sys.stderr, read_environ(),
+                   multithread=False, multiprocess=True).run(app)
         
 except Exception as e:
+    sys.stdout = sys.__stdout__
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print()